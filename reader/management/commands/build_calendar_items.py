@@ -0,0 +1,26 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sefaria.utils.calendars import precompute_calendar_items, delete_calendar_items_before, CALENDAR_CUSTOMS
+
+
+class Command(BaseCommand):
+    help = "Precomputes the calendar items served by /api/calendars for a range of days, in and out of the diaspora " \
+           "and for each custom.  Run it daily, and again after changing any of the calendar collections."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day, as YYYY-MM-DD. Default: today")
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--keep-past", action="store_true", help="Don't delete the items of days before the first day")
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.datetime.strptime(options["start"], "%Y-%m-%d") if options["start"] else datetime.datetime.now()
+        except ValueError:
+            raise CommandError("--start must be a date like 2024-01-31")
+        saved = precompute_calendar_items(start, days=options["days"], customs=CALENDAR_CUSTOMS)
+        self.stdout.write("Saved calendar items of {} days from {} ({} documents)".format(options["days"], start.date().isoformat(), saved))
+        if not options["keep_past"]:
+            deleted = delete_calendar_items_before(start)
+            self.stdout.write("Deleted {} documents of earlier days".format(deleted))
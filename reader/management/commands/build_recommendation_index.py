@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sefaria.model import library, Ref
+from sefaria.recommendation_index import build_recommendation_index, update_recommendation_index
+from sefaria.system.database import db
+from sefaria.system.exceptions import BookNameError
+
+
+class Command(BaseCommand):
+    help = "Saves the recommendation candidates of every segment, which RecommendationEngine reads with " \
+           "USE_RECOMMENDATION_INDEX.  With --update, only recomputes the segments of the refs queued by link and " \
+           "sheet changes since, so run it periodically to keep up with them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--titles", nargs="+", help="Only the segments of these indexes")
+        parser.add_argument("--update", action="store_true", help="Process the queued refs instead")
+        parser.add_argument("--limit", type=int, help="With --update, the maximum number of queued refs to process")
+        parser.add_argument("--rebuild", action="store_true", help="Delete the existing candidates first")
+
+    def handle(self, *args, **options):
+        if options["update"]:
+            counts = update_recommendation_index(limit=options["limit"])
+            self.stdout.write("Processed {refs} queued refs: saved {saved} segments, deleted {deleted}".format(**counts))
+            return
+
+        titles = options["titles"]
+        if titles:
+            try:
+                titles = [library.get_index(title).title for title in titles]
+            except BookNameError as e:
+                raise CommandError(str(e))
+        if options["rebuild"]:
+            query = {"$or": [{"ref": {"$regex": Ref(title).regex()}} for title in titles]} if titles else {}
+            deleted = db.recommendation_candidates.delete_many(query).deleted_count
+            self.stdout.write("Deleted {} segments".format(deleted))
+        counts = build_recommendation_index(titles)
+        self.stdout.write("Saved {saved} segments, deleted {deleted}".format(**counts))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sefaria.history import save_revision_checkpoints, revision_checkpoint_candidates, HISTORY_CHECKPOINT_EVERY, HISTORY_CHECKPOINT_PATCH_BYTES
+from sefaria.model import Ref
+from sefaria.system.database import db
+from sefaria.system.exceptions import InputError
+
+
+class Command(BaseCommand):
+    help = "Saves checkpoints of the text of segments with many revisions, which text_at_revision() starts from " \
+           "instead of the current text.  Only revisions since a segment's latest checkpoint are considered, " \
+           "so run it periodically to keep up with new revisions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ref", help="Only segments within this ref or title")
+        parser.add_argument("--every", type=int, default=HISTORY_CHECKPOINT_EVERY, help="Revisions between checkpoints")
+        parser.add_argument("--patch-bytes", type=int, default=HISTORY_CHECKPOINT_PATCH_BYTES,
+                            help="Size of the revert patches after which a checkpoint is saved sooner")
+        parser.add_argument("--rebuild", action="store_true", help="Delete the existing checkpoints first")
+
+    def handle(self, *args, **options):
+        regex = None
+        if options["ref"]:
+            try:
+                regex = Ref(options["ref"]).regex()
+            except InputError as e:
+                raise CommandError(str(e))
+        if options["rebuild"]:
+            deleted = db.history_checkpoints.delete_many({"ref": {"$regex": regex}} if regex else {}).deleted_count
+            self.stdout.write("Deleted {} checkpoints".format(deleted))
+
+        segments = saved = 0
+        for tref, version, lang in revision_checkpoint_candidates(options["every"], options["patch_bytes"], regex=regex):
+            try:
+                saved += save_revision_checkpoints(tref, version, lang, every=options["every"], patch_bytes=options["patch_bytes"])
+            except InputError as e:
+                self.stderr.write("Skipping {} / {} / {}: {}".format(tref, version, lang, e))
+                continue
+            segments += 1
+        self.stdout.write("Saved {} checkpoints of {} segments".format(saved, segments))
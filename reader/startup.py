@@ -1,5 +1,7 @@
+import time
 from django_topics.models import Topic as DjangoTopic
 
+
 def init_library_cache():
     import django
     django.setup()
@@ -9,31 +11,38 @@ def init_library_cache():
     from sefaria.model.text import library
     from sefaria.system.multiserver.coordinator import server_coordinator
     from django.conf import settings
-    logger.info("Initializing topic pools cache")
-    DjangoTopic.objects.build_slug_to_pools_cache()
-    logger.info("Initializing library objects.")
-    logger.info("Initializing TOC Tree")
-    library.get_toc_tree()
-
-    logger.info("Initializing Shared Cache")
-    library.init_shared_cache()
-
-    if not settings.DISABLE_AUTOCOMPLETER:
-        logger.info("Initializing Full Auto Completer")
-        library.build_full_auto_completer()
 
+    def phase(name, func, *args):
+        logger.info("Initializing {}".format(name))
+        start = time.perf_counter()
+        result = func(*args)
+        library.init_timings[name] = time.perf_counter() - start
+        logger.info("Initialized {} in {:.2f}s".format(name, library.init_timings[name]))
+        return result
 
-        logger.info("Initializing Lexicon Auto Completers")
-        library.build_lexicon_auto_completers()
+    if library._loaded_from_snapshot:
+        logger.info("Loaded library indexes and TOC Tree from snapshot in {:.2f}s".format(library.init_timings.get("index maps", 0)))
 
-        logger.info("Initializing Cross Lexicon Auto Completer")
-        library.build_cross_lexicon_auto_completer()
+    phase("topic pools cache", DjangoTopic.objects.build_slug_to_pools_cache)
+    logger.info("Initializing library objects.")
+    phase("TOC Tree", library.get_toc_tree)
+    phase("Shared Cache", library.init_shared_cache)
 
+    if not settings.DISABLE_AUTOCOMPLETER:
+        phase("Full Auto Completer", library.build_full_auto_completer)
+        phase("Lexicon Auto Completers", library.build_lexicon_auto_completers)
+        phase("Cross Lexicon Auto Completer", library.build_cross_lexicon_auto_completer)
 
     if settings.ENABLE_LINKER:
-        logger.info("Initializing Linker")
-        library.build_linker('he')
+        phase("Linker", library.build_linker, 'he')
+
+    try:
+        path = phase("library snapshot", library.save_snapshot)
+        if path:
+            logger.info("Saved library snapshot to {}".format(path))
+    except Exception as e:
+        logger.error("Failed to save library snapshot: {}".format(e))
 
     if server_coordinator:
         server_coordinator.connect()
-    logger.info("Initialization Complete")
+    logger.info("Initialization Complete", timings={name: round(seconds, 3) for name, seconds in library.init_timings.items()})
@@ -45,7 +45,7 @@ from sefaria.model.media import get_media_for_ref
 from sefaria.model.schema import SheetLibraryNode
 from sefaria.model.following import general_follow_recommendations
 from sefaria.model.trend import user_stats_data, site_stats_data
-from sefaria.client.wrapper import format_object_for_client, format_note_object_for_client, get_notes, get_links
+from sefaria.client.wrapper import format_object_for_client, format_note_object_for_client, get_notes, get_links, get_sheet_links
 from sefaria.client.util import jsonResponse, celeryResponse
 from sefaria.history import text_history, get_maximal_collapsed_activity, top_contributors, text_at_revision, record_version_deletion, record_index_deletion
 from sefaria.sefaria_tasks_interace.history_change import LinkChange, VersionChange
@@ -61,6 +61,7 @@ from sefaria.system.decorators import catch_error_as_json, sanitize_get_params,
 from sefaria.system.exceptions import InputError, PartialRefInputError, BookNameError, NoVersionFoundError, DictionaryEntryNotFoundError, ComplexBookLevelRefError
 from sefaria.system.cache import django_cache
 from sefaria.system.database import db
+from sefaria.system.fanout import FanOutSource, fan_out
 from sefaria.helper.search import get_query_obj
 from sefaria.helper.crm.crm_mediator import CrmMediator
 from sefaria.search import get_search_categories
@@ -90,6 +91,12 @@ from sefaria.helper.texts.tasks import save_version, save_changes, save_link
 if USE_VARNISH:
     from sefaria.system.varnish.wrapper import invalidate_ref, invalidate_linked
 
+try:
+    from sefaria.settings import RELATED_API_TIMEOUT, RELATED_API_SOURCE_TIMEOUTS
+except ImportError:
+    RELATED_API_TIMEOUT = 10
+    RELATED_API_SOURCE_TIMEOUTS = {}
+
 import structlog
 logger = structlog.get_logger(__name__)
 
@@ -2211,20 +2218,42 @@ def related_api(request, tref):
     elif bool(int(request.GET.get("private", False))) and not request.user.is_authenticated:
         response = {"error": "You must be logged in to access private content."}
     else:
+        Ref(tref)  # Raise InputError for a bad ref here, rather than in every source
+        sources = [
+            FanOutSource("links", get_links, (tref,), {"with_text": False}),
+            FanOutSource("sheets", get_sheets_for_ref, (tref,)),
+            FanOutSource("webpages", get_webpages_for_ref, (tref,)),
+            FanOutSource("topics", get_topics_for_ref, (tref, request.interfaceLang), {"annotate": True}),
+            FanOutSource("manuscripts", ManuscriptPageSet.load_set_for_client, (tref,)),
+            FanOutSource("media", get_media_for_ref, (tref,)),
+            FanOutSource("guides", GuideSet.load_set_for_client, (tref,)),
+        ]
+        if bool(int(request.GET.get("with_sheet_links", False))):
+            sources.append(FanOutSource("sheetLinks", get_sheet_links, (tref,)))
+        for source in sources:
+            source.timeout = RELATED_API_SOURCE_TIMEOUTS.get(source.name, RELATED_API_TIMEOUT)
+            source.default = []
+        fanned_out = fan_out(sources)
+        results = fanned_out.results
         response = {
-            "links": get_links(tref, with_text=False, with_sheet_links=bool(int(request.GET.get("with_sheet_links", False)))),
-            "sheets": get_sheets_for_ref(tref),
+            "links": results["links"] + results.get("sheetLinks", []),
+            "sheets": results["sheets"],
             "notes": [],  # get_notes(oref, public=True) # Hiding public notes for now
-            "webpages": get_webpages_for_ref(tref),
-            "topics": get_topics_for_ref(tref, request.interfaceLang, annotate=True),
-            "manuscripts": ManuscriptPageSet.load_set_for_client(tref),
-            "media": get_media_for_ref(tref),
-            "guides": GuideSet.load_set_for_client(tref)
+            "webpages": results["webpages"],
+            "topics": results["topics"],
+            "manuscripts": results["manuscripts"],
+            "media": results["media"],
+            "guides": results["guides"],
         }
         for value in response.values():
             for item in value:
                 if 'expandedRefs' in item:
                     del item['expandedRefs']
+        http_response = jsonResponse(response, callback=request.GET.get("callback", None))
+        http_response["Server-Timing"] = fanned_out.server_timing()
+        if fanned_out.partial:
+            http_response["X-Related-Partial"] = ",".join(fanned_out.timed_out + fanned_out.failed)
+        return http_response
     return jsonResponse(response, callback=request.GET.get("callback", None))
 
 
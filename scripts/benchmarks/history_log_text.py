@@ -0,0 +1,80 @@
+"""
+Times log_text() on a synthetic version replacement: a temporary index of --chapters chapters of --segments
+segments (50,000 by default), where --changed of the segments are edited.  Compares saving each record on its own
+(a batch size of 1, as log_text() used to) with batched inserts, in process and in worker processes.
+The temporary index, its version and the history records are deleted afterwards.
+
+    python scripts/benchmarks/history_log_text.py --chapters 50 --segments 1000 --changed 0.5 --workers 4
+"""
+import django
+import argparse
+django.setup()
+import random
+import time
+from sefaria.model import *
+from sefaria.model import history
+from sefaria.system.database import db
+
+TITLE = "History Benchmark"
+UID = 1999500001
+
+
+def setup_index(chapters, segments):
+    teardown_index()
+    root = JaggedArrayNode()
+    root.add_primary_titles(TITLE, "מדד היסטוריה")
+    root.add_structure(["Chapter", "Verse"])
+    root.key = TITLE
+    Index({"schema": root.serialize(), "title": TITLE, "categories": ["Halakhah"]}).save()
+    old = [["Segment {} of chapter {}, as it was before the edit".format(s, c) for s in range(segments)] for c in range(chapters)]
+    Version({"language": "en", "title": TITLE, "versionSource": "http://foobar.com", "versionTitle": TITLE, "chapter": old}).save()
+    return old
+
+
+def teardown_index():
+    db.history.delete_many({"user": UID})
+    v = Version().load({"title": TITLE})
+    if v:
+        v.delete()
+    i = Index().load({"title": TITLE})
+    if i:
+        i.delete()
+
+
+def edit(old, changed):
+    rand = random.Random(0)
+    return [[s.replace("before", "after") if rand.random() < changed else s for s in chapter] for chapter in old]
+
+
+def run(old, new, batch_size, workers):
+    history.HISTORY_BATCH_SIZE = batch_size
+    history.HISTORY_DIFF_WORKERS = workers
+    db.history.delete_many({"user": UID})
+    start = time.perf_counter()
+    log_text(UID, "edit", Ref(TITLE), "en", TITLE, old, new)
+    elapsed = time.perf_counter() - start
+    return elapsed, db.history.count_documents({"user": UID})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=1000)
+    parser.add_argument("--changed", type=float, default=0.5, help="Fraction of segments edited")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    try:
+        old = setup_index(args.chapters, args.segments)
+        new = edit(old, args.changed)
+        print(f"{'mode':<28}{'records':>9}{'seconds':>10}")
+        for label, batch_size, workers in [
+            ("one insert per record", 1, 0),
+            ("batched", args.batch_size, 0),
+            ("batched, {} workers".format(args.workers), args.batch_size, args.workers),
+        ]:
+            elapsed, records = run(old, new, batch_size, workers)
+            print(f"{label:<28}{records:>9}{elapsed:>10.2f}")
+    finally:
+        teardown_index()
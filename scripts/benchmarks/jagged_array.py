@@ -0,0 +1,113 @@
+"""
+Compares the nested list JaggedArray with FlatJaggedArray on the texts of whole corpora - every version of every book
+in Tanakh and in the Bavli - and checks that both return the same results.  Texts that aren't regular jagged arrays
+can't be stored in a FlatJaggedArray, and are skipped.
+
+    python scripts/benchmarks/jagged_array.py --category Tanakh --category Bavli --repeat 3
+"""
+import django
+import argparse
+django.setup()
+import copy
+import time
+from collections import OrderedDict
+from sefaria.model import *
+from sefaria.datatype.jagged_array import JaggedTextArray, JaggedIntArray
+from sefaria.datatype.flat_jagged_array import FlatJaggedTextArray, FlatJaggedIntArray
+
+
+def corpus_texts(category):
+    """
+    :return: list of lists of the texts of all versions of each content node in the category
+    """
+    nodes = []
+    for title in library.get_indexes_in_category(category):
+        index = library.get_index(title)
+        versions = VersionSet({"title": title}).array()
+        for node in index.nodes.get_leaf_nodes():
+            texts = [v.content_node(node) for v in versions]
+            nodes.append([t for t in texts if isinstance(t, list)])
+    return nodes
+
+
+def middle_range(ja):
+    """
+    :return: start and end indexes of a range from about a third of the way through the top level to two thirds
+    """
+    length = ja.sub_array_length() or 1
+    depth = ja.get_depth()
+    return [length // 3] + [0] * (depth - 1), [2 * length // 3] + [1] * (depth - 1)
+
+
+def node_count(arrays, int_array_class):
+    counts = int_array_class.from_nested([]) if int_array_class is FlatJaggedIntArray else JaggedIntArray()
+    for ja in arrays:
+        counts = counts + ja.mask()
+    return counts
+
+
+def depth_sums(arrays, int_array_class):
+    counts = node_count(arrays, int_array_class)
+    return [counts.depth_sum(d) for d in range(counts.get_depth())]
+
+
+OPERATIONS = OrderedDict([
+    ("mask", lambda arrays, _: [ja.mask().array() for ja in arrays]),
+    ("flatten_to_array", lambda arrays, _: [ja.flatten_to_array() for ja in arrays]),
+    ("element_count", lambda arrays, _: [ja.element_count() for ja in arrays]),
+    ("shape", lambda arrays, _: [ja.shape() for ja in arrays]),
+    ("distance", lambda arrays, _: [ja.distance([0], [max(ja.sub_array_length() - 1, 0)]) for ja in arrays if ja.get_depth()]),
+    ("subarray", lambda arrays, _: [ja.subarray(*middle_range(ja)).array() for ja in arrays if ja.get_depth()]),
+    ("node count (mask +)", lambda arrays, cls: node_count(arrays, cls).array()),
+    ("depth_sum", depth_sums),
+])
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--category", action="append", help="Default: Tanakh and Bavli")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for category in args.category or ["Tanakh", "Bavli"]:
+        nodes = []
+        skipped = 0
+        for texts in corpus_texts(category):
+            try:
+                flat = [FlatJaggedTextArray.from_nested(t) for t in texts]
+            except ValueError:
+                skipped += 1
+                continue
+            nodes.append(([JaggedTextArray(copy.deepcopy(t)) for t in texts], flat))
+        versions = sum(len(flat) for _, flat in nodes)
+        segments = sum(ja.element_count() for _, flat in nodes for ja in flat)
+        print(f"\n{category}: {len(nodes)} nodes, {versions} versions, {segments} segments, {skipped} irregular nodes skipped")
+
+        _, build_time = measure(lambda: [[FlatJaggedTextArray.from_nested(ja.array()) for ja in nested] for nested, _ in nodes], args.repeat)
+        print(f"{'operation':<24}{'nested s':>10}{'flat s':>10}{'speedup':>9}")
+        print(f"{'from_nested':<24}{'':>10}{build_time:>10.3f}")
+        for name, op in OPERATIONS.items():
+            nested_time = flat_time = 0
+            for nested, flat in nodes:
+                if name == "subarray":
+                    # JaggedArray.subarray() can change the array, so it's timed once on a copy
+                    copies = [JaggedTextArray(copy.deepcopy(ja.array())) for ja in nested]
+                    expected, t = measure(lambda: op(copies, JaggedIntArray), 1)
+                else:
+                    # new JaggedArrays each time, since they cache counts
+                    expected, t = measure(lambda: op([JaggedTextArray(ja.array()) for ja in nested], JaggedIntArray), args.repeat)
+                nested_time += t
+                actual, t = measure(lambda: op(flat, FlatJaggedIntArray), args.repeat)
+                flat_time += t
+                assert actual == expected, "{} differs from JaggedArray".format(name)
+            print(f"{name:<24}{nested_time:>10.3f}{flat_time:>10.3f}{nested_time / max(flat_time, 1e-9):>9.1f}")
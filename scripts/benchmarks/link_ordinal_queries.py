@@ -0,0 +1,48 @@
+"""
+Compares LinkSet(oref) using anchored regexes on `expandedRefs0/1` with the numeric range query on `expandedOrdinals0/1`,
+for segment, section, chapter and book level refs. Checks that both return the same links.
+
+Run scripts/migrations/backfill_ref_ordinals.py first.
+
+    python scripts/benchmarks/link_ordinal_queries.py --repeat 5
+"""
+import django
+import argparse
+django.setup()
+import time
+from sefaria.model import *
+
+
+REFS = {
+    "segment": ["Genesis 1:1", "Berakhot 2a:1", "Mishneh Torah, Sabbath 1:1", "Shulchan Arukh, Orach Chayim 1:1"],
+    "section": ["Genesis 1", "Berakhot 2a", "Mishneh Torah, Sabbath 1", "Rashi on Genesis 1"],
+    "chapter": ["Genesis 1-3", "Berakhot 2a-5b", "Psalms 119", "Shulchan Arukh, Orach Chayim 1-20"],
+    "book": ["Genesis", "Berakhot", "Psalms", "Mishnah Berakhot"],
+}
+
+
+def time_linkset(oref, use_ordinals, repeat):
+    best = float("inf")
+    ids = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ids = {link["_id"] for link in LinkSet(oref, use_ordinals=use_ordinals).raw_records}
+        best = min(best, time.perf_counter() - start)
+    return best, ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'level':<9}{'ref':<40}{'links':>8}{'regex ms':>10}{'ordinal ms':>12}{'speedup':>9}  match")
+    for level, trefs in REFS.items():
+        for tref in trefs:
+            oref = Ref(tref)
+            if oref.ordinal_range() is None:
+                print(f"{level:<9}{tref:<40}  no ordinal range, skipped")
+                continue
+            regex_time, regex_ids = time_linkset(oref, False, args.repeat)
+            ordinal_time, ordinal_ids = time_linkset(oref, True, args.repeat)
+            print(f"{level:<9}{tref:<40}{len(regex_ids):>8}{regex_time * 1000:>10.1f}{ordinal_time * 1000:>12.1f}{regex_time / ordinal_time:>9.1f}  {regex_ids == ordinal_ids}")
@@ -0,0 +1,101 @@
+"""
+Compares loading the texts of linked sections one TextChunk at a time with TextChunkPrefetch, which is what
+get_links(with_text=True) (and so /api/links/<ref>?with_text=1) uses.
+
+Mongo round trips are counted with a pymongo CommandListener.
+
+    python scripts/benchmarks/links_with_text.py "Berakhot 2a" "Genesis 1" "Shulchan Arukh, Orach Chayim 1" --repeat 5
+"""
+import argparse
+import time
+from pymongo import monitoring
+
+
+class QueryCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate", "count", "getMore"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# registered before the MongoClient is created
+counter = QueryCounter()
+monitoring.register(counter)
+
+import django
+django.setup()
+from sefaria.model import *
+from sefaria.client.wrapper import get_links
+from sefaria.system.exceptions import InputError, NoVersionFoundError
+
+
+def linked_top_sections(tref):
+    sections = {}
+    for link in LinkSet(Ref(tref)):
+        for link_tref in link.refs:
+            try:
+                for oref in Ref(link_tref).split_spanning_ref():
+                    top = oref.top_section_ref()
+                    sections[top.normal()] = top
+            except InputError:
+                continue
+    return list(sections.values())
+
+
+def load_one_by_one(orefs):
+    texts = {}
+    for oref in orefs:
+        for lang in ("en", "he"):
+            try:
+                texts[(oref.normal(), lang)] = TextChunk(oref, lang).text
+            except NoVersionFoundError:
+                pass
+    return texts
+
+
+def load_prefetched(orefs):
+    texts = {}
+    prefetch = TextChunkPrefetch(orefs)
+    for oref in orefs:
+        for lang in ("en", "he"):
+            try:
+                texts[(oref.normal(), lang)] = prefetch.get(oref, lang).text
+            except NoVersionFoundError:
+                pass
+    return texts
+
+
+def measure(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        Ref.clear_cache()
+        counter.count = 0
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best, counter.count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trefs", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'ref':<36}{'sections':>10}{'1-by-1 s':>10}{'queries':>9}{'batch s':>10}{'queries':>9}{'get_links s':>13}{'queries':>9}")
+    for tref in args.trefs:
+        orefs = linked_top_sections(tref)
+        expected, single_time, single_queries = measure(load_one_by_one, orefs, repeat=args.repeat)
+        actual, batch_time, batch_queries = measure(load_prefetched, orefs, repeat=args.repeat)
+        assert actual == expected, "Prefetched texts differ from TextChunk for {}".format(tref)
+        _, links_time, links_queries = measure(get_links, tref, True, repeat=args.repeat)
+        print(f"{tref:<36}{len(orefs):>10}{single_time:>10.3f}{single_queries:>9}{batch_time:>10.3f}{batch_queries:>9}{links_time:>13.3f}{links_queries:>9}")
@@ -0,0 +1,118 @@
+"""
+Compares merge_texts with the recursive implementation it replaced, which transposed every level once per section,
+on whole books - wide (Talmud), deep (Mishneh Torah) and with many versions (Tanakh) - and on synthetic jagged arrays.
+
+    python scripts/benchmarks/merge_texts.py --lang en --repeat 3
+"""
+import django
+import argparse
+django.setup()
+import itertools
+import time
+from sefaria.model import *
+from sefaria.utils.util import list_depth
+
+BOOKS = {
+    "wide": ["Berakhot", "Shabbat"],
+    "deep": ["Mishneh Torah, Prayer and the Priestly Blessing", "Mishneh Torah, Sabbath"],
+    "many versions": ["Genesis", "Psalms"],
+}
+
+
+def legacy_merge_texts(text, sources):
+    if not (len(text) and len(sources)):
+        return ["", []]
+
+    depth = list_depth(text)
+    if depth > 2:
+        results = []
+        result_sources = []
+        for x in range(max(list(map(len, text)))):
+            translations = [_ for _ in itertools.zip_longest(*text)][x]
+            remove_nones = lambda x: x or []
+            result, source = legacy_merge_texts(list(map(remove_nones, translations)), sources)
+            results.append(result)
+            result_sources += source
+        return [results, result_sources]
+
+    if depth == 1:
+        text = [[x] for x in text]
+
+    merged = itertools.zip_longest(*text)
+    text = []
+    text_sources = []
+    for verses in merged:
+        index, value = 0, ""
+        for i, version in enumerate(verses):
+            if version:
+                index = i
+                value = version
+                break
+        text.append(value)
+        text_sources.append(sources[index])
+
+    if depth == 1:
+        text = text[0]
+    return [text, text_sources]
+
+
+def book_inputs(title, lang):
+    """
+    :return: list of (name, texts, sources) of every content node of the book, with all its versions in priority order
+    """
+    index = library.get_index(title)
+    versions = VersionSet({"title": title, "language": lang}, sort=[("priority", -1), ("_id", 1)]).array()
+    inputs = []
+    for node in index.nodes.get_leaf_nodes():
+        texts = [v.content_node(node) for v in versions]
+        inputs.append((node.full_title("en"), texts, [v.versionTitle for v in versions]))
+    return inputs
+
+
+def synthetic_inputs():
+    def jagged(widths, version):
+        if len(widths) == 1:
+            return ["{}-{}".format(version, i) if (i + version) % 3 else "" for i in range(widths[0])]
+        return [jagged(widths[1:], version) for _ in range(widths[0])]
+    return [
+        ("synthetic wide [2000][5]", [jagged([2000, 5], v) for v in range(3)]),
+        ("synthetic deep [20][30][40]", [jagged([20, 30, 40], v) for v in range(3)]),
+        ("synthetic [300][20][10] x 12 versions", [jagged([300, 20, 10], v) for v in range(12)]),
+    ]
+
+
+def measure(func, texts, sources, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(texts, sources)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = []
+    for kind, titles in BOOKS.items():
+        for title in titles:
+            inputs = book_inputs(title, args.lang)
+            rows.append(("{} ({}, {} versions)".format(title, kind, len(inputs[0][2]) if inputs else 0),
+                         [texts for _, texts, _ in inputs], [sources for _, _, sources in inputs]))
+    for name, texts in synthetic_inputs():
+        rows.append((name, [texts], [["v{}".format(i) for i in range(len(texts))]]))
+
+    print(f"{'input':<64}{'legacy s':>10}{'merge s':>10}{'speedup':>9}")
+    for name, all_texts, all_sources in rows:
+        legacy_time = merge_time = 0
+        for texts, sources in zip(all_texts, all_sources):
+            expected, t = measure(legacy_merge_texts, texts, sources, args.repeat)
+            legacy_time += t
+            actual, t = measure(merge_texts, texts, sources, args.repeat)
+            merge_time += t
+            assert actual == expected, "merge_texts differs from the legacy merge for {}".format(name)
+        print(f"{name:<64}{legacy_time:>10.3f}{merge_time:>10.3f}{legacy_time / max(merge_time, 1e-9):>9.1f}")
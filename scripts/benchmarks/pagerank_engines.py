@@ -0,0 +1,47 @@
+"""
+Compares the sparse PageRank engine with the legacy pure-Python implementation on random_web() graphs.
+
+The legacy implementation is only run up to --legacy-max nodes; above that it takes hours.
+
+    python scripts/benchmarks/pagerank_engines.py --sizes 10000 100000 1000000
+"""
+import django
+import argparse
+django.setup()
+import random
+import time
+import numpy
+from sefaria.pagesheetrank import random_web, web_to_graph, legacy_pagerank, create_sparse_web, sparse_web_from_web, sparse_power_iteration
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--legacy-max", type=int, default=10000, help="largest graph to run the legacy implementation on")
+    parser.add_argument("--tolerance", type=float, default=0.00005)
+    parser.add_argument("--seed", type=int, default=613)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>10}{'edges':>12}{'build s':>10}{'sparse s':>10}{'legacy s':>10}{'max diff':>12}")
+    for n in args.sizes:
+        random.seed(args.seed)
+        numpy.random.seed(args.seed)
+        w = random_web(n)
+
+        start = time.perf_counter()
+        sw = sparse_web_from_web(w)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        p = sparse_power_iteration(sw, tolerance=args.tolerance)
+        sparse_time = time.perf_counter() - start
+
+        legacy_time, max_diff = float("nan"), float("nan")
+        if n <= args.legacy_max:
+            g = web_to_graph(w)
+            start = time.perf_counter()
+            legacy = legacy_pagerank(g, tolerance=args.tolerance)
+            legacy_time = time.perf_counter() - start
+            # the graph-dict path should match the web path exactly
+            p_from_graph = sparse_power_iteration(create_sparse_web(g), tolerance=args.tolerance)
+            max_diff = max(max(abs(legacy[i] - p[i]) for i in range(n)), numpy.abs(p - p_from_graph).max())
+        print(f"{n:>10,}{len(sw.src):>12,}{build_time:>10.2f}{sparse_time:>10.2f}{legacy_time:>10.2f}{max_diff:>12.2e}")
@@ -0,0 +1,58 @@
+"""
+Times rebuilding the commentary links of a commentary with its autolinker, which adds and deletes the links in
+memory and writes them with one bulk_write (see LinkReconciler), against deleting and saving them one link at a
+time, as the autolinkers used to.  Both leave the same links behind; the link counts are checked.
+
+Writes to the links collection.  Run it on a development database.
+
+    python scripts/benchmarks/rebuild_links.py "Rashi on Genesis 1" "Rashi on Exodus" --repeat 1
+"""
+import django
+import argparse
+django.setup()
+import time
+from sefaria.model import *
+
+
+def rebuild_one_at_a_time(oref):
+    linker = oref.autolinker()
+    for link in linker.linkset():
+        link.delete()
+    linker._build_links_internal(oref)
+
+
+def rebuild_in_bulk(oref):
+    oref.autolinker().rebuild_links()
+
+
+def count_links(oref):
+    return oref.autolinker().linkset().count()
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("refs", nargs="+", help="Commentary refs with an autolinker")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'ref':<30}{'links':>8}{'one at a time s':>17}{'bulk s':>9}")
+    for tref in args.refs:
+        oref = Ref(tref)
+        if not oref.autolinker():
+            print(f"{tref:<30} has no autolinker")
+            continue
+        single = measure(lambda: rebuild_one_at_a_time(oref), args.repeat)
+        single_count = count_links(oref)
+        bulk = measure(lambda: rebuild_in_bulk(oref), args.repeat)
+        bulk_count = count_links(oref)
+        assert single_count == bulk_count, (single_count, bulk_count)
+        print(f"{tref:<30}{bulk_count:>8}{single:>17.2f}{bulk:>9.2f}")
@@ -0,0 +1,71 @@
+"""
+Times the RecommendationEngine stages that SegmentOrdinals speeds up, with ordinals and with Ref methods alone:
+cluster_close_refs() on --refs random segments of --books, and normalize_related_refs() on the includedRefs of every
+interesting public sheet of --section, as get_recs_thru_sheets() calls it.
+
+    python scripts/benchmarks/recommendation_clustering.py --refs 100 1000 --section "Genesis 1" --repeat 3
+"""
+import django
+import argparse
+django.setup()
+import random
+import time
+from sefaria.model import Ref
+from sefaria.recommendation_engine import RecommendationEngine, SegmentOrdinals, SHEET_REF_SCORE
+
+FAST_PATHS = {name: getattr(SegmentOrdinals, name) for name in ("order_key", "offset", "covers_section")}
+
+
+def use_ordinals(on):
+    for name, method in FAST_PATHS.items():
+        setattr(SegmentOrdinals, name, method if on else (lambda self, *args, **kwargs: None))
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare(label, func, repeat):
+    use_ordinals(False)
+    by_ref = measure(func, repeat)
+    use_ordinals(True)
+    ordinals = measure(func, repeat)
+    print(f"{label:<40}{by_ref * 1000:>10.1f}{ordinals * 1000:>14.1f}")
+
+
+def cluster(refs):
+    return RecommendationEngine.cluster_close_refs(refs, [None] * len(refs), 5)
+
+
+def normalize(sheets, range_set):
+    ordinals = SegmentOrdinals()
+    for sheet in sheets:
+        RecommendationEngine.normalize_related_refs(sheet.get("includedRefs", []), range_set, SHEET_REF_SCORE,
+                                                    check_has_ref=True, count_steinsaltz=True, ordinals=ordinals)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--refs", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--books", nargs="+", default=["Genesis", "Exodus", "Berakhot", "Rashi on Genesis"])
+    parser.add_argument("--section", default="Genesis 1")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    segments = [r for book in args.books for r in Ref(book).all_segment_refs()]
+    print(f"{'stage':<40}{'Ref ms':>10}{'ordinals ms':>14}")
+    for n in args.refs:
+        refs = rand.sample(segments, min(n, len(segments)))
+        compare("cluster_close_refs, {} refs".format(len(refs)), lambda: cluster(refs), args.repeat)
+
+    section = Ref(args.section)
+    sheets = RecommendationEngine.get_sheets(section)
+    for oref in section.all_segment_refs()[:3]:
+        range_set = {oref.normal()}
+        compare("normalize_related_refs, {} sheets, {}".format(len(sheets), oref.normal()), lambda: normalize(sheets, range_set), args.repeat)
@@ -0,0 +1,44 @@
+"""
+Times RecommendationEngine on segments, computing their candidates from links and sheets, and reading them from the
+recommendation_candidates collection, which is built for the segments first.  The candidates saved for them are
+left in place.
+
+    python scripts/benchmarks/recommendations.py --refs "Genesis 1:1" "Berakhot 2a:1" --repeat 3
+"""
+import django
+import argparse
+django.setup()
+import time
+import sefaria.recommendation_engine as recommendation_engine
+from sefaria.model import Ref
+from sefaria.recommendation_engine import RecommendationEngine
+from sefaria.recommendation_index import index_recommendation_segments
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def recommend(tref, indexed):
+    recommendation_engine.USE_RECOMMENDATION_INDEX = indexed
+    return [rec.to_dict() for rec in RecommendationEngine(tref).recommendations]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--refs", nargs="+", default=["Genesis 1:1", "Exodus 20:2", "Berakhot 2a:1", "Mishnah Avot 1:1"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'ref':<24}{'live ms':>10}{'indexed ms':>12}")
+    for tref in args.refs:
+        index_recommendation_segments([Ref(tref)])
+        assert recommend(tref, True) == recommend(tref, False)
+        live = measure(lambda: recommend(tref, False), args.repeat)
+        indexed = measure(lambda: recommend(tref, True), args.repeat)
+        print(f"{tref:<24}{live * 1000:>10.1f}{indexed * 1000:>12.1f}")
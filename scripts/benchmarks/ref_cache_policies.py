@@ -0,0 +1,95 @@
+"""
+Replays a stream of trefs taken from the links and sheets collections against each Ref cache policy and reports
+parse throughput, hit rate, evictions and memory.
+
+Each policy runs in its own process so that RSS numbers are not polluted by the previous run.
+
+    python scripts/benchmarks/ref_cache_policies.py --links 200000 --stream 500000
+"""
+import django
+import argparse
+django.setup()
+import os
+import random
+import resource
+import time
+from collections import Counter
+from multiprocessing import Pool
+from sefaria.model import *
+from sefaria.system.database import db
+from sefaria.system.exceptions import InputError
+
+
+POLICIES = [
+    ("unbounded", {}),
+    ("lru 50k", {"policy": "lru", "max_entries": 50000}),
+    ("2q 50k", {"policy": "2q", "max_entries": 50000}),
+    ("lru 64MB", {"policy": "lru", "max_bytes": 64 * 1024 * 1024}),
+    ("2q 64MB", {"policy": "2q", "max_bytes": 64 * 1024 * 1024}),
+]
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def build_stream(num_links, num_sheets, stream_length, seed):
+    """
+    Builds a skewed tref stream: refs are drawn in proportion to how often they appear in links and sheets, which
+    approximates the request mix seen by the reader and the APIs.
+    """
+    counts = Counter()
+    for link in db.links.find({}, {"refs": 1, "_id": 0}).limit(num_links):
+        counts.update(link.get("refs", []))
+    for sheet in db.sheets.find({"status": "public"}, {"includedRefs": 1, "_id": 0}).limit(num_sheets):
+        counts.update(sheet.get("includedRefs", []))
+    trefs, weights = zip(*counts.items())
+    rand = random.Random(seed)
+    return rand.choices(trefs, weights=weights, k=stream_length)
+
+
+def run_policy(args):
+    name, config, stream = args
+    Ref.configure_cache(**config)
+    rss_before = current_rss()
+    errors = 0
+    start = time.perf_counter()
+    for tref in stream:
+        try:
+            Ref(tref)
+        except InputError:
+            errors += 1
+    elapsed = time.perf_counter() - start
+    stats = Ref.cache_size(stats=True)
+    return {
+        "name": name,
+        "refs_per_sec": len(stream) / elapsed,
+        "elapsed": elapsed,
+        "errors": errors,
+        "rss_growth_mb": (current_rss() - rss_before) / 1024 / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stats": stats,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=100000, help="number of links to sample refs from")
+    parser.add_argument("--sheets", type=int, default=10000, help="number of public sheets to sample refs from")
+    parser.add_argument("--stream", type=int, default=300000, help="length of the replayed tref stream")
+    parser.add_argument("--seed", type=int, default=613)
+    args = parser.parse_args()
+
+    stream = build_stream(args.links, args.sheets, args.stream, args.seed)
+    print(f"Replaying {len(stream):,} trefs ({len(set(stream)):,} distinct)")
+    with Pool(1, maxtasksperchild=1) as pool:
+        results = pool.map(run_policy, [(name, config, stream) for name, config in POLICIES], chunksize=1)
+
+    print(f"{'policy':<12}{'refs/s':>12}{'hit rate':>10}{'evictions':>12}{'entries':>10}{'rss +MB':>10}{'peak MB':>10}")
+    for r in results:
+        s = r["stats"]
+        print(f"{r['name']:<12}{r['refs_per_sec']:>12,.0f}{s['hit_rate'] or 0:>10.3f}{s['evictions']:>12,}{s['entries']:>10,}{r['rss_growth_mb']:>10.1f}{r['peak_rss_mb']:>10.1f}")
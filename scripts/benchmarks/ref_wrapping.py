@@ -0,0 +1,77 @@
+"""
+Compares wrapping refs in sheet text the old way, with the re2 alternation of every title and a ref regex compiled on
+every call, with Library.get_wrapped_refs_string, which finds titles with the title automaton and memoizes compiled
+ref regexes.
+
+    python scripts/benchmarks/ref_wrapping.py --sheets 2000
+"""
+import django
+import argparse
+django.setup()
+import time
+import regex
+from functools import partial
+from sefaria.model import *
+from sefaria.system.database import db
+from sefaria.utils.hebrew import has_hebrew
+
+
+def sheet_texts(limit):
+    texts = []
+    for sheet in db.sheets.find({"status": "public"}, {"sources": 1}).limit(limit):
+        for source in sheet.get("sources", []):
+            for field in ("outsideText", "comment"):
+                if source.get(field):
+                    texts.append(source[field])
+            for lang in ("en", "he"):
+                if source.get("text", {}).get(lang):
+                    texts.append(source["text"][lang])
+    return texts
+
+
+def legacy_wrap(st):
+    lang = "he" if has_hebrew(st) else "en"
+    unique_titles = set(m.group('title') for m in library.all_titles_regex(lang).finditer(st))
+    title_nodes = {title: library.get_schema_node(title, lang) for title in unique_titles}
+    all_reg = library.get_multi_title_regex_string(unique_titles, lang)
+    reg = regex.compile(all_reg, regex.VERBOSE) if all_reg else None
+    if reg is None:
+        return st
+    sub_action = partial(library._apply_action_for_ref_match, title_nodes, lang, library._wrap_ref_match)
+    if lang == "en":
+        return reg.sub(sub_action, st)
+    outer_regex = regex.compile(r"[({\[].+?[)}\]]", regex.VERBOSE)
+    return outer_regex.sub(lambda match: reg.sub(sub_action, match.group(0)), st)
+
+
+def measure(func, texts):
+    start = time.perf_counter()
+    result = [func(st) for st in texts]
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sheets", type=int, default=1000, help="number of public sheets to take text from")
+    args = parser.parse_args()
+
+    texts = sheet_texts(args.sheets)
+    print("{} texts, {:.1f} MB".format(len(texts), sum(len(t) for t in texts) / 1e6))
+
+    for name, build in (("title regex", lambda: [library.all_titles_regex(lang) for lang in ("en", "he")]),
+                        ("title automaton", lambda: [library.all_titles_automaton(lang) for lang in ("en", "he")])):
+        start = time.perf_counter()
+        build()
+        print("{:<20}built in {:.2f}s".format(name, time.perf_counter() - start))
+
+    expected, legacy_time = measure(legacy_wrap, texts)
+    library._reset_ref_regexes()
+    actual, cold_time = measure(library.get_wrapped_refs_string, texts)
+    _, warm_time = measure(library.get_wrapped_refs_string, texts)
+    differences = sum(1 for a, b in zip(actual, expected) if a != b)
+
+    print(f"{'run':<20}{'seconds':>10}")
+    print(f"{'legacy':<20}{legacy_time:>10.2f}")
+    print(f"{'automaton (cold)':<20}{cold_time:>10.2f}")
+    print(f"{'automaton (warm)':<20}{warm_time:>10.2f}")
+    print("{} of {} texts wrapped differently".format(differences, len(texts)))
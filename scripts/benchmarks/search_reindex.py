@@ -0,0 +1,143 @@
+"""
+Compares the old load-everything text reindex with the streaming pipeline of TextIndexer.index_all, with threaded bulk
+requests and with a pool of worker processes, against a synthetic Elasticsearch stand-in that accepts bulk requests
+after a fixed delay.
+
+Each run happens in its own process so that peak RSS is measured per run.
+
+    python scripts/benchmarks/search_reindex.py --titles 200 --bulk-latency 0.02
+"""
+import django
+import argparse
+django.setup()
+import json
+import resource
+import time
+from functools import partial
+from multiprocessing import Process, Queue
+from elasticsearch.helpers import bulk
+import sefaria.search as search
+from sefaria.search import TextIndexer
+from sefaria.model import *
+from sefaria.system.database import db
+
+
+class FakeSerializer(object):
+    def dumps(self, data):
+        return data if isinstance(data, str) else json.dumps(data)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.serializers = self
+
+    def get_serializer(self, mimetype):
+        return FakeSerializer()
+
+
+class FakeResponse(object):
+    def __init__(self, body):
+        self.body = body
+
+
+class FakeElasticsearch(object):
+    """
+    Accepts every bulk request after `latency` seconds
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.transport = FakeTransport()
+        self.requests = 0
+        self.documents = 0
+
+    def options(self, **kwargs):
+        return self
+
+    def bulk(self, *args, operations=None, **kwargs):
+        time.sleep(self.latency)
+        items = [{"index": {"status": 201}} for line in operations if b'"_index"' in (line if isinstance(line, bytes) else line.encode())]
+        self.requests += 1
+        self.documents += len(items)
+        return FakeResponse({"items": items, "errors": False})
+
+
+def legacy_index_all(index_name, titles):
+    """
+    The reindex as it was before streaming: every version is loaded up front with skip queries and each index's
+    documents are held until a single bulk() call.
+    """
+    TextIndexer.index_name = index_name
+    TextIndexer.create_version_priority_map()
+    TextIndexer.create_terms_dict()
+    Ref.clear_cache()
+    all_versions, page = [], 0
+    while True:
+        temp_versions = VersionSet({"title": {"$in": titles}}, limit=10, page=page).array()
+        if not temp_versions:
+            break
+        all_versions += temp_versions
+        page += 1
+    versions = sorted([x for x in all_versions if (x.title, x.versionTitle, x.language) in TextIndexer.version_priority_map], key=lambda x: TextIndexer.version_priority_map[(x.title, x.versionTitle, x.language)][0])
+    versions_by_index = {}
+    for v in versions:
+        versions_by_index.setdefault((v.title, v.language), []).append(v)
+    for (title, lang), vlist in versions_by_index.items():
+        TextIndexer.curr_index = vlist[0].get_index()
+        TextIndexer._bulk_actions = []
+        try:
+            TextIndexer.best_time_period = TextIndexer.curr_index.best_time_period()
+        except ValueError:
+            TextIndexer.best_time_period = None
+        for v in vlist:
+            if not TextIndexer.excluded_from_search(v):
+                TextIndexer.index_version(v)
+        bulk(search.es_client, TextIndexer._bulk_actions, stats_only=True, raise_on_error=False)
+
+
+def run(args):
+    name, titles, latency, chunk_size, threads, processes = args
+    search.es_client = FakeElasticsearch(latency)
+    search.get_elasticsearch_client = partial(FakeElasticsearch, latency)  # for worker processes
+    TextIndexer.clear_cache()
+    TextIndexer.bulk_chunk_size = chunk_size
+    TextIndexer.bulk_threads = threads
+    start = time.perf_counter()
+    if name == "legacy":
+        legacy_index_all("benchmark", titles)
+    else:
+        TextIndexer.index_all("benchmark", titles=titles, processes=processes)
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "elapsed": elapsed,
+        "peak_rss_mb": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--titles", type=int, default=100, help="number of indexes to reindex, in title order")
+    parser.add_argument("--bulk-latency", type=float, default=0.01, help="seconds the stand-in takes per bulk request")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    titles = sorted(db.texts.distinct("title"))[:args.titles]
+    runs = [
+        ("legacy", titles, args.bulk_latency, args.chunk_size, 1, 1),
+        ("streaming", titles, args.bulk_latency, args.chunk_size, 1, 1),
+        ("parallel x4", titles, args.bulk_latency, args.chunk_size, 4, 1),
+        ("processes x{}".format(args.processes), titles, args.bulk_latency, args.chunk_size, 1, args.processes),
+    ]
+    results = []
+    for r in runs:
+        # a plain Process rather than a Pool, since pool workers are daemonic and can't start a pool of their own
+        queue = Queue()
+        process = Process(target=lambda q, args: q.put(run(args)), args=(queue, r))
+        process.start()
+        results += [queue.get()]
+        process.join()
+
+    print(f"{'run':<14}{'seconds':>10}{'peak MB':>10}")
+    for r in results:
+        print(f"{r['name']:<14}{r['elapsed']:>10.1f}{r['peak_rss_mb']:>10.1f}")
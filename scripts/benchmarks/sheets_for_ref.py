@@ -0,0 +1,92 @@
+"""
+Times get_sheets_for_ref() on a ref with 10, 100 and 1,000 test sheets, each with its own owner, assigner and
+via owner, and a displayed collection.  For comparison, also times hydrating the same sheets one at a time, with
+public_user_data() and Collection().load() for each sheet, as get_sheets_for_ref() used to.
+The test sheets and collections are deleted afterwards.
+
+    python scripts/benchmarks/sheets_for_ref.py --sizes 10 100 1000 --repeat 3
+"""
+import django
+import argparse
+django.setup()
+import time
+from sefaria.model import *
+from sefaria.model.collection import Collection
+from sefaria.model.ref_ordinal import expanded_ordinals
+from sefaria.model.user_profile import public_user_data
+from sefaria.sheets import get_sheets_for_ref
+from sefaria.system.database import db
+
+FIRST_ID = 1999800000
+COLLECTION = "benchmark-sheets-for-ref-{}"
+
+
+def make_sheets(n, tref):
+    refs = [tref]
+    expanded = Ref.expand_refs(refs)
+    ordinals = expanded_ordinals(refs)
+    sheets = [{
+        "id": FIRST_ID + i,
+        "title": "Benchmark Sheet {}".format(i),
+        "owner": FIRST_ID + i,
+        "assigner_id": FIRST_ID + n + i,
+        "viaOwner": FIRST_ID + 2 * n + i,
+        "displayedCollection": COLLECTION.format(i % 20),
+        "status": "public",
+        "dateCreated": "2020-01-01T00:00:00",
+        "includedRefs": refs,
+        "expandedRefs": expanded,
+        "expandedOrdinals": ordinals,
+        "views": i,
+        "options": {},
+    } for i in range(n)]
+    db.sheets.insert_many(sheets)
+    db.collections.insert_many([{
+        "slug": COLLECTION.format(i),
+        "name": COLLECTION.format(i),
+        "sheets": [s["id"] for s in sheets],
+        "toc": {"title": COLLECTION.format(i)},
+    } for i in range(20)])
+    return sheets
+
+
+def delete_sheets():
+    db.sheets.delete_many({"id": {"$gte": FIRST_ID, "$lt": FIRST_ID + 10000}})
+    db.collections.delete_many({"slug": {"$regex": "^" + COLLECTION.format("")}})
+
+
+def hydrate_one_at_a_time(sheets):
+    for sheet in sheets:
+        for uid in (sheet["owner"], sheet["assigner_id"], sheet["viaOwner"]):
+            public_user_data(uid, ignore_cache=True)
+        getattr(Collection().load({"slug": sheet["displayedCollection"]}), "toc", None)
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--ref", default="Genesis 1:1", help="Segment ref the test sheets include")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'sheets':>7}{'get_sheets_for_ref ms':>23}{'ms / sheet':>12}{'one at a time ms':>18}")
+    for n in args.sizes:
+        delete_sheets()
+        try:
+            sheets = make_sheets(n, args.ref)
+            in_collection = [COLLECTION.format(0)]
+            assert len(get_sheets_for_ref(args.ref, in_collection=in_collection)) == n
+            bulk = measure(lambda: get_sheets_for_ref(args.ref, in_collection=in_collection), args.repeat)
+            single = measure(lambda: hydrate_one_at_a_time(sheets), 1)
+        finally:
+            delete_sheets()
+        print(f"{n:>7}{bulk * 1000:>23.1f}{bulk * 1000 / n:>12.2f}{single * 1000:>18.1f}")
@@ -0,0 +1,79 @@
+"""
+Times text_at_revision() on a synthetic segment with thousands of revisions, replaying every revert patch from the
+current text, and starting from the nearest checkpoint saved by save_revision_checkpoints().
+The segment's history is saved under a made up version title, and deleted afterwards.
+
+    python scripts/benchmarks/text_at_revision.py --revisions 1000 5000 --every 100 --repeat 3
+"""
+import django
+import argparse
+django.setup()
+import random
+import time
+import sefaria.history as history
+from sefaria.history import text_at_revision, save_revision_checkpoints, dmp
+from sefaria.system.database import db
+
+TREF = "Genesis 1:1"
+VERSION = "Revision Checkpoint Benchmark"
+QUERY = {"ref": TREF, "version": VERSION, "language": "en"}
+
+
+class Current(object):
+    def __init__(self, text):
+        self.text = text
+
+
+def make_history(n):
+    delete_history()
+    rand = random.Random(0)
+    words = "In the beginning God created the heaven and the earth".split()
+    texts = [" ".join(words)]
+    records = []
+    for revision in range(1, n + 1):
+        words.insert(rand.randrange(len(words) + 1), "w{}".format(revision))
+        if len(words) > 200:
+            words.pop(rand.randrange(len(words)))
+        new, old = " ".join(words), texts[-1]
+        texts.append(new)
+        records.append(dict(QUERY, revision=revision, rev_type="edit text", user=0,
+                            revert_patch=dmp.patch_toText(dmp.patch_make(dmp.diff_main(new, old)))))
+    db.history.insert_many(records)
+    history.TextChunk = lambda oref, lang, vtitle: Current(texts[-1])
+    return texts
+
+
+def delete_history():
+    db.history.delete_many({"version": VERSION})
+    db.history_checkpoints.delete_many({"version": VERSION})
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--revisions", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--every", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'revisions':>10}{'revision':>10}{'replay ms':>11}{'checkpoint ms':>15}")
+    try:
+        for n in args.revisions:
+            texts = make_history(n)
+            targets = [1, n // 2, n - 1]
+            replay = {r: measure(lambda: text_at_revision(TREF, VERSION, "en", r), args.repeat) for r in targets}
+            save_revision_checkpoints(TREF, VERSION, "en", every=args.every)
+            for r in targets:
+                assert text_at_revision(TREF, VERSION, "en", r) == texts[r]
+                checkpointed = measure(lambda: text_at_revision(TREF, VERSION, "en", r), args.repeat)
+                print(f"{n:>10}{r:>10}{replay[r] * 1000:>11.1f}{checkpointed * 1000:>15.1f}")
+    finally:
+        delete_history()
@@ -0,0 +1,64 @@
+"""
+Backfills `expandedOrdinals0/1` on links and `expandedOrdinals` on sheets, so that LinkSet(oref) and
+get_sheets_for_ref() can use numeric range queries (USE_REF_ORDINAL_QUERIES).
+
+Node ordinals are first assigned to the whole library in catalog order. Rerunning is safe; existing node ordinals are kept.
+
+    python scripts/migrations/backfill_ref_ordinals.py [--links-only | --sheets-only] [--batch-size 1000]
+"""
+import django
+import argparse
+django.setup()
+from pymongo import UpdateOne
+from sefaria.model import *
+from sefaria.model.ref_ordinal import RefOrdinalNodeSet, assign_catalog_ordinals, segment_ordinals, expanded_ordinals
+from sefaria.system.database import db, ensure_indices
+from sefaria.system.exceptions import InputError
+
+
+def segment_ordinals_for_tref(tref):
+    try:
+        return segment_ordinals(Ref(tref).all_segment_refs())
+    except (InputError, IndexError, AssertionError):
+        return []
+
+
+def backfill(collection, projection, get_update, batch_size):
+    total = collection.count_documents({})
+    updates = []
+    for i, record in enumerate(collection.find({}, projection)):
+        updates += [UpdateOne({"_id": record["_id"]}, {"$set": get_update(record)})]
+        if len(updates) >= batch_size:
+            collection.bulk_write(updates, ordered=False)
+            updates = []
+        if i % 10000 == 0:
+            print("{}/{}".format(i, total))
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links-only", action="store_true")
+    parser.add_argument("--sheets-only", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    ensure_indices()
+    print("Assigning node ordinals in catalog order")
+    assign_catalog_ordinals()
+
+    if not args.sheets_only:
+        print("Backfilling links")
+        backfill(db.links, {"refs": 1}, lambda link: {
+            "expandedOrdinals0": segment_ordinals_for_tref(link["refs"][0]),
+            "expandedOrdinals1": segment_ordinals_for_tref(link["refs"][1]),
+        }, args.batch_size)
+    if not args.links_only:
+        print("Backfilling sheets")
+        backfill(db.sheets, {"includedRefs": 1}, lambda sheet: {
+            "expandedOrdinals": expanded_ordinals(sheet.get("includedRefs", [])),
+        }, args.batch_size)
+
+    incomplete = [n.node for n in RefOrdinalNodeSet({"incomplete": True})]
+    print("Done. {} nodes will keep using regex queries because some refs didn't fit: {}".format(len(incomplete), incomplete))
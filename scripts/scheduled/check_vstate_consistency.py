@@ -0,0 +1,36 @@
+"""
+Compares the saved VersionState counts of each index with counts rebuilt from its versions, e.g. to check that
+incremental updates after edits agree with full refreshes.  Nothing is saved unless --fix is given, as the
+vstateConsistency cron job does, to repair the counts of states that drifted.
+
+    python scripts/scheduled/check_vstate_consistency.py --title "Shulchan Arukh, Orach Chayim" --fix
+"""
+import django
+import argparse
+django.setup()
+from sefaria.model import *
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--title", action="append", help="Default: all indexes")
+    parser.add_argument("--fix", action="store_true", help="Refresh the VersionStates that differ")
+    args = parser.parse_args()
+
+    inconsistent = 0
+    for title in args.title or [i.title for i in library.all_index_records()]:
+        try:
+            vs = VersionState(title)
+        except Exception as e:
+            print("{}: failed to load VersionState: {}".format(title, e))
+            continue
+        differences = vs.check_consistency()
+        if not differences:
+            continue
+        inconsistent += 1
+        print("{}: {} differences".format(title, len(differences)))
+        for address, lkey, attr, stored, rebuilt in differences[:10]:
+            print("    {} {} {}: saved {} rebuilt {}".format("/".join(address) or "-", lkey or "-", attr, str(stored)[:80], str(rebuilt)[:80]))
+        if args.fix:
+            vs.refresh()
+    print("{} inconsistent VersionStates".format(inconsistent))
@@ -17,11 +17,12 @@ value will need to be set to the time at which the last mongo dump was created (
 up-to-date mongo dump).
 """
 # last_sheet_timestamp = datetime.fromtimestamp(os.path.getmtime("/var/data/sefaria_public/dump/sefaria")).isoformat()
-last_sheet_timestamp = datetime.now().isoformat()
-update_pagesheetrank()
-index_all()
-r = requests.post("https://www.sefaria.org/admin/index-sheets-by-timestamp", data={"timestamp": last_sheet_timestamp, "apikey": SEFARIA_BOT_API_KEY})
-if "error" in r.text:
-    raise Exception("Error when calling admin/index-sheets-by-timestamp API: " + r.text)
-else:
-    print("SUCCESS!", r.text)
+if __name__ == '__main__':  # the reindex's worker processes import this module again
+    last_sheet_timestamp = datetime.now().isoformat()
+    update_pagesheetrank()
+    index_all()
+    r = requests.post("https://www.sefaria.org/admin/index-sheets-by-timestamp", data={"timestamp": last_sheet_timestamp, "apikey": SEFARIA_BOT_API_KEY})
+    if "error" in r.text:
+        raise Exception("Error when calling admin/index-sheets-by-timestamp API: " + r.text)
+    else:
+        print("SUCCESS!", r.text)
@@ -4,4 +4,5 @@ import django
 django.setup()
 from sefaria.search import *
 
-index_all()
+if __name__ == '__main__':  # the reindex's worker processes import this module again
+    index_all()
@@ -172,6 +172,8 @@ def get_links(tref, with_text=True, with_sheet_links=False):
 
     # for storing all the section level texts that need to be looked up
     texts = {}
+    # links with text still to be filled in: (link, client formatted link, section refs)
+    pending = []
 
     linkset = LinkSet(oref)
     # For all links that mention ref (in any position)
@@ -204,87 +206,94 @@ def get_links(tref, with_text=True, with_sheet_links=False):
             logger.error("AttributeError in presenting link: {} - {} : {}".format(link.refs[0], link.refs[1], e))
             continue
 
+        if not with_text:
+            links.append(com)
+            continue
+
         # Rather than getting text with each link, walk through all links here,
-        # caching text so that redundant DB calls can be minimized
+        # collecting the sections needed so that the texts can be loaded in one batch below
         # If link is spanning, split into section refs and rejoin
+        com_orefs = Ref(com["ref"]).split_spanning_ref()
+        pending.append((link, com, com_orefs))
+
+    if pending:
+        prefetch = TextChunkPrefetch([com_oref.top_section_ref() for _, _, com_orefs in pending for com_oref in com_orefs])
+    for link, com, com_orefs in pending:
         try:
-            if with_text:
-                original_com_oref = Ref(com["ref"])
-                com_orefs = original_com_oref.split_spanning_ref()
-                for com_oref in com_orefs:
-                    top_oref = com_oref.top_section_ref()
-                    # Lookup and save top level text, only if we haven't already
-                    top_nref = top_oref.normal()
-                    if top_nref not in texts:
-                        for lang in ("en", "he"):
-                            top_nref_tc = TextChunk(top_oref, lang)
-                            versionInfoMap = None if not top_nref_tc._versions else {
-                                v.versionTitle: {
-                                    'license': getattr(v, 'license', ''),
-                                    'versionTitleInHebrew': getattr(v, 'versionTitleInHebrew', '')
-                                } for v in top_nref_tc._versions
-                            }
-                            if top_nref_tc.is_merged:
-                                version = top_nref_tc.sources
-                                license = [versionInfoMap[vtitle]['license'] for vtitle in version]
-                                versionTitleInHebrew = [versionInfoMap[vtitle]['versionTitleInHebrew'] for vtitle in version]
-                            elif top_nref_tc._versions:
-                                version_obj = top_nref_tc.version()
-                                version = version_obj.versionTitle
-                                license = versionInfoMap[version]['license']
-                                versionTitleInHebrew = versionInfoMap[version]['versionTitleInHebrew']
-                            else:
-                                # version doesn't exist in this language
-                                version = None
-                                license = None
-                                versionTitleInHebrew = None
-                            version = top_nref_tc.sources if top_nref_tc.is_merged else (top_nref_tc.version().versionTitle if top_nref_tc._versions else None)
-                            if top_nref not in texts:
-                                texts[top_nref] = {}
-                            texts[top_nref][lang] = {
-                                'ja': top_nref_tc.ja(),
-                                'version': version,
-                                'license': license,
-                                'versionTitleInHebrew': versionTitleInHebrew
-                            }
-                    com_sections = [i - 1 for i in com_oref.sections]
-                    com_toSections = [i - 1 for i in com_oref.toSections]
-                    for lang, (attr, versionAttr, licenseAttr, vtitleInHeAttr) in (
-                            ("he", ("he","heVersionTitle","heLicense","heVersionTitleInHebrew")),
-                            ("en", ("text", "versionTitle","license","versionTitleInHebrew"))):
-                        temp_nref_data = texts[top_nref][lang]
-                        # Because of how the jagged arrays work, res may be either a single line or a list of lines
-                        res = temp_nref_data['ja'].subarray(com_sections[1:], com_toSections[1:]).array()
-                        if attr not in com: # If this is the first com_oref, and so the object doesn't contain any data in this field,
-                            com[attr] = res  # Set the text directly in the object
-                        else:  # This is not the first oref (this was a spanning ref, e.g. "Ketubot 110b:25-111a:1".
-                            # We'll want to connect the texts from all pages together. As mentioned, each can be either a string or a list.
-                            if isinstance(com[attr], str):
-                                com[attr] = [com[attr]]
-                            if isinstance(res, str):
-                                res = [res]
-                            com[attr] += res  # Once they're both definitely lists, merge the lists together.
-                        temp_version = temp_nref_data['version']
-                        if isinstance(temp_version, str) or temp_version is None:
-                            com[versionAttr] = temp_version
-                            com[licenseAttr] = temp_nref_data['license']
-                            com[vtitleInHeAttr] = temp_nref_data['versionTitleInHebrew']
+            for com_oref in com_orefs:
+                top_oref = com_oref.top_section_ref()
+                # Lookup and save top level text, only if we haven't already
+                top_nref = top_oref.normal()
+                if top_nref not in texts:
+                    for lang in ("en", "he"):
+                        top_nref_tc = prefetch.get(top_oref, lang)
+                        versionInfoMap = None if not top_nref_tc._versions else {
+                            v.versionTitle: {
+                                'license': getattr(v, 'license', ''),
+                                'versionTitleInHebrew': getattr(v, 'versionTitleInHebrew', '')
+                            } for v in top_nref_tc._versions
+                        }
+                        if top_nref_tc.is_merged:
+                            version = top_nref_tc.sources
+                            license = [versionInfoMap[vtitle]['license'] for vtitle in version]
+                            versionTitleInHebrew = [versionInfoMap[vtitle]['versionTitleInHebrew'] for vtitle in version]
+                        elif top_nref_tc._versions:
+                            version_obj = top_nref_tc.version()
+                            version = version_obj.versionTitle
+                            license = versionInfoMap[version]['license']
+                            versionTitleInHebrew = versionInfoMap[version]['versionTitleInHebrew']
+                        else:
+                            # version doesn't exist in this language
+                            version = None
+                            license = None
+                            versionTitleInHebrew = None
+                        version = top_nref_tc.sources if top_nref_tc.is_merged else (top_nref_tc.version().versionTitle if top_nref_tc._versions else None)
+                        if top_nref not in texts:
+                            texts[top_nref] = {}
+                        texts[top_nref][lang] = {
+                            'ja': top_nref_tc.ja(),
+                            'version': version,
+                            'license': license,
+                            'versionTitleInHebrew': versionTitleInHebrew
+                        }
+                com_sections = [i - 1 for i in com_oref.sections]
+                com_toSections = [i - 1 for i in com_oref.toSections]
+                for lang, (attr, versionAttr, licenseAttr, vtitleInHeAttr) in (
+                        ("he", ("he","heVersionTitle","heLicense","heVersionTitleInHebrew")),
+                        ("en", ("text", "versionTitle","license","versionTitleInHebrew"))):
+                    temp_nref_data = texts[top_nref][lang]
+                    # Because of how the jagged arrays work, res may be either a single line or a list of lines
+                    res = temp_nref_data['ja'].subarray(com_sections[1:], com_toSections[1:]).array()
+                    if attr not in com: # If this is the first com_oref, and so the object doesn't contain any data in this field,
+                        com[attr] = res  # Set the text directly in the object
+                    else:  # This is not the first oref (this was a spanning ref, e.g. "Ketubot 110b:25-111a:1".
+                        # We'll want to connect the texts from all pages together. As mentioned, each can be either a string or a list.
+                        if isinstance(com[attr], str):
+                            com[attr] = [com[attr]]
+                        if isinstance(res, str):
+                            res = [res]
+                        com[attr] += res  # Once they're both definitely lists, merge the lists together.
+                    temp_version = temp_nref_data['version']
+                    if isinstance(temp_version, str) or temp_version is None:
+                        com[versionAttr] = temp_version
+                        com[licenseAttr] = temp_nref_data['license']
+                        com[vtitleInHeAttr] = temp_nref_data['versionTitleInHebrew']
+                    else:
+                        # merged. find exact version titles for each segment
+                        start_sources = temp_nref_data['ja'].distance([], com_sections[1:])
+                        if com_sections == com_toSections:
+                            # simplify for the common case
+                            versions = temp_version[start_sources] if start_sources < len(temp_version) - 1 else None
+                            licenses = temp_nref_data['license'][start_sources] if start_sources < len(temp_nref_data['license']) - 1 else None
+                            versionTitlesInHebrew = temp_nref_data['versionTitleInHebrew'][start_sources] if start_sources < len(temp_nref_data['versionTitleInHebrew']) - 1 else None
                         else:
-                            # merged. find exact version titles for each segment
-                            start_sources = temp_nref_data['ja'].distance([], com_sections[1:])
-                            if com_sections == com_toSections:
-                                # simplify for the common case
-                                versions = temp_version[start_sources] if start_sources < len(temp_version) - 1 else None
-                                licenses = temp_nref_data['license'][start_sources] if start_sources < len(temp_nref_data['license']) - 1 else None
-                                versionTitlesInHebrew = temp_nref_data['versionTitleInHebrew'][start_sources] if start_sources < len(temp_nref_data['versionTitleInHebrew']) - 1 else None
-                            else:
-                                end_sources = temp_nref_data['ja'].distance([], com_toSections[1:])
-                                versions = temp_version[start_sources:end_sources + 1]
-                                licenses = temp_nref_data['license'][start_sources:end_sources + 1]
-                                versionTitlesInHebrew = temp_nref_data['versionTitleInHebrew'][start_sources:end_sources + 1]
-                            com[versionAttr] = versions
-                            com[licenseAttr] = licenses
-                            com[vtitleInHeAttr] = versionTitlesInHebrew
+                            end_sources = temp_nref_data['ja'].distance([], com_toSections[1:])
+                            versions = temp_version[start_sources:end_sources + 1]
+                            licenses = temp_nref_data['license'][start_sources:end_sources + 1]
+                            versionTitlesInHebrew = temp_nref_data['versionTitleInHebrew'][start_sources:end_sources + 1]
+                        com[versionAttr] = versions
+                        com[licenseAttr] = licenses
+                        com[vtitleInHeAttr] = versionTitlesInHebrew
             links.append(com)
         except NoVersionFoundError as e:
             logger.warning("Trying to get non existent text for ref '{}'. Link refs were: {}".format(top_nref, link.refs))
@@ -306,10 +315,18 @@ def get_links(tref, with_text=True, with_sheet_links=False):
             base_links = [x for x in base_links if ((x['sourceRef'], x['anchorRef']) not in orig_links_refs) and (x["sourceRef"] != x["anchorRef"])]
             links += base_links
 
-    collections = library.get_collections_in_library()
-    if with_sheet_links and len(collections):
-        sheet_links = get_sheets_for_ref(tref, in_collection=collections)
-        formatted_sheet_links = [format_sheet_as_link(sheet) for sheet in sheet_links]
-        links += formatted_sheet_links
+    if with_sheet_links:
+        links += get_sheet_links(tref)
 
     return links
+
+
+def get_sheet_links(tref):
+    """
+    Return sheets in collections which are listed in the TOC that include 'ref', formatted as links.
+    """
+    collections = library.get_collections_in_library()
+    if not len(collections):
+        return []
+    sheet_links = get_sheets_for_ref(tref, in_collection=collections)
+    return [format_sheet_as_link(sheet) for sheet in sheet_links]
@@ -0,0 +1,346 @@
+"""
+flat_jagged_array.py: a jagged array stored as a flat buffer of its leaves and, for every level, an array of offsets
+into the level below (like the row pointers of a CSR matrix).
+
+    [["a", "b"], [], ["c"]]  ->  leaves ["a", "b", "c"], offsets [[0, 3], [0, 2, 2, 3]]
+
+Level 0 is the root.  The children of node i of level k are the nodes (or, at the last level, the leaves)
+offsets[k][i] to offsets[k][i + 1] of level k + 1.
+
+Operations that walk the whole array in JaggedArray (mask, flatten, counts, shape, sums) are linear scans of the
+buffers here.  Only regular arrays can be stored: all leaves at the same depth, with empty lists allowed anywhere.
+`from_nested()` raises ValueError for anything else (e.g. [["a"], "b"]), and callers should keep using JaggedArray.
+"""
+from array import array
+from itertools import accumulate
+
+from sefaria.datatype.jagged_array import JaggedArray, JaggedTextArray, JaggedIntArray
+
+
+class FlatJaggedArray(object):
+    nested_class = JaggedArray
+
+    def __init__(self, offsets, leaves):
+        """
+        Use from_nested() to build
+        :param offsets: list of one array of offsets per level. empty for a single value (depth 0)
+        :param leaves: list of leaf values
+        """
+        self._offsets = offsets
+        self._leaves = leaves
+        self._empty_sections = None
+
+    @classmethod
+    def from_nested(cls, nested):
+        """
+        :param nested: nested lists, or a JaggedArray
+        :raise ValueError: if `nested` isn't regular
+        """
+        if isinstance(nested, JaggedArray):
+            nested = nested.array()
+        if not isinstance(nested, list):
+            return cls([], [nested])
+        offsets = []
+        level = [nested]
+        while True:
+            offset = array('q', [0])
+            children = []
+            has_list = has_leaf = False
+            for node in level:
+                for el in node:
+                    if isinstance(el, list):
+                        has_list = True
+                    else:
+                        has_leaf = True
+                children.extend(node)
+                offset.append(len(children))
+            offsets.append(offset)
+            if has_list and has_leaf:
+                raise ValueError("Jagged array has lists and values at depth {}".format(len(offsets)))
+            if not has_list:
+                return cls(offsets, children)
+            level = children
+
+    def array(self):
+        """
+        :return: the nested lists
+        """
+        if not self._offsets:
+            return self._leaves[0]
+        cur = self._leaves
+        for offset in reversed(self._offsets):
+            cur = [cur[offset[i]:offset[i + 1]] for i in range(len(offset) - 1)]
+        return cur[0]
+
+    def to_nested(self):
+        """
+        :return: the equivalent JaggedArray (of `nested_class`)
+        """
+        return self.nested_class(self.array())
+
+    def _levels(self):
+        return len(self._offsets)
+
+    def get_depth(self):
+        """
+        Same as JaggedArray.get_depth(): 0 for an empty array
+        """
+        if not self._offsets or self._offsets[0][1] == 0:
+            return 0
+        return self._levels()
+
+    def depth(self):
+        return self.get_depth()
+
+    def element_count(self):
+        return len(self._leaves)
+
+    def flatten_to_array(self):
+        return list(self._leaves)
+
+    def is_empty(self):
+        return not any(self._leaves)
+
+    def is_full(self):
+        if not self._offsets:
+            return bool(self._leaves[0])
+        for offset in self._offsets:
+            if any(offset[i] == offset[i + 1] for i in range(len(offset) - 1)):
+                return False
+        return all(self._leaves)
+
+    def mask(self):
+        """
+        :return FlatJaggedIntArray: 1 where this has a truthy value, otherwise 0
+        """
+        return FlatJaggedIntArray(self._offsets, [1 if v else 0 for v in self._leaves])
+
+    def zero_mask(self):
+        return self.constant_mask(0)
+
+    def constant_mask(self, constant=None):
+        return FlatJaggedIntArray(self._offsets, [constant] * len(self._leaves))
+
+    def _child_counts(self, level):
+        offset = self._offsets[level]
+        return [offset[i + 1] - offset[i] for i in range(len(offset) - 1)]
+
+    def shape(self):
+        """
+        Same as JaggedArray.shape(): for depth 1 the length, for depth 2 a list of section lengths, etc.
+        """
+        if not self._offsets:
+            return len(self._leaves[0])
+        values = self._child_counts(self._levels() - 1)
+        for level in range(self._levels() - 2, -1, -1):
+            offset = self._offsets[level]
+            values = [values[offset[i]:offset[i + 1]] if offset[i] != offset[i + 1] else 0 for i in range(len(offset) - 1)]
+        return values[0]
+
+    def _node(self, indexes):
+        """
+        :return: (level, index) of the node at `indexes`, or None if they're beyond the array
+        """
+        node = 0
+        for level, i in enumerate(indexes):
+            if level >= self._levels():
+                return None
+            offset = self._offsets[level]
+            if i > offset[node + 1] - offset[node] - 1:
+                return None
+            node = offset[node] + i
+        return len(indexes), node
+
+    def _length(self, level, node):
+        if level == self._levels():
+            try:
+                return len(self._leaves[node])
+            except TypeError:
+                return 0
+        offset = self._offsets[level]
+        return offset[node + 1] - offset[node]
+
+    def sub_array_length(self, indexes=None, until_last_nonempty=False):
+        """
+        Same as JaggedArray.sub_array_length()
+        """
+        indexes = indexes or []
+        if len(indexes) > self._levels():
+            # indexes into a value, e.g. the characters of a string
+            found = self._node(indexes[:self._levels()])
+            return None if found is None else self.nested_class(self._leaves[found[1]]).sub_array_length(indexes[self._levels():])
+        found = self._node(indexes)
+        if found is None:
+            return None
+        level, node = found
+        length = self._length(level, node)
+        if until_last_nonempty and level < self._levels() - 1:
+            first = self._offsets[level][node]
+            while length > 0 and self._length(level + 1, first + length - 1) == 0:
+                length -= 1
+        return length
+
+    def _has_empty_sections(self):
+        """
+        :return: True if any node below the root has no children
+        """
+        if self._empty_sections is None:
+            self._empty_sections = any(
+                offset[i] == offset[i + 1] for offset in self._offsets[1:] for i in range(len(offset) - 1))
+        return self._empty_sections
+
+    def distance(self, indexes1, indexes2):
+        """
+        Same as JaggedArray.distance(): the number of segments between two addresses.
+        For addresses in an array without empty sections, that's the difference of their positions in the leaf buffer.
+        """
+        n = self._levels()
+        if len(indexes1) > n or len(indexes2) > n:
+            raise IndexError
+        indexes1 = list(indexes1) + [0] * (n - len(indexes1))
+        indexes2 = list(indexes2) + [0] * (n - len(indexes2))
+        if self._has_empty_sections() or self._node(indexes1) is None or self._node(indexes2) is None:
+            # JaggedArray skips empty sections in ways that positions don't
+            return JaggedArray.distance(self, indexes1, indexes2)
+        return abs(self._node(indexes2)[1] - self._node(indexes1)[1])
+
+    is_first = JaggedArray.is_first
+
+    def subarray_with_ref(self, ref):
+        start = [i - 1 for i in ref.sections]
+        end = [i - 1 for i in ref.toSections]
+        return self.subarray(start, end)
+
+    def subarray(self, start_indexes, end_indexes=None):
+        """
+        Same as JaggedArray.subarray(), but never modifies this array
+        :return: array of the same class
+        """
+        if not end_indexes:
+            end_indexes = start_indexes
+        assert len(start_indexes) == len(end_indexes)
+        n = self._levels()
+        if len(start_indexes) > self.get_depth():
+            return self.__class__.from_nested([])
+
+        range_index = next((i for i, (s, e) in enumerate(zip(start_indexes, end_indexes)) if s != e), len(start_indexes))
+        found = self._node(start_indexes[:range_index])
+        if found is None:
+            return self.__class__.from_nested([])
+        level, node = found
+        if range_index == len(start_indexes):
+            if level == n:
+                return self.__class__([], [self._leaves[node]])
+            first, last = node, node  # the whole node
+        else:
+            # Range begins here
+            offset = self._offsets[level]
+            first = offset[node] + start_indexes[level]
+            last = min(offset[node] + end_indexes[level], offset[node + 1] - 1)
+            level += 1
+
+        # the nodes kept at each level are contiguous: from the start address to the end address
+        ranges = [(first, last)]
+        for lvl in range(level, n):
+            offset = self._offsets[lvl]
+            if last < first:
+                first, last = 0, -1
+            elif lvl < len(start_indexes):
+                # trim the first and last nodes of the range
+                lo = min(offset[first] + start_indexes[lvl], offset[first + 1])
+                hi = lo + end_indexes[lvl] if first == last else offset[last] + end_indexes[lvl]
+                first, last = lo, min(hi, offset[last + 1] - 1)
+            else:
+                first, last = offset[first], offset[last + 1] - 1
+            ranges.append((first, last))
+
+        if range_index == len(start_indexes):
+            ranges = ranges[1:]  # the node itself is the root
+            root_children = ranges[0][1] - ranges[0][0] + 1 if ranges else 0
+        else:
+            root_children = ranges[0][1] - ranges[0][0] + 1
+        offsets = [array('q', [0, max(root_children, 0)])]
+        for lvl, ((first, last), (child_first, child_last)) in enumerate(zip(ranges, ranges[1:]), start=n - len(ranges) + 1):
+            offset = self._offsets[lvl]
+            bounds = [min(max(offset[i], child_first), child_last + 1) - child_first for i in range(first, last + 1)]
+            offsets.append(array('q', bounds + [max(child_last + 1 - child_first, 0)]) if last >= first else array('q', [0]))
+        leaves_first, leaves_last = ranges[-1]
+        return self.__class__(offsets, self._leaves[leaves_first:leaves_last + 1])
+
+    def __eq__(self, other):
+        return self._offsets == other._offsets and self._leaves == other._leaves
+
+    def __len__(self):
+        return self.sub_array_length()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.array()})"
+
+    def length(self):
+        return self.__len__()
+
+
+class FlatJaggedTextArray(FlatJaggedArray):
+    nested_class = JaggedTextArray
+
+    def verse_count(self):
+        return self.element_count()
+
+    def flatten_to_array(self):
+        return [str(el) for el in self._leaves]
+
+    def flatten_to_string(self, joiner=" "):
+        return joiner.join(self.flatten_to_array())
+
+
+class FlatJaggedIntArray(FlatJaggedArray):
+    nested_class = JaggedIntArray
+
+    def add(self, other):
+        return self.__add__(other)
+
+    def __add__(self, other):
+        """
+        Same as JaggedIntArray addition: sums each position, treating missing positions as 0
+        :raise ValueError: if the arrays are of different depths and the sum isn't regular
+        """
+        assert isinstance(other, FlatJaggedIntArray)
+        shallower = min(self, other, key=lambda ja: ja._levels())
+        if self._levels() != other._levels() and shallower._leaves:
+            return FlatJaggedIntArray.from_nested(JaggedIntArray._add(self.array(), other.array()))
+        if not self._offsets and not other._offsets:
+            return FlatJaggedIntArray([], [(self._leaves[0] or 0) + (other._leaves[0] or 0)])
+        if self._offsets == other._offsets:
+            return FlatJaggedIntArray(self._offsets, [a + b for a, b in zip(self._leaves, other._leaves)])
+
+        # Walk both arrays level by level, pairing up the nodes at the same address. -1 is a missing node
+        pairs = [(0, 0)]
+        offsets = []
+        for level in range(max(self._levels(), other._levels())):
+            a_offset = self._offsets[level] if level < self._levels() else None
+            b_offset = other._offsets[level] if level < other._levels() else None
+            offset = array('q', [0])
+            children = []
+            for a, b in pairs:
+                a_count = a_offset[a + 1] - a_offset[a] if a >= 0 and a_offset is not None else 0
+                b_count = b_offset[b + 1] - b_offset[b] if b >= 0 and b_offset is not None else 0
+                for j in range(max(a_count, b_count)):
+                    children.append((a_offset[a] + j if j < a_count else -1, b_offset[b] + j if j < b_count else -1))
+                offset.append(len(children))
+            offsets.append(offset)
+            pairs = children
+        leaves = [(self._leaves[a] if a >= 0 else 0) + (other._leaves[b] if b >= 0 else 0) for a, b in pairs]
+        return FlatJaggedIntArray(offsets, leaves)
+
+    def depth_sum(self, depth):
+        """
+        Same as JaggedIntArray.depth_sum(): the number of nodes `depth` levels below the top which have any count
+        """
+        if depth >= self._levels() - 1:
+            return sum(1 for v in self._leaves if v) if depth == self._levels() - 1 else 0
+        # leaf ranges of the nodes at level depth + 1
+        bounds = list(self._offsets[-1])
+        for level in range(self._levels() - 2, depth, -1):
+            bounds = [bounds[i] for i in self._offsets[level]]
+        nonzero = [0] + list(accumulate(1 if v else 0 for v in self._leaves))
+        return sum(1 for i in range(len(bounds) - 1) if nonzero[bounds[i + 1]] > nonzero[bounds[i]])
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import copy
+import random
+
+import pytest
+
+from sefaria.datatype.jagged_array import JaggedTextArray, JaggedIntArray
+from sefaria.datatype.flat_jagged_array import FlatJaggedTextArray, FlatJaggedIntArray
+
+
+def random_ja(depth, leaf, rand):
+    if depth == 0:
+        return leaf(rand)
+    return [random_ja(depth - 1, leaf, rand) for _ in range(rand.choice([0, 1, 1, 2, 3, 4]))]
+
+
+def random_text(rand):
+    return rand.choice(["", "a", "bb", "ccc"])
+
+
+def random_count(rand):
+    return rand.choice([0, 1, 2])
+
+
+def leaf_addresses(a, path=None):
+    path = path or []
+    if not isinstance(a, list):
+        return [path]
+    return [address for i, child in enumerate(a) for address in leaf_addresses(child, path + [i])]
+
+
+FIXED = [
+    [],
+    [[]],
+    ["a", "", "b"],
+    [["Line 1:1", "1:2"], ["2:1"], [], ["", "4:2", ""]],
+    [[["1:1:1", "1:1:2"], []], [], [["3:1:1"], ["", "3:2:2", "3:2:3"], [""]]],
+]
+RANDOM = [random_ja(rand.randint(1, 4), random_text, rand) for rand in map(random.Random, range(200))]
+
+
+@pytest.fixture(params=FIXED + RANDOM)
+def arrays(request):
+    return JaggedTextArray(copy.deepcopy(request.param)), FlatJaggedTextArray.from_nested(request.param)
+
+
+class Test_Flat_Jagged_Array(object):
+
+    def test_round_trip(self, arrays):
+        nested, flat = arrays
+        assert flat.array() == nested.array()
+        assert flat.to_nested().array() == nested.array()
+
+    def test_scans(self, arrays):
+        nested, flat = arrays
+        assert flat.mask().array() == nested.mask().array()
+        assert flat.zero_mask().array() == nested.zero_mask().array()
+        assert flat.flatten_to_array() == nested.flatten_to_array()
+        assert flat.element_count() == nested.element_count()
+        assert flat.shape() == nested.shape()
+        assert flat.get_depth() == nested.get_depth()
+        assert flat.is_empty() == nested.is_empty()
+        assert flat.is_full() == nested.is_full()
+        assert len(flat) == len(nested)
+
+    def test_depth_sum(self, arrays):
+        nested, flat = arrays
+        for depth in range(nested.get_depth()):
+            assert flat.mask().depth_sum(depth) == nested.mask().depth_sum(depth)
+
+    def test_sub_array_length(self, arrays):
+        nested, flat = arrays
+        for indexes in [[], [0], [1], [2, 0], [0, 1], [1, 0, 0], [5]]:
+            assert flat.sub_array_length(indexes) == nested.sub_array_length(indexes)
+            assert flat.sub_array_length(indexes, until_last_nonempty=True) == nested.sub_array_length(indexes, until_last_nonempty=True)
+
+    def test_distance(self, arrays):
+        nested, flat = arrays
+        addresses = leaf_addresses(nested.array())
+        for a, b in zip(addresses, addresses[::-1]):
+            assert flat.distance(a, b) == nested.distance(list(a), list(b))
+
+    def test_subarray(self, arrays):
+        nested, flat = arrays
+        rand = random.Random(len(flat.flatten_to_array()))
+        for _ in range(10):
+            n = rand.randint(0, nested.get_depth())
+            start, end = sorted([[rand.randint(0, 3) for _ in range(n)] for _ in range(2)])
+            try:
+                # JaggedArray.subarray() changes the array for some ranges
+                expected = JaggedTextArray(copy.deepcopy(nested.array())).subarray(start, end).array()
+            except IndexError:
+                continue
+            assert flat.subarray(start, end).array() == expected
+        assert flat.array() == nested.array()
+
+    def test_irregular(self):
+        with pytest.raises(ValueError):
+            FlatJaggedTextArray.from_nested([["a"], "b"])
+        with pytest.raises(ValueError):
+            FlatJaggedTextArray.from_nested([[["a"]], ["b"]])
+
+
+class Test_Flat_Jagged_Int_Array(object):
+
+    @pytest.mark.parametrize("seed", range(200))
+    def test_add(self, seed):
+        rand = random.Random(seed)
+        depth = rand.randint(1, 4)
+        a, b = random_ja(depth, random_count, rand), random_ja(depth, random_count, rand)
+        expected = JaggedIntArray(copy.deepcopy(a)) + JaggedIntArray(copy.deepcopy(b))
+        assert (FlatJaggedIntArray.from_nested(a) + FlatJaggedIntArray.from_nested(b)).array() == expected.array()
+
+    def test_add_empty(self):
+        a = [[1, 0], [], [2]]
+        assert (FlatJaggedIntArray.from_nested([]) + FlatJaggedIntArray.from_nested(a)).array() == a
+        assert (FlatJaggedIntArray.from_nested([[], []]) + FlatJaggedIntArray.from_nested([[[1]]])).array() == [[[1]], []]
+
+    def test_add_irregular_sum(self):
+        with pytest.raises(ValueError):
+            FlatJaggedIntArray.from_nested([[1], [2]]) + FlatJaggedIntArray.from_nested([[[3]]])
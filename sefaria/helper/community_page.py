@@ -48,7 +48,7 @@ def get_community_page_data(language="english", refresh=False):
     "featured": load_data_from_sheet(urls[language]["featured"]),
   }
 
-  in_memory_cache.set("community-page-data-{}".format(language), data, timeout=60 * 60)
+  in_memory_cache.set("community-page-data-{}".format(language), data, timeout=60 * 60, namespace="community-page-data")
 
   return data
 
@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import csv
+import itertools
 import sys
 import re
+import regex
 from io import StringIO
+from bson.objectid import ObjectId
+from pymongo import InsertOne, ReplaceOne, DeleteOne
 import structlog
 logger = structlog.get_logger(__name__)
 
 from sefaria.model import *
+from sefaria.system.database import db
 from sefaria.system.exceptions import DuplicateRecordError, InputError
+from sefaria.recommendation_index import enqueue_recommendation_refs
+from sefaria.model.library_snapshot import bump_snapshot_generation
 import sefaria.tracker as tracker
 try:
     from sefaria.settings import USE_VARNISH
@@ -20,6 +28,279 @@ if USE_VARNISH:
 #TODO: should all the functions here be decoupled from the need to enter a userid?
 
 
+class LinkReconciler(object):
+    """
+    Adds and deletes links in memory, checking each new link against the others exactly as `Link.save()` checks it
+    against the database, then writes all of the changes at once: one `bulk_write` to the links collection,
+    one insert of their history, and one invalidation of each touched ref.
+
+    Links are only checked against the links loaded with `load()`, and the ones added since, so the links of
+    at least one of the refs of each new link should be loaded first.  Queries on the loaded links that they can't
+    answer are made on the database, once the pending changes are written.
+
+    The links are written without `Link.save()` and `Link.delete()`, so their save and delete notifications aren't
+    sent.  `flush()` does the work of the subscribers in `link_subscribers` for all the changes at once instead,
+    and has to be kept in step with the Link subscribers in sefaria/model/dependencies.py.
+
+        reconciler = LinkReconciler(user)
+        reconciler.load(Ref("Rashi on Genesis 1"))
+        reconciler.add({"refs": ["Genesis 1:1", "Rashi on Genesis 1:1:1"], "type": "commentary"})
+        reconciler.flush()
+    """
+    batch_size = 5000  # pending changes after which `load()` writes them, before loading more links
+    link_subscribers = ("process_link_change_in_recommendation_index", "process_link_change_in_library_snapshot")
+
+    def __init__(self, user=None, log=True):
+        """
+        :param user: the user id that changes are logged under
+        :param log: whether to log the changes in the history, as `tracker.add()` and `tracker.delete()` do
+        """
+        self._user = user
+        self._log = log
+        self._counter = itertools.count()
+        self._reset()
+
+    def _reset(self):
+        self._scopes = []        # compiled regexes of the loaded refs
+        self._links = {}         # _id: Link, for each loaded or added link that isn't deleted
+        self._order = {}         # _id: position, so that lookups return the earliest match, as the database would
+        self._indexed = {}       # _id: the refs that the link is indexed under
+        self._by_ref = {}        # ref: set of _ids of links with that ref
+        self._sorted_refs = []   # keys of `_by_ref`, sorted, for regex lookups
+        self._inserted = {}
+        self._updated = {}
+        self._deleted = {}
+        self._history = []
+        self._touched = set()    # refs to invalidate
+        self._changed = set()    # refs of the added, updated and deleted links, before and after the change
+
+    def load(self, oref):
+        """
+        Loads the links of `oref` and of every ref within it, unless they are loaded already.
+        """
+        if self._covers(oref.normal()):
+            return
+        if len(self._inserted) + len(self._updated) + len(self._deleted) >= self.batch_size:
+            self.flush()
+        pattern = oref.regex()
+        for link in LinkSet({"refs": {"$regex": pattern}}):
+            if link._id not in self._links and link._id not in self._deleted:
+                self._index(link)
+        self._scopes.append(regex.compile(pattern))
+
+    def add(self, attrs, **kwargs):
+        """
+        Adds a link, as `tracker.add(user, Link, attrs, **kwargs)` would.
+        If the links of neither of its refs are loaded, loads the links of the first.
+        :return: the new Link
+        :raises DuplicateRecordError: when the link, or a more precise one, exists already
+        """
+        link = Link(attrs)
+        link._normalize()
+        if not any(self._covers(tref) for tref in link.refs):
+            self.load(Ref(link.refs[0]))
+        link._validate()
+        link._sanitize()
+        link._pre_save(links=self)
+        link._id = ObjectId()
+        self._index(link)
+        self._inserted[link._id] = link
+        self._changed.update(link.refs)
+        self._log_change(None, link, **kwargs)
+        return link
+
+    def delete(self, link, **kwargs):
+        """
+        Deletes a link, as `tracker.delete(user, Link, link._id, **kwargs)` would.  Does nothing if it is deleted already.
+        :param link: a Link, which needn't have been loaded
+        """
+        if link._id in self._deleted:
+            return
+        link = self._links.get(link._id, link)
+        self.discard(link)
+        self._log_change(link, None, **kwargs)
+
+    def invalidate(self, tref):
+        """
+        Marks a ref to be invalidated in Varnish on `flush()`
+        """
+        self._touched.add(tref)
+
+    def find(self, query):
+        """
+        :param query: a query on the loaded links, of the kinds that `Link._pre_save()` makes:
+        "refs" as a list, a ref or a {"$regex": ...}, "$and", "$or", and other fields compared for equality
+        :return: list of matching links, in the order the database would return them
+        """
+        return [self._links[_id] for _id in sorted(self._matching(query), key=self._order.get)]
+
+    def find_one(self, query):
+        ids = self._matching(query)
+        return self._links[min(ids, key=self._order.get)] if ids else None
+
+    def update(self, link):
+        """
+        Saves changes to a loaded or added link, as `Link.save()` would
+        """
+        link._normalize()
+        link._validate()
+        link._sanitize()
+        link._pre_save(links=self)
+        self._changed.update(self._indexed.get(link._id, []))
+        self._changed.update(link.refs)
+        self._unindex(link._id)
+        self._index(link)
+        if link._id not in self._inserted:
+            self._updated[link._id] = link
+
+    def discard(self, link):
+        """
+        Deletes a link without logging it, as `Link.delete()` would
+        """
+        self._changed.update(self._indexed.get(link._id, link.refs))
+        self._unindex(link._id)
+        self._links.pop(link._id, None)
+        self._updated.pop(link._id, None)
+        if self._inserted.pop(link._id, None) is None:
+            self._deleted[link._id] = link
+
+    def flush(self):
+        """
+        Writes the pending changes and their history, invalidates the touched refs, and forgets the loaded links.
+        :return: dict with the number of links inserted, updated and deleted
+        """
+        ops = [InsertOne(link._saveable_attrs()) for link in self._inserted.values()]
+        ops += [ReplaceOne({"_id": _id}, link._saveable_attrs()) for _id, link in self._updated.items()]
+        ops += [DeleteOne({"_id": _id}) for _id in self._deleted]
+        if ops:
+            db.links.bulk_write(ops)
+            # the link_subscribers, for every change
+            enqueue_recommendation_refs(self._changed)
+            changed_links = itertools.chain(self._inserted.values(), self._updated.values(), self._deleted.values())
+            if any(getattr(link, "is_first_comment", False) for link in changed_links):
+                bump_snapshot_generation()
+        save_log_records(self._history)
+        if USE_VARNISH:
+            for tref in sorted(self._touched):
+                try:
+                    invalidate_ref(Ref(tref))
+                except InputError:
+                    pass
+        counts = {"inserted": len(self._inserted), "updated": len(self._updated), "deleted": len(self._deleted)}
+        self._reset()
+        return counts
+
+    def _log_change(self, old_link, new_link, **kwargs):
+        if not self._log:
+            return
+        old_dict = old_link.contents(**kwargs) if old_link else None
+        new_dict = new_link.contents(**kwargs) if new_link else None
+        self._history.append(log_record(self._user, Link, old_dict, new_dict, **kwargs))
+
+    def _covers(self, tref):
+        return any(scope.match(tref) for scope in self._scopes)
+
+    def _index(self, link):
+        self._links[link._id] = link
+        self._order.setdefault(link._id, next(self._counter))
+        self._indexed[link._id] = list(link.refs)
+        for tref in link.refs:
+            if tref not in self._by_ref:
+                self._by_ref[tref] = set()
+                bisect.insort(self._sorted_refs, tref)
+            self._by_ref[tref].add(link._id)
+
+    def _unindex(self, _id):
+        for tref in self._indexed.pop(_id, []):
+            self._by_ref[tref].discard(_id)
+
+    def _matching(self, query):
+        """
+        :return: set of _ids of the links that match `query`, from the loaded links if they can answer it,
+        otherwise from the database
+        """
+        try:
+            return self._select(query)
+        except NotImplementedError:
+            self.flush()
+            ids = set()
+            for link in LinkSet(query):
+                if link._id not in self._links:
+                    self._index(link)
+                ids.add(link._id)
+            return ids
+
+    def _select(self, query):
+        ids = None
+        fields = []
+        for key, value in query.items():
+            if key == "$and":
+                matched = set.intersection(*[self._select(clause) for clause in value])
+            elif key == "$or":
+                matched = set().union(*[self._select(clause) for clause in value])
+            elif key == "refs" and isinstance(value, list):
+                matched = {_id for _id in self._by_ref.get(value[0], ()) if self._links[_id].refs == value}
+            elif key == "refs" and isinstance(value, dict) and list(value) == ["$regex"]:
+                matched = set().union(*[self._by_ref[tref] for tref in self._refs_matching(value["$regex"])])
+            elif key == "refs" and isinstance(value, str):
+                matched = set(self._by_ref.get(value, ()))
+            elif key.startswith("$") or isinstance(value, dict):
+                raise NotImplementedError("LinkReconciler can't query {}: {}".format(key, value))
+            else:
+                fields.append((key, value))
+                continue
+            ids = matched if ids is None else ids & matched
+        if ids is None:
+            ids = set(self._links)
+        return {_id for _id in ids if all(getattr(self._links[_id], key, None) == value for key, value in fields)}
+
+    def _refs_matching(self, pattern):
+        prefix = _literal_prefix(pattern)
+        compiled = regex.compile(pattern)
+        for tref in itertools.islice(self._sorted_refs, bisect.bisect_left(self._sorted_refs, prefix), None):
+            if not tref.startswith(prefix):
+                break
+            if compiled.search(tref):
+                yield tref
+
+
+def _literal_prefix(pattern):
+    """
+    :return: the literal text at the start of every string that the anchored regex `pattern` matches,
+    e.g. "Genesis 1:1" for "^Genesis\\ 1:1$".  Empty if there's none that's simple to find.
+    """
+    if not pattern.startswith("^"):
+        return ""
+    prefix = []
+    i = 1
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            prefix.append(pattern[i + 1])
+            i += 2
+            continue
+        if char in "\\.^$*+?{}[]|()":
+            if char in "*?{" and prefix:
+                prefix.pop()  # the last character is optional
+            break
+        prefix.append(char)
+        i += 1
+    depth = 0
+    escaped = False
+    for char in pattern[i:]:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return ""  # the prefix is only one of the alternatives
+    return "".join(prefix)
+
+
 class AbstractAutoLinker(object):
     """
     This abstract class defines the interface/contract for autolinking objects.
@@ -40,6 +321,7 @@ class AbstractAutoLinker(object):
         self._user = kwargs.get('user', None)
         self._title = self._requested_oref.index.title
         self._links = None
+        self._reconciler = None
 
     def build_links(self, **kwargs):
         raise NotImplementedError
@@ -54,17 +336,12 @@ class AbstractAutoLinker(object):
         """
         Deletes all of the citation generated links from text 'title'
         """
-        links = self._load_links()
-        for link in links:
-            if USE_VARNISH:
-                try:
-                    invalidate_ref(Ref(link.refs[0]))
-                except InputError:
-                    pass
-                try:
-                    invalidate_ref(Ref(link.refs[1]))
-                except InputError:
-                    pass
+        self._reconcile(self._delete_links_internal, load=False)
+
+    def _delete_links_internal(self):
+        for link in self._load_links():
+            self._reconciler.invalidate(link.refs[0])
+            self._reconciler.invalidate(link.refs[1])
             self._delete_link(link)
 
     def rebuild_links(self, **kwargs):
@@ -77,18 +354,36 @@ class AbstractAutoLinker(object):
 
     def _load_links(self):
         if not self._links:
-            ref_regex_list = self._requested_oref.regex(as_list=True)
-            queries = [{"refs": {"$regex": ref_regex},
-                                   "generated_by": self._generated_by_string,
-                                   "auto": self._auto,
-                                   "type": self._link_type
-                                   } for ref_regex in ref_regex_list]
-            self._links = LinkSet({"$or": queries})
+            self._links = LinkSet(self._links_query())
         return self._links
 
+    def _links_query(self):
+        ref_regex_list = self._requested_oref.regex(as_list=True)
+        queries = [{"refs": {"$regex": ref_regex},
+                               "generated_by": self._generated_by_string,
+                               "auto": self._auto,
+                               "type": self._link_type
+                               } for ref_regex in ref_regex_list]
+        return {"$or": queries}
+
     def linkset(self):
         return self._load_links()
 
+    def _reconcile(self, func, load=True):
+        """
+        Runs `func` with the links saved and deleted through a `LinkReconciler`, which writes them all at the end
+        :param load: whether to load the links of the requested ref first, as is needed to save new links
+        """
+        self._reconciler = LinkReconciler(self._user, log=bool(self._user))
+        try:
+            if load:
+                self._reconciler.load(self._requested_oref)
+            result = func()
+            self._reconciler.flush()
+        finally:
+            self._reconciler = None
+        return result
+
     def _save_link(self, tref, base_tref, **kwargs):
         nlink = {
             "refs": [base_tref, tref],
@@ -98,7 +393,9 @@ class AbstractAutoLinker(object):
             "generated_by": self._generated_by_string
         }
         try:
-            if not self._user:
+            if self._reconciler:
+                self._reconciler.add(nlink, **kwargs)
+            elif not self._user:
                 Link(nlink).save()
             else:
                 tracker.add(self._user, Link, nlink, **kwargs)
@@ -107,7 +404,9 @@ class AbstractAutoLinker(object):
         return tref
 
     def _delete_link(self, link):
-        if not self._user:
+        if self._reconciler:
+            self._reconciler.delete(link)
+        elif not self._user:
             link.delete()
         else:
             tracker.delete(self._user, Link, link._id)
@@ -195,7 +494,7 @@ class AbstractStructureAutoLinker(AbstractAutoLinker):
         return found_links
 
     def build_links(self, **kwargs):
-        return self._build_links_internal(self._requested_oref)
+        return self._reconcile(lambda: self._build_links_internal(self._requested_oref))
 
     def refresh_links(self, **kwargs):
         """
@@ -206,17 +505,15 @@ class AbstractStructureAutoLinker(AbstractAutoLinker):
         :param kwargs:
         :return:
         """
-        existing_links = self._load_links()
+        self._reconcile(self._refresh_links_internal)
+
+    def _refresh_links_internal(self):
         found_links = self._build_links_internal(self._requested_oref)
-        for exLink in existing_links:
+        for exLink in self._reconciler.find(self._links_query()):
             for r in exLink.refs:
                 if self._title not in r:  #current base ref
                     continue
-                if USE_VARNISH:
-                    try:
-                        invalidate_ref(Ref(r))
-                    except InputError:
-                        pass
+                self._reconciler.invalidate(r)
                 if r not in found_links:
                     self._delete_link(exLink)
                 break
@@ -362,15 +659,27 @@ def add_links_from_text(oref, lang, text, text_id, user, **kwargs):
     The set of no longer supported links (`existingLinks` - `found`) is deleted.
     If Varnish is used, all linked refs, old and new, are refreshed
 
+    The links are added and deleted in memory, a section at a time, and written together at the end.
+    See `LinkReconciler`.
+
     Returns `links` - the list of links added.
     """
+    reconciler = LinkReconciler(user)
+    links = _add_links_from_text(reconciler, oref, lang, text, text_id, **kwargs)
+    reconciler.flush()
+    return links
+
+
+def _add_links_from_text(reconciler, oref, lang, text, text_id, **kwargs):
     if not text:
         return []
     elif isinstance(text, list):
         subrefs = oref.subrefs(len(text))
+        if any(isinstance(segment, str) for segment in text):
+            reconciler.load(oref)  # once for the whole section, rather than for each segment
         links   = []
         for i in range(len(text)):
-            single = add_links_from_text(subrefs[i], lang, text[i], text_id, user, **kwargs)
+            single = _add_links_from_text(reconciler, subrefs[i], lang, text[i], text_id, **kwargs)
             links += single
         return links
     elif isinstance(text, str):
@@ -383,12 +692,13 @@ def add_links_from_text(oref, lang, text, text_id, user, **kwargs):
             The set of no longer supported links (`existingLinks` - `found`) is deleted.
             The set of all links (`existingLinks` + `Links`) is refreshed in Varnish.
         """
-        existingLinks = LinkSet({
+        reconciler.load(oref)
+        existingLinks = reconciler.find({
             "refs": oref.normal(),
             "auto": True,
             "generated_by": "add_links_from_text",
             "source_text_oid": text_id
-        }).array()  # Added the array here to force population, so that new links don't end up in this set
+        })
 
         found = []  # The normal refs of the links found in this text
         links = []  # New link objects created by this processes
@@ -397,7 +707,6 @@ def add_links_from_text(oref, lang, text, text_id, user, **kwargs):
             citing_only = kwargs['citing_only']
         else:
             citing_only = True
-
         refs = library.get_refs_in_string(text, lang, citing_only=citing_only)
 
         for linked_oref in refs:
@@ -410,12 +719,11 @@ def add_links_from_text(oref, lang, text, text_id, user, **kwargs):
                 "source_text_oid": text_id,
                 "inline_citation": True
             }
-            found += [linked_oref.normal()]  # Keep this here, since tracker.add will throw an error if the link exists
+            found += [linked_oref.normal()]  # Keep this here, since reconciler.add will throw an error if the link exists
             try:
-                tracker.add(user, Link, link, **kwargs)
+                reconciler.add(link, **kwargs)
                 links += [link]
-                if USE_VARNISH:
-                    invalidate_ref(linked_oref)
+                reconciler.invalidate(linked_oref.normal())
             except InputError as e:
                 pass
 
@@ -424,13 +732,9 @@ def add_links_from_text(oref, lang, text, text_id, user, **kwargs):
             for r in exLink.refs:
                 if r == oref.normal():  # current base ref
                     continue
-                if USE_VARNISH:
-                    try:
-                        invalidate_ref(Ref(r))
-                    except InputError:
-                        pass
+                reconciler.invalidate(r)
                 if r not in found:
-                    tracker.delete(user, Link, exLink._id)
+                    reconciler.delete(exLink)
                 break
 
         return links
@@ -440,27 +744,28 @@ def delete_links_from_text(title, user):
     """
     Deletes all of the citation generated links from text 'title'
     """
+    reconciler = LinkReconciler(user)
+    _delete_links_from_text(reconciler, title)
+    reconciler.flush()
+
+
+def _delete_links_from_text(reconciler, title):
     regex    = Ref(title).regex()
     links    = LinkSet({"refs.0": {"$regex": regex}, "generated_by": "add_links_from_text"})
     for link in links:
-        if USE_VARNISH:
-            try:
-                invalidate_ref(Ref(link.refs[0]))
-            except InputError:
-                pass
-            try:
-                invalidate_ref(Ref(link.refs[1]))
-            except InputError:
-                pass
-        tracker.delete(user, Link, link._id)
+        reconciler.invalidate(link.refs[0])
+        reconciler.invalidate(link.refs[1])
+        reconciler.delete(link)
 
 
 def rebuild_links_from_text(title, user):
     """
     Deletes all of the citation generated links from text 'title'
     then rebuilds them.
+    The changes are written in batches of `LinkReconciler.batch_size`.
     """
-    delete_links_from_text(title, user)
+    reconciler = LinkReconciler(user)
+    _delete_links_from_text(reconciler, title)
     index = library.get_index(title)
     title = index.nodes.primary_title("en")
     versions = index.versionSet()
@@ -474,11 +779,12 @@ def rebuild_links_from_text(title, user):
         """
         assert len(contents) == 1
         version = kwargs.get("version")
-        add_links_from_text(snode.ref(), version.language, contents[0], version._id, user)
+        _add_links_from_text(reconciler, snode.ref(), version.language, contents[0], version._id)
 
     for version in versions:
         index.nodes.visit_content(add_links_callback, version.chapter, version=version)
         # add_links_from_text(Ref(title), version.language, version.chapter, version._id, user)
+    reconciler.flush()
 
 # --------------------------------------------------------------------------------- #
 
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from sefaria.model import *
+import sefaria.model.abstract as abstract
+from sefaria.helper.link import LinkReconciler, add_links_from_text
+from sefaria.system.database import db
+from sefaria.system.exceptions import DuplicateRecordError
+from sefaria.utils.testing_utils import record_mongo_calls
+import sefaria.tracker as tracker
+
+TITLE = "Link Reconciler Test"
+TEST_UID = 1999600000
+
+# Links added and deleted in order. Covers exact and reversed duplicates, section and range equivalents,
+# more precise links, and the updates to existing links that `Link._pre_save()` makes.
+OPERATIONS = [
+    ("add", {"refs": [TITLE + " 1:1", "Genesis 1:1"], "type": ""}),
+    ("add", {"refs": [TITLE + " 1:1", "Genesis 1:1"], "type": ""}),
+    ("add", {"refs": ["Genesis 1:1", TITLE + " 1:1"], "type": ""}),
+    ("add", {"refs": [TITLE + " 1:2", "Genesis 1"], "type": ""}),
+    ("add", {"refs": [TITLE + " 1:2", "Genesis 1:3"], "type": ""}),
+    ("add", {"refs": [TITLE + " 1:3", "Genesis 2:3"], "type": ""}),
+    ("add", {"refs": [TITLE + " 1:3", "Genesis 2"], "type": ""}),
+    ("add", {"refs": [TITLE + " 2:1", "Genesis 3:1"], "type": ""}),
+    ("add", {"refs": [TITLE + " 2:1", "Genesis 3:1"], "type": "quotation", "auto": True, "generated_by": "link_reconciler_test"}),
+    ("add", {"refs": [TITLE + " 2:2", "Genesis 3:2"], "type": ""}),
+    ("add", {"refs": [TITLE + " 2:2", "Genesis 3:2"], "type": "commentary"}),
+    ("add", {"refs": [TITLE + " 2:3", "Genesis 1:1-31"], "type": ""}),
+    ("add", {"refs": [TITLE + " 2:3", "Genesis 1"], "type": ""}),
+    ("add", {"refs": [TITLE + " 3:1", "Genesis 5:1"], "type": ""}),
+    ("add", {"refs": [TITLE + " 3:1", "Genesis 5"], "type": "", "generated_by": "link_reconciler_test", "_override_preciselink": True}),
+    ("delete", [TITLE + " 1:2", "Genesis 1:3"]),
+    ("add", {"refs": [TITLE + " 1:2", "Genesis 1:3"], "type": ""}),
+    ("delete", [TITLE + " 1:1", "Genesis 1:1"]),
+]
+
+
+def delete_links():
+    LinkSet(Ref(TITLE)).delete()
+    db.history.delete_many({"user": TEST_UID})
+
+
+def link_set():
+    return sorted(
+        [(link.refs, link.type, getattr(link, "auto", False), getattr(link, "generated_by", None),
+          getattr(link, "expandedRefs0", None), getattr(link, "expandedRefs1", None), getattr(link, "availableLangs", None))
+         for link in LinkSet(Ref(TITLE))], key=str)
+
+
+def history():
+    return sorted([(h.rev_type, (h.old or {}).get("refs"), (h.new or {}).get("refs")) for h in HistorySet({"user": TEST_UID})], key=str)
+
+
+WRITE_METHODS = ("insert_one", "replace_one", "delete_one", "bulk_write", "insert_many")
+
+
+class TestLinkReconciler(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.teardown_class()
+        root = JaggedArrayNode()
+        root.add_primary_titles(TITLE, "בדיקת קישורים")
+        root.add_structure(["Chapter", "Verse"])
+        root.key = TITLE
+        Index({"schema": root.serialize(), "title": TITLE, "categories": ["Halakhah"]}).save()
+        Version({
+            "language": "en",
+            "title": TITLE,
+            "versionSource": "http://foobar.com",
+            "versionTitle": "Link Reconciler Test",
+            "chapter": [["one", "two", "three"], ["one", "two", "three"], ["one"]]
+        }).save()
+
+    @classmethod
+    def teardown_class(cls):
+        index = Index().load({"title": TITLE})
+        if index:
+            delete_links()
+            v = Version().load({"title": TITLE})
+            if v:
+                v.delete()
+            index.delete()
+
+    def setup_method(self):
+        delete_links()
+
+    def teardown_method(self):
+        delete_links()
+
+    def test_same_as_saving_one_at_a_time(self, monkeypatch):
+        for op, arg in OPERATIONS:
+            if op == "add":
+                try:
+                    tracker.add(TEST_UID, Link, dict(arg))
+                except DuplicateRecordError:
+                    pass
+            else:
+                tracker.delete(TEST_UID, Link, Link().load({"refs": sorted(arg)})._id)
+        expected_links, expected_history = link_set(), history()
+        delete_links()
+
+        writes = record_mongo_calls(monkeypatch, WRITE_METHODS)
+        reconciler = LinkReconciler(TEST_UID)
+        reconciler.load(Ref(TITLE))
+        for op, arg in OPERATIONS:
+            if op == "add":
+                try:
+                    reconciler.add(dict(arg))
+                except DuplicateRecordError:
+                    pass
+            else:
+                reconciler.delete(reconciler.find_one({"refs": sorted(arg)}))
+        assert writes == []
+        reconciler.flush()
+        monkeypatch.undo()
+
+        assert writes == [("links", "bulk_write"), ("history", "insert_many")]
+        assert link_set() == expected_links
+        assert history() == expected_history
+
+    def test_add_links_from_text(self, monkeypatch):
+        version = Version().load({"title": TITLE})
+        text = [["See (Genesis 1:1) and (Exodus 2:3)", "See (Leviticus 1:1)", "No citations"]]
+        writes = record_mongo_calls(monkeypatch, WRITE_METHODS)
+        links = add_links_from_text(Ref(TITLE), "en", text, version._id, TEST_UID)
+        monkeypatch.undo()
+        assert writes == [("links", "bulk_write"), ("history", "insert_many")]
+        assert sorted(link["refs"][1] for link in links) == ["Exodus 2:3", "Genesis 1:1", "Leviticus 1:1"]
+        assert len(LinkSet(Ref(TITLE))) == 3
+
+        # Rescanning removes the links that are no longer in the text, and keeps the others
+        text = [["See (Genesis 1:1)", "See (Leviticus 1:1)", "No citations"]]
+        assert add_links_from_text(Ref(TITLE), "en", text, version._id, TEST_UID) == []
+        assert sorted(link.refs for link in LinkSet(Ref(TITLE))) == [["Genesis 1:1", TITLE + " 1:1"], ["Leviticus 1:1", TITLE + " 1:2"]]
+        assert [h.rev_type for h in HistorySet({"user": TEST_UID}, sort=[("date", 1)])] == ["add link"] * 3 + ["delete link"]
+
+    def test_load_once_per_section(self, monkeypatch):
+        reconciler = LinkReconciler(TEST_UID)
+        reconciler.load(Ref(TITLE + " 1"))
+        queries = record_mongo_calls(monkeypatch, ("find",))
+        reconciler.load(Ref(TITLE + " 1:2"))
+        monkeypatch.undo()
+        assert ("links", "find") not in queries
+
+    def test_query_answered_by_the_database(self):
+        reconciler = LinkReconciler(TEST_UID)
+        reconciler.load(Ref(TITLE))
+        link = reconciler.add({"refs": [TITLE + " 1:1", "Genesis 1:1"], "type": ""})
+        # the pending link is written first, so the database has it
+        found = reconciler.find({"refs": {"$in": [TITLE + " 1:1"]}})
+        assert [l.refs for l in found] == [link.refs]
+        assert reconciler.find_one({"refs": link.refs}) is found[0]
+
+    def test_flush_stands_in_for_the_link_subscribers(self):
+        subscribers = {callback.__name__ for action in ("save", "delete") for callback in abstract.deps.get((Link, action, None), [])}
+        assert subscribers == set(LinkReconciler.link_subscribers)
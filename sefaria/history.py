@@ -9,6 +9,14 @@ from bson.code import Code
 
 from sefaria.model import *
 from sefaria.system.database import db
+try:
+    from sefaria.settings import HISTORY_CHECKPOINT_EVERY
+except ImportError:
+    HISTORY_CHECKPOINT_EVERY = 100
+try:
+    from sefaria.settings import HISTORY_CHECKPOINT_PATCH_BYTES
+except ImportError:
+    HISTORY_CHECKPOINT_PATCH_BYTES = 64 * 1024
 
 dmp = diff_match_patch()
 
@@ -164,18 +172,97 @@ def get_maximal_collapsed_activity(query={}, page_size=100, page=1, filter_type=
 def text_at_revision(tref, version, lang, revision):
     """
     Returns the state of a text (identified by ref/version/lang) at revision number 'revision'
+
+    Starts from the earliest checkpoint at or after 'revision' (see `save_revision_checkpoints()`) when there is one,
+    and otherwise from the current text, and applies the revert patches of the later revisions, latest first.
     """
-    changes = db.history.find({"ref": tref, "version": version, "language": lang}).sort([['revision', -1]])
-    current = TextChunk(Ref(tref), lang, version)
-    text = str(current.text)  # needed?
+    query = {"ref": tref, "version": version, "language": lang}
+    checkpoint = None
+    if db.history.find_one(dict(query, revision=revision), {"_id": 1}):  # an unknown revision reverts every change
+        checkpoint = db.history_checkpoints.find_one(dict(query, revision={"$gte": revision}), sort=[("revision", 1)])
+
+    if checkpoint:
+        text = checkpoint["text"]
+        changes = db.history.find(dict(query, revision={"$gt": revision, "$lte": checkpoint["revision"]})).sort([['revision', -1]])
+    else:
+        changes = db.history.find(query).sort([['revision', -1]])
+        current = TextChunk(Ref(tref), lang, version)
+        text = str(current.text)  # needed?
 
     for r in changes:
-        if r["revision"] == revision: break
+        if r.get("revision") == revision: break
         patch = dmp.patch_fromText(r["revert_patch"])
         text = dmp.patch_apply(patch, text)[0]
 
     return text
 
+
+def save_revision_checkpoints(tref, version, lang, every=None, patch_bytes=None):
+    """
+    Saves the text of a segment (identified by ref/version/lang) at every `every` revisions, and at revisions whose
+    revert patches add up to `patch_bytes` since the previous checkpoint, so that `text_at_revision()` applies
+    about that many patches at most.
+    Only the revisions after the latest checkpoint are considered, so this can be rerun as revisions are added.
+    Edits save the text before logging their revision, so the revisions considered are those logged before the text is
+    read, and nothing is saved if a revision is logged by the time the checkpoints are ready, since the text read may
+    include it.  The segment is checkpointed on a later run.
+    :return: the number of checkpoints saved
+    """
+    every = every or HISTORY_CHECKPOINT_EVERY
+    patch_bytes = patch_bytes or HISTORY_CHECKPOINT_PATCH_BYTES
+    query = {"ref": tref, "version": version, "language": lang}
+    latest = db.history_checkpoints.find_one(query, sort=[("revision", -1)])
+    numbered = {"$gt": latest["revision"]} if latest else {"$ne": None}
+    read_at = datetime.now()
+    text = str(TextChunk(Ref(tref), lang, version).text)
+    changes = list(db.history.find(dict(query, revision=numbered, date={"$lt": read_at}), {"revision": 1, "revert_patch": 1}).sort([['revision', -1]]))
+
+    marked = set()
+    count, size = 0, 0
+    for r in reversed(changes):
+        count += 1
+        size += len(r["revert_patch"])
+        if count >= every or size >= patch_bytes:
+            marked.add(r["revision"])
+            count, size = 0, 0
+    if not marked:
+        return 0
+
+    checkpoints = []
+    for r in changes:
+        if r["revision"] in marked:
+            checkpoints.append(dict(query, revision=r["revision"], text=text, date=datetime.now()))
+        text = dmp.patch_apply(dmp.patch_fromText(r["revert_patch"]), text)[0]
+    if db.history.find_one(dict(query, revision={"$gt": changes[0]["revision"]}), {"_id": 1}):
+        return 0
+    db.history_checkpoints.insert_many(checkpoints)
+    return len(checkpoints)
+
+
+def revision_checkpoint_candidates(min_revisions, min_patch_bytes=None, regex=None):
+    """
+    Yields (ref, version, language) for each segment with at least `min_revisions` numbered revisions,
+    or with revert patches that add up to at least `min_patch_bytes`
+    :param regex: optional. only segments whose refs match it
+    """
+    match = {"revision": {"$ne": None}, "version": {"$exists": True}}
+    if regex:
+        match["ref"] = {"$regex": regex}
+    enough = [{"count": {"$gte": min_revisions}}]
+    if min_patch_bytes:
+        enough.append({"bytes": {"$gte": min_patch_bytes}})
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"ref": "$ref", "version": "$version", "language": "$language"},
+            "count": {"$sum": 1},
+            "bytes": {"$sum": {"$strLenBytes": {"$ifNull": ["$revert_patch", ""]}}},
+        }},
+        {"$match": {"$or": enough}},
+    ]
+    for group in db.history.aggregate(pipeline, allowDiskUse=True):
+        yield group["_id"]["ref"], group["_id"]["version"], group["_id"]["language"]
+
 '''
 def next_revision_num():
     """
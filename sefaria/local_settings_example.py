@@ -166,6 +166,7 @@ SEARCH_URL = "http://localhost:9200"
 SEARCH_INDEX_ON_SAVE = False  # Whether to send texts and source sheet to Search Host for indexing after save
 SEARCH_INDEX_NAME_TEXT = 'text'  # name of the ElasticSearch index to use
 SEARCH_INDEX_NAME_SHEET = 'sheet'
+SEARCH_REINDEX_PROCESSES = 1  # Number of processes a full text reindex is split between
 
 # Node Server
 USE_NODE = False
@@ -202,6 +203,11 @@ VARNISH_ADM_ADDR = "localhost:6082" # And this one doesn't
 VARNISH_HOST = "localhost"
 VARNISH_FRNT_PORT = 8040
 VARNISH_SECRET = "/etc/varnish/secret"
+# Purges and bans are collected for this many seconds, then sent together from a background thread.
+# 0 sends them on every save, from the request thread.
+VARNISH_INVALIDATION_WINDOW = 0.5
+VARNISH_PURGE_CONCURRENCY = 8  # Number of purges sent at once
+VARNISH_MAX_SECTIONS_PER_BAN = 50  # Past this many sections of a book in one window, the whole book is banned
 # Use ESI for user box in header.
 USE_VARNISH_ESI = False
 
@@ -215,6 +221,57 @@ DISABLE_AUTOCOMPLETER = False
 # Turns on loading of machine learning models to run linker
 ENABLE_LINKER = False
 
+# Bounds for the in-process Ref instance cache. None means unbounded.
+# REF_CACHE_POLICY is "lru" or "2q" (2q resists being flushed by one-off scans such as reindexing)
+REF_CACHE_MAX_ENTRIES = None
+REF_CACHE_MAX_BYTES = None
+REF_CACHE_POLICY = "lru"
+
+# Query links and sheets by integer ref ordinals instead of regexes. Run scripts/migrations/backfill_ref_ordinals.py first.
+USE_REF_ORDINAL_QUERIES = False
+
+# Directory where the title automata used to find refs in text are saved, so that other processes load them instead of building them.
+# None builds them in every process.
+TITLE_AUTOMATON_DIR = None
+
+# Directory where a snapshot of the library's indexes and TOC is saved on startup, for processes started later to load
+# instead of rebuilding them.  Snapshots are keyed by markers of changes to the index and category data, which saves
+# through the model update, so a stale one isn't loaded.  Snapshots are signed with SECRET_KEY, and only used if it's set.
+# See sefaria/model/library_snapshot.py.  None always rebuilds.
+LIBRARY_SNAPSHOT_DIR = None
+
+# Bounds of the per-process in-memory cache (sefaria.system.cache.in_memory_cache).  Least recently used entries are evicted past either.
+IN_MEMORY_CACHE_MAX_ENTRIES = 10000
+IN_MEMORY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# public_user_data() summaries are kept in the default django cache for PUBLIC_USER_DATA_CACHE_TIMEOUT seconds, and in a
+# per-process tier of up to PUBLIC_USER_DATA_CACHE_MAX_ENTRIES for PUBLIC_USER_DATA_LOCAL_TIMEOUT seconds
+PUBLIC_USER_DATA_CACHE_TIMEOUT = 60 * 60 * 24
+PUBLIC_USER_DATA_LOCAL_TIMEOUT = 60
+PUBLIC_USER_DATA_CACHE_MAX_ENTRIES = 10000
+
+# Text history records are saved in batches of HISTORY_BATCH_SIZE.  Edits that change many segments have their diffs
+# computed in a pool of HISTORY_DIFF_WORKERS processes, started on the first such edit and kept for later ones;
+# 0 computes them in the request's process.
+HISTORY_BATCH_SIZE = 1000
+HISTORY_DIFF_WORKERS = 0
+
+# manage.py build_revision_checkpoints saves a segment's text every HISTORY_CHECKPOINT_EVERY revisions, or once the revert
+# patches since the last checkpoint add up to HISTORY_CHECKPOINT_PATCH_BYTES, so text_at_revision() needn't replay them all
+HISTORY_CHECKPOINT_EVERY = 100
+HISTORY_CHECKPOINT_PATCH_BYTES = 64 * 1024
+
+# RecommendationEngine reads the candidates of segments from the recommendation_candidates collection, built with
+# manage.py build_recommendation_index, and link and sheet changes queue the refs to update with --update
+USE_RECOMMENDATION_INDEX = False
+
+# /api/related runs its lookups concurrently, on at most FAN_OUT_MAX_WORKERS threads per process at a time.
+# Past that, lookups run one after another on the request's thread.
+# A lookup that takes longer than its timeout (seconds) is left out of the response, which is then marked with an X-Related-Partial header
+FAN_OUT_MAX_WORKERS = 16
+RELATED_API_TIMEOUT = 10
+RELATED_API_SOURCE_TIMEOUTS = {}  # e.g. {"webpages": 2, "media": 2}
+
 # Caching with Cloudflare
 CLOUDFLARE_ZONE = ""
 CLOUDFLARE_EMAIL = ""
@@ -227,6 +284,8 @@ MULTISERVER_REDIS_PORT = 6379
 MULTISERVER_REDIS_DB = 0
 MULTISERVER_REDIS_EVENT_CHANNEL = "msync"   # Message queue on Redis
 MULTISERVER_REDIS_CONFIRM_CHANNEL = "mconfirm"   # Message queue on Redis
+MULTISERVER_LISTENER_THREAD = True   # Apply events from a thread in each worker as they arrive. False applies them between requests.
+MULTISERVER_EVENT_LOG_LENGTH = 1000   # Number of recent events kept in Redis, for servers that missed them
 
 # OAUTH these fields dont need to be filled in. they are only required for oauth2client to __init__ successfully
 GOOGLE_OAUTH2_CLIENT_ID = ""
@@ -137,9 +137,7 @@ class AbstractMongoRecord(object):
             notify(self, "save", orig_vals=self.pkeys_orig_values, is_new=is_new_obj)
 
         # Set new values as pkey_orig_values so that future changes will be caught
-        if self.track_pkeys:
-            for pkey in self.pkeys:
-                self.pkeys_orig_values[pkey] = getattr(self, pkey, None)
+        self._set_pkeys()
 
         return self
 
@@ -369,7 +369,7 @@ class TocTree(object):
         del self._path_hash[tuple(toc_node.categories + [toc_node.primary_title()])]
         toc_node.detach()
 
-    def update_title(self, index, old_ref=None, recount=True):
+    def update_title(self, index, old_ref=None, recount=True, refresh=True):
         title = old_ref or index.title
         node = self.lookup(index.categories, title)
 
@@ -380,7 +380,8 @@ class TocTree(object):
             except BookNameError:
                 logger.warning("Failed to find VersionState for {} in TocTree.update_title()".format(title))
                 return
-            vs.refresh()
+            if refresh:
+                vs.refresh()
             # sn = vs.state_node(index.nodes)
             self._vs_lookup[title] = {
                 "first_section_ref": vs.first_section_ref,
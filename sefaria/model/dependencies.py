@@ -2,10 +2,11 @@
 dependencies.py -- list cross model dependencies and subscribe listeners to changes.
 """
 
-from . import abstract, link, note, history, schema, text, layer, version_state, timeperiod, garden, notification, collection, library, category, ref_data, user_profile, manuscript, topic, place
+from . import abstract, link, ref_ordinal, library_snapshot, note, history, schema, text, layer, version_state, timeperiod, garden, notification, collection, library, category, ref_data, user_profile, manuscript, topic, place
 
 from .abstract import subscribe, cascade, cascade_to_list, cascade_delete, cascade_delete_to_list
 import sefaria.system.cache as scache
+from sefaria import recommendation_index
 
 # Index Save / Create
 subscribe(text.process_index_change_in_core_cache,                      text.Index, "save")
@@ -19,6 +20,7 @@ subscribe(text.process_index_title_change_in_core_cache,                text.Ind
 subscribe(text.process_index_title_change_in_versions,                  text.Index, "attributeChange", "title")
 subscribe(version_state.process_index_title_change_in_version_state,    text.Index, "attributeChange", "title")
 subscribe(link.process_index_title_change_in_links,                     text.Index, "attributeChange", "title")
+subscribe(ref_ordinal.process_index_title_change_in_ref_ordinals,       text.Index, "attributeChange", "title")
 subscribe(note.process_index_title_change_in_notes,                     text.Index, "attributeChange", "title")
 subscribe(history.process_index_title_change_in_history,                text.Index, "attributeChange", "title")
 subscribe(text.process_index_title_change_in_dependant_records,         text.Index, "attributeChange", "title")
@@ -68,6 +70,13 @@ subscribe(cascade(notification.GlobalNotificationSet, "content.version"), text.V
 subscribe(cascade_delete(notification.GlobalNotificationSet, "content.version", "versionTitle"),   text.Version, "delete")
 
 
+# Recommendation index
+subscribe(recommendation_index.process_link_change_in_recommendation_index, link.Link, "save")
+subscribe(recommendation_index.process_link_change_in_recommendation_index, link.Link, "delete")
+subscribe(recommendation_index.process_version_state_change_in_segment_offsets, version_state.VersionState, "save")
+subscribe(recommendation_index.process_version_state_change_in_segment_offsets, version_state.VersionState, "delete")
+
+
 # Note Delete
 subscribe(layer.process_note_deletion_in_layer,                         note.Note, "delete")
 
@@ -124,6 +133,18 @@ subscribe(text.reset_simple_term_mapping,                                   cate
 subscribe(text.reset_simple_term_mapping,                                   category.Category, "save")
 '''
 
+# Library snapshots
+subscribe(library_snapshot.bump_snapshot_generation,                    text.Index, "save")
+subscribe(library_snapshot.bump_snapshot_generation,                    text.Index, "delete")
+subscribe(library_snapshot.bump_snapshot_generation,                    category.Category, "save")
+subscribe(library_snapshot.bump_snapshot_generation,                    category.Category, "delete")
+subscribe(library_snapshot.bump_snapshot_generation,                    version_state.VersionState, "save")
+subscribe(library_snapshot.bump_snapshot_generation,                    version_state.VersionState, "delete")
+subscribe(library_snapshot.bump_snapshot_generation,                    collection.Collection, "save")
+subscribe(library_snapshot.bump_snapshot_generation,                    collection.Collection, "delete")
+subscribe(library_snapshot.process_link_change_in_library_snapshot,     link.Link, "save")
+subscribe(library_snapshot.process_link_change_in_library_snapshot,     link.Link, "delete")
+
 # todo: notes? reviews?
 # todo: Scheme name change in Index
 # todo: term change in nodes
@@ -18,54 +18,105 @@ Writes to MongoDB Collection: history
 
 """
 
+import multiprocessing
+import os
+import threading
 import regex as re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from diff_match_patch import diff_match_patch
 dmp = diff_match_patch()
 
 from . import abstract as abst
 from sefaria.system.database import db
+from sefaria.system.exceptions import InputError
+from sefaria.utils.util import text_diffs as _text_diffs
+try:
+    from sefaria.settings import HISTORY_BATCH_SIZE
+except ImportError:
+    HISTORY_BATCH_SIZE = 1000
+try:
+    from sefaria.settings import HISTORY_DIFF_WORKERS
+except ImportError:
+    HISTORY_DIFF_WORKERS = 0
+
+HISTORY_PARALLEL_MIN_CHANGES = 1000  # fewer changed segments than this are diffed in process
 
 
 def log_text(user, action, oref, lang, vtitle, old_text, new_text, **kwargs):
+    """
+    Logs each segment of `oref` that differs between `old_text` and `new_text`, which may be jagged arrays.
+    When there are many changed segments, their diffs are computed in HISTORY_DIFF_WORKERS processes,
+    and the records are saved in batches of HISTORY_BATCH_SIZE.
+    """
+    changes = list(_changed_segments(oref, old_text, new_text))
+    if HISTORY_DIFF_WORKERS > 1 and len(changes) >= HISTORY_PARALLEL_MIN_CHANGES:
+        chunksize = max(1, len(changes) // (HISTORY_DIFF_WORKERS * 4))
+        _save_text_records(user, action, lang, vtitle, changes, _diff_executor().map(_text_diffs, [c[1:] for c in changes], chunksize=chunksize), **kwargs)
+    else:
+        _save_text_records(user, action, lang, vtitle, changes, map(_text_diffs, [c[1:] for c in changes]), **kwargs)
+
+
+_diff_executor_lock = threading.Lock()
+_diff_executors = {}  # (pid, workers) -> ProcessPoolExecutor
+
+
+def _diff_executor():
+    """
+    Returns the pool of HISTORY_DIFF_WORKERS processes that diffs are computed in, started on first use and kept for
+    later edits.  Its processes are spawned, since forking a process that has threads running isn't safe.
+    A forked process starts a pool of its own.
+    """
+    key = (os.getpid(), HISTORY_DIFF_WORKERS)
+    with _diff_executor_lock:
+        if key not in _diff_executors:
+            _diff_executors[key] = ProcessPoolExecutor(max_workers=HISTORY_DIFF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _diff_executors[key]
 
+
+def _changed_segments(oref, old_text, new_text):
+    """
+    Yields (ref, old segment, new segment) for each segment that changed, in the order they have always been logged in:
+    last segment first.
+    """
     if isinstance(new_text, list):
         if not isinstance(old_text, list):  # is this necessary? the TextChunk should handle it.
             old_text = [old_text]
         maxlength = max(len(old_text), len(new_text))
         for i in reversed(list(range(maxlength))):
-            subref = oref.subref(i + 1)
             subold = old_text[i] if i < len(old_text) else [] if isinstance(new_text[i], list) else ""
             subnew = new_text[i] if i < len(new_text) else [] if isinstance(old_text[i], list) else ""
-            log_text(user, action, subref, lang, vtitle, subold, subnew, **kwargs)
+            if subold == subnew:
+                continue
+            yield from _changed_segments(oref.subref(i + 1), subold, subnew)
         return
 
     if old_text == new_text:
         return
 
-    # create a patch that turns the new version back into the old
-    backwards_diff = dmp.diff_main(new_text, old_text)
-    patch = dmp.patch_toText(dmp.patch_make(backwards_diff))
-    # get html displaying edits in this change.
-    forwards_diff = dmp.diff_main(old_text, new_text)
-    dmp.diff_cleanupSemantic(forwards_diff)
-    diff_html = dmp.diff_prettyHtml(forwards_diff)
-
-    log = {
-        "ref": oref.normal(),
-        "version": vtitle,
-        "language": lang,
-        "diff_html": diff_html,
-        "revert_patch": patch,
-        "user": user,
-        "date": datetime.now(),
-        #"revision": next_revision_num(),
-        "message": kwargs.get("message", ""), # is this used?
-        "rev_type": "{} text".format(action),
-        "method": kwargs.get("method", "Site")
-    }
-
-    History(log).save()
+    yield oref, old_text, new_text
+
+
+def _save_text_records(user, action, lang, vtitle, changes, diffs, **kwargs):
+    records = []
+    for (oref, old_text, new_text), (patch, diff_html) in zip(changes, diffs):
+        records.append({
+            "ref": oref.normal(),
+            "version": vtitle,
+            "language": lang,
+            "diff_html": diff_html,
+            "revert_patch": patch,
+            "user": user,
+            "date": datetime.now(),
+            #"revision": next_revision_num(),
+            "message": kwargs.get("message", ""), # is this used?
+            "rev_type": "{} text".format(action),
+            "method": kwargs.get("method", "Site")
+        })
+        if len(records) >= HISTORY_BATCH_SIZE:
+            save_log_records(records)
+            records = []
+    save_log_records(records)
 
 
 def log_update(user, klass, old_dict, new_dict, **kwargs):
@@ -86,7 +137,41 @@ def log_add(user, klass, new_dict, **kwargs):
     return _log_general(user, kind, None, new_dict, rev_type, **kwargs)
 
 
+def log_record(user, klass, old_dict, new_dict, **kwargs):
+    """
+    Returns the history record that `log_add`, `log_update` or `log_delete` would save, without saving it.
+    Returns None for changes that aren't logged.  Save a batch of records with `save_log_records`.
+    """
+    kind = klass.history_noun
+    action = "add" if old_dict is None else "delete" if new_dict is None else "edit"
+    return _general_record(user, kind, old_dict, new_dict, "{} {}".format(action, kind), **kwargs)
+
+
+def save_log_records(records):
+    """
+    Saves a batch of history records, as returned by `log_record`, with one insert.
+    The records are checked and saved as `History(record).save()` would, without building a History for each.
+    :return: the number of records saved
+    """
+    records = [r for r in records if r]
+    keys = History.required_attrs + History.optional_attrs
+    for record in records:
+        missing = [attr for attr in History.required_attrs if attr not in record]
+        if missing:
+            raise InputError("History record is missing {}".format(", ".join(missing)))
+    if records:
+        db.history.insert_many([{k: r[k] for k in keys if k in r} for r in records], ordered=True)
+    return len(records)
+
+
 def _log_general(user, kind, old_dict, new_dict, rev_type, **kwargs):
+    log = _general_record(user, kind, old_dict, new_dict, rev_type, **kwargs)
+    if log is None:
+        return
+    return History(log).save()
+
+
+def _general_record(user, kind, old_dict, new_dict, rev_type, **kwargs):
     log = {
         #"revision": next_revision_num(),
         "user": user,
@@ -110,7 +195,7 @@ def _log_general(user, kind, old_dict, new_dict, rev_type, **kwargs):
     if kind == "index":
         log['title'] = new_dict["title"]
 
-    return History(log).save()
+    return log
 
 '''
 def next_revision_num():
@@ -179,6 +264,10 @@ def process_index_title_change_in_history(indx, **kwargs):
         h.ref = h.ref.replace(kwargs["old"], kwargs["new"], 1)
         h.save()
 
+    print("Cascading Text History Checkpoints {} to {}".format(kwargs['old'], kwargs['new']))
+    for c in db.history_checkpoints.find(construct_query('ref', queries), {"ref": 1}):
+        db.history_checkpoints.update_one({"_id": c["_id"]}, {"$set": {"ref": c["ref"].replace(kwargs["old"], kwargs["new"], 1)}})
+
     link_hist = HistorySet(construct_query("new.refs", queries), sort=[('new.refs', 1)])
     print("Cascading Link History {} to {}".format(kwargs['old'], kwargs['new']))
     for h in link_hist:
@@ -207,4 +296,5 @@ def process_version_title_change_in_history(ver, **kwargs):
         "version": kwargs["old"],
         "language": ver.language,
     }
-    db.history.update(query, {"$set": {"version": kwargs["new"]}}, upsert=False, multi=True)
\ No newline at end of file
+    db.history.update(query, {"$set": {"version": kwargs["new"]}}, upsert=False, multi=True)
+    db.history_checkpoints.update_many(query, {"$set": {"version": kwargs["new"]}})
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+library_snapshot.py
+Saves the structures that Library derives from the index and category collections - the index and title node maps and
+the TOC tree - so that a starting process can load them instead of building them.
+
+A snapshot is named by a key made of the snapshot format, a fingerprint of the code of the pickled classes, and cheap
+markers of changes to the collections the structures are built from: the number of documents and the largest _id of
+each, and a generation counter that saves and deletes of their records bump (see bump_snapshot_generation()).
+A process only loads a snapshot with its own key, so a snapshot of an older library or older code is never used.
+Scripts that write these collections directly, rather than through the model, should call bump_snapshot_generation().
+Snapshots are pickles, so the payload is signed with an HMAC of SECRET_KEY, and a snapshot that fails the check is
+ignored rather than unpickled.  Without a SECRET_KEY, snapshots aren't used.  The directory and the snapshots are only
+accessible to the user that wrote them.
+
+Writes to MongoDB Collection: library_snapshot_generation
+"""
+import glob
+import hashlib
+import hmac
+import io
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from sefaria.settings import SECRET_KEY
+from sefaria.system.database import db
+
+import structlog
+logger = structlog.get_logger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_ATTRIBUTES = ("_index_map", "_title_node_maps", "_index_title_maps", "_toc_tree")
+SNAPSHOT_KEEP = 3  # number of snapshots left in the directory, so that processes of a previous deploy can still load theirs
+
+# (collection, query, projection) of the data that the snapshot attributes are built from.  See Library._build_index_maps() and TocTree
+SNAPSHOT_SOURCES = (
+    ("index", {}, None),
+    ("category", {}, None),
+    ("vstate", {}, {"title": 1, "first_section_ref": 1, "flags": 1}),
+    ("links", {"is_first_comment": True}, {"first_comment_indexes": 1, "first_comment_section_ref": 1}),
+    ("groups", {"toc": {"$exists": True}}, None),
+)
+
+# Modules defining the classes that are pickled
+SNAPSHOT_MODULES = ("text.py", "schema.py", "category.py", "collection.py", "abstract.py")
+
+
+def content_markers():
+    """
+    :return: list of the number of documents and the largest _id in each of SNAPSHOT_SOURCES, and the generation
+    """
+    markers = []
+    for collection, query, projection in SNAPSHOT_SOURCES:
+        last = db[collection].find_one(query, {"_id": 1}, sort=[("_id", -1)])
+        markers.append([collection, db[collection].count_documents(query), str(last["_id"]) if last else None])
+    generation = db.library_snapshot_generation.find_one({"_id": "library"})
+    markers.append(["generation", generation["generation"] if generation else 0])
+    return markers
+
+
+def bump_snapshot_generation(*args, **kwargs):
+    """
+    Changes the key of the current library, so that snapshots from before a change to its data aren't loaded.
+    Subscribed to saves and deletes of the records in SNAPSHOT_SOURCES.
+    """
+    db.library_snapshot_generation.update_one({"_id": "library"}, {"$inc": {"generation": 1}}, upsert=True)
+
+
+def process_link_change_in_library_snapshot(l, **kwargs):
+    if getattr(l, "is_first_comment", False):
+        bump_snapshot_generation()
+
+
+def code_fingerprint():
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in SNAPSHOT_MODULES:
+        with open(os.path.join(directory, module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def snapshot_key():
+    markers = json.dumps(content_markers())
+    return hashlib.sha1("{}:{}:{}".format(SNAPSHOT_FORMAT_VERSION, code_fingerprint(), markers).encode("utf-8")).hexdigest()
+
+
+def snapshot_path(directory, key):
+    return os.path.join(directory, "library-{}.snapshot".format(key))
+
+
+def _signature(payload):
+    return hmac.new(SECRET_KEY.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+
+
+class _LibraryPickler(pickle.Pickler):
+    """
+    Pickles references to the library (e.g. TocTree._library) by name, so that they are restored as the live library
+    """
+    def __init__(self, file, lib):
+        super(_LibraryPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._lib = lib
+
+    def persistent_id(self, obj):
+        return "library" if obj is self._lib else None
+
+
+class _LibraryUnpickler(pickle.Unpickler):
+    def __init__(self, file, lib):
+        super(_LibraryUnpickler, self).__init__(file)
+        self._lib = lib
+
+    def persistent_load(self, pid):
+        if pid != "library":
+            raise pickle.UnpicklingError("Unknown persistent id {}".format(pid))
+        return self._lib
+
+
+def save_library_snapshot(lib, directory, key=None):
+    """
+    Writes a snapshot of `lib`, which should be fully built
+    :param key: optional. snapshot_key() of the data `lib` was built from
+    :return: path of the snapshot, or None without a SECRET_KEY
+    """
+    if not SECRET_KEY:
+        logger.warning("Not saving a library snapshot without a SECRET_KEY to sign it with")
+        return None
+    key = key or snapshot_key()
+    buffer = io.BytesIO()
+    _LibraryPickler(buffer, lib).dump({attr: getattr(lib, attr) for attr in SNAPSHOT_ATTRIBUTES})
+    payload = buffer.getvalue()
+    header = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "key": key,
+        "hmac": _signature(payload),
+        "size": len(payload),
+        "created": time.time(),
+    }
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    path = snapshot_path(directory, key)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)  # readable and writable by this user only
+    with os.fdopen(fd, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(payload)
+    os.replace(tmp_path, path)  # processes loading concurrently never see a partial file
+    _prune(directory, keep=SNAPSHOT_KEEP)
+    return path
+
+
+def load_library_snapshot(lib, directory, key=None):
+    """
+    Sets the snapshot attributes of `lib` from the current snapshot in `directory`, if there is one
+    :param key: optional. defaults to snapshot_key()
+    :return: True if a snapshot was loaded
+    """
+    if not SECRET_KEY:
+        return False
+    key = key or snapshot_key()
+    path = snapshot_path(directory, key)
+    try:
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            payload = f.read()
+    except (IOError, OSError, ValueError):
+        return False
+    if header.get("format") != SNAPSHOT_FORMAT_VERSION or header.get("key") != key:
+        logger.warning("Ignoring library snapshot {} with a different format or key".format(path))
+        return False
+    if not hmac.compare_digest(_signature(payload), str(header.get("hmac"))):
+        logger.error("Ignoring library snapshot {} with a bad signature".format(path))
+        return False
+    try:
+        state = _LibraryUnpickler(io.BytesIO(payload), lib).load()
+    except Exception as e:
+        logger.error("Failed to unpickle library snapshot {}: {}".format(path, e))
+        return False
+    for attr in SNAPSHOT_ATTRIBUTES:
+        setattr(lib, attr, state[attr])
+    return True
+
+
+def _prune(directory, keep):
+    try:
+        snapshots = sorted(glob.glob(os.path.join(directory, "library-*.snapshot")), key=os.path.getmtime, reverse=True)
+        for path in snapshots[keep:]:
+            os.remove(path)
+    except OSError:
+        pass  # pruned concurrently by another process
@@ -10,6 +10,11 @@ from sefaria.system.exceptions import DuplicateRecordError, InputError, BookName
 from sefaria.system.database import db
 from . import abstract as abst
 from . import text
+from . import ref_ordinal
+try:
+    from sefaria.settings import USE_REF_ORDINAL_QUERIES
+except ImportError:
+    USE_REF_ORDINAL_QUERIES = False
 
 import structlog
 logger = structlog.get_logger(__name__)
@@ -21,6 +26,8 @@ class Link(abst.AbstractMongoRecord):
     """
     collection = 'links'
     history_noun = 'link'
+    track_pkeys = True
+    pkeys = ["refs"]
 
     required_attrs = [
         "type",             # string of connection type
@@ -30,6 +37,8 @@ class Link(abst.AbstractMongoRecord):
     optional_attrs = [
         "expandedRefs0",    # list of refs corresponding to `refs.0`, but breaking ranging refs down into individual segments
         "expandedRefs1",    # list of refs corresponding to `refs.1`, but breaking ranging refs down into individual segments
+        "expandedOrdinals0", # sorted list of integer segment ordinals corresponding to `expandedRefs0`. see ref_ordinal.py
+        "expandedOrdinals1", # sorted list of integer segment ordinals corresponding to `expandedRefs1`
         "anchorText",       # string of dibbur hamatchil (largely depcrated) 
         "availableLangs",   # list of lists corresponding to `refs` showing languages available, e.g. [["he"], ["he", "en"]]  
         "highlightedWords", # list of strings to be highlighted when presenting a text as a connection
@@ -47,6 +56,11 @@ class Link(abst.AbstractMongoRecord):
         "displayedText"       # only for cases when type is `essay`: dictionary of en and he strings to be displayed
     ]
 
+    def _set_pkeys(self):
+        super(Link, self)._set_pkeys()
+        # a copy, so that changes made to `refs` in place are caught too
+        self.pkeys_orig_values["refs"] = list(self.pkeys_orig_values["refs"] or [])
+
     def _normalize(self):
         self.auto = getattr(self, 'auto', False)
         self.generated_by = getattr(self, "generated_by", None)
@@ -87,7 +101,22 @@ class Link(abst.AbstractMongoRecord):
             assert self.charLevelData[0]['versionTitle'] in [v['versionTitle'] for v in text.Ref(self.refs[0]).version_list()], 'Dictionaries in charLevelData should be in correspondence to the "refs" list'
         return True
 
-    def _pre_save(self):
+    def _pre_save(self, links=None):
+        """
+        :param links: optional. Where to look up, update and delete the other links that this link is checked against.
+        Must have `find_one(query)`, `update(link)` and `discard(link)`, like `sefaria.helper.link.LinkReconciler`.
+        Defaults to the database.
+        """
+        if getattr(self, "_id", None) is not None and "refs" not in self.pkeys_orig_values:
+            # Loaded without tracking its refs, e.g. with `Link().load_from_dict(d)`.  Take the saved refs from the db.
+            saved = db.links.find_one({"_id": self._id}, {"refs": 1})
+            self.pkeys_orig_values["refs"] = list(saved["refs"]) if saved else []
+
+        if links is None:
+            find_one, update, discard = Link().load, Link.save, Link.delete
+        else:
+            find_one, update, discard = links.find_one, links.update, links.discard
+
         if getattr(self, "_id", None) is None:
             # Don't bother saving a connection that already exists, or that has a more precise link already
             if self.refs != sorted(self.refs):
@@ -98,7 +127,7 @@ class Link(abst.AbstractMongoRecord):
                     self.versions = self.versions[::-1]
                     self.displayedText = self.displayedText[::-1]
             self.refs = sorted(self.refs)  # make sure ref order is deterministic
-            samelink = Link().load({"refs": self.refs})
+            samelink = find_one({"refs": self.refs})
 
             if not samelink:
                 #check for samelink section level vs ranged ref
@@ -107,26 +136,26 @@ class Link(abst.AbstractMongoRecord):
                 section0 = oref0.section_ref()
                 section1 = oref1.section_ref()
                 if oref0.is_range() and oref0.all_segment_refs() == section0.all_segment_refs():
-                    samelink = Link().load({"$and": [{"refs": section0.normal()}, {"refs": self.refs[1]}]})
+                    samelink = find_one({"$and": [{"refs": section0.normal()}, {"refs": self.refs[1]}]})
                 elif oref0.is_section_level():
                     ranged0 = text.Ref(f"{oref0.all_segment_refs()[0].normal()}-{oref0.all_segment_refs()[-1].normal()}") #without nomalizing the first ref can have '<d>' which cause invalid ranged ref
-                    samelink = Link().load({"$and": [{"refs": ranged0.normal()}, {"refs": self.refs[1]}]})
+                    samelink = find_one({"$and": [{"refs": ranged0.normal()}, {"refs": self.refs[1]}]})
                 elif oref1.is_range() and oref1.all_segment_refs() == section1.all_segment_refs():
-                    samelink = Link().load({"$and": [{"refs": section1.normal()}, {"refs": self.refs[0]}]})
+                    samelink = find_one({"$and": [{"refs": section1.normal()}, {"refs": self.refs[0]}]})
                 elif oref1.is_section_level():
                     ranged1 = text.Ref(f"{oref1.all_segment_refs()[0].normal()}-{oref1.all_segment_refs()[-1].normal()}")
-                    samelink = Link().load({"$and": [{"refs": ranged1.normal()}, {"refs": self.refs[0]}]})
+                    samelink = find_one({"$and": [{"refs": ranged1.normal()}, {"refs": self.refs[0]}]})
 
             if samelink:
                 if hasattr(self, 'score') and hasattr(self, 'charLevelData'):
                     samelink.score = self.score
                     samelink.charLevelData = self.charLevelData
-                    samelink.save()
+                    update(samelink)
                     raise DuplicateRecordError("Updated existing link with the new score and charLevelData data")
 
                 elif not self.auto and self.type and not samelink.type:
                     samelink.type = self.type
-                    samelink.save()
+                    update(samelink)
                     raise DuplicateRecordError("Updated existing link with new type: {}".format(self.type))
 
                 elif self.auto and not samelink.auto:
@@ -135,21 +164,21 @@ class Link(abst.AbstractMongoRecord):
                     samelink.source_text_oid = self.source_text_oid
                     samelink.type = self.type
                     samelink.refs = self.refs  #in case the refs are reversed. switch them around
-                    samelink.save()
+                    update(samelink)
                     raise DuplicateRecordError("Updated existing link with auto generation data {} - {}".format(self.refs[0], self.refs[1]))
                 else:
                     raise DuplicateRecordError("Link already exists {} - {}. Try editing instead.".format(self.refs[0], self.refs[1]))
 
             else:
                 #find a potential link that already has a more precise ref of either of this link's refs.
-                preciselink = Link().load(
+                preciselink = find_one(
                     {'$and':[text.Ref(self.refs[0]).ref_regex_query(), text.Ref(self.refs[1]).ref_regex_query()]}
                 )
 
                 if preciselink:
                     # logger.debug("save_link: More specific link exists: " + link["refs"][1] + " and " + preciselink["refs"][1])
                     if getattr(self, "_override_preciselink", False):
-                        preciselink.delete()
+                        discard(preciselink)
                         self.generated_by = self.generated_by+'_preciselink_override'
                         #and the new link will be posted (supposedly)
                     else:
@@ -180,8 +209,12 @@ class Link(abst.AbstractMongoRecord):
         self.availableLangs = [lang_list(ref) for ref in self.refs]
 
     def _set_expanded_refs(self):
-        self.expandedRefs0 = [oref.normal() for oref in text.Ref(self.refs[0]).all_segment_refs()]
-        self.expandedRefs1 = [oref.normal() for oref in text.Ref(self.refs[1]).all_segment_refs()]
+        segment_refs0 = text.Ref(self.refs[0]).all_segment_refs()
+        segment_refs1 = text.Ref(self.refs[1]).all_segment_refs()
+        self.expandedRefs0 = [oref.normal() for oref in segment_refs0]
+        self.expandedRefs1 = [oref.normal() for oref in segment_refs1]
+        self.expandedOrdinals0 = ref_ordinal.segment_ordinals(segment_refs0)
+        self.expandedOrdinals1 = ref_ordinal.segment_ordinals(segment_refs1)
 
     def ref_opposite(self, from_ref, as_tuple=False):
         """
@@ -215,13 +248,22 @@ class Link(abst.AbstractMongoRecord):
 class LinkSet(abst.AbstractMongoSet):
     recordClass = Link
 
-    def __init__(self, query_or_ref={}, page=0, limit=0):
+    def __init__(self, query_or_ref={}, page=0, limit=0, use_ordinals=None):
         '''
         LinkSet can be initialized with a query dictionary, as any other MongoSet.
         It can also be initialized with a :py:class: `sefaria.text.Ref` object,
         and will use the :py:meth: `sefaria.text.Ref.regex()` method to return the set of Links that refer to that Ref or below.
         :param query_or_ref: A query dict, or a :py:class: `sefaria.text.Ref` object
+        :param use_ordinals: When initialized with a Ref, query the `expandedOrdinals` fields with a numeric range instead
+        of regexes, when the Ref allows it. Defaults to the USE_REF_ORDINAL_QUERIES setting.
         '''
+        if use_ordinals is None:
+            use_ordinals = USE_REF_ORDINAL_QUERIES
+        if use_ordinals and isinstance(query_or_ref, text.Ref):
+            query = ref_ordinal.ordinal_query(query_or_ref, ["expandedOrdinals0", "expandedOrdinals1"])
+            if query is not None:
+                super(LinkSet, self).__init__(query, page, limit)
+                return
         try:
             regex_list = query_or_ref.regex(as_list=True)
             ref_clauses = [{"expandedRefs0": {"$regex": r}} for r in regex_list]
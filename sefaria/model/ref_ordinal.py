@@ -0,0 +1,238 @@
+"""
+ref_ordinal.py
+Integer ordinals for segment refs, so that "records that reference this Ref, or anything inside it" can be found with an
+indexed numeric range query instead of a list of anchored regexes.
+
+An ordinal packs the position of a segment into one int64:
+    [ node ordinal (NODE_BITS) | sections, one bit field per depth of the node (SECTION_BITS total) ]
+Node ordinals are handed out in catalog order (see assign_catalog_ordinals()) and then persisted, so ordinals that are
+already stored stay valid when the TOC is reordered. Within a node, the sections are packed most significant first,
+which makes every Ref a contiguous ordinal range that contains exactly the segments inside it.
+
+A node is marked `incomplete` when a section number too large for its bit field was seen. Queries on incomplete or
+unknown nodes return None so that callers fall back to the regex query.
+
+Writes to MongoDB Collection: ref_ordinal_nodes
+"""
+import re
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import abstract as abst
+from sefaria.system.database import db
+from sefaria.system.multiserver.coordinator import server_coordinator
+from sefaria.settings import MULTISERVER_ENABLED
+
+import structlog
+logger = structlog.get_logger(__name__)
+
+
+NODE_BITS = 20
+SECTION_BITS = 43
+SECTION_BITS_BY_DEPTH = {
+    1: (43,),
+    2: (20, 23),
+    3: (13, 15, 15),
+    4: (10, 11, 11, 11),
+    5: (8, 8, 9, 9, 9),
+}
+COUNTER_KEY = "__next_ordinal__"
+
+
+class RefOrdinalNode(abst.AbstractMongoRecord):
+    """
+    The ordinal assigned to one JaggedArrayNode
+    """
+    collection = 'ref_ordinal_nodes'
+    required_attrs = [
+        "node",         # string. node key, see node_key()
+        "ordinal",      # int. position of the node in the catalog when it was assigned
+    ]
+    optional_attrs = [
+        "incomplete",   # bool. True if some ref in this node could not be encoded
+    ]
+
+
+class RefOrdinalNodeSet(abst.AbstractMongoSet):
+    recordClass = RefOrdinalNode
+
+
+def node_key(index_node):
+    return index_node.full_title("en") + ("<d>" if index_node.is_default() else "")
+
+
+def is_orderable_node(index_node):
+    from .schema import JaggedArrayNode
+    return isinstance(index_node, JaggedArrayNode) and not index_node.is_virtual and index_node.depth in SECTION_BITS_BY_DEPTH
+
+
+class RefOrdinalMap(object):
+    """
+    In-process cache of the ref_ordinal_nodes collection.  Changes to existing nodes reset the cache of every server.
+    """
+    def __init__(self):
+        self._nodes = None
+
+    def reset(self):
+        self._nodes = None
+
+    def _load(self):
+        if self._nodes is None:
+            self._nodes = {n["node"]: n for n in db.ref_ordinal_nodes.find({"node": {"$ne": COUNTER_KEY}}, {"_id": 0})}
+        return self._nodes
+
+    def get(self, key, create=False):
+        """
+        :return: dict with keys `node`, `ordinal` and optionally `incomplete`, or None if the node has no ordinal and
+        `create` is False
+        """
+        nodes = self._load()
+        node = nodes.get(key)
+        if node is None:
+            # another process may have assigned it since we loaded
+            node = db.ref_ordinal_nodes.find_one({"node": key}, {"_id": 0})
+            if node is None and create:
+                node = self._create(key)
+            if node is not None:
+                nodes[key] = node
+        return node
+
+    def _create(self, key):
+        counter = db.ref_ordinal_nodes.find_one_and_update({"node": COUNTER_KEY}, {"$inc": {"ordinal": 1}}, upsert=True, return_document=ReturnDocument.AFTER)
+        ordinal = counter["ordinal"]
+        if ordinal >= 2 ** NODE_BITS:
+            raise OverflowError("Ran out of ref ordinals for node {}".format(key))
+        try:
+            db.ref_ordinal_nodes.insert_one({"node": key, "ordinal": ordinal})
+        except DuplicateKeyError:
+            pass  # lost a race to another process. use its ordinal
+        return db.ref_ordinal_nodes.find_one({"node": key}, {"_id": 0})
+
+    def mark_incomplete(self, key):
+        db.ref_ordinal_nodes.update_one({"node": key}, {"$set": {"incomplete": True}})
+        node = self._load().get(key)
+        if node is not None:
+            node["incomplete"] = True
+        if MULTISERVER_ENABLED:
+            server_coordinator.publish_event("ref_ordinal_map", "reset")
+
+    def rename(self, old_prefix, new_prefix):
+        """
+        Keeps ordinals of an Index's nodes when the Index is renamed
+        """
+        for node in db.ref_ordinal_nodes.find({"node": {"$regex": "^" + re.escape(old_prefix) + "(,|<d>|$)"}}):
+            new_key = new_prefix + node["node"][len(old_prefix):]
+            db.ref_ordinal_nodes.update_one({"_id": node["_id"]}, {"$set": {"node": new_key}})
+        self.reset()
+        if MULTISERVER_ENABLED:
+            server_coordinator.publish_event("ref_ordinal_map", "reset")
+
+
+ref_ordinal_map = RefOrdinalMap()
+
+
+def _pack(sections, bits, pad):
+    """
+    :param pad: value used for levels beyond len(sections). 0 for the start of a range, None for the end
+    :return: int, or None if a section does not fit in its bit field
+    """
+    value = 0
+    for i, width in enumerate(bits):
+        if i < len(sections):
+            section = sections[i]
+            if section >= 2 ** width:
+                return None
+        else:
+            section = (2 ** width - 1) if pad is None else pad
+        value = (value << width) | section
+    return value
+
+
+def ordinal_range(oref, create=False):
+    """
+    :param oref: Ref
+    :param create: assign an ordinal to the node of `oref` if it does not have one yet
+    :return: (start, end) such that the ordinal of every segment inside `oref` is in [start, end], or None if `oref`
+    can't be represented as an ordinal range.
+    """
+    index_node = oref.index_node
+    if not is_orderable_node(index_node):
+        return None
+    key = node_key(index_node)
+    node = ref_ordinal_map.get(key, create=create)
+    if node is None or node.get("incomplete", False):
+        return None
+    bits = SECTION_BITS_BY_DEPTH[index_node.depth]
+    start = _pack(oref.sections, bits, 0)
+    end = _pack(oref.toSections, bits, None)
+    if start is None or end is None:
+        if create:
+            logger.warning("Marking ref ordinal node {} incomplete. {} doesn't fit".format(key, oref.normal()))
+            ref_ordinal_map.mark_incomplete(key)
+        return None
+    base = node["ordinal"] << SECTION_BITS
+    return base + start, base + end
+
+
+def segment_ordinals(orefs):
+    """
+    :param orefs: list of segment Refs
+    :return: sorted list of the ordinals of the Refs that can be encoded. Refs that can't be encoded have marked their
+    node incomplete, so queries on that node won't rely on ordinals.
+    """
+    ordinals = set()
+    for oref in orefs:
+        r = ordinal_range(oref, create=True)
+        if r is not None:
+            ordinals.add(r[0])
+    return sorted(ordinals)
+
+
+def expanded_ordinals(trefs):
+    """
+    :param trefs: list of trefs, as stored in `includedRefs`
+    :return: sorted list of segment ordinals of all segments in `trefs`
+    """
+    from .text import Ref
+    from sefaria.system.exceptions import InputError
+    orefs = []
+    for tref in trefs:
+        try:
+            orefs += Ref(tref).all_segment_refs()
+        except (InputError, IndexError, AssertionError):
+            continue
+    return segment_ordinals(orefs)
+
+
+def ordinal_query(oref, fields):
+    """
+    :param fields: list of fields that hold lists of segment ordinals
+    :return: query dict matching records where any of `fields` has a segment inside `oref`, or None if `oref` can't be
+    queried by ordinal
+    """
+    r = ordinal_range(oref)
+    if r is None:
+        return None
+    clauses = [{field: {"$elemMatch": {"$gte": r[0], "$lte": r[1]}}} for field in fields]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def assign_catalog_ordinals():
+    """
+    Assigns ordinals to every JaggedArrayNode in the library that doesn't have one yet, in catalog order.
+    """
+    from .text import library, Ref
+    indexes = []
+    for index in library.all_index_records():
+        try:
+            indexes += [(Ref(index.title).order_id(), index)]
+        except Exception:
+            continue
+    for _, index in sorted(indexes, key=lambda x: x[0]):
+        for leaf in index.nodes.get_leaf_nodes():
+            if is_orderable_node(leaf):
+                ref_ordinal_map.get(node_key(leaf), create=True)
+
+
+def process_index_title_change_in_ref_ordinals(indx, **kwargs):
+    ref_ordinal_map.rename(kwargs["old"], kwargs["new"])
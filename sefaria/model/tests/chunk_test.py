@@ -465,6 +465,37 @@ def test_complex_with_depth_2():
     pass
 
 
+def test_prefetch_matches_text_chunk():
+    orefs = [Ref(tref) for tref in [
+        "Rashi on Exodus 3", "Rashi on Exodus 4", "Rashi on Exodus 40", "Ramban on Exodus 3", "Genesis 1", "Genesis 50",
+        "Pesach Haggadah, Kadesh", "Pesach Haggadah, Kadesh 2", "Berakhot 2a", "Berakhot 10b", "Rashi on Berakhot 2a",
+        "Shulchan Arukh, Even HaEzer 1", "Genesis 1:3", "Genesis 1-2",
+    ]]
+    prefetch = TextChunkPrefetch(orefs)
+    # one query per language for each of the batchable indexes
+    assert prefetch.query_count == 2 * len({r.index.title for r in orefs if TextChunkPrefetch.is_batchable(r)})
+    for oref in orefs:
+        for lang in ("en", "he"):
+            expected = TextChunk(oref, lang)
+            actual = prefetch.get(oref, lang)
+            assert actual.text == expected.text, (oref.normal(), lang)
+            assert actual.is_merged == expected.is_merged
+            assert actual.sources == expected.sources
+            assert [v.versionTitle for v in actual._versions] == [v.versionTitle for v in expected._versions]
+
+
+def test_prefetch_splits_distant_sections():
+    class NarrowPrefetch(TextChunkPrefetch):
+        max_slice = 10
+
+    orefs = [Ref("Genesis 1"), Ref("Genesis 5"), Ref("Genesis 50")]
+    assert TextChunkPrefetch(orefs).query_count == 2
+    prefetch = NarrowPrefetch(orefs)
+    assert prefetch.query_count == 4
+    for oref in orefs:
+        assert prefetch.get(oref, "he").text == TextChunk(oref, "he").text
+
+
 def test_strip_imgs():
     text = "text with an image"
     image = "<img src='src.jpg' alt='image caption'>"
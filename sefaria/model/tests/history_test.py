@@ -0,0 +1,55 @@
+import pytest
+
+from sefaria.model import *
+from sefaria.model import history
+from sefaria.system.database import db
+
+TEST_UID = 1999500000
+
+
+def logged():
+    return [{k: v for k, v in h.items() if k not in ("_id", "date")} for h in db.history.find({"user": TEST_UID}).sort("_id", 1)]
+
+
+@pytest.fixture
+def clean_history():
+    db.history.delete_many({"user": TEST_UID})
+    yield
+    db.history.delete_many({"user": TEST_UID})
+
+
+class TestLogText(object):
+    old = [["one", "two", "three"], ["four"]]
+    new = [["one", "TWO", "three", "five"], ["four"], ["six"]]
+
+    def test_changed_segments_only(self, clean_history):
+        log_text(TEST_UID, "edit", Ref("Genesis"), "en", "Test Version", self.old, self.new, method="API")
+        records = logged()
+        assert [r["ref"] for r in records] == ["Genesis 3:1", "Genesis 1:4", "Genesis 1:2"]
+        patch, diff_html = history._text_diffs(("two", "TWO"))
+        assert records[2] == {
+            "ref": "Genesis 1:2",
+            "version": "Test Version",
+            "language": "en",
+            "diff_html": diff_html,
+            "revert_patch": patch,
+            "user": TEST_UID,
+            "message": "",
+            "rev_type": "edit text",
+            "method": "API",
+        }
+
+    def test_batches_and_workers(self, clean_history, monkeypatch):
+        log_text(TEST_UID, "edit", Ref("Genesis"), "en", "Test Version", self.old, self.new)
+        serial = logged()
+        db.history.delete_many({"user": TEST_UID})
+
+        monkeypatch.setattr(history, "HISTORY_BATCH_SIZE", 2)
+        monkeypatch.setattr(history, "HISTORY_DIFF_WORKERS", 2)
+        monkeypatch.setattr(history, "HISTORY_PARALLEL_MIN_CHANGES", 1)
+        log_text(TEST_UID, "edit", Ref("Genesis"), "en", "Test Version", self.old, self.new)
+        assert logged() == serial
+
+    def test_unchanged(self, clean_history):
+        log_text(TEST_UID, "edit", Ref("Genesis 1"), "en", "Test Version", ["one", "two"], ["one", "two"])
+        assert logged() == []
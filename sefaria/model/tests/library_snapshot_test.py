@@ -0,0 +1,53 @@
+import django
+django.setup()
+import pytest
+from sefaria.model import *
+from sefaria.model import library_snapshot
+from sefaria.model.text import Library
+from sefaria.model.library_snapshot import save_library_snapshot, load_library_snapshot, snapshot_key, bump_snapshot_generation
+
+
+@pytest.fixture(scope="module")
+def key():
+    return snapshot_key()
+
+
+class TestLibrarySnapshot:
+
+    def test_round_trip(self, tmpdir, key):
+        library.get_toc_tree()
+        save_library_snapshot(library, str(tmpdir), key)
+        lib = Library()
+        assert load_library_snapshot(lib, str(tmpdir), key)
+        assert set(lib._index_map.keys()) == set(library._index_map.keys())
+        assert set(lib._title_node_maps["he"].keys()) == set(library._title_node_maps["he"].keys())
+        assert lib._index_title_maps["en"]["Genesis"] == library._index_title_maps["en"]["Genesis"]
+        assert lib._toc_tree._library is lib
+        assert lib._toc_tree.get_serialized_toc() == library.get_toc_tree().get_serialized_toc()
+
+    def test_other_key_not_loaded(self, tmpdir, key):
+        save_library_snapshot(library, str(tmpdir), key)
+        assert not load_library_snapshot(Library(), str(tmpdir), "0" * 40)
+
+    def test_corrupt_snapshot_not_loaded(self, tmpdir, key):
+        path = save_library_snapshot(library, str(tmpdir), key)
+        with open(path, "r+b") as f:
+            f.seek(-10, 2)
+            f.write(b"0123456789")
+        assert not load_library_snapshot(Library(), str(tmpdir), key)
+
+    def test_unsigned_snapshot_not_loaded(self, tmpdir, key, monkeypatch):
+        save_library_snapshot(library, str(tmpdir), key)
+        monkeypatch.setattr(library_snapshot, "SECRET_KEY", "another secret")
+        assert not load_library_snapshot(Library(), str(tmpdir), key)
+
+    def test_key_is_stable(self, key):
+        assert snapshot_key() == key
+
+    def test_saves_change_key(self):
+        key = snapshot_key()
+        VersionState("Genesis").save()
+        assert snapshot_key() != key
+        key = snapshot_key()
+        bump_snapshot_generation()
+        assert snapshot_key() != key
@@ -6,6 +6,7 @@ import pytest
 import regex as re
 from sefaria.utils.hebrew import has_hebrew
 import sefaria.model as m
+from sefaria.model.title_automaton import TitleAutomaton
 
 
 
@@ -99,3 +100,24 @@ class Test_find_citation_in_text(object):
 
     def test_check_first(self):
         assert In('בבא מציעא פ"ד מ"ו, ועיין לעיל').looking_for('בבא מציעא').finds("Mishnah Bava Metzia 4:6")
+
+
+class Test_title_automaton(object):
+
+    @pytest.mark.parametrize(('s', 'lang'), [
+        ("See Genesis 2:1-Genesis 2:3 and Genesis Rabbah 1:1, also Shabbat 31a.", "en"),
+        ("Rashi on Genesis 1:1<br>Exodus, Leviticus. Not a title: Genesisx", "en"),
+        ('ובויקרא כ"ה (שמות ג, ד) ירושלמי כתובות (פרק א הלכה ב)', "he"),
+    ])
+    def test_matches_title_regex(self, s, lang):
+        for citing_only in (False, True):
+            expected = [(mt.group('title'), mt.start()) for mt in m.library.all_titles_regex(lang, citing_only=citing_only).finditer(s)]
+            assert list(m.library.all_titles_automaton(lang, citing_only=citing_only).finditer(s)) == expected
+
+    def test_save_and_load(self, tmpdir):
+        titles = m.library.full_title_list("en")
+        built = TitleAutomaton.cached(titles, str(tmpdir))
+        loaded = TitleAutomaton.cached(titles, str(tmpdir))
+        s = "Genesis 1:1, Exodus 2"
+        assert len(loaded) == len(built)
+        assert list(loaded.finditer(s)) == list(built.finditer(s))
@@ -0,0 +1,80 @@
+from sefaria.model import *
+from sefaria.model import ref_ordinal
+from sefaria.model.ref_ordinal import ordinal_range, ordinal_query, segment_ordinals, ref_ordinal_map
+
+
+def contains(outer, inner):
+    return outer[0] <= inner[0] and inner[1] <= outer[1]
+
+
+class TestOrdinalRange:
+
+    def test_containment(self):
+        chapter = ordinal_range(Ref("Genesis 1"), create=True)
+        verse = ordinal_range(Ref("Genesis 1:5"), create=True)
+        book = ordinal_range(Ref("Genesis"), create=True)
+        assert verse[0] == verse[1]
+        assert contains(chapter, verse)
+        assert contains(book, chapter)
+        assert not contains(chapter, ordinal_range(Ref("Genesis 2:1"), create=True))
+        assert not contains(book, ordinal_range(Ref("Exodus 1:1"), create=True))
+
+    def test_ranges(self):
+        spanning = ordinal_range(Ref("Genesis 1:30-2:3"), create=True)
+        assert contains(spanning, ordinal_range(Ref("Genesis 2:1"), create=True))
+        assert not contains(spanning, ordinal_range(Ref("Genesis 1:29"), create=True))
+        assert contains(ordinal_range(Ref("Rashi on Genesis 1"), create=True), ordinal_range(Ref("Rashi on Genesis 1:2:3"), create=True))
+        assert contains(ordinal_range(Ref("Berakhot 2a-3b"), create=True), ordinal_range(Ref("Berakhot 3a:4"), create=True))
+
+    def test_segment_ordinals_are_sorted_and_in_range(self):
+        oref = Ref("Genesis 3")
+        ordinals = segment_ordinals(oref.all_segment_refs())
+        r = ordinal_range(oref)
+        assert ordinals == sorted(ordinals)
+        assert len(ordinals) == len(oref.all_segment_refs())
+        assert all(r[0] <= o <= r[1] for o in ordinals)
+
+    def test_not_orderable(self):
+        assert ordinal_query(Ref("Jastrow, אב"), ["expandedOrdinals"]) is None
+
+
+class TestRefOrdinalMap:
+
+    def test_changes_reset_other_servers(self, monkeypatch):
+        published = []
+        monkeypatch.setattr(ref_ordinal, "MULTISERVER_ENABLED", True)
+        monkeypatch.setattr(ref_ordinal.server_coordinator, "publish_event", lambda *args: published.append(args))
+        ref_ordinal_map.rename("No Such Ordinal Title", "Another Ordinal Title")
+        assert published == [("ref_ordinal_map", "reset")]
+
+
+class TestOrdinalLinkSet:
+    refs = ["Genesis 1:30-2:3", "Shabbat 2a:1"]
+
+    @classmethod
+    def setup_class(cls):
+        LinkSet({"generated_by": "ordinal_tester"}).delete()
+        LinkSet({"refs": cls.refs}).delete()
+        cls.link = Link({"auto": True,
+                         "generated_by": "ordinal_tester",
+                         "type": "commentary",
+                         "refs": cls.refs})
+        cls.link.save()
+
+    @classmethod
+    def teardown_class(cls):
+        LinkSet({"generated_by": "ordinal_tester"}).delete()
+
+    def test_ordinals_saved(self):
+        link = Link().load({"generated_by": "ordinal_tester"})
+        assert len(link.expandedOrdinals0) == len(link.expandedRefs0)
+        assert len(link.expandedOrdinals1) == len(link.expandedRefs1)
+
+    def test_same_links_as_regex(self):
+        link = Link().load({"generated_by": "ordinal_tester"})
+        for tref in ["Genesis 2:1", "Genesis 1", "Genesis", "Shabbat 2a", "Shabbat 2a-3b"]:
+            oref = Ref(tref)
+            by_regex = {l._id for l in LinkSet(oref, use_ordinals=False) if l._id == link._id}
+            by_ordinal = {l._id for l in LinkSet(oref, use_ordinals=True) if l._id == link._id}
+            assert by_regex == by_ordinal == {link._id}
+        assert link._id not in {l._id for l in LinkSet(Ref("Genesis 1:29"), use_ordinals=True)}
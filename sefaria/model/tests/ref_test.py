@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import pytest
+from django.test import override_settings
 from sefaria.model import *
 from sefaria.system.exceptions import InputError
 
@@ -573,6 +574,60 @@ class Test_Cache(object):
         r2 = Ref("Ramban on Genesis 1")
         assert r1 is not r2
 
+    def test_bounded_lru_eviction(self):
+        try:
+            Ref.configure_cache(max_entries=2)
+            r1 = Ref("Genesis 1")
+            Ref("Exodus 1")
+            assert Ref("Genesis 1") is r1  # Genesis 1 is now the most recently used
+            Ref("Leviticus 1")  # evicts Exodus 1
+            assert Ref("Genesis 1") is r1
+            stats = Ref.cache_size(stats=True)
+            assert stats["entries"] == 2
+            assert stats["evictions"] >= 1
+            assert stats["hits"] >= 2
+            assert stats["misses"] >= 3
+        finally:
+            Ref.configure_cache()
+
+    def test_bounded_eviction_keeps_aliases_together(self):
+        try:
+            Ref.configure_cache(max_entries=1)
+            r1 = Ref("Gen. 27:3")
+            assert Ref("Genesis 27:3") is r1
+            Ref("Exodus 3")
+            assert not any(key in ("Gen. 27:3", "Genesis 27:3") for key in Ref._raw_cache())
+            assert Ref("Genesis 27:3") is Ref("Gen. 27:3")
+        finally:
+            Ref.configure_cache()
+
+    def test_bounded_index_flush_from_cache(self):
+        try:
+            Ref.configure_cache(policy="2q", max_entries=100)
+            r1 = Ref("Genesis 1")
+            r2 = Ref("Exodus 3")
+            Ref.remove_index_from_cache("Genesis")
+            assert r1 is not Ref("Genesis 1")
+            assert r2 is Ref("Exodus 3")
+        finally:
+            Ref.configure_cache()
+
+    def test_cache_configured_from_settings(self):
+        try:
+            with override_settings(REF_CACHE_POLICY="2q", REF_CACHE_MAX_ENTRIES=50, REF_CACHE_MAX_BYTES=None):
+                Ref.configure_cache()
+                stats = Ref.cache_size(stats=True)
+                assert stats["policy"] == "2q"
+                assert stats["max_entries"] == 50
+                Ref.configure_cache(max_entries=0)
+                assert Ref.cache_size(stats=True)["max_entries"] is None
+        finally:
+            Ref.configure_cache()
+
+    def test_bad_cache_policy(self):
+        with pytest.raises(InputError):
+            Ref.configure_cache(policy="fifo")
+
     '''
     # Retired.  Since we're dealing with objects, tref will either bleed one way or the other.
     # Removed last dependencies on tref outside of object init. 
@@ -325,6 +325,14 @@ def test_merge():
     # three texts, depth 2
     assert model.merge_texts([[["a", ""],["p","",""]], [["", "b", ""],["p","d",""]], [["","","c"],["","","q"]]], ["first", "second", "third"])[0] == [["a", "b", "c"],["p","d","q"]]
 
+    # sources are flattened, in segment order
+    assert model.merge_texts([[["a", ""],["p","","q"]], [["", "b", "c"],["p","d",""]]], ["first", "second"])[1] == ["first", "second", "second", "first", "second", "first"]
+
+    # ragged versions, and a section missing from the first version
+    assert model.merge_texts([[["a"]], [["", "b"], ["c"]]], ["first", "second"]) == [[["a", "b"], ["c"]], ["first", "second", "second"]]
+
+    assert model.merge_texts([], []) == ["", []]
+
 
 def test_text_helpers():
     res = model.library.get_indices_by_collective_title("Rashi")
@@ -0,0 +1,72 @@
+import pytest
+from django.contrib.auth.models import User
+
+from sefaria.model.user_profile import UserProfile, public_user_data, public_user_data_many, public_user_data_cache_stats, invalidate_public_user_data
+from sefaria.system.database import db
+
+TEST_UID = 1999700000
+
+
+@pytest.fixture
+def profiles(django_db_setup, django_db_blocker):
+    uids = [TEST_UID + i for i in range(3)]
+    with django_db_blocker.unblock():
+        db.profiles.insert_many([{"id": uid, "slug": "test-user-{}".format(uid), "position": "Tester"} for uid in uids])
+        yield uids
+        db.profiles.delete_many({"id": {"$in": uids}})
+        for uid in uids:
+            invalidate_public_user_data(uid)
+
+
+class TestPublicUserData(object):
+
+    def test_many(self, profiles):
+        data = public_user_data_many(profiles)
+        assert set(data) == set(profiles)
+        for uid in profiles:
+            assert data[uid]["profileUrl"] == "/profile/test-user-{}".format(uid)
+            assert data[uid]["position"] == "Tester"
+            assert data[uid] == public_user_data(uid)
+        assert public_user_data(str(profiles[0])) == data[profiles[0]]
+
+    def test_hits(self, profiles):
+        public_user_data_many(profiles)
+        before = public_user_data_cache_stats()
+        public_user_data_many(profiles)
+        after = public_user_data_cache_stats()
+        assert after["local_hits"] - before["local_hits"] == len(profiles)
+        assert after["misses"] == before["misses"]
+        assert after["hit_rate"] > 0
+        assert after["bytes"] > 0
+
+    def test_invalidated_on_profile_save(self, profiles):
+        uid = profiles[0]
+        assert public_user_data(uid)["position"] == "Tester"
+        profile = UserProfile(id=uid)
+        profile.update({"position": "Editor"})
+        profile.save()
+        assert public_user_data(uid)["position"] == "Editor"
+
+    def test_user_without_profile(self, django_db_setup, django_db_blocker):
+        with django_db_blocker.unblock():
+            user = User.objects.create_user(username="public-user-data@sefaria.org", email="public-user-data@sefaria.org", password="!!!", first_name="No", last_name="Profile", is_staff=True)
+            try:
+                data = public_user_data(user.id)
+                assert data["profileUrl"] == "/profile/no-profile"
+                assert data["isStaff"] is False
+                assert db.profiles.find_one({"id": user.id}) is None
+            finally:
+                invalidate_public_user_data(user.id)
+                user.delete()
+
+    def test_invalidated_on_user_save(self, django_db_setup, django_db_blocker):
+        with django_db_blocker.unblock():
+            user = User.objects.create_user(username="public-user-data@sefaria.org", email="public-user-data@sefaria.org", password="!!!", first_name="Before", last_name="Test")
+            try:
+                assert public_user_data(user.id)["name"] == "Before Test"
+                user.first_name = "After"
+                user.save()
+                assert public_user_data(user.id)["name"] == "After Test"
+            finally:
+                db.profiles.delete_many({"id": user.id})
+                user.delete()
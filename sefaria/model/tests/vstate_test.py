@@ -1,6 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import pytest
+import time
+from datetime import datetime, timedelta
 from sefaria.model import *
+from sefaria.model.version_state import version_state_lock
+from sefaria.system.database import db
+from sefaria.system.exceptions import LockTimeoutError
+
+
+@pytest.fixture
+def restore_exodus_vstate():
+    doc = db.vstate.find_one({"title": "Exodus"})
+    yield
+    db.vstate.replace_one({"_id": doc["_id"]}, doc)
 
 
 class Test_VState(object):
@@ -41,3 +54,53 @@ class Test_VSNode(object):
         assert "Verse" in cd
         assert "Comment" in cd
 
+
+
+class Test_VState_Incremental(object):
+
+    def test_patch_counts(self):
+        counts = [[1, 2], [1], []]
+        assert VersionState._patch_counts(counts, [0, 1], 1, 0, 2) == [[1, 1], [1], []]
+        assert VersionState._patch_counts(counts, [1, 3], 0, 1, 2) == [[1, 1], [1, 0, 0, 1], []]
+        assert VersionState._patch_counts(counts, [2], [], [1, 0], 2) == [[1, 1], [1, 0, 0, 1], [1, 0]]
+        assert VersionState._patch_counts(counts, [4, 0], 0, 1, 2) == [[1, 1], [1, 0, 0, 1], [1, 0], [], [1]]
+
+    def test_patch_counts_removing_positions(self):
+        with pytest.raises(ValueError):
+            VersionState._patch_counts([[1, 1]], [0], [1, 1], [1], 2)
+        with pytest.raises(ValueError):
+            VersionState._patch_counts([[1, 1]], [3], [], [1], 2)
+
+    def test_consistency(self):
+        vs = VersionState("Exodus")
+        assert vs.check_consistency() == []
+
+    def test_consistency_of_links_count(self):
+        vs = VersionState("Exodus")
+        vs.linksCount += 1
+        assert vs.check_consistency() == [([], "", "linksCount", vs.linksCount, vs.linksCount - 1)]
+
+    def test_interleaved_patches(self, restore_exodus_vstate):
+        saved = VersionState("Exodus")
+        first, second = VersionState("Exodus"), VersionState("Exodus")
+        # second was loaded before first saved its patch, and keeps it
+        assert first.refresh_ref(Ref("Exodus 1:1"), "en", "", "In the beginning")
+        assert second.refresh_ref(Ref("Exodus 1:2"), "en", "", "In the beginning")
+        counts = VersionState("Exodus").content["_en"]["availableTexts"][0][:2]
+        assert counts == [c + 1 for c in saved.content["_en"]["availableTexts"][0][:2]]
+
+    def test_abandoned_lock(self):
+        db.vstate_locks.delete_one({"_id": "Exodus"})
+        db.vstate_locks.insert_one({"_id": "Exodus", "owner": "gone", "expires": datetime.utcnow() - timedelta(hours=1)})
+        with version_state_lock("Exodus"):
+            assert db.vstate_locks.find_one({"_id": "Exodus"})["owner"] != "gone"
+        assert db.vstate_locks.find_one({"_id": "Exodus"}) is None
+
+    def test_held_lock_is_renewed(self):
+        db.vstate_locks.delete_one({"_id": "Exodus"})
+        with version_state_lock("Exodus", lease=0.3):
+            time.sleep(0.6)  # past the first lease
+            with pytest.raises(LockTimeoutError):
+                with version_state_lock("Exodus", wait=0.2):
+                    pass
+        assert db.vstate_locks.find_one({"_id": "Exodus"}) is None
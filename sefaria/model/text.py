@@ -4,6 +4,7 @@ text.py
 """
 
 import time
+import threading
 import structlog
 from functools import reduce, partial
 from typing import Optional, Union
@@ -15,11 +16,14 @@ import copy
 import bleach
 import json
 import itertools
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from bs4 import BeautifulSoup, Tag
 import re2 as re
 from . import abstract as abst
+from .title_automaton import TitleAutomaton
+from .library_snapshot import snapshot_key, load_library_snapshot, save_library_snapshot
 from .schema import deserialize_tree, AltStructNode, VirtualNode, DictionaryNode, JaggedArrayNode, TitledTreeNode, DictionaryEntryNode, SheetNode, AddressTalmud, Term, TermSet, TitleGroup, AddressType
+from django.conf import settings
 from sefaria.system.database import db
 
 import sefaria.system.cache as scache
@@ -35,6 +39,14 @@ try:
 except ImportError:
     RAW_REF_MODEL_BY_LANG_FILEPATH = None
     RAW_REF_PART_MODEL_BY_LANG_FILEPATH = None
+try:
+    from sefaria.settings import TITLE_AUTOMATON_DIR
+except ImportError:
+    TITLE_AUTOMATON_DIR = None
+try:
+    from sefaria.settings import LIBRARY_SNAPSHOT_DIR
+except ImportError:
+    LIBRARY_SNAPSHOT_DIR = None
 from sefaria.system.multiserver.coordinator import server_coordinator
 from sefaria.constants import model as constants
 
@@ -1619,13 +1631,23 @@ class VersionSet(abst.AbstractMongoSet):
                 logger.error("No version title for Version: {}".format(vars(v)))
         if node is None:
             return merge_texts([getattr(v, "chapter", []) for v in self], [getattr(v, "versionTitle", None) for v in self])
-        versions = self.array()
-        if prioritized_vtitle:
-            vindex = next((i for (i, v) in enumerate(versions) if v.versionTitle == prioritized_vtitle), None)
-            if vindex is not None:
-                # move versions[vindex] to front of list
-                versions.insert(0, versions.pop(vindex))
-        return merge_texts([v.content_node(node) for v in versions], [getattr(v, "versionTitle", None) for v in versions])
+        return merge_versions(self.array(), node, prioritized_vtitle)
+
+
+def merge_versions(versions, node, prioritized_vtitle=None):
+    """
+    Merges the content of `node` in a list of Versions, in priority order
+    :param versions: list of Versions
+    :param prioritized_vtitle: optional vtitle which should have top priority, even if it generally has lower priority
+    :return: (merged text, sources)
+    """
+    versions = list(versions)
+    if prioritized_vtitle:
+        vindex = next((i for (i, v) in enumerate(versions) if v.versionTitle == prioritized_vtitle), None)
+        if vindex is not None:
+            # move versions[vindex] to front of list
+            versions.insert(0, versions.pop(vindex))
+    return merge_texts([v.content_node(node) for v in versions], [getattr(v, "versionTitle", None) for v in versions])
 
 
 # used in VersionSet.merge(), merge_text_versions(), and export.export_merged()
@@ -1633,50 +1655,76 @@ class VersionSet(abst.AbstractMongoSet):
 # Doesn't work for complex texts
 def merge_texts(text, sources):
     """
-    This is a recursive function that merges the text in multiple
-    translations to fill any gaps and deliver as much text as
-    possible.
+    Merges the text in multiple translations to fill any gaps and deliver as much text as possible.
     e.g. [["a", ""], ["", "b", "c"]] becomes ["a", "b", "c"]
+
+    Walks all the versions together in one pass, taking each segment from the first version which has it (which will
+    be the oldest, or one with highest priority), and recording that version's source.
+    :param text: list of jagged arrays, one per version, in priority order
+    :param sources: list of the same length, identifying the versions
+    :return: [merged text, list of the source of every segment]
+    NOTE - the sources list is flat, so downstream code can always expect a one dimensional list, but in so doing the
+    mapping of source names to segments is lost for merged texts of depth > 2 (this mapping is not currenly used in general)
     """
     if not (len(text) and len(sources)):
         return ["", []]
+    return _TextMerger(sources).merge(text)
 
-    depth = list_depth(text)
-    if depth > 2:
-        results = []
-        result_sources = []
-        for x in range(max(list(map(len, text)))):    # Let longest text determine how many times to iterate
-            translations = [_ for _ in itertools.zip_longest(*text)][x]  # transpose, and take section x
-            remove_nones = lambda x: x or []
-            result, source = merge_texts(list(map(remove_nones, translations)), sources)
-            results.append(result)
-            # NOTE - the below flattens the sources list, so downstream code can always expect
-            # a one dimensional list, but in so doing the mapping of source names to segments
-            # is lost for merged texts of depth > 2 (this mapping is not currenly used in general)
-            result_sources += source
-        return [results, result_sources]
-
-    if depth == 1:
-        text = [[x] for x in text]
-
-    merged = itertools.zip_longest(*text)  # transpose
-    text = []
-    text_sources = []
-    for verses in merged:
-        # Look for the first non empty version (which will be the oldest, or one with highest priority)
-        index, value = 0, ""
+
+class _TextMerger(object):
+    """
+    Merges versions level by level like `list_depth()` would measure them, but measures the depth of every sub-list
+    only once.
+    """
+    def __init__(self, sources):
+        self.sources = sources
+        self.result_sources = []
+        self._depths = {}  # id -> (list, depth). holds the list so that its id isn't reused
+
+    def merge(self, text):
+        depth = self._depth(text)
+        if depth > 2:
+            results = []
+            for x in range(max(len(t) for t in text)):  # Let longest text determine how many sections there are
+                translations = [(t[x] if x < len(t) else None) or [] for t in text]
+                results.append(self.merge(translations)[0])
+            return [results, self.result_sources]
+
+        if depth == 1:
+            index, value = self._first(text)
+            self.result_sources.append(self.sources[index])
+            return [value, self.result_sources]
+
+        merged = []
+        for x in range(max(len(t) for t in text)):
+            index, value = self._first([t[x] if x < len(t) else None for t in text])
+            merged.append(value)
+            self.result_sources.append(self.sources[index])
+        return [merged, self.result_sources]
+
+    @staticmethod
+    def _first(verses):
+        # Look for the first non empty version
         for i, version in enumerate(verses):
             if version:
-                index = i
-                value = version
-                break
-        text.append(value)
-        text_sources.append(sources[index])
+                return i, version
+        return 0, ""
 
-    if depth == 1:
-        # strings were earlier wrapped in lists, now unwrap
-        text = text[0]
-    return [text, text_sources]
+    def _depth(self, x):
+        """
+        Same as list_depth(x)
+        """
+        if isinstance(x, int):
+            return 0
+        known = self._depths.get(id(x))
+        if known is not None:
+            return known[1]
+        if len(x) > 0 and all(isinstance(y, list) for y in x):
+            depth = 1 + max(self._depth(y) for y in x)
+        else:
+            depth = 1
+        self._depths[id(x)] = (x, depth)
+        return depth
 
 
 class TextFamilyDelegator(type):
@@ -1777,16 +1825,18 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
     :param lang: "he" or "en". "he" means all rtl languages and "en" means all ltr languages
     :param vtitle: optional. Title of the version desired.
     :param actual_lang: optional. if vtitle isn't specified, prefer to find a version with ISO language `actual_lang`. As opposed to `lang` which can only be "he" or "en", `actual_lang` can be any valid 2 letter ISO language code.
+    :param versions: optional. list of the Versions matching ``oref.condition_query(lang)``, in VersionSet order, already loaded with ``oref.part_projection()``. Skips the Version query. See :class:`TextChunkPrefetch`.
     """
 
     text_attr = "text"
 
-    def __init__(self, oref, lang="en", vtitle=None, exclude_copyrighted=False, actual_lang=None, fallback_on_default_version=False):
+    def __init__(self, oref, lang="en", vtitle=None, exclude_copyrighted=False, actual_lang=None, fallback_on_default_version=False, versions=None):
         """
         :param oref:
         :type oref: Ref
         :param lang: "he" or "en"
         :param vtitle:
+        :param versions: optional. preloaded list of Versions to choose from, instead of querying
         :return:
         """
         if isinstance(oref.index_node, JaggedArrayNode):
@@ -1823,20 +1873,26 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
                     raise MissingKeyError(f'The version {vtitle} exists but has no key for the node {self._oref.index_node}')
         elif lang:
             if actual_lang is not None:
-                self._choose_version_by_lang(oref, lang, exclude_copyrighted, actual_lang, prioritized_vtitle=vtitle)
+                self._choose_version_by_lang(oref, lang, exclude_copyrighted, actual_lang, prioritized_vtitle=vtitle, versions=versions)
             else:
-                self._choose_version_by_lang(oref, lang, exclude_copyrighted, prioritized_vtitle=vtitle)
+                self._choose_version_by_lang(oref, lang, exclude_copyrighted, prioritized_vtitle=vtitle, versions=versions)
         else:
             raise Exception("TextChunk requires a language.")
 
-    def _choose_version_by_lang(self, oref, lang: str, exclude_copyrighted: bool, actual_lang: str = None, prioritized_vtitle: str = None) -> None:
+    def _choose_version_by_lang(self, oref, lang: str, exclude_copyrighted: bool, actual_lang: str = None, prioritized_vtitle: str = None, versions: list = None) -> None:
         if prioritized_vtitle:
             actual_lang = None
-        vset = VersionSet(self._oref.condition_query(lang, actual_lang), proj=self._oref.part_projection())
-        if len(vset) == 0:
-            if VersionSet({"title": self._oref.index.title}).count() == 0:
-                raise NoVersionFoundError("No text record found for '{}'".format(self._oref.index.title))
-            return
+        if versions is not None:
+            # Preloaded by the caller, who is responsible for the NoVersionFoundError check
+            vset = list(versions)
+            if len(vset) == 0:
+                return
+        else:
+            vset = VersionSet(self._oref.condition_query(lang, actual_lang), proj=self._oref.part_projection())
+            if len(vset) == 0:
+                if VersionSet({"title": self._oref.index.title}).count() == 0:
+                    raise NoVersionFoundError("No text record found for '{}'".format(self._oref.index.title))
+                return
         if len(vset) == 1:
             v = vset[0]
             if exclude_copyrighted and v.is_copyrighted():
@@ -1846,8 +1902,8 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
             #todo: Should this instance, and the non-merge below, be made saveable?
         else:  # multiple versions available, merge
             if exclude_copyrighted:
-                vset.remove(Version.is_copyrighted)
-            merged_text, sources = vset.merge(self._oref.index_node, prioritized_vtitle=prioritized_vtitle)  #todo: For commentaries, this merges the whole chapter.  It may show up as merged, even if our part is not merged.
+                vset = [v for v in vset if not v.is_copyrighted()]
+            merged_text, sources = merge_versions(vset, self._oref.index_node, prioritized_vtitle=prioritized_vtitle)  #todo: For commentaries, this merges the whole chapter.  It may show up as merged, even if our part is not merged.
             self.text = self.trim_text(merged_text)
             if len(set(sources)) == 1:
                 for v in vset:
@@ -1857,7 +1913,7 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
             else:
                 self.sources = sources
                 self.is_merged = True
-                self._versions = vset.array()
+                self._versions = list(vset)
 
     def __str__(self):
         args = "{}, {}".format(self._oref, self.lang)
@@ -2262,6 +2318,146 @@ class TextChunk(AbstractTextRecord, metaclass=TextFamilyDelegator):
             return ind_list, ref_list, total_len
 
 
+class TextChunkPrefetch(object):
+    """
+    Loads the TextChunks of many Refs with one Version query per index and language, instead of one query (plus a
+    NoVersionFoundError check) per Ref.
+
+    Each query projects a single `$slice` per node, covering the top level sections of all requested Refs in that node,
+    and the Versions are then filtered per Ref with the same rules as :meth:`Ref.condition_query`.
+    Refs that can't be served from a batch (ranges, refs without sections, virtual and non JaggedArray nodes) fall
+    back to a regular TextChunk.
+
+    ::
+
+        >>> prefetch = TextChunkPrefetch([Ref("Rashi on Genesis 1"), Ref("Ramban on Genesis 1")])
+        >>> prefetch.get(Ref("Rashi on Genesis 1"), "he")
+    """
+    # Sections of a node that are further apart than this are loaded in separate queries
+    max_slice = 100
+    empty_values = ("", [], 0)
+
+    def __init__(self, orefs, langs=("en", "he")):
+        self._langs = tuple(langs)
+        self._versions = {}  # (normal ref, lang) -> list of Versions projected as with Ref.part_projection()
+        self._missing_titles = set()
+        self.query_count = 0
+        self._load(orefs)
+
+    @staticmethod
+    def is_batchable(oref):
+        node = oref.index_node
+        return isinstance(node, JaggedArrayNode) and not node.is_virtual and len(oref.sections) > 0 and not oref.is_range()
+
+    def get(self, oref, lang):
+        """
+        :return: TextChunk equivalent to ``TextChunk(oref, lang)``
+        :raises NoVersionFoundError: if the index of `oref` has no versions at all
+        """
+        versions = self._versions.get((oref.normal(), lang))
+        if versions is None:
+            return TextChunk(oref, lang)
+        if oref.index.title in self._missing_titles:
+            raise NoVersionFoundError("No text record found for '{}'".format(oref.index.title))
+        return TextChunk(oref, lang, versions=versions)
+
+    def _load(self, orefs):
+        refs_by_title = defaultdict(dict)
+        for oref in orefs:
+            if self.is_batchable(oref):
+                refs_by_title[oref.index.title][oref.normal()] = oref
+
+        for title, refs in refs_by_title.items():
+            found = False
+            for projection, slice_starts in self._projections(list(refs.values())):
+                for lang in self._langs:
+                    vset = VersionSet({"title": title, "language": lang}, proj=projection)
+                    docs = list(vset.raw_records)
+                    self.query_count += 1
+                    found = found or len(docs) > 0
+                    for nref, start in slice_starts.items():
+                        oref = refs[nref]
+                        parts = (self._version_part(doc, oref, start) for doc in docs)
+                        self._versions[(nref, lang)] = [Version(attrs=part) for part in parts if part is not None]
+            if not found:
+                self.query_count += 1
+                if VersionSet({"title": title}).count() == 0:
+                    self._missing_titles.add(title)
+
+    def _projections(self, orefs):
+        """
+        :return: list of (projection, {normal ref: offset of the first section in the projected slice of its node})
+        """
+        offsets_by_address = defaultdict(set)
+        for oref in orefs:
+            offsets_by_address[oref.storage_address()].add(oref.sections[0] - 1)
+
+        slices = defaultdict(dict)  # query number -> {storage address: (offset, limit)}
+        chunk_of = {}  # (storage address, offset) -> (query number, offset of the slice)
+        for address, offsets in offsets_by_address.items():
+            n, start = -1, None
+            for offset in sorted(offsets):
+                if start is None or offset - start >= self.max_slice:
+                    n, start = n + 1, offset
+                slices[n][address] = (start, offset - start + 1)
+                chunk_of[(address, offset)] = (n, start)
+
+        base = {k: 1 for k in Version.required_attrs + Version.optional_attrs}
+        del base[Version.content_attr]
+        base["_id"] = 0
+        results = []
+        for n in sorted(slices):
+            projection = dict(base)
+            for address, (offset, limit) in slices[n].items():
+                projection[address] = {"$slice": [offset, limit]}
+            starts = {}
+            for oref in orefs:
+                query_number, start = chunk_of[(oref.storage_address(), oref.sections[0] - 1)]
+                if query_number != n:
+                    continue
+                starts[oref.normal()] = start
+                if len(oref.index_node.address()) > 1:
+                    # create dummy key at level of our selection - see Ref.part_projection()
+                    projection[".".join(["chapter"] + oref.index_node.address()[1:-1] + ["hacky_dummy_key"])] = 1
+            results.append((projection, starts))
+        return results
+
+    def _version_part(self, doc, oref, start):
+        """
+        :param doc: raw Version record, loaded with a projection from _projections()
+        :return: copy of `doc` as it would have been loaded with ``oref.part_projection()``, or None if it doesn't
+        match ``oref.condition_query()``
+        """
+        address = oref.storage_address(format="list")
+        content = doc
+        for key in address:
+            content = content.get(key) if isinstance(content, dict) else None
+        if not isinstance(content, list):
+            return None
+        i = oref.sections[0] - 1 - start
+        if i >= len(content):
+            return None
+        section = content[i]
+
+        value = section
+        for s in oref.sections[1:]:
+            if not isinstance(value, list) or len(value) < s:
+                return None
+            value = value[s - 1]
+        if len(oref.sections) == oref.index_node.depth:
+            if value in self.empty_values:
+                return None
+        elif not isinstance(value, list) or all(v in self.empty_values for v in value):
+            return None
+
+        part_content = [section]
+        for key in reversed(address[1:]):
+            part_content = {key: part_content}
+        part = {k: v for k, v in doc.items() if k != Version.content_attr}
+        part[Version.content_attr] = part_content
+        return part
+
+
 class VirtualTextChunk(AbstractTextRecord):
     """
     Delegated from TextChunk
@@ -2617,34 +2813,238 @@ class TextFamily(object):
 """
 
 
+class _RefCacheEntry(object):
+    """
+    A single cached Ref along with every key (uid and instantiation strings) that resolves to it.
+    """
+    __slots__ = ("oref", "uid", "title", "keys", "nbytes")
+
+    def __init__(self, oref, uid, title):
+        self.oref = oref
+        self.uid = uid
+        self.title = title
+        self.keys = []
+        self.nbytes = 0
+
+
+class RefCacheStore(object):
+    """
+    Storage behind RefCacheType.
+    Every cached Ref is held in one entry, keyed by its uid, and is reachable from any number of alias keys
+    (the strings it was instantiated with).  When the store is bounded, eviction removes an entry together with all of
+    its aliases, so two cached lookups for the same location always return the same instance.
+
+    Policies:
+        "lru" - evict the least recently used entry.
+        "2q"  - new entries wait in a FIFO probation queue, and are promoted to the main LRU queue only if they are
+                requested again soon after falling out of it.  This keeps one-off refs (e.g. a full reindex walking the
+                library) from flushing the hot working set.
+    """
+    POLICIES = ("lru", "2q")
+    PROBATION_RATIO = 0.25
+    GHOST_RATIO = 0.5
+
+    def __init__(self, policy="lru", max_entries=None, max_bytes=None):
+        if policy not in self.POLICIES:
+            raise InputError("Unknown Ref cache policy '{}'. Expected one of {}".format(policy, ", ".join(self.POLICIES)))
+        self.policy = policy
+        self.max_entries = max_entries or None
+        self.max_bytes = max_bytes or None
+        self.bounded = bool(self.max_entries or self.max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()  # Refs are created concurrently by request threads and fan outs
+        self.clear()
+
+    def clear(self):
+        self._key_map = {}  # key -> _RefCacheEntry
+        self._index_map = defaultdict(set)  # index title -> uids
+        self._main = OrderedDict()  # uid -> _RefCacheEntry, least recently used first
+        self._probation = OrderedDict()  # 2q only.  uid -> _RefCacheEntry, oldest first
+        self._ghosts = OrderedDict()  # 2q only.  uids recently evicted from probation
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._main) + len(self._probation)
+
+    def lookup(self, key):
+        """
+        :return: the cached Ref for `key`, or None
+        """
+        entry = self._key_map.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.bounded:
+            with self._lock:
+                if entry.uid in self._main:
+                    self._main.move_to_end(entry.uid)
+        return entry.oref
+
+    def insert(self, oref, tref=None):
+        """
+        Adds `oref` to the cache under its uid and, if given, under `tref`.
+        If a Ref with the same uid is already cached, `tref` is added as an alias for it and the cached Ref is returned.
+        :return: the canonical cached Ref
+        """
+        uid = oref.uid()
+        with self._lock:
+            return self._insert(oref, uid, tref)
+
+    def _insert(self, oref, uid, tref):
+        entry = self._key_map.get(uid)
+        if entry is None:
+            entry = _RefCacheEntry(oref, uid, oref.index.title)
+            self._add_key(entry, uid)
+            if self.max_bytes:
+                entry.nbytes += self._ref_bytes(oref)
+                self.bytes += entry.nbytes
+            self._index_map[entry.title].add(uid)
+            if self.policy == "2q" and uid not in self._ghosts:
+                self._probation[uid] = entry
+            else:
+                self._ghosts.pop(uid, None)
+                self._main[uid] = entry
+        elif self.bounded and uid in self._main:
+            self._main.move_to_end(uid)
+        if tref is not None and tref not in self._key_map:
+            self._add_key(entry, tref)
+        if self.bounded:
+            self._evict()
+        return entry.oref
+
+    def remove_index(self, index_title):
+        with self._lock:
+            for uid in self._index_map.pop(index_title, ()):
+                entry = self._key_map.get(uid)
+                if entry is not None:
+                    self._drop(entry)
+
+    def keys(self):
+        return self._key_map.keys()
+
+    def items(self):
+        return ((key, entry.oref) for key, entry in self._key_map.items())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "entries": len(self),
+            "keys": len(self._key_map),
+            "bytes": self.bytes if self.max_bytes else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+    def _add_key(self, entry, key):
+        self._key_map[key] = entry
+        entry.keys.append(key)
+        if self.max_bytes:
+            key_bytes = sys.getsizeof(key)
+            entry.nbytes += key_bytes
+            self.bytes += key_bytes
+
+    def _drop(self, entry):
+        for key in entry.keys:
+            self._key_map.pop(key, None)
+        self._main.pop(entry.uid, None)
+        self._probation.pop(entry.uid, None)
+        uids = self._index_map.get(entry.title)
+        if uids is not None:
+            uids.discard(entry.uid)
+        self.bytes -= entry.nbytes
+
+    def _over_capacity(self):
+        return bool((self.max_entries and len(self) > self.max_entries) or (self.max_bytes and self.bytes > self.max_bytes))
+
+    def _evict(self):
+        while self._over_capacity() and len(self) > 1:
+            if self.policy == "2q" and self._probation and (len(self._probation) > self._queue_limit(self.PROBATION_RATIO) or not self._main):
+                uid, entry = self._probation.popitem(last=False)
+                self._ghosts[uid] = None
+                while len(self._ghosts) > self._queue_limit(self.GHOST_RATIO):
+                    self._ghosts.popitem(last=False)
+            elif self._main:
+                uid, entry = self._main.popitem(last=False)
+            else:
+                break
+            self._drop(entry)
+            self.evictions += 1
+
+    def _queue_limit(self, ratio):
+        return max(1, int((self.max_entries or len(self)) * ratio))
+
+    @staticmethod
+    def _ref_bytes(oref):
+        """
+        Approximate memory held by a single Ref, not counting the Index and schema nodes it shares with other Refs.
+        """
+        size = sys.getsizeof(oref) + sys.getsizeof(oref.__dict__)
+        for attr in ("sections", "toSections"):
+            value = getattr(oref, attr, None)
+            if value is not None:
+                size += sys.getsizeof(value)
+        for attr in ("tref", "orig_tref", "_normal", "_he_normal", "_url"):
+            value = getattr(oref, attr, None)
+            if isinstance(value, str):
+                size += sys.getsizeof(value)
+        return size
+
+
 class RefCacheType(type):
     """
     Metaclass for Ref class.
     Caches all Ref instances according to the string they were instantiated with and their normal form.
     Returns cached instance on instantiation if either instantiation string or normal form are matched.
+
+    By default the cache is unbounded.  Set REF_CACHE_MAX_ENTRIES and/or REF_CACHE_MAX_BYTES (and optionally
+    REF_CACHE_POLICY) in local settings, or call Ref.configure_cache(), to bound it.  See RefCacheStore.
     """
 
     def __init__(cls, name, parents, dct):
         super(RefCacheType, cls).__init__(name, parents, dct)
-        cls.__tref_oref_map = {}
-        cls.__index_tref_map = {}
+        cls.configure_cache()
 
-    def cache_size(cls):
-        return len(cls.__tref_oref_map)
+    def configure_cache(cls, policy=None, max_entries=None, max_bytes=None):
+        """
+        Replaces the Ref cache with an empty one using the given policy and limits.  Each one left out is taken from
+        the REF_CACHE_* settings, so `Ref.configure_cache()` restores the configured cache.
+        :param policy: "lru" or "2q"
+        :param max_entries: maximum number of cached Refs.  0 for no limit.
+        :param max_bytes: approximate maximum size of the cache in bytes.  0 for no limit.
+        """
+        policy = policy if policy is not None else getattr(settings, "REF_CACHE_POLICY", "lru")
+        max_entries = max_entries if max_entries is not None else getattr(settings, "REF_CACHE_MAX_ENTRIES", None)
+        max_bytes = max_bytes if max_bytes is not None else getattr(settings, "REF_CACHE_MAX_BYTES", None)
+        cls.__cache = RefCacheStore(policy, max_entries, max_bytes)
+
+    def cache_size(cls, stats=False):
+        """
+        :param stats: if True, return a dict with size, limits and hit/miss/eviction counters instead of the entry count
+        """
+        if stats:
+            return cls.__cache.stats()
+        return len(cls.__cache.keys())
 
     def cache_size_bytes(cls):
         from sefaria.utils.util import get_size
-        return get_size(cls.__tref_oref_map)
+        return get_size(cls._raw_cache())
 
     def cache_dump(cls):
-        return [(a, repr(b)) for (a, b) in cls.__tref_oref_map.items()]
+        return [(a, repr(b)) for (a, b) in cls.__cache.items()]
 
     def _raw_cache(cls):
-        return cls.__tref_oref_map
+        return dict(cls.__cache.items())
 
     def clear_cache(cls):
-        cls.__tref_oref_map = {}
-        cls.__index_tref_map = {}
+        cls.__cache.clear()
 
     def remove_index_from_cache(cls, index_title):
         """
@@ -2653,14 +3053,7 @@ class RefCacheType(type):
         :param index_title:
         :return:
         """
-        try:
-            for tref in cls.__index_tref_map[index_title]:
-                try:
-                    del cls.__tref_oref_map[tref]
-                except KeyError:
-                    continue
-        except KeyError:
-            pass
+        cls.__cache.remove_index(index_title)
 
     def __call__(cls, *args, **kwargs):
         if len(args) == 1:
@@ -2671,42 +3064,18 @@ class RefCacheType(type):
         obj_arg = kwargs.get("_obj")
 
         if tref:
-            if tref in cls.__tref_oref_map:
-                return cls.__tref_oref_map[tref]
-            else:
-                result = super(RefCacheType, cls).__call__(*args, **kwargs)
-                uid = result.uid()
-                title = result.index.title
-                if uid in cls.__tref_oref_map:
-                    #del result  #  Do we need this to keep memory clean?
-                    cls.__tref_oref_map[tref] = cls.__tref_oref_map[uid]
-                    try:
-                        cls.__index_tref_map[title] += [tref]
-                    except KeyError:
-                        cls.__index_tref_map[title] = [tref]
-                    return cls.__tref_oref_map[uid]
-                cls.__tref_oref_map[uid] = result
-                cls.__tref_oref_map[tref] = result
-                try:
-                    cls.__index_tref_map[title] += [tref]
-                except KeyError:
-                    cls.__index_tref_map[title] = [tref]
-                cls.__index_tref_map[title] += [uid]
-
-                return result
+            cached = cls.__cache.lookup(tref)
+            if cached is not None:
+                return cached
+            result = super(RefCacheType, cls).__call__(*args, **kwargs)
+            return cls.__cache.insert(result, tref)
         elif obj_arg:
             result = super(RefCacheType, cls).__call__(*args, **kwargs)
-            uid = result.uid()
-            title = result.index.title
-            if uid in cls.__tref_oref_map:
+            cached = cls.__cache.lookup(result.uid())
+            if cached is not None:
                 #del result  #  Do we need this to keep memory clean?
-                return cls.__tref_oref_map[uid]
-            cls.__tref_oref_map[uid] = result
-            try:
-                cls.__index_tref_map[title] += [uid]
-            except KeyError:
-                cls.__index_tref_map[title] = [uid]
-            return result
+                return cached
+            return cls.__cache.insert(result)
         else:  # Default.  Shouldn't be used.
             return super(RefCacheType, cls).__call__(*args, **kwargs)
 
@@ -4457,6 +4826,17 @@ class Ref(object, metaclass=RefCacheType):
             logger.warning("Failed to execute order_id for {} : {}".format(self, e))
             return "Z"
 
+    def ordinal_range(self):
+        """
+        Returns integer ordinals (start, end) that bound the ordinal of every segment in this Ref.
+        Unlike order_id(), these are stable when the TOC changes, and can be used for range queries on the
+        `expandedOrdinals` fields of links and sheets.
+
+        :return: tuple of ints, or None if this Ref can't be represented as an ordinal range
+        """
+        from .ref_ordinal import ordinal_range
+        return ordinal_range(self)
+
     """ Methods for working with Versions and VersionSets """
     def storage_address(self, format="string"):
         """
@@ -4913,6 +5293,7 @@ class Library(object):
 
 
     """
+    MAX_WRAPPING_REGEXES = 1000  # Compiled regexes for combinations of titles kept by `get_regex_and_titles_for_ref_wrapping()`
 
     def __init__(self):
         # Timestamp when library last stored shared cache items (toc, terms, etc)
@@ -4937,6 +5318,14 @@ class Library(object):
         self._title_regex_strings = {}
         self._title_regexes = {}
 
+        # Title automata, keyed like `_title_regexes`.  See `all_titles_automaton()`
+        self._title_automata = {}
+
+        # Compiled ref regexes, keyed by the arguments that built them.  See `_internal_ref_from_string()` and `get_regex_and_titles_for_ref_wrapping()`
+        self._ref_regexes = {}
+        self._wrapping_regexes = OrderedDict()
+        self._wrapping_regexes_lock = threading.Lock()  # Refs are wrapped concurrently by request threads and fan outs
+
         # Maps, keyed by language, from term names to text refs
         self._term_ref_maps = {lang: {} for lang in self.langs}
 
@@ -4980,6 +5369,11 @@ class Library(object):
         self._cross_lexicon_auto_completer_is_ready = False
         self._topic_auto_completer_is_ready = False
 
+        # Seconds taken by each phase of initialization, keyed by phase.  See `init_index_maps()` and reader/startup.py
+        self.init_timings = OrderedDict()
+        self._snapshot_key = None
+        self._loaded_from_snapshot = False
+
         if not hasattr(sys, '_doc_build'):  # Can't build cache without DB
             self.get_simple_term_mapping() # this will implicitly call self.build_term_mappings() but also make sure its cached.
 
@@ -5004,6 +5398,38 @@ class Library(object):
             except IndexSchemaError as e:
                 logger.error("Error in generating title node dictionary: {}".format(e))
 
+    def init_index_maps(self):
+        """
+        Builds the index maps, or, if LIBRARY_SNAPSHOT_DIR is set and holds a snapshot of the current index and
+        category data, loads them and the TOC tree from the snapshot.  See library_snapshot.py
+        :return: True if loaded from a snapshot
+        """
+        start = time.perf_counter()
+        if LIBRARY_SNAPSHOT_DIR:
+            self._snapshot_key = snapshot_key()
+            self._loaded_from_snapshot = load_library_snapshot(self, LIBRARY_SNAPSHOT_DIR, self._snapshot_key)
+        if self._loaded_from_snapshot:
+            self._toc_tree_is_ready = True
+        else:
+            self._build_index_maps()
+        self.init_timings["index maps"] = time.perf_counter() - start
+        return self._loaded_from_snapshot
+
+    def save_snapshot(self):
+        """
+        Saves a snapshot of the index maps and TOC tree to LIBRARY_SNAPSHOT_DIR, for processes started later to load.
+        Does nothing if the library was loaded from a current snapshot, or changed after init_index_maps().
+        :return: path of the snapshot, or None
+        """
+        if not LIBRARY_SNAPSHOT_DIR or self._loaded_from_snapshot:
+            return None
+        self.get_toc_tree()
+        if snapshot_key() != self._snapshot_key:
+            # Something was saved while the library was built, which it may or may not include
+            logger.info("Not saving a library snapshot, since the library changed while it was built")
+            return None
+        return save_library_snapshot(self, LIBRARY_SNAPSHOT_DIR, self._snapshot_key)
+
     def _reset_index_derivative_objects(self, include_auto_complete=False):
         """
         Resets the objects which are derivatives of the index
@@ -5012,8 +5438,14 @@ class Library(object):
         self._full_title_list_jsons = {}
         self._title_regex_strings = {}
         self._title_regexes = {}
+        self._reset_ref_regexes()
         # TOC is handled separately since it can be edited in place
 
+    def _reset_ref_regexes(self):
+        self._title_automata = {}
+        self._ref_regexes = {}
+        self._wrapping_regexes = OrderedDict()
+
     def rebuild(self, include_toc = False, include_auto_complete=False):
         self.get_simple_term_mapping_json(rebuild=True)
         self._build_topic_mapping()
@@ -5023,6 +5455,7 @@ class Library(object):
         self.reset_text_titles_cache()
         self._title_regex_strings = {}
         self._title_regexes = {}
+        self._reset_ref_regexes()
         Ref.clear_cache()
         in_memory_cache.reset_all()
         if include_toc:
@@ -5370,12 +5803,16 @@ class Library(object):
             logger.warning("Built full {} auto completer.".format(lang))
             return self._full_auto_completer[lang]
 
-    def recount_index_in_toc(self, indx):
+    def recount_index_in_toc(self, indx, refresh=True):
+        """
+        :param indx: The Index object.  When called remotely, in multiserver mode, the string title of the index
+        :param refresh: False to use the saved VersionState of the index, without recounting its versions
+        """
         # This is used in the case of a remotely triggered multiserver update
         if isinstance(indx, str):
             indx = Index().load({"title": indx})
 
-        self.get_toc_tree().update_title(indx, recount=True)
+        self.get_toc_tree().update_title(indx, recount=True, refresh=refresh)
 
         self.rebuild_toc(skip_toc_tree=True)
 
@@ -5575,6 +6012,24 @@ class Library(object):
             self._title_regexes[key] = reg
         return reg
 
+    def all_titles_automaton(self, lang="en", with_terms=False, citing_only=False):
+        """
+        :return: :class:`TitleAutomaton` which finds the same titles as `all_titles_regex()` with the same arguments,
+        in a single pass and without compiling a regex of every title.
+        If TITLE_AUTOMATON_DIR is set, automata are saved there and loaded by other processes rather than rebuilt.
+        """
+        if citing_only:
+            key = "citing_titles_automaton_" + lang
+        else:
+            key = "all_titles_automaton_" + lang
+            key += "_terms" if with_terms else ""
+        automaton = self._title_automata.get(key)
+        if not automaton:
+            titles = self.citing_title_list(lang) if citing_only else self.full_title_list(lang, with_terms=with_terms)
+            automaton = TitleAutomaton.cached(titles, TITLE_AUTOMATON_DIR)
+            self._title_automata[key] = automaton
+        return automaton
+
     def ref_list(self):
         """
         :return: list of all section-level Refs in the library
@@ -5938,7 +6393,7 @@ class Library(object):
         """
         if not lang:
             lang = "he" if has_hebrew(s) else "en"
-        return [m.group('title') for m in self.all_titles_regex(lang, citing_only=citing_only).finditer(s)]
+        return [title for title, start in self.all_titles_automaton(lang, citing_only=citing_only).finditer(s)]
 
     def get_refs_in_string(self, st, lang=None, citing_only=False):
         """
@@ -5969,12 +6424,9 @@ class Library(object):
                     logger.info("Error finding ref for {} in: {}".format(title, st))
 
         else:  # lang == "en"
-            for match in self.all_titles_regex(lang, citing_only=citing_only).finditer(st):
-                title = match.group('title')
-                if not title:
-                    continue
+            for title, start in self.all_titles_automaton(lang, citing_only=citing_only).finditer(st):
                 try:
-                    res = self._build_ref_from_string(title, st[match.start():])  # Slice string from title start
+                    res = self._build_ref_from_string(title, st[start:])  # Slice string from title start
                     refs += res
                 except AssertionError as e:
                     logger.info("Skipping Schema Node: {}".format(title))
@@ -5995,10 +6447,21 @@ class Library(object):
         :return: Compiled regex, dict of title:node correspondences
 
         """
-        unique_titles = set(self.get_titles_in_string(st, lang, citing_only))
+        unique_titles = frozenset(self.get_titles_in_string(st, lang, citing_only))
         title_nodes = {title: self.get_schema_node(title,lang) for title in unique_titles}
-        all_reg = self.get_multi_title_regex_string(unique_titles, lang)
+        key = (lang, unique_titles)
+        with self._wrapping_regexes_lock:
+            wrapping_regexes = self._wrapping_regexes
+            if key in wrapping_regexes:
+                wrapping_regexes.move_to_end(key)
+                return wrapping_regexes[key], title_nodes
+        # Sorted longest first, so that the same titles always make the same regex
+        all_reg = self.get_multi_title_regex_string(sorted(unique_titles, key=lambda t: (-len(t), t)), lang)
         reg = regex.compile(all_reg, regex.VERBOSE) if all_reg else None
+        with self._wrapping_regexes_lock:
+            wrapping_regexes[key] = reg
+            while len(wrapping_regexes) > self.MAX_WRAPPING_REGEXES:
+                wrapping_regexes.popitem(last=False)
         return reg, title_nodes
 
     def get_wrapped_refs_string(self, st, lang=None, citing_only=False, reg=None, title_nodes=None):
@@ -6180,14 +6643,17 @@ class Library(object):
             return None
 
         refs = []
-        try:
-            re_string = self.get_regex_string(title, lang, anchored=stIsAnchored)
-        except AttributeError as e:
-            logger.warning(
-                "Library._internal_ref_from_string() failed to create regex for: {}.  {}".format(title, e))
-            return refs
-
-        reg = regex.compile(re_string, regex.VERBOSE)
+        key = (title, lang, stIsAnchored)
+        reg = self._ref_regexes.get(key)
+        if reg is None:
+            try:
+                re_string = self.get_regex_string(title, lang, anchored=stIsAnchored)
+            except AttributeError as e:
+                logger.warning(
+                    "Library._internal_ref_from_string() failed to create regex for: {}.  {}".format(title, e))
+                return refs
+            # setdefault, so that threads that compiled it at the same time use the same regex
+            reg = self._ref_regexes.setdefault(key, regex.compile(re_string, regex.VERBOSE))
         if stIsAnchored:
             m = reg.match(st)
             matches = [m] if m else []
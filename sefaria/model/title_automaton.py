@@ -0,0 +1,121 @@
+"""
+title_automaton.py
+Finds library titles in a string with a single pass over a trie of all titles, rather than with a regex alternation of
+every title (see Library.all_titles_regex()), which is slow to compile and needs hundreds of MB of re2 memory.
+
+The trie is a datrie double-array trie.  It is compact, and can be saved to disk so that worker processes load it in
+milliseconds instead of building it.  Saved tries are named by a checksum of their titles, so a stale file is never used.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import datrie
+
+import structlog
+logger = structlog.get_logger(__name__)
+
+
+class TitleAutomaton(object):
+    """
+    Matches titles the way Library.all_titles_regex() does:  a title must be followed by the end of the string or by
+    delimiters, which are consumed with the match.  The longest such title at the leftmost position wins, and
+    matches don't overlap.
+    """
+    DELIMITERS = frozenset(":., <")
+
+    def __init__(self, trie, first_chars, max_length):
+        self._trie = trie
+        self._first_chars = frozenset(first_chars)
+        self._max_length = max_length
+
+    @classmethod
+    def build(cls, titles):
+        titles = sorted(set(t for t in titles if t))  # datrie inserts much faster in order
+        alphabet = "".join(sorted(set("".join(titles))))
+        trie = datrie.BaseTrie(alphabet)
+        for title in titles:
+            trie[title] = 0
+        return cls(trie, {t[0] for t in titles}, max((len(t) for t in titles), default=0))
+
+    @staticmethod
+    def checksum(titles):
+        return hashlib.sha1("\n".join(sorted(set(titles))).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def cached(cls, titles, directory=None):
+        """
+        :param directory: optional. directory of saved automata. If given, load the automaton of `titles` from it, or
+        build it and save it there
+        """
+        if not directory:
+            return cls.build(titles)
+        path = os.path.join(directory, "titles-{}.trie".format(cls.checksum(titles)))
+        try:
+            return cls.load(path)
+        except (IOError, OSError, ValueError, KeyError, datrie.DatrieError):
+            pass  # not saved yet, or unreadable
+        automaton = cls.build(titles)
+        try:
+            automaton.save(path)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to save title automaton to {}: {}".format(path, e))
+        return automaton
+
+    @classmethod
+    def load(cls, path):
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        return cls(datrie.BaseTrie.load(path), meta["first_chars"], meta["max_length"])
+
+    def save(self, path):
+        """
+        Writes to temporary files and renames them, so that processes loading concurrently never see a partial file
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        for suffix, write in ((".json", self._write_meta), ("", self._trie.save)):
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            os.close(fd)
+            write(tmp_path)
+            os.replace(tmp_path, path + suffix)
+
+    def _write_meta(self, path):
+        with open(path, "w") as f:
+            json.dump({"first_chars": "".join(sorted(self._first_chars)), "max_length": self._max_length}, f)
+
+    def __len__(self):
+        return len(self._trie)
+
+    def __contains__(self, title):
+        return title in self._trie
+
+    def finditer(self, s):
+        """
+        :return: generator of (title, start) for every title found in `s`
+        """
+        i = 0
+        n = len(s)
+        while i < n:
+            if s[i] in self._first_chars:
+                end = self._match_end(s, i)
+                if end is not None:
+                    title_end, i = end
+                    yield s[title_end[0]:title_end[1]], title_end[0]
+                    continue
+            i += 1
+
+    def _match_end(self, s, i):
+        """
+        :return: ((start, end) of the title, end of the match including delimiters), or None if no title matches at i
+        """
+        n = len(s)
+        for title in reversed(self._trie.prefixes(s[i:i + self._max_length])):  # prefixes() is shortest first
+            end = i + len(title)
+            if end == n or s[end] in self.DELIMITERS:
+                match_end = end
+                while match_end < n and s[match_end] in self.DELIMITERS:
+                    match_end += 1
+                return (i, end), match_end
+        return None
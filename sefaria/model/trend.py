@@ -431,7 +431,7 @@ def user_stats_data(uid):
     from sefaria.sheets import user_sheets
 
     uid = int(uid)
-    user_stats_dict = user_profile.public_user_data(uid)
+    user_stats_dict = dict(user_profile.public_user_data(uid))  # a copy, not the cached summary
 
     # All of user's sheets
     usheets = user_sheets(uid)["sheets"]
@@ -5,6 +5,7 @@ import bleach
 import sys
 import json
 import csv
+import threading
 from datetime import datetime
 from django.utils.translation import ugettext as _, ungettext_lazy
 from random import randint
@@ -20,18 +21,33 @@ if not hasattr(sys, '_doc_build'):
     from django.core.validators import URLValidator, EmailValidator
     from django.core.exceptions import ValidationError
     from anymail.exceptions import AnymailRecipientsRefused
+    from django.db.models.signals import post_save
 
 from . import abstract as abst
 from sefaria.model.following import FollowersSet, FolloweesSet, general_follow_recommendations
 from sefaria.model.blocking import BlockersSet, BlockeesSet
 from sefaria.model.text import Ref, TextChunk
 from sefaria.system.database import db
+from sefaria.system.cache import InMemoryCache, get_cache_factory, delete_cache_elem
 from sefaria.utils.util import epoch_time
 from django.utils import translation
 
 import structlog
 logger = structlog.get_logger(__name__)
 
+try:
+    from sefaria.settings import PUBLIC_USER_DATA_CACHE_TIMEOUT
+except ImportError:
+    PUBLIC_USER_DATA_CACHE_TIMEOUT = 60 * 60 * 24
+try:
+    from sefaria.settings import PUBLIC_USER_DATA_LOCAL_TIMEOUT
+except ImportError:
+    PUBLIC_USER_DATA_LOCAL_TIMEOUT = 60
+try:
+    from sefaria.settings import PUBLIC_USER_DATA_CACHE_MAX_ENTRIES
+except ImportError:
+    PUBLIC_USER_DATA_CACHE_MAX_ENTRIES = 10000
+
 
 class UserHistory(abst.AbstractMongoRecord):
     collection = 'user_history'
@@ -304,6 +320,16 @@ class UserWrapper(object):
             return False
 
 
+def name_slug(first_name, last_name):
+    """
+    Returns the profile slug for a name, before a number is added to tell it from existing ones
+    """
+    slug = "%s-%s" % (first_name, last_name)
+    slug = slug.lower()
+    slug = slug.replace(" ", "-")
+    return re.sub(r"[^a-z0-9\-]", "", slug)
+
+
 class UserProfile(object):
     def __init__(self, user_obj=None, id=None, slug=None, email=None, user_registration=False):
         """
@@ -511,6 +537,8 @@ class UserProfile(object):
             user.save()
             self._name_updated = False
 
+        invalidate_public_user_data(self.id)
+
         if self._process_remove_history:
             self.delete_user_history()
             self._process_remove_history = False
@@ -562,10 +590,7 @@ class UserProfile(object):
         Set the slug according to the profile name,
         using the first available number at the end if duplicated exist
         """
-        slug = "%s-%s" % (self.first_name, self.last_name)
-        slug = slug.lower()
-        slug = slug.replace(" ", "-")
-        slug = re.sub(r"[^a-z0-9\-]", "", slug)
+        slug = name_slug(self.first_name, self.last_name)
         self.slug = slug
         dupe_count = 0
         while self.errors():
@@ -817,32 +842,150 @@ def email_unread_notifications(timeframe):
             translation.deactivate()
 
 
-public_user_data_cache = {}
-def public_user_data(uid, ignore_cache=False):
-    """Returns a dictionary with common public data for `uid`"""
-    if uid in public_user_data_cache and not ignore_cache:
-        return public_user_data_cache[uid]
+class PublicUserDataStats(object):
+    def __init__(self):
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def incr(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def contents(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        contents = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+        contents["hit_rate"] = (self.local_hits + self.shared_hits) / lookups if lookups else None
+        return contents
+
+
+# Summaries are kept in the django cache for PUBLIC_USER_DATA_CACHE_TIMEOUT seconds, and in a bounded tier in each
+# process for PUBLIC_USER_DATA_LOCAL_TIMEOUT seconds.  Saving a profile or user clears both, though other
+# processes can keep a changed summary until their local copy expires.
+public_user_data_cache = InMemoryCache(max_entries=PUBLIC_USER_DATA_CACHE_MAX_ENTRIES)
+public_user_data_stats = PublicUserDataStats()
 
-    profile = UserProfile(id=uid)
+
+def _public_user_data_key(uid):
+    return "public_user_data:{}".format(uid)
+
+
+def _normalize_uid(uid):
     try:
-        user = User.objects.get(id=uid)
-        is_staff = user.is_staff()
-    except:
-        is_staff = False
-
-    data = {
-        "name": profile.full_name,
-        "profileUrl": "/profile/" + profile.slug,
-        "imageUrl": profile.profile_pic_url_small,
-        "position": profile.position,
-        "organization": profile.organization,
-        "isStaff": is_staff,
-        "uid": uid
-    }
-    public_user_data_cache[uid] = data
+        return int(uid)
+    except (TypeError, ValueError):
+        return uid
+
+
+def bulk_user_profiles(uids):
+    """
+    Returns a dictionary mapping each of `uids` that has a user record or a profile to its email, first and last name,
+    and its profile's slug, small profile picture, position and organization, with the defaults UserProfile has for
+    what's missing.  Makes one query for users and one for profiles, for any number of uids.
+    Users who don't have a profile yet get the slug UserProfile would assign them, though it isn't saved.
+    """
+    users = {u["id"]: u for u in User.objects.filter(id__in=[uid for uid in uids if isinstance(uid, int)]).values("id", "email", "first_name", "last_name")}
+    profiles = {p["id"]: p for p in db.profiles.find({"id": {"$in": list(uids)}}, {"id": 1, "slug": 1, "profile_pic_url_small": 1, "position": 1, "organization": 1})}
+    user_profiles = {}
+    for uid in set(users) | set(profiles):
+        user = users.get(uid) or {"id": uid, "email": "test@sefaria.org", "first_name": "User", "last_name": str(uid)}
+        profile = profiles.get(uid, {})
+        user_profiles[uid] = dict(user,
+            slug=profile.get("slug") or (name_slug(user["first_name"], user["last_name"]) if uid in users else ""),
+            profile_pic_url_small=profile.get("profile_pic_url_small", ""),
+            position=profile.get("position", ""),
+            organization=profile.get("organization", ""),
+        )
+    return user_profiles
+
+
+def _load_public_user_data(uids):
+    """
+    Returns a dict mapping each of `uids` to its public data, with one query for users and one for profiles
+    """
+    user_profiles = bulk_user_profiles(uids)
+    data = {}
+    for uid in uids:
+        profile = user_profiles.get(uid, {"first_name": "User", "last_name": str(uid), "slug": "", "profile_pic_url_small": "", "position": "", "organization": ""})
+        data[uid] = {
+            "name": profile["first_name"] + " " + profile["last_name"],
+            "profileUrl": "/profile/" + profile["slug"],
+            "imageUrl": profile["profile_pic_url_small"],
+            "position": profile["position"],
+            "organization": profile["organization"],
+            "isStaff": False,  # staff status isn't public. see is_user_staff()
+            "uid": uid
+        }
     return data
 
 
+def public_user_data_many(uids, ignore_cache=False):
+    """
+    Returns a dictionary mapping each of `uids` to the dictionary `public_user_data` returns for it.
+    Whatever isn't cached is loaded with one query for users and one for profiles.
+    """
+    uids = {uid: _normalize_uid(uid) for uid in uids}
+    found = {}
+    if not ignore_cache:
+        for uid in set(uids.values()):
+            data = public_user_data_cache.get(uid, namespace="public_user_data")
+            if data is not None:
+                found[uid] = data
+        public_user_data_stats.incr("local_hits", len(found))
+        missing = [uid for uid in set(uids.values()) if uid not in found]
+        if missing:
+            shared = get_cache_factory(None).get_many([_public_user_data_key(uid) for uid in missing])
+            for uid in missing:
+                data = shared.get(_public_user_data_key(uid))
+                if data is not None:
+                    found[uid] = data
+                    public_user_data_cache.set(uid, data, timeout=PUBLIC_USER_DATA_LOCAL_TIMEOUT, namespace="public_user_data")
+                    public_user_data_stats.incr("shared_hits")
+
+    missing = [uid for uid in set(uids.values()) if uid not in found]
+    if missing:
+        public_user_data_stats.incr("misses", len(missing))
+        loaded = _load_public_user_data(missing)
+        get_cache_factory(None).set_many({_public_user_data_key(uid): data for uid, data in loaded.items()}, PUBLIC_USER_DATA_CACHE_TIMEOUT)
+        for uid, data in loaded.items():
+            public_user_data_cache.set(uid, data, timeout=PUBLIC_USER_DATA_LOCAL_TIMEOUT, namespace="public_user_data")
+        found.update(loaded)
+    return {uid: found[normalized] for uid, normalized in uids.items()}
+
+
+def public_user_data(uid, ignore_cache=False):
+    """Returns a dictionary with common public data for `uid`"""
+    return public_user_data_many([uid], ignore_cache=ignore_cache)[uid]
+
+
+def invalidate_public_user_data(uid):
+    """
+    Clears the cached public data for `uid`, here and in the django cache
+    """
+    uid = _normalize_uid(uid)
+    public_user_data_stats.incr("invalidations")
+    public_user_data_cache.delete(uid)
+    delete_cache_elem(_public_user_data_key(uid))
+
+
+def public_user_data_cache_stats():
+    """
+    :return: dict of hit counts and rate, and the entries and bytes held in this process
+    """
+    local = public_user_data_cache.stats()
+    return dict(public_user_data_stats.contents(), entries=local["entries"], bytes=local["bytes"])
+
+
+def _invalidate_user_public_data(sender, instance, **kwargs):
+    invalidate_public_user_data(instance.id)
+
+
+if not hasattr(sys, '_doc_build'):
+    post_save.connect(_invalidate_user_public_data, sender=User, dispatch_uid="invalidate_public_user_data")
+
+
 def user_name(uid):
     """Returns a string of a user's full name"""
     data = public_user_data(uid)
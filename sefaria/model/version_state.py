@@ -1,9 +1,16 @@
 """
 version_state.py
-Writes to MongoDB Collection:
+Writes to MongoDB Collection: vstate, vstate_locks
 """
+import copy
+import threading
+import time
+import uuid
 import structlog
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from functools import reduce
+from pymongo.errors import DuplicateKeyError
 
 
 logger = structlog.get_logger(__name__)
@@ -13,8 +20,10 @@ from . import text
 from . import link
 from .text import VersionSet, AbstractIndex, AbstractSchemaContent, IndexSet, library, Ref
 from sefaria.datatype.jagged_array import JaggedTextArray, JaggedIntArray
-from sefaria.system.exceptions import InputError, BookNameError
+from sefaria.datatype.flat_jagged_array import FlatJaggedTextArray, FlatJaggedIntArray
+from sefaria.system.exceptions import InputError, BookNameError, LockTimeoutError
 from sefaria.system.cache import delete_template_cache
+from sefaria.system.database import db
 try:
     from sefaria.settings import USE_VARNISH
 except ImportError:
@@ -22,6 +31,49 @@ except ImportError:
 '''
 '''
 
+LOCK_LEASE = 60  # seconds a lock on a VersionState is held for without being renewed. Its holder renews it while alive.
+LOCK_WAIT = 120  # seconds to wait for a lock held by another update
+
+
+@contextmanager
+def version_state_lock(title, wait=LOCK_WAIT, lease=LOCK_LEASE):
+    """
+    Holds a lock on the VersionState of `title`, shared by all processes, so that updates which load, change and save
+    the record don't save over each other's changes.  Waits while another update holds it.
+    The lock is a lease, which a thread renews while it's held, so that the lock of a process that died is taken over
+    once its lease runs out, but a slow update keeps its lock.
+    Writes to MongoDB Collection: vstate_locks
+    :param title: Index title
+    :param wait: seconds to wait for the lock before raising LockTimeoutError
+    :param lease: seconds the lock is held for between renewals
+    """
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            db.vstate_locks.insert_one({"_id": title, "owner": owner, "expires": datetime.utcnow() + timedelta(seconds=lease)})
+            break
+        except DuplicateKeyError:
+            db.vstate_locks.delete_one({"_id": title, "expires": {"$lt": datetime.utcnow()}})
+            if time.monotonic() > deadline:
+                raise LockTimeoutError(title, wait)
+            time.sleep(0.05)
+
+    released = threading.Event()
+
+    def renew():
+        while not released.wait(lease / 3):
+            db.vstate_locks.update_one({"_id": title, "owner": owner}, {"$set": {"expires": datetime.utcnow() + timedelta(seconds=lease)}})
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+        yield
+    finally:
+        released.set()
+        renewer.join()
+        db.vstate_locks.delete_one({"_id": title, "owner": owner})
+
 
 class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
     """
@@ -150,9 +202,45 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
     def refresh(self):
         if self.is_new_state:  # refresh done on init
             return
+        with version_state_lock(self.title):
+            self._refresh()
+
+    def _refresh(self):
         self.content = self.index.nodes.visit_content(self._content_node_visitor, self.content)
-        self.index.nodes.visit_structure(self._aggregate_structure_state, self)
         self.linksCount = link.LinkSet(Ref(self.index.title)).count()
+        self._save_refreshed()
+
+    def refresh_ref(self, oref, lang, old_text, new_text):
+        """
+        Updates the state for an edit of one version's text, by patching the counts of the edited section,
+        without loading any versions.  Falls back to refresh() for edits that it can't patch,
+        e.g. ones that remove positions from the text, or are ranges.
+        linksCount is left as is, since edits don't change links.  Links saved without a refresh leave it behind, which
+        check_consistency() reports.
+        The patch is made to the saved state, reloaded under version_state_lock(), so that it keeps the changes of
+        other edits saved since this record was loaded.  scripts/scheduled/check_vstate_consistency.py repairs
+        states that drift from their versions anyway.
+        :param oref: Ref of the edited text
+        :param lang: language of the edited version
+        :param old_text: text of the version at `oref` before the edit
+        :param new_text: text of the version at `oref` after the edit
+        :return: True if the state was patched, False if it was refreshed
+        """
+        if self.is_new_state:  # refresh done on init
+            return False
+        with version_state_lock(self.title):
+            self.load({"title": self.title})
+            try:
+                self._patch_node_state(oref, lang, old_text, new_text)
+            except ValueError as e:
+                logger.info("Refreshing VersionState of {} after edit of {}: {}".format(self.title, oref.normal(), e))
+                self._refresh()
+                return False
+            self._save_refreshed()
+        return True
+
+    def _save_refreshed(self):
+        self.index.nodes.visit_structure(self._aggregate_structure_state, self)
         fsr = self._first_section_ref()
         self.first_section_ref = fsr.normal() if fsr else None
         self.save()
@@ -204,28 +292,36 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
         """
         assert len(contents) == 1
         current = contents[0]  # some information is manually set - don't wipe and re-create it.   todo: just copy flags?
-        depth = snode.depth  # This also acts as an assertion that we have a SchemaContentNode
-        ja = {}  # JaggedIntArrays for each language and 'all'
-        padded_ja = {}  # Padded JaggedIntArrays for each language
 
-        # Get base counts for each language
+        # Get base counts - JaggedIntArrays for each language and 'all', and padded JaggedIntArrays for each language
+        try:
+            ja, padded_ja = self._node_counts(snode, flat=True)
+        except ValueError:
+            # Some version isn't a regular jagged array
+            ja, padded_ja = self._node_counts(snode)
+        return self._set_node_state(snode, current, ja, padded_ja)
+
+    def _set_node_state(self, snode, current, ja, padded_ja):
+        """
+        Sets the counts of a content node, and the data derived from them
+        :param snode: SchemaContentNode
+        :param current: the content node of self.content, modified in place
+        :param ja: JaggedIntArrays of counts for each language and '_all'
+        :param padded_ja: JaggedIntArrays of counts for each language, padded with zeros to the shape of '_all'
+        :return: current
+        """
+        depth = snode.depth  # This also acts as an assertion that we have a SchemaContentNode
         for lang, lkey in list(self.lang_map.items()):
             if not current.get(lkey):
                 current[lkey] = {}
 
-            ja[lkey] = self._node_count(snode, lang)
-
-        # Sum all of the languages
-        ja['_all'] = reduce(lambda x, y: x + y, [ja[lkey] for lkey in self.lang_keys])
-        zero_mask = ja['_all'].zero_mask()
         current["_all"] = {
             "availableTexts": ja['_all'].array(),
             "shape": ja['_all'].shape()
         }
         # Get derived data for all languages
         for lang, lkey in list(self.lang_map.items()):
-            # build zero-padded count ("availableTexts")
-            padded_ja[lkey] = ja[lkey] + zero_mask
+            # zero-padded count ("availableTexts")
             current[lkey]["availableTexts"] = padded_ja[lkey].array()
 
             # number of units at each level ("availableCounts") from raw counts
@@ -261,23 +357,142 @@ class VersionState(abst.AbstractMongoRecord, AbstractSchemaContent):
 
         return current
 
-    def _node_count(self, snode, lang="en"):
+    def _node_counts(self, snode, flat=False):
+        """
+        Count available versions of a text in each language, and in all of them
+        :param flat: Count with FlatJaggedIntArrays, which are faster on whole books. Raises ValueError on irregular texts.
+        :return: (dict of counts for each language and '_all', dict of counts for each language padded with zeros to the shape of '_all')
+        """
+        ja = {lkey: self._node_count(snode, lang, flat) for lang, lkey in list(self.lang_map.items())}
+
+        # Sum all of the languages
+        ja['_all'] = reduce(lambda x, y: x + y, [ja[lkey] for lkey in self.lang_keys])
+        zero_mask = ja['_all'].zero_mask()
+        padded_ja = {lkey: ja[lkey] + zero_mask for lkey in self.lang_keys}
+        return ja, padded_ja
+
+    def _node_count(self, snode, lang="en", flat=False):
         """
         Count available versions of a text in the db, segment by segment.
+        :param flat: Count with FlatJaggedIntArrays. Raises ValueError on irregular texts.
         :return counts:
-        :type return: JaggedIntArray
+        :type return: JaggedIntArray or FlatJaggedIntArray
         """
-        counts = JaggedIntArray()
+        counts = FlatJaggedIntArray.from_nested([]) if flat else JaggedIntArray()
 
         versions = self.versions(lang)
         for version in versions:
             raw_text_ja = version.content_node(snode)
-            ja = JaggedTextArray(raw_text_ja)
+            if flat:
+                ja = FlatJaggedTextArray.from_nested(raw_text_ja if raw_text_ja is not None else [])
+            else:
+                ja = JaggedTextArray(raw_text_ja)
             mask = ja.mask()
             counts = counts + mask
 
         return counts
 
+    def _patch_node_state(self, oref, lang, old_text, new_text):
+        """
+        Patches the counts of the content node of `oref` for an edit, and recalculates the data derived from them
+        :raise ValueError: if the edit can't be patched into the stored counts
+        """
+        snode = oref.index_node
+        if oref.is_range() or snode.has_children() or snode.is_virtual:
+            raise ValueError("Can't patch counts for {}".format(oref.normal()))
+        current = self.content_node(snode)
+        lkey = self.lang_map[lang]
+        if any("availableTexts" not in current.get(key, {}) for key in (lkey, "_all")):
+            raise ValueError("No counts for {}".format(oref.normal()))
+        address = [s - 1 for s in oref.sections]
+        old_mask, new_mask = [JaggedTextArray(t if t is not None else "").mask().array() for t in (old_text, new_text)]
+
+        for key in (lkey, "_all"):
+            current[key]["availableTexts"] = self._patch_counts(current[key]["availableTexts"], address, old_mask, new_mask, snode.depth)
+
+        ja = {"_all": JaggedIntArray(current["_all"]["availableTexts"])}
+        zero_mask = ja["_all"].zero_mask()
+        for key in self.lang_keys:
+            ja[key] = JaggedIntArray(current[key]["availableTexts"]) + zero_mask
+        self._set_node_state(snode, current, ja, ja)
+
+    @classmethod
+    def _patch_counts(cls, counts, address, old_mask, new_mask, depth):
+        """
+        Adds the change in one version's mask at `address` to counts of versions, growing counts the way the version grew.
+        :param counts: nested list of counts of a content node. Modified in place.
+        :param address: zero based indexes of the edited text
+        :param old_mask: mask of the version's text at `address` before the edit
+        :param new_mask: mask of the version's text at `address` after the edit
+        :param depth: depth of the content node
+        :return: the patched counts
+        :raise ValueError: if the edit removes positions, or doesn't match the structure of the counts
+        """
+        root = [counts]
+        parent, i = root, 0
+        for j in address:
+            # Pad with empty sections, like JaggedArray.set_element()
+            parent.extend([] for _ in range(len(parent), i + 1))
+            if not isinstance(parent[i], list):
+                raise ValueError("Counts aren't a list at {}".format(address))
+            parent, i = parent[i], j
+        cls._add_mask_difference(parent, i, old_mask, new_mask, depth - len(address))
+        return root[0]
+
+    @classmethod
+    def _add_mask_difference(cls, parent, i, old, new, depth):
+        """
+        Adds new - old to parent[i]
+        :param depth: number of levels below parent[i]
+        """
+        if depth > 0 and old == 0:
+            old = []  # missing section
+        if depth == 0:
+            if isinstance(old, list) or isinstance(new, list):
+                raise ValueError("Edit is deeper than the text")
+            parent.extend([0] * (i + 1 - len(parent)))
+            if isinstance(parent[i], list):
+                raise ValueError("Counts are deeper than the text")
+            parent[i] += new - old
+            return
+
+        if not (isinstance(old, list) and isinstance(new, list)):
+            raise ValueError("Edit is shallower than the text")
+        if len(new) < len(old):
+            raise ValueError("Edit removes positions")
+        if i > len(parent):
+            raise ValueError("Edit adds a section after a gap")
+        if i == len(parent):
+            parent.append([])
+        if not isinstance(parent[i], list):
+            raise ValueError("Counts are shallower than the text")
+        for j, n in enumerate(new):
+            cls._add_mask_difference(parent[i], j, old[j] if j < len(old) else 0, n, depth - 1)
+
+    def check_consistency(self):
+        """
+        Compares the stored counts with counts rebuilt from the versions, and linksCount with a count of the links,
+        without saving anything.
+        Used to check that incremental updates (refresh_ref()) agree with full ones (refresh()).
+        :return: list of (node address, language key, attribute, stored value, rebuilt value) for each difference.
+        A difference in linksCount has an empty address and language key.
+        """
+        rebuilt = self.index.nodes.visit_content(self._content_node_visitor, copy.deepcopy(self.content))
+        differences = []
+        for snode in self.index.nodes.get_leaf_nodes():
+            if snode.is_virtual:
+                continue
+            address = snode.version_address()
+            stored_node = reduce(lambda d, k: d[k], address, self.content)
+            rebuilt_node = reduce(lambda d, k: d[k], address, rebuilt)
+            for lkey in self.lang_keys + ["_all"]:
+                for attr, value in rebuilt_node[lkey].items():
+                    if stored_node.get(lkey, {}).get(attr) != value:
+                        differences.append((address, lkey, attr, stored_node.get(lkey, {}).get(attr), value))
+        links_count = link.LinkSet(Ref(self.index.title)).count()
+        if getattr(self, "linksCount", None) != links_count:
+            differences.append(([], "", "linksCount", getattr(self, "linksCount", None), links_count))
+        return differences
 
     @classmethod
     def _calc_text_structure_completeness(cls, text_depth, structure):
@@ -1,8 +1,10 @@
 # implementation of pagerank with low ram requirements
 # source: http://michaelnielsen.org/blog/using-your-laptop-to-compute-pagerank-for-millions-of-webpages/
 
+import os
 import re
 import math
+import tempfile
 import numpy
 import random
 import json
@@ -72,13 +74,108 @@ def create_web(g):
     for i, (r, links) in enumerate(g):
         r_ind = node2index[r]
         link_inds = [(node2index[r_temp], count) for r_temp, count in list(links.items())]
-        w.in_links[r_ind] = reduce(lambda a, b: a + [b[0]] * int(round(b[1])), link_inds, [])
+        in_links = []
+        for j, count in link_inds:
+            in_links += [j] * int(round(count))
+        w.in_links[r_ind] = in_links
         for j, count in link_inds:
             if w.number_out_links[j] == 0: w.dangling_pages.pop(j)
             w.number_out_links[j] += count
     return w
 
 
+def web_to_graph(w):
+    """
+    Converts a `web` (e.g. from random_web()) to the list of (node, {in_link_node: count}) pairs accepted by pagerank()
+    """
+    graph = []
+    for j in range(w.size):
+        in_counts = defaultdict(int)
+        for k in w.in_links[j]:
+            in_counts[k] += 1
+        graph += [(j, dict(in_counts))]
+    return graph
+
+
+class sparse_web:
+    """
+    Link graph in coordinate (COO) form. Edge i moves rank from node src[i] to node dst[i], scaled by weight[i],
+    which is the edge multiplicity divided by the total out-weight of src[i].
+    `dangling` is a boolean mask of nodes with no out links.
+    """
+    def __init__(self, n, dst, src, multiplicity, out_weight, dangling):
+        self.size = n
+        self.dst = dst
+        self.src = src
+        self.dangling = dangling
+        self.weight = numpy.divide(multiplicity, out_weight[src], out=numpy.zeros(len(src)), where=out_weight[src] != 0)
+
+
+def create_sparse_web(g):
+    """
+    Builds a sparse_web from the same input as create_web(), in time linear in the number of edges.
+    Mirrors create_web() exactly: in-link multiplicity is the rounded edge weight while out-weight sums the raw weights.
+    """
+    n = len(g)
+    node2index = {r: i for i, r in enumerate([x[0] for x in g])}
+    num_edges = sum(len(links) for _, links in g)
+    dst = numpy.empty(num_edges, dtype=numpy.int64)
+    src = numpy.empty(num_edges, dtype=numpy.int64)
+    counts = numpy.empty(num_edges, dtype=numpy.float64)
+    e = 0
+    for i, (r, links) in enumerate(g):
+        for r_temp, count in links.items():
+            dst[e] = i
+            src[e] = node2index[r_temp]
+            counts[e] = count
+            e += 1
+    return sparse_web_from_edges(n, dst, src, counts)
+
+
+def sparse_web_from_web(w):
+    dst = numpy.fromiter((j for j in range(w.size) for _ in w.in_links[j]), dtype=numpy.int64)
+    src = numpy.fromiter((k for j in range(w.size) for k in w.in_links[j]), dtype=numpy.int64)
+    return sparse_web_from_edges(w.size, dst, src, numpy.ones(len(src)))
+
+
+def sparse_web_from_edges(n, dst, src, counts):
+    """
+    :param n: number of nodes
+    :param dst: int array. node receiving each edge
+    :param src: int array. node each edge comes from
+    :param counts: float array. weight of each edge
+    """
+    out_weight = numpy.bincount(src, weights=counts, minlength=n)
+    has_out_links = numpy.zeros(n, dtype=bool)
+    has_out_links[src] = True
+    return sparse_web(n, dst, src, numpy.rint(counts), out_weight, ~has_out_links)
+
+
+def sparse_step(sw, p, s=0.85):
+    """
+    Same as step(), but vectorized over the edges of a sparse_web. p is a 1-D array.
+    """
+    v = s * numpy.bincount(sw.dst, weights=sw.weight * p[sw.src], minlength=sw.size)
+    v += (s * p[sw.dangling].sum() + (1 - s)) / sw.size
+    return v / numpy.sum(v)
+
+
+def sparse_power_iteration(sw, s=0.85, tolerance=0.00001, maxiter=100, verbose=False):
+    p = numpy.ones(sw.size) / sw.size
+    iteration = 1
+    change = 2
+    while change > tolerance and iteration < maxiter:
+        if verbose:
+            print("Iteration: %s" % iteration)
+        new_p = sparse_step(sw, p, s)
+        change = numpy.sum(numpy.abs(p - new_p))
+        if verbose:
+            print("Change in l1 norm: %s" % change)
+        p = new_p
+        iteration += 1
+    return p
+
+
 def step(w, p, s=0.85):
     '''Performs a single step in the PageRank computation,
     with web g and parameter s.  Applies the corresponding M
@@ -96,7 +193,10 @@ def step(w, p, s=0.85):
     return v / numpy.sum(v)
 
 
-def pagerank(g, s=0.85, tolerance=0.00001, maxiter=100, verbose=False, normalize=False):
+def legacy_pagerank(g, s=0.85, tolerance=0.00001, maxiter=100, verbose=False, normalize=False):
+    """
+    Original pure-Python implementation of pagerank(). Very slow on large graphs; kept as a reference for tests and benchmarks.
+    """
     w = create_web(g)
     n = w.size
     p = numpy.matrix(numpy.ones((n, 1))) / n
@@ -112,10 +212,6 @@ def pagerank(g, s=0.85, tolerance=0.00001, maxiter=100, verbose=False, normalize
         p = new_p
         iteration += 1
     if normalize:
-        # This is interesting and nerdy, but min seems to do the exact same thing
-        # dangling_pr_sum = sum(p[j] for j in w.dangling_pages.keys())
-        # norm_factor = ((1-s) + s*dangling_pr_sum)/w.size  # see: https://www2007.org/posters/poster893.pdf
-        # p /= norm_factor
         try:
             p /= p.min()
         except ValueError:
@@ -124,6 +220,23 @@ def pagerank(g, s=0.85, tolerance=0.00001, maxiter=100, verbose=False, normalize
     return {k: v for k, v in zip([x[0] for x in g], pr_list)}
 
 
+def pagerank(g, s=0.85, tolerance=0.00001, maxiter=100, verbose=False, normalize=False):
+    """
+    :param g: list of (node, {in_link_node: weight}) pairs. Every in_link_node must itself be a node in g.
+    :return: dict from node to pagerank
+    """
+    if len(g) == 0:
+        return {}
+    p = sparse_power_iteration(create_sparse_web(g), s, tolerance, maxiter, verbose)
+    if normalize:
+        # This is interesting and nerdy, but min seems to do the exact same thing
+        # dangling_pr_sum = sum(p[j] for j in w.dangling_pages.keys())
+        # norm_factor = ((1-s) + s*dangling_pr_sum)/w.size  # see: https://www2007.org/posters/poster893.pdf
+        # p /= norm_factor
+        p /= p.min()
+    return {k: v for k, v in zip([x[0] for x in g], p.tolist())}
+
+
 def has_intersection(a, b):
     for temp_a in a:
         if temp_a in b:
@@ -131,37 +244,71 @@ def has_intersection(a, b):
     return False
 
 
-def init_pagerank_graph(ref_list=None):
+def is_tanach(r):
+    return r.index.title in tanach_indexes
+
+
+def link_year(oref, year_cache=None):
+    """
+    :param year_cache: optional dict from index title to year, to avoid recomputing best_time_period() for every link
+    :return: estimated year the Index of `oref` was written, or 3000 if unknown
+    """
+    title = oref.index.title
+    if year_cache is not None and title in year_cache:
+        return year_cache[title]
+    tp = oref.index.best_time_period()
+    year = int(tp.determine_year_estimate()) if tp else 3000
+    if year_cache is not None:
+        year_cache[title] = year
+    return year
+
+
+def order_pagerank_link(refs, year_cache=None, allow_equal_dates=True):
     """
-    :param ref_list: optional list of refs to use instead of using all links. link graph is built from all links to these refs
+    :param refs: the two Refs of a link
+    :return: (older_ref, newer_ref), both padded, or None if the refs are equally dated and `allow_equal_dates` is False.
+    Equally dated refs are ordered randomly.
+    """
+    start1 = link_year(refs[0], year_cache)
+    start2 = link_year(refs[1], year_cache)
+
+    older_ref, newer_ref = (refs[0], refs[1]) if start1 < start2 else (refs[1], refs[0])
+    older_ref = older_ref.padded_ref()
+    newer_ref = newer_ref.padded_ref()
+    if start1 == start2:
+        if not allow_equal_dates:
+            return None
+        # randomly switch refs that are equally dated
+        older_ref, newer_ref = (older_ref, newer_ref) if random.choice([True, False]) else (newer_ref, older_ref)
+    return older_ref, newer_ref
+
+
+def expand_pagerank_link(ref1, ref2):
+    """
+    Yields the (ref1, ref2) pairs a link contributes to the pagerank graph. Section level links are ignored and ranges are
+    split into their segments.
+    """
+    if ref1.is_section_level() or ref2.is_section_level():
+        return  # ignore section level
+    elif ref1.is_range():
+        for ref1_seg in ref1.range_list():
+            if ref2.is_range():
+                for ref2_seg in ref2.range_list():
+                    yield from expand_pagerank_link(ref1_seg, ref2_seg)
+            else:
+                yield from expand_pagerank_link(ref1_seg, ref2)
+    else:
+        yield ref1, ref2
+
+
+def init_pagerank_graph(ref_list):
+    """
+    Builds the graph of the links among a list of refs.  The graph of the whole library is built by stream_pagerank_graph()
+    :param ref_list: list of refs. link graph is built from the links between these refs
     :return: graph which is a double dict. the keys of both dicts are refs. the values are the number of incoming links
     between outer key and inner key
     """
 
-    def is_tanach(r):
-        return r.index.title in tanach_indexes
-
-    def recursively_put_in_graph(ref1, ref2, weight=1.0):
-        if ref1.is_section_level():
-            return  # ignore section level
-            seg_refs = ref1.all_segment_refs()
-            for ref1_seg in seg_refs:
-                recursively_put_in_graph(ref1_seg, ref2, weight / len(seg_refs))
-        elif ref2.is_section_level():
-            return  # ignore section level
-            seg_refs = ref2.all_segment_refs()
-            for ref2_seg in seg_refs:
-                recursively_put_in_graph(ref1, ref2_seg, weight / len(seg_refs))
-        elif ref1.is_range():
-            for ref1_seg in ref1.range_list():
-                if ref2.is_range():
-                    for ref2_seg in ref2.range_list():
-                        recursively_put_in_graph(ref1_seg, ref2_seg)
-                else:
-                    recursively_put_in_graph(ref1_seg, ref2)
-        else:
-            put_link_in_graph(ref1, ref2, weight)
-
     def put_link_in_graph(ref1, ref2, weight=1.0):
         str1 = ref1.normal()
         str2 = ref2.normal()
@@ -185,68 +332,41 @@ def init_pagerank_graph(ref_list=None):
         graph[str1][str2] += weight
 
     graph = OrderedDict()
-    if ref_list is None:
-        all_links = LinkSet()  # LinkSet({"type": re.compile(ur"(commentary|quotation)")}).array()
-        len_all_links = all_links.count()
-    else:
-        link_list = []
-        ref_list_seg_set = {rr.normal() for r in ref_list for rr in r.all_segment_refs()}
-        for oref in ref_list:
-            link_list += list(filter(lambda x: has_intersection(x.expandedRefs0, ref_list_seg_set) and has_intersection(x.expandedRefs1, ref_list_seg_set), oref.linkset()))
-        len_all_links = len(link_list)
-        all_links = LinkSet()
-        all_links.records = link_list
+    link_list = []
+    ref_list_seg_set = {rr.normal() for r in ref_list for rr in r.all_segment_refs()}
+    for oref in ref_list:
+        link_list += list(filter(lambda x: has_intersection(x.expandedRefs0, ref_list_seg_set) and has_intersection(x.expandedRefs1, ref_list_seg_set), oref.linkset()))
+    len_all_links = len(link_list)
     all_ref_cat_counts = {}
-    current_link, page, link_limit = 0, 0, 100000
-    if ref_list is None:
-        all_links = LinkSet(limit=link_limit, page=page)
-
-    while len(all_links.array()) > 0:
-        for link in all_links:  # raw records avoids caching the entire LinkSet into memory
-            if current_link % 1000 == 0 and current_link > 0:
-                print("{}/{}".format(current_link, len_all_links))
-
-            try:
-                # TODO pagerank segments except Talmud. Talmud is pageranked by section
-                # TODO if you see a section link, add pagerank to all of its segments
-                refs = [Ref(r) for r in link.refs]
-                tp1 = refs[0].index.best_time_period()
-                tp2 = refs[1].index.best_time_period()
-                start1 = int(tp1.determine_year_estimate()) if tp1 else 3000
-                start2 = int(tp2.determine_year_estimate()) if tp2 else 3000
-
-                older_ref, newer_ref = (refs[0], refs[1]) if start1 < start2 else (refs[1], refs[0])
-
-                temp_links = []
-                older_ref = older_ref.padded_ref()
-                newer_ref = newer_ref.padded_ref()
-                if start1 == start2:
-                    if ref_list is not None:
-                        continue  # looks like links at the same time span can cause a big increase in PR. I'm going to disable this right now for small graphs
-                    # randomly switch refs that are equally dated
-                    older_ref, newer_ref = (older_ref, newer_ref) if random.choice([True, False]) else (
-                    newer_ref, older_ref)
-                recursively_put_in_graph(older_ref, newer_ref)
-
-            except InputError:
-                pass
-            except TypeError as e:
-                print("TypeError")
-                print(link.refs)
-            except IndexError:
-                pass
-            except AssertionError:
-                pass
-            except ValueError:
-                print("ValueError")
-                print(link.refs)
-                pass
-            current_link += 1
-        if ref_list is None:
-            page += 1
-            all_links = LinkSet(limit=link_limit, page=page)
-        else:
-            break
+    year_cache = {}
+    for current_link, link in enumerate(link_list):
+        if current_link % 1000 == 0 and current_link > 0:
+            print("{}/{}".format(current_link, len_all_links))
+
+        try:
+            # TODO pagerank segments except Talmud. Talmud is pageranked by section
+            # TODO if you see a section link, add pagerank to all of its segments
+            refs = [Ref(r) for r in link.refs]
+            # looks like links at the same time span can cause a big increase in PR. I'm going to disable this right now for small graphs
+            ordered = order_pagerank_link(refs, year_cache, allow_equal_dates=False)
+            if ordered is None:
+                continue
+            for older_ref, newer_ref in expand_pagerank_link(*ordered):
+                put_link_in_graph(older_ref, newer_ref)
+
+        except InputError:
+            pass
+        except TypeError as e:
+            print("TypeError")
+            print(link.refs)
+        except IndexError:
+            pass
+        except AssertionError:
+            pass
+        except ValueError:
+            print("ValueError")
+            print(link.refs)
+            pass
 
     for ref in all_ref_cat_counts:
         if ref not in graph:
@@ -255,6 +375,127 @@ def init_pagerank_graph(ref_list=None):
     return graph, all_ref_cat_counts
 
 
+class PagerankGraphWriter(object):
+    """
+    Writes a pagerank graph to disk as it is built, so the graph never has to be held in memory as nested dicts.
+
+    Refs are interned to integer ids in the order they are first seen. Edges are buffered and appended in chunks to
+    raw little-endian arrays which load_pagerank_graph() memory-maps. Directory layout:
+        nodes.txt   - one normal tref per line. line i is node i
+        dst.i32     - int32 node receiving each edge (the older ref)
+        src.i32     - int32 node each edge comes from (the newer ref)
+        weight.f32  - float32 weight of each edge
+        meta.json   - node and edge counts
+    Repeated edges are not merged; the sparse engine sums them.
+    """
+    DTYPES = {"dst": "<i4", "src": "<i4", "weight": "<f4"}
+    EXTENSIONS = {"dst": "i32", "src": "i32", "weight": "f32"}
+
+    def __init__(self, path, chunk_size=1000000):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.node_ids = {}
+        self.num_edges = 0
+        os.makedirs(path, exist_ok=True)
+        self._nodes_file = open(os.path.join(path, "nodes.txt"), "w", encoding="utf-8")
+        self._edge_files = {key: open(self.edge_path(path, key), "wb") for key in self.DTYPES}
+        self._buffers = {key: [] for key in self.DTYPES}
+
+    @classmethod
+    def edge_path(cls, path, key):
+        return os.path.join(path, "{}.{}".format(key, cls.EXTENSIONS[key]))
+
+    def node_id(self, tref):
+        try:
+            return self.node_ids[tref]
+        except KeyError:
+            node_id = len(self.node_ids)
+            self.node_ids[tref] = node_id
+            self._nodes_file.write(tref + "\n")
+            return node_id
+
+    def add_edge(self, dst_id, src_id, weight=1.0):
+        self._buffers["dst"] += [dst_id]
+        self._buffers["src"] += [src_id]
+        self._buffers["weight"] += [weight]
+        if len(self._buffers["dst"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        for key, buffer in self._buffers.items():
+            numpy.asarray(buffer, dtype=self.DTYPES[key]).tofile(self._edge_files[key])
+        self.num_edges += len(self._buffers["dst"])
+        self._buffers = {key: [] for key in self.DTYPES}
+
+    def close(self):
+        self.flush()
+        self._nodes_file.close()
+        for f in self._edge_files.values():
+            f.close()
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"num_nodes": len(self.node_ids), "num_edges": self.num_edges}, f)
+
+
+def stream_pagerank_graph(path, query=None, chunk_size=1000000, tries=200):
+    """
+    Builds the pagerank graph for all links matching `query` with a single cursor over the raw link records, writing it
+    to `path` with PagerankGraphWriter. Links are added as init_pagerank_graph() adds them, except that the refs of
+    equally dated links are ordered randomly rather than skipped.
+    :return: path
+    """
+    query = query or {}
+    writer = PagerankGraphWriter(path, chunk_size)
+    year_cache = {}
+    last_id, current_link, failures = None, 0, 0
+    len_all_links = db.links.count_documents(query)
+    while True:
+        cursor_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        try:
+            for link in db.links.find(cursor_query, {"refs": 1}).sort("_id", 1):
+                last_id = link["_id"]
+                current_link += 1
+                if current_link % 100000 == 0:
+                    print("{}/{}".format(current_link, len_all_links))
+                try:
+                    refs = [Ref(r) for r in link["refs"]]
+                    for older_ref, newer_ref in expand_pagerank_link(*order_pagerank_link(refs, year_cache)):
+                        older_id = writer.node_id(older_ref.normal())
+                        newer_id = writer.node_id(newer_ref.normal())
+                        if older_id == newer_id or (is_tanach(older_ref) and is_tanach(newer_ref)):
+                            # self link
+                            continue
+                        writer.add_edge(older_id, newer_id)
+                except (InputError, IndexError, AssertionError):
+                    pass
+                except (TypeError, ValueError) as e:
+                    print("{}: {}".format(e.__class__.__name__, link.get("refs")))
+            break
+        except AutoReconnect as e:
+            failures += 1
+            if failures >= tries:
+                print("Tried: {} times".format(failures))
+                raise e
+            time.sleep(5)
+    writer.close()
+    return path
+
+
+def load_pagerank_graph(path):
+    """
+    :return: (list of trefs, sparse_web) for a graph written by PagerankGraphWriter. Edge arrays are memory-mapped.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(path, "nodes.txt"), encoding="utf-8") as f:
+        trefs = f.read().split("\n")[:meta["num_nodes"]]
+    edges = {
+        key: numpy.memmap(PagerankGraphWriter.edge_path(path, key), dtype=dtype, mode="r", shape=(meta["num_edges"],))
+        if meta["num_edges"] else numpy.empty(0, dtype=dtype)
+        for key, dtype in PagerankGraphWriter.DTYPES.items()
+    }
+    return trefs, sparse_web_from_edges(meta["num_nodes"], edges["dst"], edges["src"], edges["weight"])
+
+
 def pagerank_rank_ref_list(ref_list, normalize=False, seg_ref_map=None):
     """
     :param seg_ref_map: dict with keys that are ranged refs and values are list of segment trefs. pass in order to save from recomputing within this function
@@ -285,11 +526,16 @@ def pagerank_rank_ref_list(ref_list, normalize=False, seg_ref_map=None):
     return ref_list_with_pr
 
 
-def calculate_pagerank():
-    graph, all_ref_cat_counts = init_pagerank_graph()
-    # json.dump(graph.items(), open("{}pagerank_graph3.json".format(STATICFILES_DIRS[0]), "wb"))
-    ranked = pagerank(list(graph.items()), 0.85, verbose=True, tolerance=0.00005)
-    sorted_ranking = sorted(list(dict(ranked).items()), key=lambda x: x[1])
+def calculate_pagerank(graph_path=None):
+    """
+    :param graph_path: directory to write the link graph to. defaults to a temporary directory which is removed afterwards
+    """
+    with tempfile.TemporaryDirectory() as tmp_path:
+        graph_path = stream_pagerank_graph(graph_path or tmp_path)
+        trefs, sw = load_pagerank_graph(graph_path)
+        ranked = sparse_power_iteration(sw, 0.85, verbose=True, tolerance=0.00005) if sw.size else []
+        sorted_ranking = sorted(zip(trefs, numpy.asarray(ranked).tolist()), key=lambda x: x[1])
+        del sw
     count = 0
     smallest_pr = sorted_ranking[0][1]
     while count < len(sorted_ranking) and (sorted_ranking[count][1] - smallest_pr) < 1e-30:
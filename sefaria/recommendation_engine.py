@@ -1,12 +1,21 @@
 import django
 from functools import reduce
 django.setup()
+import numpy
 from collections import defaultdict
 from sefaria.model import *
 from sefaria.client.wrapper import get_links
+from sefaria.system.cache import in_memory_cache
 from sefaria.system.database import db
 from sefaria.system.exceptions import InputError
 from sefaria.model.schema import DictionaryEntryNode
+from sefaria.recommendation_index import load_recommendation_candidates
+import structlog
+logger = structlog.get_logger(__name__)
+try:
+    from sefaria.settings import USE_RECOMMENDATION_INDEX
+except ImportError:
+    USE_RECOMMENDATION_INDEX = False
 
 # TODO dont double count source and its commentary (might be costly)
 # TODO do better job of double author
@@ -17,6 +26,7 @@ COMMENTARY_LINK_SCORE = 0.7
 SHEET_REF_SCORE = 1.0
 INCLUDED_REF_MAX = 50
 REF_RANGE_MAX = 30
+SEGMENT_OFFSETS_TIMEOUT = 60 * 60  # seconds that a node's segment offsets are kept in the in-memory cache
 
 
 class RecommendationSource:
@@ -59,6 +69,7 @@ class Recommendation:
 
     def __iadd__(self, other):
         self.ref = self.ref if self.ref is not None else other.ref
+        self.novelty = self.novelty if self.novelty is not None else other.novelty
         self.relevance += other.relevance
         self.sources += other.sources
         return self
@@ -79,8 +90,9 @@ class Recommendation:
     @property
     def score(self):
         if self._score is None:
-            ref_data = RefData().load({"ref": self.ref.normal()})
-            self.novelty = ref_data.inverse_pagesheetrank() if ref_data is not None else 1.0
+            if self.novelty is None:
+                ref_data = RefData().load({"ref": self.ref.normal()})
+                self.novelty = ref_data.inverse_pagesheetrank() if ref_data is not None else 1.0
             self._score = self.relevance * self.novelty
         return self._score
 
@@ -90,6 +102,156 @@ class Recommendation:
         return len(filt) >= 2
 
 
+class SegmentOrdinals:
+    """
+    Integer positions of refs, so that refs can be sorted, measured and intersected with NumPy rather than with
+    `Ref.order_id()` strings, `Ref.distance()` and sets of normal refs.
+
+    A ref's order key is the `order_id()` prefix of its node, ranked among the nodes seen, and its sections. A segment's
+    offset is its position among all of the segments of its node, counted from the node's version state, so that the
+    difference of two offsets is their `Ref.distance()`.  Only nodes whose sections are all non-empty have offsets,
+    since `JaggedArray.distance()` skips some empty sections, and only segments within the version state have them.
+    Callers fall back to the `Ref` methods for refs without an order key or offset.
+
+    The offsets of a node are kept in the in-memory cache, and dropped when the node's version state is saved.
+    """
+
+    def __init__(self):
+        self._bases = {}      # node address: order_id() prefix of the node's refs, or None
+        self._sections = {}   # node address: {0 based indexes of a section: (offset of its first segment, its length)}, or None
+        self._focus = {}      # frozenset of trefs: {node address: (sorted offsets, trefs in the same order)}, or None
+
+    @staticmethod
+    def node(oref):
+        return tuple(oref.index_node.address())
+
+    @staticmethod
+    def cache_key(node):
+        return "segment-offsets-{}".format("|".join(node))
+
+    def order_key(self, oref):
+        """
+        :return: (node order_id() prefix, sections), which sort as `order_id()` does, or None
+        """
+        if oref.is_range() or any(section >= 10000 for section in oref.sections):
+            return None
+        node = self.node(oref)
+        if node not in self._bases:
+            order_id = oref.order_id()
+            suffix = 4 * len(oref.sections)
+            self._bases[node] = None if order_id == "Z" else order_id[:len(order_id) - suffix]
+        base = self._bases[node]
+        return None if base is None else (base, oref.sections)
+
+    def _node_sections(self, oref):
+        node = self.node(oref)
+        if node not in self._sections:
+            key = self.cache_key(node)
+            sections = in_memory_cache.get(key, namespace="segment-offsets")
+            if sections is None:
+                sections = {}  # a node without offsets is cached as empty, and has no sections to look up
+                if isinstance(oref.index_node, JaggedArrayNode) and not oref.index_node.is_virtual:
+                    try:
+                        sections = self._flatten(oref.get_state_ja().array(), oref.index_node.depth) or {}
+                    except Exception as e:
+                        logger.warning("No segment offsets for {}: {}".format(oref.index_node.full_title("en"), e))
+                in_memory_cache.set(key, sections, timeout=SEGMENT_OFFSETS_TIMEOUT, namespace="segment-offsets")
+            self._sections[node] = sections or None
+        return self._sections[node]
+
+    @staticmethod
+    def _flatten(array, depth):
+        sections = {}
+        offset = 0
+        stack = [((), array)]
+        while stack:
+            indexes, sub_array = stack.pop()
+            if not isinstance(sub_array, list) or len(sub_array) == 0:
+                return None
+            if len(indexes) == depth - 1:
+                if any(isinstance(segment, list) for segment in sub_array):
+                    return None
+                sections[indexes] = (offset, len(sub_array))
+                offset += len(sub_array)
+            else:
+                stack += [(indexes + (i,), sub) for i, sub in reversed(list(enumerate(sub_array)))]
+        return sections
+
+    def _section(self, oref, sections):
+        """
+        :return: (offset of the first segment, length) of the section of segments that `sections` are in, or None
+        """
+        node_sections = self._node_sections(oref)
+        if node_sections is None or len(sections) != oref.index_node.depth:
+            return None
+        return node_sections.get(tuple(s - 1 for s in sections[:-1]))
+
+    def offset(self, oref, sections=None):
+        """
+        :param sections: the sections of a segment of `oref`'s node. Defaults to `oref.sections`
+        :return: int, or None
+        """
+        sections = oref.sections if sections is None else sections
+        section = self._section(oref, sections)
+        if section is None or not 0 < sections[-1] <= section[1]:
+            return None
+        return section[0] + sections[-1] - 1
+
+    def covers_section(self, oref):
+        """
+        :return: True if `oref` is a segment, or a range of segments within one section, that covers its whole section.
+        None if that can't be told from the offsets
+        """
+        if oref.is_spanning():
+            return None
+        section = self._section(oref, oref.sections)
+        if section is None or len(oref.toSections) != len(oref.sections):
+            return None
+        return oref.sections[-1] <= 1 and oref.toSections[-1] >= section[1]
+
+    def focus(self, trefs):
+        """
+        :param trefs: set of normal segment refs
+        :return: {node address: (sorted numpy array of offsets, list of the trefs in the same order)}, or None if any of
+        `trefs` has no offset
+        """
+        key = frozenset(trefs)
+        if key not in self._focus:
+            by_node = defaultdict(list)
+            for tref in key:
+                try:
+                    oref = Ref(tref)
+                except InputError:
+                    break
+                offset = self.offset(oref) if not oref.is_range() else None
+                if offset is None or oref.normal() != tref:
+                    break
+                by_node[self.node(oref)].append((offset, tref))
+            else:
+                self._focus[key] = {node: (numpy.array([o for o, _ in sorted(items)], dtype=numpy.int64), [t for _, t in sorted(items)])
+                                    for node, items in by_node.items()}
+            self._focus.setdefault(key, None)
+        return self._focus[key]
+
+    def overlap(self, oref, focus):
+        """
+        :param oref: range Ref
+        :param focus: from `focus()`
+        :return: (the number of segments in `oref.range_list()`, set of the trefs of `focus` within it), or None if the
+        range has no offsets. Only ranges of depth 1 and 2 nodes, whose `range_list()` is made of segments, have them.
+        """
+        if oref.index_node.depth > 2:
+            return None
+        start, end = self.offset(oref), self.offset(oref, oref.toSections)
+        if start is None or end is None:
+            return None
+        offsets, trefs = focus.get(self.node(oref), (None, []))
+        if offsets is None:
+            return end - start + 1, set()
+        lo, hi = numpy.searchsorted(offsets, start, "left"), numpy.searchsorted(offsets, end, "right")
+        return end - start + 1, set(trefs[lo:hi])
+
+
 class RecommendationEngine:
 
     def __init__(self, tref, top=10, exclude_direct_commentary=True, limit_to_direct_link=False, cluster_max_dist=5):
@@ -119,6 +281,12 @@ class RecommendationEngine:
         self.choose_top(top)
 
     def get_all_possible_recs(self):
+        if USE_RECOMMENDATION_INDEX and self.ref.is_segment_level():
+            candidates = load_recommendation_candidates(self.ref)
+            if candidates is not None:
+                self.recommendations, self.commentary_link_ref_set, self.direct_link_ref_set = candidates
+                return self
+
         sheet_recs = self.get_recs_thru_sheets(self.ref)
         link_recs, commentary_link_ref_set, direct_link_ref_set = self.get_recs_thru_links(self.ref)
         self.commentary_link_ref_set = commentary_link_ref_set
@@ -128,11 +296,7 @@ class RecommendationEngine:
         return self
 
     def reduce_recs(self):
-        d = defaultdict(Recommendation)
-        for temp_rec in self.recommendations:
-            d[temp_rec.ref.normal()] += temp_rec
-            pass
-        self.recommendations = list(d.values())
+        self.recommendations = self.combine_recs(self.recommendations)
         return self
 
     def filter_recs(self):
@@ -175,15 +339,30 @@ class RecommendationEngine:
         return self
 
     @staticmethod
-    def get_recs_thru_links(oref):
+    def combine_recs(recommendations):
+        '''
+        Combines the recommendations of the same ref, adding up their relevance and sources
+        :param recommendations: list of `Recommendation`s
+        :return: list of `Recommendation`s, one per ref, in the order their refs first appear
+        '''
+        d = defaultdict(Recommendation)
+        for temp_rec in recommendations:
+            d[temp_rec.ref.normal()] += temp_rec
+        return list(d.values())
+
+    @staticmethod
+    def get_recs_thru_links(oref, link_getter=None):
         '''
         Given a ref, returns items connected to central ref through links - direct links and links through commentaries.
         :param oref:
+        :param link_getter: function with the signature of `get_links()`, which it defaults to. Lets callers reuse the links of a section for each of its segments
         :return: Twos things:
                     list of `Recommendation`s
                     [tref, tref] - all of the refs in the above set that are direct commentaries of original tref
         '''
 
+        link_getter = link_getter or get_links
+        ordinals = SegmentOrdinals()
         direct_links = set()
         section_ref_list = [r.section_ref() for r in oref.split_spanning_ref()]
         range_set = {r.normal() for r in oref.all_segment_refs()}
@@ -193,7 +372,7 @@ class RecommendationEngine:
             commentary_author_set = set()
             # set is used b/c sometimes there are duplicate links
             temp_direct_links = set()
-            initial_links = get_links(section_ref.normal(), with_text=False)
+            initial_links = link_getter(section_ref.normal(), with_text=False)
             filtered_links = [l for l in initial_links if len(range_set & {r.normal() for r in Ref(l['anchorRef']).range_list()}) > 0]
             direct_links |= {(l['ref'], l['category'] in ('Commentary', 'Modern Commentary'), Ref(l['anchorRef'])) for l in filtered_links}
         for link_tref, is_comment, anchor_ref in direct_links:
@@ -201,7 +380,7 @@ class RecommendationEngine:
             if is_comment and not link_tref.startswith("Steinsaltz on "):
                 link_oref = Ref(link_tref)
                 author = getattr(link_oref.index, "collective_title", None)
-                temp_commentary_links, _, _, _ = RecommendationEngine.normalize_related_refs([x["ref"] for x in get_links(link_tref, with_text=False)], None, COMMENTARY_LINK_SCORE)
+                temp_commentary_links, _, _, _ = RecommendationEngine.normalize_related_refs([x["ref"] for x in link_getter(link_tref, with_text=False)], None, COMMENTARY_LINK_SCORE, ordinals=ordinals)
                 for commentary_link in temp_commentary_links:
                     if author is not None and (commentary_link, author) in commentary_author_set:
                         # don't add same ref twice from same author
@@ -209,7 +388,7 @@ class RecommendationEngine:
                     commentary_author_set.add((commentary_link, author))
                     commentary_links += [Recommendation(Ref(commentary_link), relevance=COMMENTARY_LINK_SCORE, sources=[RecommendationSource(link_tref, anchor_ref)])]
         other_data = [(x[1], x[2]) for x in direct_links]
-        direct_links, _, other_data, focus_ref_subref = RecommendationEngine.normalize_related_refs([x[0] for x in direct_links], None, DIRECT_LINK_SCORE, other_data=other_data)
+        direct_links, _, other_data, focus_ref_subref = RecommendationEngine.normalize_related_refs([x[0] for x in direct_links], None, DIRECT_LINK_SCORE, other_data=other_data, ordinals=ordinals)
         direct_ref_set = set(direct_links)
         is_comment_list, anchor_ref_list = list(zip(*other_data))
         final_rex = [Recommendation(Ref(x), relevance=DIRECT_LINK_SCORE, sources=[RecommendationSource('direct', anchor_ref)]) for x, anchor_ref in zip(direct_links, anchor_ref_list)] + commentary_links
@@ -229,24 +408,34 @@ class RecommendationEngine:
         return True
 
     @staticmethod
-    def get_recs_thru_sheets(oref):
+    def get_sheets(section_ref):
+        '''
+        :param section_ref: section level Ref
+        :return: list of the interesting public sheets that include refs in `section_ref`
+        '''
+        regex_list = section_ref.regex(as_list=True)
+        ref_clauses = [{"includedRefs": {"$regex": r}} for r in regex_list]
+        query = {"status": "public", "$or": ref_clauses, "viaOwner": {"$exists": 0}, "assignment_id": {"$exists": 0}}
+        sheets_cursor = db.sheets.find(query, {"includedRefs": 1, "owner": 1, "id": 1, "tags": 1, "title": 1})
+        return [s for s in sheets_cursor if RecommendationEngine.is_interesting_sheet(s)]
+
+    @staticmethod
+    def get_recs_thru_sheets(oref, sheets=None):
         '''
 
         :param oref:
+        :param sheets: the sheets of the sections of `oref`, from `get_sheets()`. Queried when None
         :return: list of tuples, each one with (tref, score, way of connection[str])
         '''
-        sheets = []
-        section_ref_list = [r.section_ref() for r in oref.split_spanning_ref()]
         range_set = {r.normal() for r in oref.all_segment_refs()}
-        for section_ref in section_ref_list:
-            regex_list = section_ref.regex(as_list=True)
-            ref_clauses = [{"includedRefs": {"$regex": r}} for r in regex_list]
-            query = {"status": "public", "$or": ref_clauses, "viaOwner": {"$exists": 0}, "assignment_id": {"$exists": 0}}
-            sheets_cursor = db.sheets.find(query, {"includedRefs": 1, "owner": 1, "id": 1, "tags": 1, "title": 1})
-            sheets += [s for s in sheets_cursor if RecommendationEngine.is_interesting_sheet(s)]
+        if sheets is None:
+            sheets = []
+            for section_ref in [r.section_ref() for r in oref.split_spanning_ref()]:
+                sheets += RecommendationEngine.get_sheets(section_ref)
         included_ref_dict = {}
+        ordinals = SegmentOrdinals()
         for sheet in sheets:
-            temp_included, focus_range_factor, _, focus_ref_subref = RecommendationEngine.normalize_related_refs(sheet.get("includedRefs", []), range_set, SHEET_REF_SCORE, check_has_ref=True, count_steinsaltz=True)
+            temp_included, focus_range_factor, _, focus_ref_subref = RecommendationEngine.normalize_related_refs(sheet.get("includedRefs", []), range_set, SHEET_REF_SCORE, check_has_ref=True, count_steinsaltz=True, ordinals=ordinals)
             if focus_range_factor == 0:
                 continue
             ref_owner_keys = [(r, sheet["owner"]) for r in temp_included]
@@ -257,15 +446,49 @@ class RecommendationEngine:
         return [Recommendation(Ref(r), relevance=d["score"], sources=[RecommendationSource(d["source"], d["anchor_ref"])]) for (r, _), d in list(included_ref_dict.items())]
 
     @staticmethod
-    def cluster_close_refs(ref_list, data_list, dist_threshold):
+    def cluster_close_refs(ref_list, data_list, dist_threshold, ordinals=None):
         '''
 
         :param ref_list: list of orefs
         :param data_list: list of data to associate w/ refs (same length as ref_list)
         :param dist_threshold: max distance where you want two refs clustered
+        :param ordinals: `SegmentOrdinals` to reuse
         :return: List of lists where each internal list is a cluster of segment refs
         '''
+        ordinals = ordinals or SegmentOrdinals()
+        keys = [ordinals.order_key(r) for r in ref_list]
+        if len(ref_list) == 0 or None in keys:
+            return RecommendationEngine.cluster_close_refs_by_ref(ref_list, data_list, dist_threshold)
+        bases = sorted({base for base, _ in keys})
+        if any(b.startswith(a) for a, b in zip(bases, bases[1:])):
+            # order_id() compares these nodes' prefixes with the other's sections
+            return RecommendationEngine.cluster_close_refs_by_ref(ref_list, data_list, dist_threshold)
+
+        # rows are the rank of the node, then its sections, padded with -1 so that shorter refs sort first
+        rank = {base: i for i, base in enumerate(bases)}
+        columns = numpy.full((1 + max(len(sections) for _, sections in keys), len(keys)), -1, dtype=numpy.int64)
+        for i, (base, sections) in enumerate(keys):
+            columns[0, i] = rank[base]
+            columns[1:len(sections) + 1, i] = sections
+        order = numpy.lexsort(columns[::-1])
+
+        refs = [ref_list[i] for i in order]
+        nodes = [ordinals.node(r) for r in refs]
+        offsets = numpy.array([-1 if o is None else o for o in (ordinals.offset(r) for r in refs)], dtype=numpy.int64)
+        same_node = numpy.array([a == b for a, b in zip(nodes, nodes[1:])], dtype=bool)
+        known = (offsets[1:] >= 0) & (offsets[:-1] >= 0)
+        close = same_node & known & (numpy.abs(numpy.diff(offsets)) <= dist_threshold)
+        for i in numpy.flatnonzero(same_node & ~known):
+            close[i] = -1 < refs[i].distance(refs[i + 1]) <= dist_threshold
+
+        starts = [0] + list(numpy.flatnonzero(~close) + 1) + [len(refs)]
+        return [[{"ref": refs[j], "data": data_list[order[j]]} for j in range(start, end)] for start, end in zip(starts, starts[1:])]
 
+    @staticmethod
+    def cluster_close_refs_by_ref(ref_list, data_list, dist_threshold):
+        '''
+        `cluster_close_refs()`, with `Ref.order_id()` and `Ref.distance()`, for refs that `SegmentOrdinals` can't order
+        '''
         clusters = []
         item_list = sorted(zip(ref_list, data_list), key=lambda x: x[0].order_id())
         last_cluster = None
@@ -279,15 +502,19 @@ class RecommendationEngine:
         return clusters
 
     @staticmethod
-    def includes_section(oref):
+    def includes_section(oref, ordinals=None):
         """
         makes sure oref is not a range which makes up at least one entire section
         :param oref:
+        :param ordinals: `SegmentOrdinals` to reuse
         :return:
         """
         if oref.is_section_level():
             return True
         if isinstance(oref.index_node, JaggedArrayNode) and oref.index.schema.get("depth", 0) == 2:
+            covers = (ordinals or SegmentOrdinals()).covers_section(oref)
+            if covers is not None:
+                return covers
             # doesn't work for dictionary entries and not relevant anyway
             range_set = {r.normal() for r in oref.all_segment_refs()}
             section_range_set = {r.normal() for r in Ref(next(iter(range_set))).section_ref().all_segment_refs()}
@@ -297,7 +524,7 @@ class RecommendationEngine:
         return False
 
     @staticmethod
-    def normalize_related_refs(related_refs, focus_ref_set, base_score, check_has_ref=False, other_data=None, count_steinsaltz=False):
+    def normalize_related_refs(related_refs, focus_ref_set, base_score, check_has_ref=False, other_data=None, count_steinsaltz=False, ordinals=None):
         '''
 
         :param related_refs:
@@ -306,8 +533,11 @@ class RecommendationEngine:
         :param check_has_ref:
         :param other_data:
         :param count_steinsaltz:
+        :param ordinals: `SegmentOrdinals` to reuse
         :return:
         '''
+        ordinals = ordinals or SegmentOrdinals()
+        focus = ordinals.focus(focus_ref_set) if focus_ref_set else None
         # make sure oref is in includedRefs but don't actually add those to the final includedRefs
         focus_ref_subset = None
         focus_range_factor = 0.0  # multiplicative factor based on how big a range the focus_ref is in
@@ -323,20 +553,25 @@ class RecommendationEngine:
             if isinstance(temp_oref.index_node, DictionaryEntryNode):
                 # dictionary entries aren't interesting
                 continue
-            if RecommendationEngine.includes_section(temp_oref):
+            if RecommendationEngine.includes_section(temp_oref, ordinals):
                 continue
             if temp_oref.is_range():
-                temp_range_set = {subref.normal() for subref in temp_oref.range_list()}
-                in_common_set = set() if focus_ref_set is None else temp_range_set & focus_ref_set
+                overlap = None if focus is None else ordinals.overlap(temp_oref, focus)
+                if overlap is None:
+                    temp_range_set = {subref.normal() for subref in temp_oref.range_list()}
+                    range_size, in_common_set = len(temp_range_set), set() if focus_ref_set is None else temp_range_set & focus_ref_set
+                else:
+                    range_size, in_common_set = overlap
                 if len(in_common_set) > 0:
-                    temp_focus_range_factor = (len(in_common_set) * base_score)/len(temp_range_set) if len(temp_range_set) < REF_RANGE_MAX else 0.0
+                    temp_focus_range_factor = (len(in_common_set) * base_score)/range_size if range_size < REF_RANGE_MAX else 0.0
                     if temp_focus_range_factor > focus_range_factor:
                         focus_range_factor = temp_focus_range_factor
                     if focus_ref_subset is None or len(in_common_set) < len(focus_ref_subset):
                         focus_ref_subset = in_common_set
                     continue
-                final_refs += list(temp_range_set)
-                final_other_data += [other_data_item] * len(temp_range_set)
+                # ranges measured by their offsets are expanded below, if they are returned
+                final_refs += list(temp_range_set) if overlap is None else [temp_oref]
+                final_other_data += [other_data_item] * range_size
 
             else:
                 if focus_ref_set is not None and temp_oref.normal() in focus_ref_set:
@@ -345,6 +580,9 @@ class RecommendationEngine:
                     continue
                 final_refs += [temp_tref]
                 final_other_data += [other_data_item]
+        if focus_ref_subset is None and check_has_ref and count_steinsaltz:
+            return [], focus_range_factor, final_other_data, None
+        final_refs = [x for item in final_refs for x in ([item] if isinstance(item, str) else list({subref.normal() for subref in item.range_list()}))]
         if count_steinsaltz:
             # transform mentions of steinsaltz to talmud
             final_refs = [x.replace("Steinsaltz on ", "") for x in final_refs]
@@ -0,0 +1,225 @@
+"""
+recommendation_index.py
+Precomputed candidates for RecommendationEngine, so that recommending sources for a segment takes one lookup
+instead of the links of its section and of each of its commentaries, and the sheets of its section.
+
+build_recommendation_index() saves, for each segment of the library, what RecommendationEngine.get_all_possible_recs()
+would find for it, combined per ref and with the novelty of each ref:
+    {
+        "ref": "Genesis 1:1",
+        "recs": [[tref, relevance, novelty, [[source, anchor tref], ...]], ...],
+        "commentary": [tref, ...],   # the engine's commentary_link_ref_set
+        "direct": [tref, ...],       # the engine's direct_link_ref_set
+        "date": datetime
+    }
+Segments without links, for which the engine raises, have no document, and neither do ranges. The engine computes
+the candidates of those itself, as it does for everything when USE_RECOMMENDATION_INDEX is off.
+
+Saving or deleting a link, and publishing, editing or deleting a public sheet queue the refs involved, and
+update_recommendation_index() recomputes the segments whose candidates they could change. Novelty comes from ref_data,
+so rebuild the index after the pagesheetranks are recalculated.
+
+Writes to MongoDB Collections: recommendation_candidates, recommendation_index_queue
+"""
+import functools
+from collections import defaultdict
+from datetime import datetime
+from pymongo import ReplaceOne, DeleteOne, UpdateOne
+
+from sefaria.model import *
+from sefaria.system.cache import in_memory_cache
+from sefaria.system.database import db
+from sefaria.system.exceptions import InputError, BookNameError
+try:
+    from sefaria.settings import USE_RECOMMENDATION_INDEX
+except ImportError:
+    USE_RECOMMENDATION_INDEX = False
+
+import structlog
+logger = structlog.get_logger(__name__)
+
+BATCH_SIZE = 1000
+QUEUE_COLLECTION = "recommendation_index_queue"
+
+
+def load_recommendation_candidates(oref):
+    """
+    :param oref: segment level Ref
+    :return: (list of `Recommendation`s, commentary ref set, direct ref set), as
+    `RecommendationEngine.get_all_possible_recs()` would set them after `reduce_recs()`, or None if `oref` isn't indexed
+    """
+    from sefaria.recommendation_engine import Recommendation, RecommendationSource
+    doc = db.recommendation_candidates.find_one({"ref": oref.normal()})
+    if doc is None:
+        return None
+    recs = [Recommendation(Ref(tref), relevance=relevance, novelty=novelty,
+                           sources=[RecommendationSource(source, Ref(anchor)) for source, anchor in sources])
+            for tref, relevance, novelty, sources in doc["recs"]]
+    return recs, set(doc["commentary"]), set(doc["direct"])
+
+
+def build_recommendation_index(titles=None):
+    """
+    Computes the candidates of every segment of the given indexes, or of the whole library
+    :param titles: list of index titles
+    :return: dict with the number of segments saved and deleted
+    """
+    indexes = [library.get_index(title) for title in titles] if titles else library.all_index_records()
+    counts = {"saved": 0, "deleted": 0}
+    for index in indexes:
+        try:
+            segments = index.all_segment_refs()
+        except Exception as e:
+            logger.warning("Skipping recommendations of {}: {}".format(index.title, e))
+            continue
+        for k, v in index_recommendation_segments(segments).items():
+            counts[k] += v
+    return counts
+
+
+def index_recommendation_segments(orefs):
+    """
+    Computes and saves the candidates of each segment, and deletes the saved candidates of segments that now have none
+    :param orefs: list of segment level Refs
+    :return: dict with the number of segments saved and deleted
+    """
+    from sefaria import recommendation_engine
+    by_section = defaultdict(list)
+    for oref in orefs:
+        by_section[oref.section_ref().normal()].append(oref)
+
+    counts = {"saved": 0, "deleted": 0}
+    ops = []
+    for section_tref, section_orefs in by_section.items():
+        sheets = recommendation_engine.RecommendationEngine.get_sheets(Ref(section_tref))
+        # each segment asks for the links of the section, and of the commentaries that the segments share
+        link_getter = functools.lru_cache(maxsize=None)(recommendation_engine.get_links)
+        docs = [_candidates(oref, sheets, link_getter) for oref in section_orefs]
+        novelty = _novelty({rec[0] for doc in docs if doc for rec in doc["recs"]})
+        for oref, doc in zip(section_orefs, docs):
+            if doc is None:
+                ops.append(DeleteOne({"ref": oref.normal()}))
+                counts["deleted"] += 1
+                continue
+            for rec in doc["recs"]:
+                rec[2] = novelty.get(rec[0], 1.0)
+            ops.append(ReplaceOne({"ref": oref.normal()}, doc, upsert=True))
+            counts["saved"] += 1
+        if len(ops) >= BATCH_SIZE:
+            db.recommendation_candidates.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.recommendation_candidates.bulk_write(ops, ordered=False)
+    return counts
+
+
+def _candidates(oref, sheets, link_getter):
+    from sefaria.recommendation_engine import RecommendationEngine
+    try:
+        link_recs, commentary_ref_set, direct_ref_set = RecommendationEngine.get_recs_thru_links(oref, link_getter=link_getter)
+    except ValueError:
+        # no links
+        return None
+    sheet_recs = RecommendationEngine.get_recs_thru_sheets(oref, sheets=sheets)
+    recs = RecommendationEngine.combine_recs(sheet_recs + link_recs)
+    return {
+        "ref": oref.normal(),
+        "recs": [[rec.ref.normal(), rec.relevance, None, [[s.source, s.anchor_ref.normal()] for s in rec.sources]] for rec in recs],
+        "commentary": sorted(commentary_ref_set),
+        "direct": sorted(direct_ref_set),
+        "date": datetime.now(),
+    }
+
+
+def _novelty(trefs):
+    return {rd.ref: rd.inverse_pagesheetrank() for rd in RefDataSet({"ref": {"$in": list(trefs)}})}
+
+
+def enqueue_recommendation_refs(trefs):
+    """
+    Queues refs whose links or sheets changed, for `update_recommendation_index()`
+    :param trefs: iterable of normal refs, of any level
+    """
+    if not USE_RECOMMENDATION_INDEX:
+        return
+    now = datetime.now()
+    ops = [UpdateOne({"ref": tref}, {"$set": {"date": now}}, upsert=True) for tref in sorted(set(trefs))]
+    if ops:
+        db[QUEUE_COLLECTION].bulk_write(ops, ordered=False)
+
+
+def process_link_change_in_recommendation_index(l, **kwargs):
+    """
+    Queues the refs of a saved or deleted link, and its refs from before the save, if they changed
+    """
+    old_refs = kwargs.get("orig_vals", {}).get("refs") or []
+    enqueue_recommendation_refs(set(l.refs) | set(old_refs))
+
+
+def process_version_state_change_in_segment_offsets(vs, **kwargs):
+    """
+    Drops the cached segment offsets of the nodes of a saved or deleted version state, which `SegmentOrdinals` counts
+    from the version state
+    """
+    from sefaria.recommendation_engine import SegmentOrdinals
+    try:
+        nodes = library.get_index(vs.title).nodes.get_leaf_nodes()
+    except BookNameError:
+        return
+    for node in nodes:
+        in_memory_cache.delete(SegmentOrdinals.cache_key(tuple(node.address())))
+
+
+def enqueue_sheet_change(old_sheet, new_sheet):
+    """
+    Queues the refs of a sheet if it is or was public, and its refs, title or status changed
+    :param old_sheet: sheet dict before the change, or None for a new sheet
+    :param new_sheet: sheet dict after the change, or None for a deleted sheet
+    """
+    def state(sheet):
+        if sheet is None or sheet.get("status") != "public":
+            return None
+        return sheet.get("title"), tuple(sheet.get("includedRefs", []))
+
+    old_state, new_state = state(old_sheet), state(new_sheet)
+    if old_state != new_state:
+        enqueue_recommendation_refs((old_state[1] if old_state else ()) + (new_state[1] if new_state else ()))
+
+
+def update_recommendation_index(limit=None):
+    """
+    Recomputes the segments of the queued refs, and the segments linked to them, whose commentary links may have
+    changed, then removes the refs from the queue. Refs queued again in the meantime stay queued.
+    :param limit: maximum number of queued refs to process
+    :return: dict with the number of refs processed and of segments saved and deleted
+    """
+    started = datetime.now()
+    queued = list(db[QUEUE_COLLECTION].find({"date": {"$lte": started}}).sort("date", 1).limit(limit or 0))
+    counts = index_recommendation_segments(_affected_segments([q["ref"] for q in queued]))
+    db[QUEUE_COLLECTION].delete_many({"_id": {"$in": [q["_id"] for q in queued]}, "date": {"$lte": started}})
+    counts["refs"] = len(queued)
+    return counts
+
+
+def _affected_segments(trefs):
+    segments = set()
+    for tref in trefs:
+        try:
+            segments |= {r.normal() for r in Ref(tref).all_segment_refs()}
+        except InputError:
+            continue
+    linked = set()
+    segment_list = sorted(segments)
+    for i in range(0, len(segment_list), BATCH_SIZE):
+        chunk = segment_list[i:i + BATCH_SIZE]
+        query = {"$or": [{"expandedRefs0": {"$in": chunk}}, {"expandedRefs1": {"$in": chunk}}]}
+        for link in db.links.find(query, {"expandedRefs0": 1, "expandedRefs1": 1}):
+            linked.update(link.get("expandedRefs0", []))
+            linked.update(link.get("expandedRefs1", []))
+    orefs = []
+    for tref in sorted(segments | linked):
+        try:
+            orefs.append(Ref(tref))
+        except InputError:
+            continue
+    return orefs
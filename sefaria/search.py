@@ -5,6 +5,8 @@ search.py - full-text search for Sefaria using ElasticSearch
 Writes to MongoDB Collection: index_queue
 """
 import os
+import multiprocessing
+import traceback
 from datetime import datetime, timedelta
 import re
 import bleach
@@ -19,16 +21,20 @@ import time as pytime
 logger = structlog.get_logger(__name__)
 
 from elasticsearch.client import IndicesClient
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import streaming_bulk, parallel_bulk
 from elasticsearch.exceptions import NotFoundError
 from sefaria.model import *
 from sefaria.model.text import AbstractIndex, AbstractTextRecord
 from sefaria.model.user_profile import user_link, public_user_data
 from sefaria.model.collection import CollectionSet
 from sefaria.system.database import db
-from sefaria.system.exceptions import InputError
+from sefaria.system.exceptions import InputError, BookNameError
 from sefaria.utils.util import strip_tags
 from .settings import SEARCH_INDEX_NAME_TEXT, SEARCH_INDEX_NAME_SHEET
+try:
+    from .settings import SEARCH_REINDEX_PROCESSES
+except ImportError:
+    SEARCH_REINDEX_PROCESSES = 1
 from sefaria.helper.search import get_elasticsearch_client
 from sefaria.site.site_settings import SITE_SETTINGS
 from sefaria.utils.hebrew import strip_cantillation
@@ -394,6 +400,12 @@ def get_search_categories(oref, categories):
 
 
 class TextIndexer(object):
+    best_time_periods = None  # index title -> best time period, when computed up front for worker processes
+    version_batch_size = 10  # versions per Mongo batch. Versions are read with their full content
+    bulk_chunk_size = 500  # documents per Elasticsearch bulk request
+    bulk_threads = 1  # more than 1 sends bulk requests from a thread pool, with parallel_bulk
+    bulk_max_retries = 3  # retries of documents rejected with 429, when bulk_threads == 1
+    curr_index = None
 
     @classmethod
     def clear_cache(cls):
@@ -401,6 +413,8 @@ class TextIndexer(object):
         cls.version_priority_map = None
         cls._bulk_actions = None
         cls.best_time_period = None
+        cls.best_time_periods = None
+        cls.curr_index = None
 
 
     @classmethod
@@ -454,25 +468,51 @@ class TextIndexer(object):
                 raise e
 
     @classmethod
-    def get_all_versions(cls, tries=0, versions=None, page=0):
-        versions = versions or []
-        try:
-            version_limit = 10
-            temp_versions = []
-            first_run = True
-            while first_run or len(temp_versions) > 0:
-                temp_versions = VersionSet(limit=version_limit, page=page).array()
-                versions += temp_versions
-                page += 1
-                first_run = False
-            return versions
-        except pymongo.errors.AutoReconnect as e:
-            if tries < 200:
-                pytime.sleep(5)
-                return cls.get_all_versions(tries+1, versions, page)
-            else:
-                print("Tried: {} times. Got {} versions".format(tries, len(versions)))
-                raise e
+    def iter_versions(cls, titles=None, tries=0):
+        """
+        Streams the Versions in the version priority map, one index at a time, with the versions of each index in
+        priority order.
+        Reads a single cursor sorted by title, so only the versions of one index are held in memory at a time.
+        After a lost connection, the cursor is reopened at the index that was being read.
+        :param titles: optional. list of index titles to limit to
+        """
+        last_title = None
+        while True:
+            query = {"title": {"$in": titles}} if titles is not None else {}
+            if last_title is not None:
+                query.setdefault("title", {})["$gt"] = last_title
+            cursor = db.texts.find(query, sort=[("title", pymongo.ASCENDING)], no_cursor_timeout=True, batch_size=cls.version_batch_size)
+            group = []
+            try:
+                for record in cursor:
+                    if group and record["title"] != group[0].title:
+                        yield from cls._prioritize_versions(group)
+                        last_title = group[0].title
+                        group = []
+                    group.append(Version(attrs=record))
+                yield from cls._prioritize_versions(group)
+                return
+            except pymongo.errors.AutoReconnect as e:
+                if tries < 200:
+                    tries += 1
+                    pytime.sleep(5)
+                else:
+                    print("iter_versions -- Tried: {} times. Failed after {}".format(tries, last_title))
+                    raise e
+            finally:
+                cursor.close()
+
+    @classmethod
+    def _prioritize_versions(cls, versions):
+        """
+        :param versions: list of Versions of one index
+        :return: the versions that are in the version priority map, grouped by language, in priority order
+        """
+        versions = sorted([v for v in versions if (v.title, v.versionTitle, v.language) in cls.version_priority_map], key=lambda v: cls.version_priority_map[(v.title, v.versionTitle, v.language)][0])
+        versions_by_lang = defaultdict(list)
+        for v in versions:
+            versions_by_lang[v.language] += [v]
+        return [v for vlist in versions_by_lang.values() for v in vlist]
 
     @staticmethod
     def excluded_from_search(version):
@@ -482,45 +522,138 @@ class TextIndexer(object):
         ]
 
     @classmethod
-    def index_all(cls, index_name, debug=False, for_es=True, action=None):
+    def create_best_time_periods(cls, titles):
+        cls.best_time_periods = {}
+        for title in titles:
+            try:
+                cls.best_time_periods[title] = library.get_index(title).best_time_period()
+            except (ValueError, BookNameError):
+                cls.best_time_periods[title] = None
+
+    @classmethod
+    def index_all(cls, index_name, debug=False, for_es=True, action=None, titles=None, processes=None):
+        """
+        Indexes every version in the version priority map.
+        Versions are streamed from Mongo (see iter_versions()) and their documents are streamed to Elasticsearch in
+        chunks of `bulk_chunk_size`, so memory use doesn't grow with the size of the library.
+        :param for_es: if False, only call `action` on every segment
+        :param titles: optional. list of index titles to limit to
+        :param processes: number of worker processes to split the indexes between. Defaults to SEARCH_REINDEX_PROCESSES
+        """
+        processes = processes or SEARCH_REINDEX_PROCESSES
         cls.index_name = index_name
+        cls.curr_index = None
+        cls.best_time_periods = None
         cls.create_version_priority_map()
         cls.create_terms_dict()
         Ref.clear_cache()  # try to clear Ref cache to save RAM
 
-        versions = sorted([x for x in cls.get_all_versions() if (x.title, x.versionTitle, x.language) in cls.version_priority_map], key=lambda x: cls.version_priority_map[(x.title, x.versionTitle, x.language)][0])
-        versions_by_index = {}
-        # organizing by index for the merged case. There is no longer a merged case but keeping this logic b/c it seems fine
-        for v in versions:
-            key = (v.title, v.language)
-            if key in versions_by_index:
-                versions_by_index[key] += [v]
+        total_versions = len(cls.version_priority_map)
+        print("Beginning index of {} versions.".format(total_versions))
+        if for_es and processes > 1:
+            cls._index_all_in_pool(titles, processes)
+            return
+
+        actions = cls._walk_versions(cls.iter_versions(titles), total_versions, action)
+        if not for_es:
+            for _ in actions:
+                pass
+            return
+        succeeded, failed = cls._send_bulk(actions)
+        print("Indexed {} documents. {} failed.".format(succeeded, failed))
+
+    @classmethod
+    def _send_bulk(cls, actions):
+        """
+        :return: (number of documents indexed, number of documents that failed)
+        """
+        if cls.bulk_threads > 1:
+            results = parallel_bulk(es_client, actions, thread_count=cls.bulk_threads, queue_size=cls.bulk_threads, chunk_size=cls.bulk_chunk_size, raise_on_error=False)
+        else:
+            results = streaming_bulk(es_client, actions, chunk_size=cls.bulk_chunk_size, max_retries=cls.bulk_max_retries, raise_on_error=False)
+        succeeded = failed = 0
+        for ok, item in results:
+            if ok:
+                succeeded += 1
             else:
-                versions_by_index[key] = [v]
-        print("Beginning index of {} versions.".format(len(versions)))
+                failed += 1
+                logger.error("ERROR indexing document: {}".format(item))
+        return succeeded, failed
+
+    @classmethod
+    def _index_all_in_pool(cls, titles, processes, titles_per_task=5, max_retries=2):
+        """
+        Splits the indexes between a pool of spawned worker processes.
+        Forking this process isn't safe, since it may have threads (Mongo's monitors, among others) holding locks, so
+        workers are started fresh and open their own Mongo connection and Elasticsearch client. As with any spawned
+        process, the main module is imported again in each worker, so scripts that reindex need a `__main__` guard.
+        The version priority map, terms dict and best time periods are computed here once, and are sent to each worker
+        when it starts.
+        Batches of titles that fail are retried up to `max_retries` times once the other batches are done.
+        """
+        all_titles = sorted({key[0] for key in cls.version_priority_map})
+        if titles is not None:
+            titles = set(titles)
+            all_titles = [t for t in all_titles if t in titles]
+        cls.create_best_time_periods(all_titles)
+        tasks = [all_titles[i:i + titles_per_task] for i in range(0, len(all_titles), titles_per_task)]
+        print("Indexing {} indexes in {} batches with {} processes".format(len(all_titles), len(tasks), processes))
+
+        state = {
+            "index_name": cls.index_name,
+            "version_priority_map": cls.version_priority_map,
+            "terms_dict": cls.terms_dict,
+            "best_time_periods": cls.best_time_periods,
+        }
+        succeeded = failed = 0
+        with multiprocessing.get_context("spawn").Pool(processes, initializer=_init_reindex_worker, initargs=(state, get_elasticsearch_client)) as pool:
+            for attempt in range(max_retries + 1):
+                failed_tasks = []
+                for i, result in enumerate(pool.imap_unordered(_reindex_titles, tasks), 1):
+                    if result["error"]:
+                        logger.error("Error indexing {}: {}".format(", ".join(result["titles"]), result["error"]))
+                        failed_tasks += [result["titles"]]
+                    else:
+                        succeeded += result["succeeded"]
+                        failed += result["failed"]
+                    print("{}/{} batches. {} documents indexed, {} failed. Last: {} ({:.1f}s)".format(i, len(tasks), succeeded, failed, result["titles"][0], result["seconds"]))
+                tasks = failed_tasks
+                if not tasks:
+                    break
+                if attempt < max_retries:
+                    print("Retrying {} batches".format(len(tasks)))
+        for task in tasks:
+            print("Failed to index {}".format(", ".join(task)))
+        print("Indexed {} documents. {} failed.".format(succeeded, failed))
+
+    @classmethod
+    def _walk_versions(cls, versions, total_versions=None, action=None):
+        """
+        Walks the segments of every version in `versions`, yielding the bulk actions made by `action` for each version
+        :param total_versions: if given, print progress
+        """
         vcount = 0
-        total_versions = len(versions)
-        versions = None  # release RAM
-        for title, vlist in list(versions_by_index.items()):
-            if len(vlist) == 0:
+        for v in versions:
+            if cls.curr_index is None or cls.curr_index.title != v.title:
+                cls.curr_index = v.get_index()
+                if cls.best_time_periods is not None and v.title in cls.best_time_periods:
+                    cls.best_time_period = cls.best_time_periods[v.title]
+                else:
+                    try:
+                        cls.best_time_period = cls.curr_index.best_time_period()
+                    except ValueError:
+                        cls.best_time_period = None
+            if cls.excluded_from_search(v):
+                print("skipping version")
                 continue
-            cls.curr_index = vlist[0].get_index()
-            if for_es:
-                cls._bulk_actions = []
-                try:
-                    cls.best_time_period = cls.curr_index.best_time_period()
-                except ValueError:
-                    cls.best_time_period = None
-            for v in vlist:
-                if cls.excluded_from_search(v):
-                    print("skipping version")
-                    continue
-
-                cls.index_version(v, action=action)
+
+            cls._bulk_actions = []
+            cls.index_version(v, action=action)
+            if total_versions is not None:
                 print("Indexed Version {}/{}".format(vcount, total_versions))
-                vcount += 1
-            if for_es:
-                bulk(es_client, cls._bulk_actions, stats_only=True, raise_on_error=False)
+            vcount += 1
+            actions, cls._bulk_actions = cls._bulk_actions, None
+            yield from actions
 
     @classmethod
     def index_version(cls, version, tries=0, action=None):
@@ -533,7 +666,7 @@ class TextIndexer(object):
             if tries < 200:
                 pytime.sleep(5)
                 print("Retrying {}. Try {}".format(version.title, tries))
-                cls.index_version(version, tries+1)
+                cls.index_version(version, tries+1, action=action)
             else:
                 print("Tried {} times to get {}. I have failed you...".format(tries, version.title))
                 raise e
@@ -660,6 +793,33 @@ class TextIndexer(object):
         }
 
 
+def _init_reindex_worker(state, es_client_factory):
+    """
+    Runs once in each worker process of TextIndexer._index_all_in_pool()
+    :param state: the TextIndexer attributes computed by the parent process
+    :param es_client_factory: makes the worker's Elasticsearch client
+    """
+    global es_client
+    es_client = es_client_factory()
+    for attr, value in state.items():
+        setattr(TextIndexer, attr, value)
+
+
+def _reindex_titles(titles):
+    """
+    Runs in a worker process of TextIndexer._index_all_in_pool()
+    """
+    start = pytime.perf_counter()
+    result = {"titles": titles, "succeeded": 0, "failed": 0, "error": None}
+    try:
+        TextIndexer.curr_index = None
+        result["succeeded"], result["failed"] = TextIndexer._send_bulk(TextIndexer._walk_versions(TextIndexer.iter_versions(titles)))
+    except Exception:
+        result["error"] = traceback.format_exc()
+    result["seconds"] = pytime.perf_counter() - start
+    return result
+
+
 def index_sheets_by_timestamp(timestamp):
     """
     :param timestamp str: index all sheets modified after `timestamp` (in isoformat)
@@ -24,15 +24,21 @@ import sefaria.model.abstract as abstract
 from sefaria.system.database import db
 from sefaria.model.notification import Notification, NotificationSet
 from sefaria.model.following import FollowersSet
-from sefaria.model.user_profile import UserProfile, annotate_user_list, public_user_data, user_link
+from sefaria.model.user_profile import UserProfile, annotate_user_list, public_user_data, user_link, bulk_user_profiles
 from sefaria.model.collection import Collection, CollectionSet
 from sefaria.model.topic import TopicSet, Topic, RefTopicLink, RefTopicLinkSet
+from sefaria.model.ref_ordinal import expanded_ordinals, ordinal_query as ref_ordinal_query
 from sefaria.utils.util import strip_tags, string_overlap, titlecase
 from sefaria.utils.hebrew import has_hebrew, is_all_hebrew
 from sefaria.system.exceptions import InputError, DuplicateRecordError
 from sefaria.system.cache import django_cache
+from sefaria.recommendation_index import enqueue_sheet_change
 from .history import record_sheet_publication, delete_sheet_publication
 from .settings import SEARCH_INDEX_ON_SAVE
+try:
+	from .settings import USE_REF_ORDINAL_QUERIES
+except ImportError:
+	USE_REF_ORDINAL_QUERIES = False
 from . import search
 from sefaria.google_storage_manager import GoogleStorageManager
 import re
@@ -466,9 +472,11 @@ def save_sheet(sheet, user_id, search_override=False, rebuild_nodes=False):
 
 	sheet["dateModified"] = datetime.now().isoformat()
 	status_changed = False
+	old_sheet = None
 	if "id" in sheet:
 		new_sheet = False
 		existing = db.sheets.find_one({"id": sheet["id"]})
+		old_sheet = dict(existing)
 
 		if sheet["lastModified"] != existing["dateModified"]:
 			# Don't allow saving if the sheet has been modified since the time
@@ -564,6 +572,7 @@ def save_sheet(sheet, user_id, search_override=False, rebuild_nodes=False):
 
 	sheet["includedRefs"] = refs_in_sources(sheet.get("sources", []))
 	sheet["expandedRefs"] = model.Ref.expand_refs(sheet["includedRefs"])
+	sheet["expandedOrdinals"] = expanded_ordinals(sheet["includedRefs"])
 	sheet["sheetLanguage"] = get_sheet_language(sheet)
 
 	if rebuild_nodes:
@@ -582,6 +591,8 @@ def save_sheet(sheet, user_id, search_override=False, rebuild_nodes=False):
 	else:
 		db.sheets.find_one_and_replace({"id": sheet["id"]}, sheet)
 
+	enqueue_sheet_change(old_sheet, sheet)
+
 	if len(topics_diff["added"]) or len(topics_diff["removed"]):
 		update_sheet_topics(sheet["id"], sheet.get("topics", []), old_topics)
 		sheet = db.sheets.find_one({"id": sheet["id"]})
@@ -773,7 +784,7 @@ def update_included_refs(query=None, hours=None, refine_refs=False):
 	for sheet in sheets:
 		sources = sheet.get("sources", [])
 		refs = refs_in_sources(sources, refine_refs=refine_refs)
-		db.sheets.update({"_id": sheet["_id"]}, {"$set": {"includedRefs": refs, "expandedRefs": model.Ref.expand_refs(refs)}})
+		db.sheets.update({"_id": sheet["_id"]}, {"$set": {"includedRefs": refs, "expandedRefs": model.Ref.expand_refs(refs), "expandedOrdinals": expanded_ordinals(refs)}})
 
 
 def get_top_sheets(limit=3):
@@ -785,6 +796,16 @@ def get_top_sheets(limit=3):
 	return sheet_list(query=query, limit=limit)
 
 
+def _name_and_profile_url(user_profiles, uid):
+	"""
+	Returns the name and profile URL of `uid` from the results of `bulk_user_profiles`, as `public_user_data` gives them.
+	"""
+	profile = user_profiles.get(uid)
+	if profile is None:
+		return "User {}".format(uid), "/profile/"
+	return profile["first_name"] + " " + profile["last_name"], "/profile/" + profile["slug"]
+
+
 def get_sheets_for_ref(tref, uid=None, in_collection=None):
 	"""
 	Returns a list of sheets that include ref,
@@ -795,7 +816,8 @@ def get_sheets_for_ref(tref, uid=None, in_collection=None):
 	oref = model.Ref(tref)
 	# perform initial search with context to catch ranges that include a segment ref
 	segment_refs = [r.normal() for r in oref.all_segment_refs()]
-	query = {"expandedRefs": {"$in": segment_refs}}
+	ordinal_query = ref_ordinal_query(oref, ["expandedOrdinals"]) if USE_REF_ORDINAL_QUERIES else None
+	query = ordinal_query or {"expandedRefs": {"$in": segment_refs}}
 	if uid:
 		query["owner"] = uid
 	else:
@@ -808,23 +830,12 @@ def get_sheets_for_ref(tref, uid=None, in_collection=None):
 
 	sheetsObj = db.sheets.find(query,
 		{"id": 1, "title": 1, "owner": 1, "viaOwner":1, "via":1, "dateCreated": 1, "includedRefs": 1, "expandedRefs": 1, "views": 1, "topics": 1, "status": 1, "summary":1, "attribution":1, "assigner_id":1, "likes":1, "displayedCollection":1, "options":1}).sort([["views", -1]])
-	sheetsObj.hint("expandedRefs_1")
+	sheetsObj.hint("expandedOrdinals_1" if ordinal_query else "expandedRefs_1")
 	sheets = [s for s in sheetsObj]
-	user_ids = list({s["owner"] for s in sheets})
-	django_user_profiles = User.objects.filter(id__in=user_ids).values('email','first_name','last_name','id')
-	user_profiles = {item['id']: item for item in django_user_profiles}
-	mongo_user_profiles = list(db.profiles.find({"id": {"$in": user_ids}},{"id":1,"slug":1,"profile_pic_url_small":1}))
-	mongo_user_profiles = {item['id']: item for item in mongo_user_profiles}
-	for profile in user_profiles:
-		try:
-			user_profiles[profile]["slug"] = mongo_user_profiles[profile]["slug"]
-		except:
-			user_profiles[profile]["slug"] = "/"
-
-		try:
-			user_profiles[profile]["profile_pic_url_small"] = mongo_user_profiles[profile].get("profile_pic_url_small", '')
-		except:
-			user_profiles[profile]["profile_pic_url_small"] = ""
+	user_ids = list({s[field] for s in sheets for field in ("owner", "assigner_id", "viaOwner") if field in s})
+	user_profiles = bulk_user_profiles(user_ids)
+	collection_slugs = list({s["displayedCollection"] for s in sheets if "displayedCollection" in s})
+	collection_tocs = {c.slug: getattr(c, "toc", None) for c in CollectionSet({"slug": {"$in": collection_slugs}})} if collection_slugs else {}
 
 	results = []
 	for sheet in sheets:
@@ -832,17 +843,12 @@ def get_sheets_for_ref(tref, uid=None, in_collection=None):
 		ownerData = user_profiles.get(sheet["owner"], {'first_name': 'Ploni', 'last_name': 'Almoni', 'email': 'test@sefaria.org', 'slug': 'Ploni-Almoni', 'id': None, 'profile_pic_url_small': ''})
 
 		if "assigner_id" in sheet:
-			asignerData = public_user_data(sheet["assigner_id"])
-			sheet["assignerName"] = asignerData["name"]
-			sheet["assignerProfileUrl"] = asignerData["profileUrl"]
+			sheet["assignerName"], sheet["assignerProfileUrl"] = _name_and_profile_url(user_profiles, sheet["assigner_id"])
 		if "viaOwner" in sheet:
-			viaOwnerData = public_user_data(sheet["viaOwner"])
-			sheet["viaOwnerName"] = viaOwnerData["name"]
-			sheet["viaOwnerProfileUrl"] = viaOwnerData["profileUrl"]
+			sheet["viaOwnerName"], sheet["viaOwnerProfileUrl"] = _name_and_profile_url(user_profiles, sheet["viaOwner"])
 
 		if "displayedCollection" in sheet:
-			collection = Collection().load({"slug": sheet["displayedCollection"]})
-			sheet["collectionTOC"] = getattr(collection, "toc", None)
+			sheet["collectionTOC"] = collection_tocs.get(sheet["displayedCollection"])
 		topics = add_langs_to_topics(sheet.get("topics", []))
 		for anchor_ref, anchor_ref_expanded in zip(anchor_ref_list, anchor_ref_expanded_list):
 			sheet_data = {
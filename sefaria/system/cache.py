@@ -1,6 +1,13 @@
 
 import hashlib
+import heapq
+import itertools
+import math
+import random
 import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from datetime import datetime
 from functools import wraps
 
@@ -46,57 +53,201 @@ def cache_get_key(key_arr):
     return hashlib.md5("".join(key_arr).encode('utf-8')).hexdigest()
 
 
-def django_cache(action="get", timeout=None, cache_key='', cache_prefix=None, default_on_miss=False, default_on_miss_value=None, cache_type=None, decorate_data_with_key=False):
+class CacheStats(object):
+    """
+    Counters of one function decorated with `django_cache`.  See `django_cache_stats()`
+    """
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.l1_hits = 0
+        self.stale_hits = 0  # expired values returned while another caller recomputes
+        self.misses = 0
+        self.recomputes = 0
+        self.early_refreshes = 0
+        self.lock_waits = 0
+        self.lookup_seconds = 0.0
+        self.compute_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def incr(self, counter, seconds=None, seconds_counter="lookup_seconds"):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if seconds is not None:
+                setattr(self, seconds_counter, getattr(self, seconds_counter) + seconds)
+
+    def contents(self):
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
+
+_cache_stats = {}
+
+
+def django_cache_stats():
+    """
+    :return: dict of the counters of every function decorated with `django_cache`, keyed by cache prefix or function name
+    """
+    return {name: stats.contents() for name, stats in _cache_stats.items()}
+
+
+class CachedValue(object):
+    """
+    What `django_cache` stores.  Wrapping the value means that falsy values (empty lists, zero counts, None) are cached
+    like any other, and carries what probabilistic early refresh needs.
+    :param value: the function's result
+    :param delta: seconds it took to compute
+    :param expiry: timestamp after which the value is stale, or None if it never is
+    """
+    def __init__(self, value, delta, expiry):
+        self.value = value
+        self.delta = delta
+        self.expiry = expiry
+
+    def is_stale(self, now):
+        return self.expiry is not None and now >= self.expiry
+
+    def should_refresh(self, now, beta):
+        """
+        "Optimal probabilistic cache stampede prevention" (Vattani et al.): the closer to expiry, and the longer the
+        value took to compute, the likelier that one caller refreshes it before it expires.
+        """
+        if self.expiry is None or beta <= 0:
+            return False
+        return now - self.delta * beta * math.log(1.0 - random.random()) >= self.expiry
+
+
+def django_cache(action="get", timeout=None, cache_key='', cache_prefix=None, default_on_miss=False, default_on_miss_value=None,
+                 cache_type=None, decorate_data_with_key=False, l1_timeout=None, early_refresh_beta=1.0, lock_timeout=60):
     """
     Easily add caching to a function in django
+
+    Only one caller (across processes, where the cache backend's `add` is atomic) computes a missing value.  Others
+    wait for it, up to `lock_timeout` seconds.  Once a value is stale, callers keep getting it for a grace period of a
+    tenth of `timeout` while one of them recomputes it, and callers may refresh it early, at random, as it nears expiry.
+
+    :param action: "get", or "set"/"reset" to compute the value and store it regardless of the cache
+    :param timeout: seconds a value is fresh. None never expires
+    :param l1_timeout: optional. seconds to keep values in an in-process tier in front of the django cache
+    :param early_refresh_beta: > 1 refreshes earlier, 0 never refreshes early
+    :param lock_timeout: seconds one caller may take to compute a value before others compute it too
     """
     if not cache_key:
         cache_key = None
+    grace = None if timeout is None else max(1, timeout // 10)
+    l1 = InMemoryCache(max_entries=1000) if l1_timeout else None
 
     def decorator(fn):
         fn.__dict__["django_cache"] = True
+        stats = _cache_stats.setdefault(cache_prefix or "{}.{}".format(fn.__module__, fn.__name__), CacheStats(fn.__name__))
+
+        def l1_timeout_for(cached):
+            # never keep a value locally past its expiry
+            return l1_timeout if cached.expiry is None else max(0.001, min(l1_timeout, cached.expiry - time.time()))
+
+        def compute(_cache_key, key_name, args, kwargs):
+            start = time.time()
+            result = fn(*args, **kwargs)
+            if decorate_data_with_key:
+                result = {
+                    'key': key_name,
+                    'data': result
+                }
+            delta = time.time() - start
+            stats.incr("recomputes", delta, "compute_seconds")
+            cached = CachedValue(result, delta, None if timeout is None else time.time() + timeout)
+            set_cache_elem(_cache_key, cached, timeout=None if timeout is None else timeout + grace, cache_type=cache_type)
+            if l1 is not None:
+                l1.set(_cache_key, cached, timeout=l1_timeout_for(cached), namespace=stats.name)
+            return cached
+
+        def compute_once(_cache_key, key_name, args, kwargs):
+            """
+            Computes the value if no other caller is computing it
+            :return: CachedValue, or None if another caller holds the lock
+            """
+            lock_key = _cache_key + ":lock"
+            if not get_cache_factory(cache_type).add(lock_key, 1, lock_timeout):
+                return None
+            try:
+                return compute(_cache_key, key_name, args, kwargs)
+            finally:
+                delete_cache_elem(lock_key, cache_type=cache_type)
+
+        def wait_for(_cache_key):
+            """
+            Waits for the caller holding the lock to store the value
+            :return: CachedValue, or None if the lock was released or expired without a value
+            """
+            stats.incr("lock_waits")
+            lock_key = _cache_key + ":lock"
+            deadline = time.time() + lock_timeout
+            pause = 0.01
+            while time.time() < deadline:
+                time.sleep(pause)
+                pause = min(pause * 2, 0.25)
+                released = get_cache_elem(lock_key, cache_type=cache_type) is None
+                cached = get_cache_elem(_cache_key, cache_type=cache_type)
+                if isinstance(cached, CachedValue):
+                    return cached
+                if released:
+                    return None
+            return None
+
+        def lookup(_cache_key):
+            """
+            :return: (CachedValue or None, whether it came from the local tier)
+            """
+            if l1 is not None:
+                cached = l1.get(_cache_key, namespace=stats.name)
+                if cached is not None:
+                    return cached, True
+            cached = get_cache_elem(_cache_key, cache_type=cache_type)
+            if cached is not None and not isinstance(cached, CachedValue):
+                # stored before values were wrapped. falsy values were never meant as hits
+                cached = CachedValue(cached, 0, None) if cached else None
+            if cached is not None and l1 is not None:
+                l1.set(_cache_key, cached, timeout=l1_timeout_for(cached), namespace=stats.name)
+            return cached, False
+
         @wraps(fn)
         def wrapper(*args, **kwargs):
             #logger.debug([args, kwargs])
 
-            # Inner scope variables are read-only so we set a new var
-            _cache_key = cache_key
-            do_actual_func = False
-
-            if not _cache_key:
-                cachekey_args = args[:]
-                if len(cachekey_args) and isinstance(cachekey_args[0], HttpRequest): # we dont want a HttpRequest to form part of the cache key, it wont be replicatable.
-                    cachekey_args = cachekey_args[1:]
-                _cache_ke_arr = cache_get_key_arr(cache_prefix if cache_prefix else fn.__name__, *cachekey_args, **kwargs)
-                _cache_key = cache_get_key(_cache_ke_arr)
+            cachekey_args = args[:]
+            if len(cachekey_args) and isinstance(cachekey_args[0], HttpRequest): # we dont want a HttpRequest to form part of the cache key, it wont be replicatable.
+                cachekey_args = cachekey_args[1:]
+            _cache_ke_arr = cache_get_key_arr(cache_prefix if cache_prefix else fn.__name__, *cachekey_args, **kwargs)
+            _cache_key = cache_key or cache_get_key(_cache_ke_arr)
+            key_name = "_".join(_cache_ke_arr)
 
             if action in ["reset", "set"]:
-                do_actual_func = True
-                """try:
-                    delete_cache_elem(_cache_key, cache_type=cache_type)
-                except:
-                    pass"""
-                result = None
+                cached = compute(_cache_key, key_name, args, kwargs)
             else:
-                #logger.debug(['_cach_key.......',_cache_key])
-                result = get_cache_elem(_cache_key, cache_type=cache_type)
-                if decorate_data_with_key:
-                    result = result["data"]
-
-            if not result:
-                if default_on_miss is False or do_actual_func:
-                    result = fn(*args, **kwargs)
-                    if decorate_data_with_key:
-                        result = {
-                            'key': "_".join(_cache_ke_arr),
-                            'data': result
-                        }
-                    set_cache_elem(_cache_key, result, timeout=timeout, cache_type=cache_type)
+                start = time.time()
+                cached, local = lookup(_cache_key)
+                now = time.time()
+                if cached is None:
+                    stats.incr("misses", now - start)
+                    if default_on_miss is not False:
+                        logger.critical("No cached data was found for {}".format(fn.__name__))
+                        return default_on_miss_value
+                    cached = compute_once(_cache_key, key_name, args, kwargs) or wait_for(_cache_key) or compute(_cache_key, key_name, args, kwargs)
+                elif cached.is_stale(now) or cached.should_refresh(now, early_refresh_beta):
+                    refreshed = None if default_on_miss is not False else compute_once(_cache_key, key_name, args, kwargs)
+                    if refreshed is not None:
+                        stats.incr("misses" if cached.is_stale(now) else "early_refreshes", now - start)
+                        cached = refreshed
+                    else:
+                        stats.incr("stale_hits" if cached.is_stale(now) else "hits", now - start)
                 else:
-                    result = default_on_miss_value
-                    logger.critical("No cached data was found for {}".format(fn.__name__))
+                    stats.incr("l1_hits" if local else "hits", now - start)
 
+            result = cached.value
+            if decorate_data_with_key and isinstance(result, dict) and "data" in result:
+                result = result["data"]
             return result
+
+        wrapper.cache_stats = stats
         return wrapper
     return decorator
 #-------------------------------------------------------------#
@@ -146,26 +297,159 @@ def delete_template_cache(fragment_name='', *args):
     delete_cache_elem('template.cache.%s.%s' % (fragment_name, hashlib.md5(':'.join([arg for arg in args]).encode('utf-8')).hexdigest()))
 
 
-class InMemoryCache():
-    data = {}
-    timeouts = {}
+IN_MEMORY_CACHE_MAX_ENTRIES = getattr(settings, 'IN_MEMORY_CACHE_MAX_ENTRIES', 10000)
+IN_MEMORY_CACHE_MAX_BYTES = getattr(settings, 'IN_MEMORY_CACHE_MAX_BYTES', 256 * 1024 * 1024)
 
-    def set(self, key, val, timeout=None):
-        self.data[key] = val
-        if timeout:
-            self.timeouts[key] = (timeout, datetime.now().timestamp())
 
-    def get(self, key):
-        timeout = self.timeouts.get(key, None)
-        if timeout and timeout[0] + timeout[1] < datetime.now().timestamp():
-            self.set(key, None, timeout=timeout[0])
-            return None
+def approximate_size(obj, sample=8, depth=4):
+    """
+    Estimates the bytes used by `obj` and the containers, strings and numbers it holds, from the sizes of up to `sample`
+    items of each container, to `depth` containers down, so that it's cheap to call however large `obj` is.
+    Items held by more than one container are counted in each, and those further down aren't counted.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        items = [i for kv in itertools.islice(obj.items(), sample) for i in kv]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = list(itertools.islice(obj, sample))
+    elif hasattr(obj, "__dict__") and not callable(obj):
+        return size + approximate_size(obj.__dict__, sample, depth - 1) if depth else size
+    else:
+        return size
+    if not items or not depth:
+        return size
+    sampled = sum(approximate_size(item, sample, depth - 1) for item in items)
+    return size + sampled * len(obj) * (2 if isinstance(obj, dict) else 1) // len(items)
+
+
+class InMemoryCacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.entries = 0
+        self.bytes = 0
+
+    def contents(self):
+        return dict(self.__dict__)
+
+
+class InMemoryCache(object):
+    """
+    A per-process cache, bounded by number of entries and approximate bytes, which evicts the least recently used
+    entries past either bound.  Expired entries are swept a few at a time on every access, so they don't accumulate
+    if they are never read again.
 
-        return self.data.get(key,  None)
+    Setting a key to None deletes it (multiserver events invalidate entries that way).
+    Each entry belongs to a namespace, the key unless given, for stats.
+    """
+    SWEEP_PER_ACCESS = 10
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries if max_entries is not None else IN_MEMORY_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes if max_bytes is not None else IN_MEMORY_CACHE_MAX_BYTES
+        self._data = OrderedDict()  # key -> (value, expiry or None, size, namespace), least recently used first
+        self._expiries = []  # heap of (expiry, key).  May hold entries that have since been replaced
+        self._bytes = 0
+        self._stats = defaultdict(InMemoryCacheStats)
+        self._lock = threading.RLock()
+
+    def set(self, key, val, timeout=None, namespace=None):
+        if val is None:
+            self.delete(key)
+            return
+        expiry = time.time() + timeout if timeout else None
+        size = approximate_size(val)
+        namespace = namespace or key
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (val, expiry, size, namespace)
+            self._bytes += size
+            stats = self._stats[namespace]
+            stats.sets += 1
+            stats.entries += 1
+            stats.bytes += size
+            if expiry is not None:
+                heapq.heappush(self._expiries, (expiry, key))
+                if len(self._expiries) > 2 * len(self._data) + 100:
+                    # drop the expiries of replaced and removed entries
+                    self._expiries = [(e[1], k) for k, e in self._data.items() if e[1] is not None]
+                    heapq.heapify(self._expiries)
+            self._sweep()
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                evicted_key = next(iter(self._data))
+                self._stats[self._data[evicted_key][3]].evictions += 1
+                self._remove(evicted_key)
+
+    def get(self, key, namespace=None):
+        """
+        :param namespace: optional. namespace to count a miss in. defaults to the key, if it has been set before
+        """
+        with self._lock:
+            self._sweep()
+            entry = self._data.get(key)
+            if entry is None:
+                # don't add a namespace for every key ever missed
+                namespace = namespace or (key if key in self._stats else "other")
+                self._stats[namespace].misses += 1
+                return None
+            val, expiry, size, namespace = entry
+            if expiry is not None and expiry <= time.time():
+                self._stats[namespace].expirations += 1
+                self._stats[namespace].misses += 1
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            self._stats[namespace].hits += 1
+            return val
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
 
     def reset_all(self):
-        for k in self.data:
-            self.data[k] = None
-
-
-in_memory_cache = InMemoryCache()
\ No newline at end of file
+        with self._lock:
+            self._data = OrderedDict()
+            self._expiries = []
+            self._bytes = 0
+            for stats in self._stats.values():
+                stats.entries = 0
+                stats.bytes = 0
+
+    def stats(self):
+        """
+        :return: dict of counters, keyed by namespace, and the total entries and bytes held
+        """
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "namespaces": {namespace: stats.contents() for namespace, stats in self._stats.items()},
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            size, namespace = entry[2], entry[3]
+            self._bytes -= size
+            self._stats[namespace].entries -= 1
+            self._stats[namespace].bytes -= size
+
+    def _sweep(self):
+        now = time.time()
+        for _ in range(self.SWEEP_PER_ACCESS):
+            if not self._expiries or self._expiries[0][0] > now:
+                return
+            expiry, key = heapq.heappop(self._expiries)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == expiry:  # not replaced since
+                self._stats[entry[3]].expirations += 1
+                self._remove(key)
+
+
+in_memory_cache = InMemoryCache()
@@ -163,6 +163,7 @@ def ensure_indices(active_db=None):
             ('history', ["old.refs"],{}),
             ('history', ["old.ref"],{}),
             ('history', ["title"],{}),
+            ('history_checkpoints', [[("ref", pymongo.ASCENDING), ("version", pymongo.ASCENDING), ("language", pymongo.ASCENDING), ("revision", pymongo.ASCENDING)]], {'unique': True}),
             ('index', ["title"],{}),
             ('index_queue', [[("lang", pymongo.ASCENDING), ("version", pymongo.ASCENDING), ("ref", pymongo.ASCENDING)]],{'unique': True}),
             ('index', ["categories.0"], {}),
@@ -174,6 +175,8 @@ def ensure_indices(active_db=None):
             ('links', ["refs.1"],{}),
             ('links', ["expandedRefs0"],{}),
             ('links', ["expandedRefs1"],{}),
+            ('links', ["expandedOrdinals0"],{}),
+            ('links', ["expandedOrdinals1"],{}),
             ('links', ["source_text_oid"],{}),
             ('links', ["is_first_comment"],{}),
             ('links', ["inline_citation"],{}),
@@ -194,6 +197,7 @@ def ensure_indices(active_db=None):
             ('sheets', ["sources.ref"],{}),
             ('sheets', ["includedRefs"],{}),
             ('sheets', ["expandedRefs"], {}),
+            ('sheets', ["expandedOrdinals"], {}),
             ('sheets', ["tags"],{}),
             ('sheets', ["owner"],{}),
             ('sheets', ["assignment_id"],{}),
@@ -203,6 +207,11 @@ def ensure_indices(active_db=None):
             ('sheets', [[("views", pymongo.DESCENDING)]],{}),
             ('sheets', ["categories"], {}),
             ('links', [[("owner", pymongo.ASCENDING), ("date_modified", pymongo.DESCENDING)]], {}),
+            ('ref_ordinal_nodes', ["node"], {'unique': True}),
+            ('recommendation_candidates', ["ref"], {'unique': True}),
+            ('recommendation_index_queue', ["ref"], {'unique': True}),
+            ('recommendation_index_queue', ["date"], {}),
+            ('calendar_items', [[("date", pymongo.ASCENDING), ("diaspora", pymongo.ASCENDING), ("custom", pymongo.ASCENDING)]], {'unique': True}),
             ('texts', ["title"],{}),
             ('texts', [[("priority", pymongo.DESCENDING), ("_id", pymongo.ASCENDING)]],{}),
             ('texts', [[("versionTitle", pymongo.ASCENDING), ("langauge", pymongo.ASCENDING)]],{}),
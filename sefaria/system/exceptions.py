@@ -57,6 +57,14 @@ class ManuscriptError(Exception):
     pass
 
 
+class LockTimeoutError(Exception):
+    def __init__(self, name, wait):
+        self.name = name
+        self.wait = wait
+        self.message = f"Timed out after {wait} seconds waiting for the lock on '{name}'."
+        super().__init__(self.message)
+
+
 class MissingKeyError(Exception):
     pass
 
@@ -0,0 +1,133 @@
+"""
+fanout.py
+Runs independent lookups concurrently on a shared, bounded thread pool, so that a view which bundles several sources
+takes about as long as its slowest source rather than the sum of all of them.
+
+Each source has its own deadline, measured from when the fan out starts.  A source that misses its deadline or raises
+is reported, and its default value is used instead, so the caller always gets a (possibly partial) result.
+A timed out source can't be interrupted.  It keeps running on its thread and its result is discarded.
+
+Each fan out runs its sources on threads of its own, so sources that time out don't hold up the sources of later
+requests.  A thread is only started for a source while fewer than FAN_OUT_MAX_WORKERS sources are running in the
+process, counting ones that timed out.  Past that, sources run one after another on the calling thread.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.db import connections
+from django.utils import translation
+
+import structlog
+logger = structlog.get_logger(__name__)
+
+try:
+    from sefaria.settings import FAN_OUT_MAX_WORKERS
+except ImportError:
+    FAN_OUT_MAX_WORKERS = 16
+
+# One for each source running on a fan out thread, in any fan out of the process
+_thread_slots = threading.BoundedSemaphore(FAN_OUT_MAX_WORKERS)
+
+
+class FanOutSource(object):
+    """
+    One lookup in a fan out
+    :param name: key of the result
+    :param func: callable
+    :param args, kwargs: arguments for `func`
+    :param timeout: seconds after the start of the fan out to wait for the result. None to wait indefinitely
+    :param default: result used if the source times out or fails
+    """
+    def __init__(self, name, func, args=None, kwargs=None, timeout=None, default=None):
+        self.name = name
+        self.func = func
+        self.args = args or ()
+        self.kwargs = kwargs or {}
+        self.timeout = timeout
+        self.default = default
+
+
+class FanOutResult(object):
+    def __init__(self):
+        self.results = {}
+        self.timings = {}  # name -> seconds the source ran, or waited before it was abandoned
+        self.timed_out = []
+        self.failed = []
+
+    @property
+    def partial(self):
+        return bool(self.timed_out or self.failed)
+
+    def server_timing(self):
+        """
+        :return: value for a Server-Timing header, with the duration of every source in milliseconds
+        """
+        return ", ".join("{};dur={:.1f}".format(name, seconds * 1000) for name, seconds in self.timings.items())
+
+
+def _run(source, language):
+    start = time.perf_counter()
+    try:
+        with translation.override(language):
+            return source.func(*source.args, **source.kwargs), time.perf_counter() - start
+    finally:
+        # Django connections are per thread. Don't leave one open on a fan out thread.
+        connections.close_all()
+
+
+def _run_here(source):
+    future = Future()
+    start = time.perf_counter()
+    try:
+        future.set_result((source.func(*source.args, **source.kwargs), time.perf_counter() - start))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def fan_out(sources, executor=None):
+    """
+    Runs `sources` concurrently and waits for each one until its deadline.
+    :param sources: list of FanOutSource
+    :param executor: optional. By default, the sources run on threads of this fan out, limited by FAN_OUT_MAX_WORKERS
+    :return: FanOutResult, with a result for every source in `sources`
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max(len(sources), 1), thread_name_prefix="fanout")
+    language = translation.get_language()
+    start = time.perf_counter()
+    slots = _thread_slots
+    futures = [None] * len(sources)
+    for i, source in enumerate(sources):
+        if own_executor and not slots.acquire(blocking=False):
+            continue
+        futures[i] = executor.submit(_run, source, language)
+        if own_executor:
+            futures[i].add_done_callback(lambda future: slots.release())
+    if own_executor:
+        executor.shutdown(wait=False)  # the threads of sources that time out exit when they finish
+    for i, source in enumerate(sources):
+        if futures[i] is None:
+            futures[i] = _run_here(source)
+    result = FanOutResult()
+    for source, future in zip(sources, futures):
+        remaining = None if source.timeout is None else max(0, start + source.timeout - time.perf_counter())
+        try:
+            value, duration = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            result.timed_out.append(source.name)
+            result.results[source.name] = source.default
+            result.timings[source.name] = time.perf_counter() - start
+            logger.warning("Fan out source '{}' timed out after {}s".format(source.name, source.timeout))
+        except Exception as e:
+            result.failed.append(source.name)
+            result.results[source.name] = source.default
+            result.timings[source.name] = time.perf_counter() - start
+            logger.exception("Fan out source '{}' failed: {}".format(source.name, e))
+        else:
+            result.results[source.name] = value
+            result.timings[source.name] = duration
+    return result
@@ -1,5 +1,10 @@
 import json
+import os
+import socket
+import threading
+import time
 import uuid
+from contextlib import contextmanager
 
 from django.core.exceptions import MiddlewareNotUsed
 
@@ -10,78 +15,377 @@ from .messaging import MessagingNode
 import structlog
 logger = structlog.get_logger(__name__)
 
+try:
+    from sefaria.settings import MULTISERVER_LISTENER_THREAD
+except ImportError:
+    MULTISERVER_LISTENER_THREAD = True
+try:
+    from sefaria.settings import MULTISERVER_EVENT_LOG_LENGTH
+except ImportError:
+    MULTISERVER_EVENT_LOG_LENGTH = 1000
+
+_listener_lock = threading.Lock()
+
+
+class ReadWriteLock(object):
+    """
+    Lets any number of threads read at once, or one thread write.  A waiting writer holds back new readers, so that
+    it isn't starved by a steady stream of requests.  A thread may nest reads, and may nest writes, but can't write
+    while it reads.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def is_reading(self):
+        return getattr(self._local, "depth", 0) > 0
+
+    @contextmanager
+    def reading(self):
+        me = threading.get_ident()
+        if self.is_reading() or self._writer == me:
+            self._local.depth = getattr(self._local, "depth", 0) + 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        with self._condition:
+            while self._writer is not None or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        if self.is_reading():
+            raise RuntimeError("Can't write to the library while reading it - this would deadlock")
+        with self._condition:
+            if self._writer != me:
+                self._writers_waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._condition.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self._writer = me
+            self._writer_depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+# Requests read the library under this lock, and events change it under it, so that a request never sees a library
+# that an event is part way through changing.
+library_lock = ReadWriteLock()
+
+
+class EventStats(object):
+    """
+    Counts of the events a ServerCoordinator has seen, and the time taken to apply them.
+    lag is the time from publish to applied, across servers, so it depends on their clocks agreeing.
+    """
+    def __init__(self):
+        self.events_applied = 0
+        self.events_failed = 0
+        self.events_skipped = 0
+        self.gaps = 0
+        self.gaps_recovered = 0
+        self.resyncs = 0
+        self.apply_seconds = 0.0
+        self.max_apply_seconds = 0.0
+        self.lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def incr(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def record_apply(self, seconds, lag):
+        with self._lock:
+            self.apply_seconds += seconds
+            self.max_apply_seconds = max(self.max_apply_seconds, seconds)
+            if lag is not None:
+                self.lag_seconds += lag
+                self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+    def contents(self):
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
 
 class ServerCoordinator(MessagingNode):
     """
     Runs on each instance of the server.
     publish_event() - Used for publishing events to other servers
     sync() - used for listening for events. Invoked periodically from MultiServerEventListenerMiddleware
+    start_listener() - listens for events in a background thread, and applies them as they arrive
+
+    Events are applied under library_lock.writing(), and MultiServerEventListenerMiddleware handles requests under
+    library_lock.reading(), so an event waits for the requests in progress, and holds back new ones while it's applied.
+
+    Each event gets the next number from a Redis counter, and is kept in a Redis sorted set for a while, as well as
+    published.  Events are applied in order.  A missing event is read from the log, and if it can't be found within
+    `gap_timeout` seconds, the library is rebuilt from the database.
     """
     subscription_channels = [MULTISERVER_REDIS_EVENT_CHANNEL]
+    sequence_key = MULTISERVER_REDIS_EVENT_CHANNEL + ":seq"
+    log_key = MULTISERVER_REDIS_EVENT_CHANNEL + ":log"
+    log_length = MULTISERVER_EVENT_LOG_LENGTH
+    gap_timeout = 2.0           # seconds to wait for a missing event before rebuilding the library
+    sequence_check_interval = 5.0  # seconds between checks of the sequence number, for events published while the listener was disconnected
+
+    def __init__(self):
+        self.stats = EventStats()
+        self.last_seq = None
+        self._pending = {}      # seq -> event data, for events received ahead of a missing one
+        self._gap_since = None
+        self._listener = None
+        self._listener_pid = None
+        self._stop = threading.Event()
+
+    @property
+    def origin(self):
+        return "{}:{}".format(socket.gethostname(), os.getpid())
+
+    def connect(self):
+        super(ServerCoordinator, self).connect()
+        if self.last_seq is None:
+            # The library was just loaded from the database, so it already reflects every event published so far
+            self.last_seq = self._current_seq()
+
+    def _current_seq(self):
+        try:
+            return int(self.redis_client.get(self.sequence_key) or 0)
+        except Exception:
+            logger.error("Failed to connect to Redis instance while reading event sequence.")
+            return None
+
+    @property
+    def listening(self):
+        return self._listener is not None and self._listener_pid == os.getpid() and self._listener.is_alive()
 
     def publish_event(self, obj, method, args = None):
         """
-
-        :param obj:
-        :param method:
-        :param args:
+        Publishes an event to the other servers.  The caller is expected to have made the change locally already.
+        :param obj: name of the object to call the method on - "library", "scache", "text", "in_memory_cache" or
+        "ref_ordinal_map"
+        :param method: method name
+        :param args: list of JSON serializable arguments
         :return:
         """
-        # Check to see if there's any messages in the queue before pushing/popping a new one.
-        ## Edge case - needs thought - does the order of operations make for trouble in this case?##
-        self.sync()
+        # Apply anything earlier before publishing.  The listener thread does this on its own.
+        # A request can't apply events while it reads the library - they wait for the next call of sync().
+        apply_here = not self.listening and not library_lock.is_reading()
+        if apply_here:
+            self.sync()
+        self._check_initialization()
 
         payload = {
             "obj": obj,
             "method": method,
             "args": args or [],
-            "id": uuid.uuid4().hex
+            "id": uuid.uuid4().hex,
+            "origin": self.origin,
+            "published": time.time(),
         }
-        msg_data = json.dumps(payload)
 
-        import socket
-        import os
-        logger.info("publish_event from {}:{} - {}".format(socket.gethostname(), os.getpid(), msg_data))
         try:
-            self.redis_client.publish(MULTISERVER_REDIS_EVENT_CHANNEL, msg_data)
+            payload["seq"] = self.redis_client.incr(self.sequence_key)
+            msg_data = json.dumps(payload)
+            logger.info("publish_event from {} - {}".format(self.origin, msg_data))
+            pipe = self.redis_client.pipeline()
+            pipe.zadd(self.log_key, {msg_data: payload["seq"]})
+            pipe.zremrangebyrank(self.log_key, 0, -self.log_length - 1)
+            pipe.publish(MULTISERVER_REDIS_EVENT_CHANNEL, msg_data)
+            pipe.execute()
         except Exception:
             logger.error("Failed to connect to Redis instance while doing message publish.")
             return
 
-        # Since we are subscribed to this channel as well, throw away the message we just sent.
-        # It would be nice to assume that nothing new came through in the microseconds that it took to publish ##
-        # But the below should insulate against even that case ##
-        try:
-            popped_msg = self.pubsub.get_message()
-        except Exception:
-            logger.error("Failed to connect to Redis instance while doing message publish listen.")
-            popped_msg = None
-
-        while popped_msg:
-            if popped_msg["data"] != msg_data:
-                logger.warning("Multiserver Message collision!")
-                self._process_message(popped_msg)
-            try:
-                popped_msg = self.pubsub.get_message()
-            except Exception:
-                logger.error("Failed to connect to Redis instance while doing message publish listen.")
-                popped_msg = None
+        if apply_here:
+            # Since we are subscribed to this channel as well, pass over the message we just sent,
+            # and apply anything that came through from other servers in the meantime.
+            self.sync()
 
     def sync(self):
+        """
+        Applies the events that have arrived since the last call
+        """
         self._check_initialization()
-        try:
-            msg = self.pubsub.get_message()
-        except Exception:
-            logger.error("Failed to connect to Redis instance while doing multiserver sync.")
-            return
-        if not msg or msg["type"] == "subscribe":
+        while True:
+            try:
+                msg = self.pubsub.get_message()
+            except Exception:
+                logger.error("Failed to connect to Redis instance while doing multiserver sync.")
+                return
+            if not msg:
+                break
+            self._receive(msg)
+        self._check_gap()
+
+    def _receive(self, msg):
+        if msg["type"] == "subscribe":
             return
-
         if msg["type"] != "message":
             logger.error("Surprising redis message type: {}".format(msg["type"]))
+            return
 
-        self._process_message(msg)
-        self.sync()  # While there are still live messages, keep processing them.
+        data = json.loads(msg["data"])
+        if data.get("seq") is None:
+            # Published by a server that doesn't number its events
+            self._process_message(msg)
+            return
+        if self.last_seq is None:
+            self.last_seq = data["seq"] - 1
+        if data["seq"] <= self.last_seq:
+            self.stats.incr("events_skipped")
+            return
+        self._pending[data["seq"]] = msg
+        self._apply_pending()
+        if self._pending:
+            self._close_gap(min(self._pending) - 1)
+
+    def _apply_pending(self):
+        """
+        Applies pending events in order, up to the first missing one
+        """
+        while self.last_seq + 1 in self._pending:
+            msg = self._pending.pop(self.last_seq + 1)
+            self.last_seq += 1
+            if json.loads(msg["data"]).get("origin") == self.origin:
+                # Already applied here, by the publisher
+                continue
+            self._process_message(msg)
+
+    def _check_gap(self, check_sequence=False):
+        """
+        :param check_sequence: Also compare with the Redis counter, for missing events that nothing after them has been received for
+        """
+        if self._pending:
+            self._close_gap(min(self._pending) - 1)
+        elif check_sequence and self.last_seq is not None:
+            current = self._current_seq()
+            if current is not None and current > self.last_seq:
+                self._close_gap(current)
+
+    def _close_gap(self, until):
+        """
+        Reads events last_seq + 1 through `until` from the event log and applies them, along with the pending events
+        after them.  Rebuilds the library if they've been missing for more than gap_timeout seconds.
+        """
+        if self._gap_since is None:
+            self.stats.incr("gaps")
+            self._gap_since = time.time()
+            logger.warning("Multiserver events missing", last_seq=self.last_seq, until=until)
+        try:
+            logged = self.redis_client.zrangebyscore(self.log_key, self.last_seq + 1, until)
+        except Exception:
+            logger.error("Failed to connect to Redis instance while reading event log.")
+            logged = []
+        for msg_data in logged:
+            seq = json.loads(msg_data)["seq"]
+            if seq > self.last_seq:
+                self._pending.setdefault(seq, {"type": "message", "channel": MULTISERVER_REDIS_EVENT_CHANNEL, "data": msg_data})
+        self._apply_pending()
+
+        if self.last_seq >= until and not self._pending:
+            self.stats.incr("gaps_recovered")
+            self._gap_since = None
+        elif time.time() - self._gap_since > self.gap_timeout:
+            self._resync(max([until] + list(self._pending)))
+
+    def _resync(self, seq):
+        """
+        Rebuilds the library from the database, which reflects every event up to `seq` and maybe later
+        """
+        logger.warning("Multiserver events lost - rebuilding library", last_seq=self.last_seq, seq=seq)
+        self.stats.incr("resyncs")
+        current = self._current_seq()
+        with library_lock.writing():
+            try:
+                self._event_targets()["library"].rebuild(include_toc=True)
+            except Exception as e:
+                logger.error("Failed to rebuild library: {}".format(e))
+            self._event_targets()["ref_ordinal_map"].reset()
+        self.last_seq = max(seq, current or 0)
+        self._pending = {seq: msg for seq, msg in self._pending.items() if seq > self.last_seq}
+        self._gap_since = None
+
+    def start_listener(self):
+        """
+        Starts the background listener thread for this process, if it isn't running.
+        Threads don't survive a fork, so this is called from each worker, rather than at startup.
+        """
+        if self.listening:
+            return
+        with _listener_lock:
+            if self.listening:
+                return
+            self._stop.clear()
+            self._listener_pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, name="multiserver-listener", daemon=True)
+            self._listener.start()
+
+    def stop_listener(self, timeout=None):
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout)
+
+    def _listen(self):
+        connected = False
+        last_check = 0
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                if not connected:
+                    # A new connection - one made before a fork is shared with the parent and the other workers
+                    self.connect()
+                    connected = True
+                    last_check = 0  # Events published while disconnected are only in the log
+                msg = self.pubsub.get_message(timeout=1.0)
+                if msg:
+                    self._receive(msg)
+                elif self._pending or time.time() - last_check > self.sequence_check_interval:
+                    self._check_gap(check_sequence=True)
+                    last_check = time.time()
+                backoff = 1
+            except Exception as e:
+                logger.error("Multiserver listener failed - reconnecting in {}s: {}".format(backoff, e))
+                connected = False
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    @staticmethod
+    def _event_targets():
+        """
+        :return: dict of the objects that events can call methods on
+        """
+        from sefaria.model import library
+        import sefaria.system.cache as scache
+        import sefaria.model.text as text
+        from sefaria.system.cache import in_memory_cache
+        from sefaria.model.ref_ordinal import ref_ordinal_map
+        return {"library": library, "scache": scache, "text": text, "in_memory_cache": in_memory_cache,
+                "ref_ordinal_map": ref_ordinal_map}
 
     def _process_message(self, msg):
         """
@@ -92,7 +396,10 @@ class ServerCoordinator(MessagingNode):
             "obj": obj,
             "method": method,
             "args": args or [],
-            "id": uuid.uuid4().hex
+            "id": uuid.uuid4().hex,
+            "seq": 1234,
+            "origin": "host:pid",
+            "published": 1700000000.0
           }
           'pattern': None,
           'type': 'message',
@@ -102,25 +409,20 @@ class ServerCoordinator(MessagingNode):
         """
 
 
-        # A list of all of the objects that be referenced
-        from sefaria.model import library
-        import sefaria.system.cache as scache
-        import sefaria.model.text as text
-        from sefaria.system.cache import in_memory_cache
-
-        import socket
-        import os
         host = socket.gethostname()
         pid = os.getpid()
 
         data = json.loads(msg["data"])
 
-        obj = locals()[data["obj"]]
+        obj = self._event_targets()[data["obj"]]
         method = getattr(obj, data["method"])
 
+        start = time.perf_counter()
         try:
-            method(*data["args"])
+            with library_lock.writing():
+                method(*data["args"])
             logger.info("Processing succeeded for {} on {}:{}".format(self.event_description(data), host, pid))
+            self.stats.incr("events_applied")
 
             confirm_msg = {
                 'event_id': data["id"],
@@ -131,6 +433,7 @@ class ServerCoordinator(MessagingNode):
 
         except Exception as e:
             logger.error("Processing failed for {} on {}:{} - {}".format(self.event_description(data), host, pid, str(e)))
+            self.stats.incr("events_failed")
 
             confirm_msg = {
                 'event_id': data["id"],
@@ -139,6 +442,11 @@ class ServerCoordinator(MessagingNode):
                 'status': 'error',
                 'error': str(e)
             }
+        seconds = time.perf_counter() - start
+        lag = time.time() - data["published"] if "published" in data else None
+        self.stats.record_apply(seconds, lag)
+        logger.info("Applied multiserver event", event_id=data["id"], seq=data.get("seq"), apply_seconds=round(seconds, 4),
+                    lag_seconds=round(lag, 4) if lag is not None else None)
 
         # Send confirmation
         msg_data = json.dumps(confirm_msg)
@@ -150,6 +458,11 @@ class ServerCoordinator(MessagingNode):
 
 
 class MultiServerEventListenerMiddleware(object):
+    """
+    Starts the listener thread of the worker on its first request.
+    Without MULTISERVER_LISTENER_THREAD, applies library updates between requests instead.
+    Requests are handled under library_lock.reading(), so that events aren't applied while they run.
+    """
     delay = 20  # Will check for library updates every X requests.  0 means every request.
 
     def __init__(self, get_response):
@@ -160,13 +473,16 @@ class MultiServerEventListenerMiddleware(object):
         self.req_counter = 0
 
     def __call__(self, request):
-        if self.req_counter == self.delay:
+        if MULTISERVER_LISTENER_THREAD:
+            server_coordinator.start_listener()
+        elif self.req_counter == self.delay:
             server_coordinator.sync()
             self.req_counter = 0
         else:
             self.req_counter += 1
 
-        response = self.get_response(request)
+        with library_lock.reading():
+            response = self.get_response(request)
         return response
 
 server_coordinator = ServerCoordinator() if MULTISERVER_ENABLED else None
@@ -0,0 +1,167 @@
+import sys
+import threading
+import time
+
+import pytest
+from django.test import override_settings
+
+from sefaria.system import cache
+from sefaria.system.cache import django_cache, get_cache_factory, InMemoryCache, approximate_size
+
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "cache_test"}}
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache():
+    with override_settings(CACHES=LOCMEM):
+        get_cache_factory(None).clear()
+        yield
+
+
+class Counter(object):
+    """
+    A function to cache, which counts its calls
+    """
+    def __init__(self, value=None, seconds=0):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        def compute(*args):
+            with self._lock:
+                self.calls += 1
+            time.sleep(seconds)
+            return value
+        self.compute = compute
+
+
+def call_concurrently(func, threads=10):
+    barrier = threading.Barrier(threads)
+    results = []
+
+    def call():
+        barrier.wait()
+        results.append(func("key"))
+
+    workers = [threading.Thread(target=call) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return results
+
+
+class TestDjangoCache:
+
+    @pytest.mark.parametrize("value", [[], 0, None, {}])
+    def test_empty_values_are_cached(self, value):
+        counter = Counter(value)
+        cached = django_cache(cache_prefix="empty_{}".format(value))(counter.compute)
+        assert cached("key") == value
+        assert cached("key") == value
+        assert counter.calls == 1
+        assert cached.cache_stats.hits >= 1
+
+    def test_one_compute_on_cold_miss(self):
+        counter = Counter("value", seconds=0.2)
+        cached = django_cache(timeout=60, cache_prefix="cold_miss")(counter.compute)
+        assert call_concurrently(cached) == ["value"] * 10
+        assert counter.calls == 1
+
+    def test_one_recompute_per_expiry(self):
+        counter = Counter("value", seconds=0.2)
+        cached = django_cache(timeout=2, cache_prefix="expiry", early_refresh_beta=0)(counter.compute)
+        cached("key")
+        time.sleep(2.05)
+        assert call_concurrently(cached) == ["value"] * 10
+        assert counter.calls == 2
+        assert cached.cache_stats.stale_hits == 9
+
+    def test_early_refresh(self, monkeypatch):
+        monkeypatch.setattr(cache.random, "random", lambda: 0.5)
+        counter = Counter("value", seconds=0.1)
+        cached = django_cache(timeout=1, cache_prefix="early", early_refresh_beta=100)(counter.compute)
+        cached("key")
+        cached("key")  # 0.1s to compute * beta 100 * ln 2 is well past the 1s expiry, so it's refreshed early
+        assert counter.calls == 2
+        assert cached.cache_stats.early_refreshes == 1
+
+    def test_l1_tier(self):
+        counter = Counter("value")
+        cached = django_cache(timeout=60, cache_prefix="l1", l1_timeout=60)(counter.compute)
+        cached("key")
+        get_cache_factory(None).clear()
+        assert cached("key") == "value"
+        assert counter.calls == 1
+        assert cached.cache_stats.l1_hits == 1
+
+    def test_reset(self):
+        counter = Counter("value")
+        cached = django_cache(cache_prefix="reset")(counter.compute)
+        cached("key")
+        django_cache(action="reset", cache_prefix="reset")(counter.compute)("key")
+        assert cached("key") == "value"
+        assert counter.calls == 2
+
+
+class TestInMemoryCache:
+
+    def test_set_get_delete(self):
+        c = InMemoryCache()
+        c.set("a", [1])
+        assert c.get("a") == [1]
+        c.delete("a")
+        assert c.get("a") is None
+        assert len(c) == 0
+
+    def test_set_none_deletes(self):
+        c = InMemoryCache()
+        c.set("a", [1])
+        c.set("a", None)
+        assert len(c) == 0
+
+    def test_lru_eviction_by_entries(self):
+        c = InMemoryCache(max_entries=2)
+        c.set("a", 1)
+        c.set("b", 2)
+        c.get("a")
+        c.set("c", 3)
+        assert c.get("b") is None
+        assert c.get("a") == 1 and c.get("c") == 3
+        assert c.stats()["namespaces"]["b"]["evictions"] == 1
+
+    def test_eviction_by_bytes(self):
+        c = InMemoryCache(max_bytes=approximate_size("x" * 1000) * 2)
+        for key in "abc":
+            c.set(key, key * 1000)
+        assert len(c) == 2
+        assert c.stats()["bytes"] <= c.max_bytes
+
+    def test_approximate_size_of_uniform_items(self):
+        segments = [["x" * 100] * 50 for _ in range(1000)]
+        assert approximate_size(segments) == sys.getsizeof(segments) + 1000 * (sys.getsizeof(segments[0]) + 50 * sys.getsizeof("x" * 100))
+        assert approximate_size({"a": 1, "b": 2}) == sys.getsizeof({"a": 1, "b": 2}) + 2 * sys.getsizeof("a") + 2 * sys.getsizeof(1)
+
+    def test_expired_entries_are_swept(self):
+        c = InMemoryCache()
+        c.set("a", 1, timeout=0.05)
+        c.set("b", 2)
+        time.sleep(0.1)
+        c.get("b")  # any access sweeps expired entries
+        assert len(c) == 1
+        assert c.stats()["namespaces"]["a"]["expirations"] == 1
+
+    def test_reset_all(self):
+        c = InMemoryCache()
+        c.set("a", 1)
+        c.reset_all()
+        assert len(c) == 0
+        assert c.stats()["bytes"] == 0
+
+    def test_namespace_stats(self):
+        c = InMemoryCache()
+        c.set("page-en", 1, namespace="page")
+        c.set("page-he", 2, namespace="page")
+        c.get("page-en")
+        c.get("page-fr", namespace="page")
+        stats = c.stats()["namespaces"]["page"]
+        assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 1, 1)
@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sefaria.system import fanout
+from sefaria.system.fanout import FanOutSource, fan_out
+
+
+def slow(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def slow_thread_id(seconds):
+    time.sleep(seconds)
+    return threading.get_ident()
+
+
+def fail():
+    raise ValueError("source failed")
+
+
+class TestFanOut:
+
+    def test_results(self):
+        result = fan_out([
+            FanOutSource("a", slow, (0, 1)),
+            FanOutSource("b", slow, (0,), {"value": 2}),
+        ], executor=ThreadPoolExecutor(2))
+        assert result.results == {"a": 1, "b": 2}
+        assert not result.partial
+        assert list(result.timings.keys()) == ["a", "b"]
+
+    def test_sources_run_concurrently(self):
+        start = time.perf_counter()
+        result = fan_out([FanOutSource(str(i), slow, (0.2, i)) for i in range(4)], executor=ThreadPoolExecutor(4))
+        assert time.perf_counter() - start < 0.6
+        assert result.results == {str(i): i for i in range(4)}
+
+    def test_timeout_gives_partial_result(self):
+        start = time.perf_counter()
+        result = fan_out([
+            FanOutSource("fast", slow, (0, "ok"), timeout=1),
+            FanOutSource("slow", slow, (2, "late"), timeout=0.1, default=[]),
+        ], executor=ThreadPoolExecutor(2))
+        assert time.perf_counter() - start < 1
+        assert result.results == {"fast": "ok", "slow": []}
+        assert result.timed_out == ["slow"]
+        assert result.partial
+
+    def test_failure_gives_default(self):
+        result = fan_out([
+            FanOutSource("ok", slow, (0, "ok")),
+            FanOutSource("broken", fail, default=[]),
+        ], executor=ThreadPoolExecutor(2))
+        assert result.results == {"ok": "ok", "broken": []}
+        assert result.failed == ["broken"]
+
+    def test_server_timing(self):
+        result = fan_out([FanOutSource("links", slow, (0, 1)), FanOutSource("sheets", slow, (0, 2))], executor=ThreadPoolExecutor(2))
+        header = result.server_timing()
+        assert [part.split(";")[0] for part in header.split(", ")] == ["links", "sheets"]
+        assert all(part.split(";")[1].startswith("dur=") for part in header.split(", "))
+
+    def test_timed_out_sources_dont_hold_up_later_fan_outs(self, monkeypatch):
+        monkeypatch.setattr(fanout, "_thread_slots", threading.BoundedSemaphore(2))
+        first = fan_out([FanOutSource("slow", slow, (1, "late"), timeout=0.1, default=[])])
+        start = time.perf_counter()
+        second = fan_out([FanOutSource("fast", slow, (0.1, "ok"), timeout=0.5)])
+        assert first.timed_out == ["slow"]
+        assert second.results == {"fast": "ok"}
+        assert time.perf_counter() - start < 0.5
+
+    def test_runs_on_calling_thread_without_free_threads(self, monkeypatch):
+        monkeypatch.setattr(fanout, "_thread_slots", threading.BoundedSemaphore(1))
+        result = fan_out([FanOutSource(str(i), slow_thread_id, (0.2,)) for i in range(3)])
+        assert list(result.results.values()).count(threading.get_ident()) == 2
@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from sefaria.system.multiserver import messaging
+from sefaria.system.multiserver.coordinator import ServerCoordinator, ReadWriteLock
+
+
+class Recorder(object):
+    """
+    Stands in for the library and the other event targets, and records the methods called on it
+    """
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, list(args)))
+
+
+class Node(ServerCoordinator):
+    origin = None
+    gap_timeout = 60
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(messaging.redis, "StrictRedis", lambda **kwargs: fakeredis.FakeStrictRedis(server=server, decode_responses=True))
+    libraries = {}
+
+    def make(name):
+        node = Node()
+        node.origin = name
+        libraries[name] = Recorder()
+        targets = {"library": libraries[name], "ref_ordinal_map": Recorder()}
+        node._event_targets = lambda: targets
+        node.connect()
+        return node, libraries[name]
+
+    created = []
+
+    def factory(name):
+        node, library = make(name)
+        created.append(node)
+        return node, library
+
+    yield factory
+    for node in created:
+        node.stop_listener(timeout=5)
+
+
+def drop_messages(node, n):
+    """
+    Reads n event messages off the node's subscription, without applying them
+    """
+    while n:
+        msg = node.pubsub.get_message(timeout=1.0)
+        if msg and msg["type"] == "message":
+            n -= 1
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end, "Timed out"
+        time.sleep(0.05)
+
+
+class TestServerCoordinator(object):
+
+    def test_events_applied_in_order(self, nodes):
+        a, a_library = nodes("a")
+        b, b_library = nodes("b")
+        for title in ["Genesis", "Exodus", "Leviticus"]:
+            a.publish_event("library", "refresh_index_record_in_cache", [title])
+        b.sync()
+        assert b_library.calls == [("refresh_index_record_in_cache", [t]) for t in ["Genesis", "Exodus", "Leviticus"]]
+        assert a_library.calls == []
+        assert b.last_seq == a.last_seq == 3
+        assert b.stats.events_applied == 3
+        assert b.stats.max_lag_seconds >= 0
+
+    def test_duplicates_skipped(self, nodes):
+        a, _ = nodes("a")
+        b, b_library = nodes("b")
+        a.publish_event("library", "rebuild_toc")
+        msg = b.pubsub.get_message(timeout=1.0)
+        b._receive(msg)
+        b._receive(msg)
+        assert b_library.calls == [("rebuild_toc", [])]
+        assert b.stats.events_skipped == 1
+
+    def test_gap_filled_from_log(self, nodes):
+        a, _ = nodes("a")
+        b, b_library = nodes("b")
+        for title in ["Genesis", "Exodus", "Leviticus"]:
+            a.publish_event("library", "refresh_index_record_in_cache", [title])
+        drop_messages(b, 2)
+        b.sync()
+        assert b_library.calls == [("refresh_index_record_in_cache", [t]) for t in ["Genesis", "Exodus", "Leviticus"]]
+        assert b.stats.gaps == 1
+        assert b.stats.gaps_recovered == 1
+        assert b.stats.resyncs == 0
+
+    def test_resync_when_events_lost(self, nodes):
+        a, _ = nodes("a")
+        b, b_library = nodes("b")
+        for title in ["Genesis", "Exodus", "Leviticus"]:
+            a.publish_event("library", "refresh_index_record_in_cache", [title])
+        a.redis_client.delete(a.log_key)
+        drop_messages(b, 2)
+        b.sync()
+        assert b_library.calls == []
+        assert b.last_seq == 0
+
+        b.gap_timeout = -1
+        b.sync()
+        assert b_library.calls == [("rebuild", [])]
+        assert b._event_targets()["ref_ordinal_map"].calls == [("reset", [])]
+        assert b.stats.resyncs == 1
+        assert b.last_seq == 3
+
+        a.publish_event("library", "rebuild_toc")
+        b.sync()
+        assert b_library.calls[-1] == ("rebuild_toc", [])
+
+    def test_other_targets(self, nodes):
+        a, a_library = nodes("a")
+        b, b_library = nodes("b")
+        a.publish_event("ref_ordinal_map", "reset")
+        b.sync()
+        assert b._event_targets()["ref_ordinal_map"].calls == [("reset", [])]
+        assert b_library.calls == []
+
+    def test_event_log_trimmed(self, nodes):
+        a, _ = nodes("a")
+        a.log_length = 5
+        for i in range(8):
+            a.publish_event("library", "rebuild_toc")
+        logged = [json.loads(m)["seq"] for m in a.redis_client.zrange(a.log_key, 0, -1)]
+        assert logged == [4, 5, 6, 7, 8]
+
+    def test_listener_thread(self, nodes):
+        a, _ = nodes("a")
+        b, b_library = nodes("b")
+        b.start_listener()
+        a.publish_event("library", "refresh_index_record_in_cache", ["Genesis"])
+        wait_for(lambda: b_library.calls)
+        assert b_library.calls == [("refresh_index_record_in_cache", ["Genesis"])]
+        assert b.stats.events_applied == 1
+
+    def test_listener_catches_up(self, nodes):
+        # Events published before the listener subscribed are read from the log
+        a, _ = nodes("a")
+        b, b_library = nodes("b")
+        a.publish_event("library", "refresh_index_record_in_cache", ["Genesis"])
+        a.publish_event("library", "refresh_index_record_in_cache", ["Exodus"])
+        b.start_listener()
+        wait_for(lambda: len(b_library.calls) == 2)
+        assert b_library.calls == [("refresh_index_record_in_cache", [t]) for t in ["Genesis", "Exodus"]]
+        assert b.last_seq == 2
+
+
+class TestReadWriteLock(object):
+
+    def test_writer_waits_for_readers_and_holds_back_new_ones(self):
+        lock = ReadWriteLock()
+        order = []
+        reading, release = threading.Event(), threading.Event()
+
+        def request(name, hold=None):
+            with lock.reading():
+                order.append(name)
+                reading.set()
+                if hold:
+                    hold.wait(5)
+
+        def event():
+            with lock.writing():
+                order.append("event")
+
+        first = threading.Thread(target=request, args=("first", release))
+        first.start()
+        reading.wait(5)
+        writer = threading.Thread(target=event)
+        writer.start()
+        wait_for(lambda: lock._writers_waiting == 1)
+        second = threading.Thread(target=request, args=("second",))
+        second.start()
+        time.sleep(0.1)
+        assert order == ["first"]
+        release.set()
+        for thread in (first, writer, second):
+            thread.join(5)
+        assert order == ["first", "event", "second"]
+
+    def test_nesting(self):
+        lock = ReadWriteLock()
+        with lock.reading():
+            with lock.reading():
+                assert lock.is_reading()
+            with pytest.raises(RuntimeError):
+                with lock.writing():
+                    pass
+        assert not lock.is_reading()
+        with lock.writing():
+            with lock.writing():
+                with lock.reading():
+                    pass
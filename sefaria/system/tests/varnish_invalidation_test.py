@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sefaria.system.varnish import common, invalidation
+from sefaria.system.varnish.invalidation import InvalidationQueue
+
+
+class VarnishStandIn(BaseHTTPRequestHandler):
+    """
+    Records the PURGE requests that it receives
+    """
+    requests = []
+
+    def do_PURGE(self):
+        self.requests.append(self.path)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def varnish(monkeypatch):
+    VarnishStandIn.requests = []
+    server = ThreadingHTTPServer(("localhost", 0), VarnishStandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(common, "VARNISH_HOST", "localhost")
+    monkeypatch.setattr(common, "VARNISH_FRNT_PORT", server.server_address[1])
+    yield VarnishStandIn.requests
+    server.shutdown()
+    server.server_close()
+
+
+GENESIS = (r"Genesis", [r"($|\\.)"])
+
+
+def section(n):
+    return [r"\\.{}$".format(n), r"\\.{}\\?".format(n), r"\\.{}\\/".format(n), r"\\.{}\\.".format(n)]
+
+
+class TestInvalidationQueue:
+
+    def test_purges_are_deduped(self, varnish):
+        q = InvalidationQueue(window=60, ban=lambda url: None)
+        for _ in range(3):
+            q.purge("http://localhost:8000/api/texts/Genesis.1")
+            q.purge("http://localhost:8000/api/links/Genesis.1?with_text=0")
+        assert varnish == []
+        q.flush()
+        assert sorted(varnish) == ["/api/links/Genesis.1?with_text=0", "/api/texts/Genesis.1"]
+        assert q.stats.purges_sent == 2
+        assert q.stats.urls_deduped == 4
+
+    def test_sections_of_a_book_are_one_ban(self):
+        bans = []
+        q = InvalidationQueue(window=60, ban=bans.append)
+        for n in [1, 2, 1]:
+            q.ban_section(GENESIS[0], section(n), GENESIS[1])
+        q.ban_section("Exodus", section(3), GENESIS[1])
+        q.flush()
+        assert len(bans) == 2
+        genesis = [b for b in bans if "Genesis" in b][0]
+        assert genesis.startswith("/api/(texts|links|related)/Genesis(")
+        assert all(p in genesis for p in section(1) + section(2))
+        assert q.stats.sections_deduped == 1
+
+    def test_many_sections_ban_the_book(self):
+        bans = []
+        q = InvalidationQueue(window=60, max_sections=5, ban=bans.append)
+        for n in range(10):
+            q.ban_section(GENESIS[0], section(n), GENESIS[1])
+        q.flush()
+        assert bans == [r"/api/(texts|links|related)/Genesis(($|\\.))"]
+        assert q.stats.books_banned_whole == 1
+
+    def test_background_flush(self, varnish):
+        q = InvalidationQueue(window=0.1, ban=lambda url: None)
+        q.purge("http://localhost:8000/api/texts/Genesis.1")
+        q.purge("http://localhost:8000/api/texts/Genesis.2")
+        deadline = time.time() + 5
+        while q.stats.flushes == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sorted(varnish) == ["/api/texts/Genesis.1", "/api/texts/Genesis.2"]
+        assert q.stats.flushes == 1
+
+    def test_background_flush_after_fork(self, varnish, monkeypatch):
+        q = InvalidationQueue(window=0.1, ban=lambda url: None)
+        q.purge("http://localhost:8000/api/texts/Genesis.1")
+        parent_thread = q._thread
+        # the same queue, as a forked process sees it
+        monkeypatch.setattr(invalidation.os, "getpid", lambda: -1)
+        q.purge("http://localhost:8000/api/texts/Genesis.2")
+        assert q._thread is not parent_thread
+        deadline = time.time() + 5
+        while len(varnish) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sorted(varnish) == ["/api/texts/Genesis.1", "/api/texts/Genesis.2"]
+
+    def test_forked_child_gets_its_own_locks_and_batch(self):
+        q = InvalidationQueue(window=60, purge=lambda url: None, ban=lambda url: None)
+        q.purge("http://localhost:8000/api/texts/Genesis.1")
+        q._flush_lock.acquire()  # as another thread of the parent may hold it at the fork
+        pid = os.fork()
+        if pid == 0:
+            clean = not q._batch and q._flush_lock.acquire(timeout=1) and q._lock.acquire(timeout=1)
+            os._exit(0 if clean else 1)
+        q._flush_lock.release()
+        assert os.waitpid(pid, 0)[1] == 0
+        assert q._batch.purges == {"http://localhost:8000/api/texts/Genesis.1"}
+        q.flush()
+
+    def test_no_window_sends_immediately(self, varnish):
+        q = InvalidationQueue(window=0, ban=lambda url: None)
+        q.purge("http://localhost:8000/api/texts/Genesis.1")
+        assert varnish == ["/api/texts/Genesis.1"]
@@ -0,0 +1,213 @@
+"""
+A queue of Varnish invalidations, sent from a background thread.
+
+Saves can invalidate many URLs - every API variant of a section, and of every section linked to it.  Rather than
+send each purge and ban from the request thread as it's needed, they are collected for `window` seconds, deduped,
+and the bans of the sections of each book are joined into one ban for the book.  Past `max_sections` sections, the
+whole book is banned.  Purges are sent `concurrency` at a time.
+"""
+import atexit
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .common import ban_url, purge_url
+
+import structlog
+logger = structlog.get_logger(__name__)
+
+try:
+    from sefaria.settings import VARNISH_INVALIDATION_WINDOW
+except ImportError:
+    VARNISH_INVALIDATION_WINDOW = 0.5
+try:
+    from sefaria.settings import VARNISH_PURGE_CONCURRENCY
+except ImportError:
+    VARNISH_PURGE_CONCURRENCY = 8
+try:
+    from sefaria.settings import VARNISH_MAX_SECTIONS_PER_BAN
+except ImportError:
+    VARNISH_MAX_SECTIONS_PER_BAN = 50
+
+
+class InvalidationStats(object):
+    def __init__(self):
+        self.flushes = 0
+        self.urls_queued = 0
+        self.urls_deduped = 0
+        self.sections_queued = 0
+        self.sections_deduped = 0
+        self.books_banned_whole = 0
+        self.purges_sent = 0
+        self.purges_failed = 0
+        self.bans_sent = 0
+        self.bans_failed = 0
+        self.flush_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def incr(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def contents(self):
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
+
+class _Batch(object):
+    def __init__(self):
+        self.purges = set()
+        self.bans = set()
+        self.sections = {}  # book regex -> {"sections": set of patterns, "book": patterns that match the whole book}
+
+    def __bool__(self):
+        return bool(self.purges or self.bans or self.sections)
+
+
+class InvalidationQueue(object):
+    BANNED_APIS = ("texts", "links", "related")
+
+    def __init__(self, window=None, concurrency=None, max_sections=None, purge=purge_url, ban=ban_url):
+        """
+        :param window: seconds to collect invalidations before sending them.  0 sends them on every call, in the caller's thread.
+        :param concurrency: number of purges sent at once
+        :param max_sections: number of sections of a book, past which the whole book is banned
+        :param purge: function that sends a PURGE for a URL. Returns the response, or None on failure.
+        :param ban: function that bans a URL regex
+        """
+        self.window = window if window is not None else VARNISH_INVALIDATION_WINDOW
+        self.concurrency = concurrency or VARNISH_PURGE_CONCURRENCY
+        self.max_sections = max_sections or VARNISH_MAX_SECTIONS_PER_BAN
+        self.stats = InvalidationStats()
+        self._purge = purge
+        self._ban = ban
+        self._batch = _Batch()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=partial(_after_fork_in_child, weakref.ref(self)))
+
+    def _after_fork_in_child(self):
+        # The parent's locks may have been held by another of its threads at the fork, and its batch is the parent's to send
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batch = _Batch()
+        self.stats = InvalidationStats()
+
+    def purge(self, url):
+        with self._lock:
+            self.stats.incr("urls_queued")
+            if url in self._batch.purges:
+                self.stats.incr("urls_deduped")
+            self._batch.purges.add(url)
+        self._queued()
+
+    def ban(self, url):
+        """
+        :param url: URL regex, as for `ban_url`
+        """
+        with self._lock:
+            self._batch.bans.add(url)
+        self._queued()
+
+    def ban_section(self, book, patterns, book_patterns):
+        """
+        Bans the text, links and related APIs of a section
+        :param book: regex of the book part of the URLs
+        :param patterns: regex alternatives that match the rest of the URLs of the section
+        :param book_patterns: regex alternatives that match the rest of the URLs of any section in the book
+        """
+        patterns = frozenset(patterns)
+        with self._lock:
+            self.stats.incr("sections_queued")
+            book_sections = self._batch.sections.setdefault(book, {"sections": set(), "book": book_patterns})
+            if patterns in book_sections["sections"]:
+                self.stats.incr("sections_deduped")
+            book_sections["sections"].add(patterns)
+        self._queued()
+
+    def _queued(self):
+        if not self.window:
+            self.flush()
+            return
+        self._start()
+        self._pending.set()
+
+    def _start(self):
+        # A forked process inherits the thread object, but not the thread, so it starts its own
+        pid = os.getpid()
+        if self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid != pid:
+                if self._thread_pid is None:
+                    atexit.register(self.flush)  # forked processes inherit the registration
+                self._pending = threading.Event()
+                self._thread = threading.Thread(target=self._run, name="varnish-invalidation", daemon=True)
+                self._thread.start()
+                self._thread_pid = pid
+
+    def _run(self):
+        pending = self._pending
+        while True:
+            pending.wait()
+            time.sleep(self.window)
+            pending.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(str(e))
+
+    def _ban_urls(self, batch):
+        urls = set(batch.bans)
+        api_regex = "/api/({})/".format("|".join(self.BANNED_APIS))
+        for book, book_sections in batch.sections.items():
+            if len(book_sections["sections"]) > self.max_sections:
+                self.stats.incr("books_banned_whole")
+                patterns = book_sections["book"]
+            else:
+                patterns = sorted(set().union(*book_sections["sections"]))
+            urls.add("{}{}({})".format(api_regex, book, "|".join(patterns)))
+        return sorted(urls)
+
+    def flush(self):
+        """
+        Sends everything queued so far, in the caller's thread
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._batch = self._batch, _Batch()
+            if not batch:
+                return
+            start = time.perf_counter()
+            ban_urls = self._ban_urls(batch)
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for response in executor.map(self._purge, sorted(batch.purges)):
+                    self.stats.incr("purges_sent")
+                    if response is None or getattr(response, "status", 200) != 200:
+                        self.stats.incr("purges_failed")
+            for url in ban_urls:
+                self.stats.incr("bans_sent")
+                try:
+                    self._ban(url)
+                except Exception as e:
+                    self.stats.incr("bans_failed")
+                    logger.exception(str(e))
+            seconds = time.perf_counter() - start
+            self.stats.incr("flushes")
+            self.stats.incr("flush_seconds", seconds)
+            logger.info("Flushed Varnish invalidations", purges=len(batch.purges), bans=len(ban_urls), seconds=round(seconds, 3))
+
+
+def _after_fork_in_child(queue_ref):
+    queue = queue_ref()
+    if queue is not None:
+        queue._after_fork_in_child()
+
+
+invalidation_queue = InvalidationQueue()
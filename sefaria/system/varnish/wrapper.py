@@ -5,6 +5,7 @@ import re
 import urllib.request, urllib.parse, urllib.error
 
 from .common import ban_url, purge_url, FRONT_END_URL
+from .invalidation import invalidation_queue
 from sefaria.model import *
 from sefaria.system.exceptions import InputError
 from sefaria.utils.util import graceful_exception
@@ -18,8 +19,10 @@ logger = structlog.get_logger(__name__)
 def invalidate_ref(oref, lang=None, version=None, purge=False):
     """
     Called when 'ref' is changed.
-    We aim to PURGE the main page, so that the results of any save will be immediately visible to the person editing.
+    We aim to PURGE the main page, so that the results of any save will be visible to the person editing.
     All other implications are handled with a blanket BAN.
+    Purges and bans are queued, and sent together from a background thread, so the edited page can be served
+    from the cache for up to VARNISH_INVALIDATION_WINDOW seconds after the save.  See `invalidation.InvalidationQueue`
 
     todo: Tune this so as not to ban when the version changed is not a displayed version
     """
@@ -33,33 +36,27 @@ def invalidate_ref(oref, lang=None, version=None, purge=False):
         version = urllib.parse.quote(version.replace(" ", "_").encode("utf-8"))
     if purge:
         # Purge this section level ref, so that immediate responses will return good results
-        purge_url("{}/api/texts/{}".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/texts/{}".format(FRONT_END_URL, oref.url()))
         if version and lang:
-            try:
-                purge_url("{}/api/texts/{}/{}/{}".format(FRONT_END_URL, oref.url(), lang, version))
-            except Exception as e:
-                logger.exception(e)
+            invalidation_queue.purge("{}/api/texts/{}/{}/{}".format(FRONT_END_URL, oref.url(), lang, version))
         # Hacky to add these
-        purge_url("{}/api/texts/{}?commentary=1&sheets=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/texts/{}?sheets=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/texts/{}?commentary=0".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/texts/{}?commentary=0&pad=0".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/texts/{}?commentary=1&sheets=1".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/texts/{}?sheets=1".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/texts/{}?commentary=0".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/texts/{}?commentary=0&pad=0".format(FRONT_END_URL, oref.url()))
         if version and lang:
-            try:
-                purge_url("{}/api/texts/{}/{}/{}?commentary=0".format(FRONT_END_URL, oref.url(), lang, version))
-            except Exception as e:
-                logger.exception(e)
-        purge_url("{}/api/links/{}".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/links/{}?with_text=0".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/links/{}?with_text=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/related/{}".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/related/{}?with_sheet_links=1".format(FRONT_END_URL, oref.url()))
-        purge_url("{}/api/related/{}?with_sheet_links=0".format(FRONT_END_URL, oref.url()))
+            invalidation_queue.purge("{}/api/texts/{}/{}/{}?commentary=0".format(FRONT_END_URL, oref.url(), lang, version))
+        invalidation_queue.purge("{}/api/links/{}".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/links/{}?with_text=0".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/links/{}?with_text=1".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/related/{}".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/related/{}?with_sheet_links=1".format(FRONT_END_URL, oref.url()))
+        invalidation_queue.purge("{}/api/related/{}?with_sheet_links=0".format(FRONT_END_URL, oref.url()))
 
     # Ban anything underneath this section
-    ban_url("/api/texts/{}".format(url_regex(oref)))
-    ban_url("/api/links/{}".format(url_regex(oref)))
-    ban_url("/api/related/{}".format(url_regex(oref)))
+    book, patterns = url_regex_parts(oref)
+    _, book_patterns = url_regex_parts(Ref(oref.book))
+    invalidation_queue.ban_section(book, patterns, book_patterns)
 
 
 def invalidate_linked(oref):
@@ -81,9 +78,9 @@ def invalidate_counts(indx):
         logger.warn("Could not parse index '{}' to purge counts from Varnish.".format(indx))
         return
 
-    purge_url("{}/api/preview/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/counts/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/preview/{}".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/counts/{}".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
 
     # Assume this is unnecesary, given that the specific URLs will have been purged/banned by the save action
     # oref = Ref(indx.title)
@@ -105,10 +102,10 @@ def invalidate_index(indx):
         logger.warn("Could not parse index '{}' to purge from Varnish.".format(indx))
         return
 
-    purge_url("{}/api/index/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/raw/index/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/index/{}".format(FRONT_END_URL, url))
-    purge_url("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/index/{}".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/v2/raw/index/{}".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/v2/index/{}".format(FRONT_END_URL, url))
+    invalidation_queue.purge("{}/api/v2/index/{}?with_content_counts=1".format(FRONT_END_URL, url))
 
 
 @graceful_exception(logger=logger, return_value=None)
@@ -116,8 +113,8 @@ def invalidate_title(title):
     title = title.replace(" ", "_").replace(":", ".")
     invalidate_index(title)
     invalidate_counts(title)
-    ban_url("/api/texts/{}".format(title))
-    ban_url("/api/links/{}".format(title))
+    invalidation_queue.ban("/api/texts/{}".format(title))
+    invalidation_queue.ban("/api/links/{}".format(title))
 
 
 def invalidate_all():
@@ -131,6 +128,15 @@ def url_regex(ref):
     Result is hyper slashed, as Varnish likes.
     """
 
+    book, patterns = url_regex_parts(ref)
+    return r"%s(%s)" % (book, "|".join(patterns))
+
+
+def url_regex_parts(ref):
+    """
+    :return: (regular expression part for the book, list of alternative regular expression parts for the rest of the URL),
+    which `url_regex()` joins
+    """
     assert isinstance(ref, Ref)
 
     patterns = []
@@ -161,6 +167,6 @@ def url_regex(ref):
         elif ref.index_node.has_numeric_continuation():
             patterns.append(r"%s\\." % sections)   # more granualar, exact match followed by .
 
-    return r"%s(%s)" % (re.escape(ref.book).replace(" ","_").replace("\\", "\\\\"), "|".join(patterns))
+    return re.escape(ref.book).replace(" ","_").replace("\\", "\\\\"), patterns
 
 
@@ -0,0 +1,105 @@
+import random
+from datetime import datetime
+
+import pytest
+
+import sefaria.history as history
+from sefaria.history import text_at_revision, save_revision_checkpoints, revision_checkpoint_candidates, dmp
+from sefaria.system.database import db
+
+TREF = "Genesis 1:1"
+VERSION = "Revision Checkpoint Test"
+QUERY = {"ref": TREF, "version": VERSION, "language": "en"}
+
+
+class Current(object):
+    def __init__(self, text):
+        self.text = text
+
+
+def add_revisions(texts, first, n):
+    """
+    Appends n edited texts to `texts`, and saves their revisions, numbered from `first`
+    """
+    rand = random.Random(first)
+    records = []
+    for revision in range(first, first + n):
+        old = texts[-1]
+        words = old.split() or ["word"]
+        words.insert(rand.randrange(len(words) + 1), "w{}".format(revision))
+        new = " ".join(words)
+        texts.append(new)
+        patch = dmp.patch_toText(dmp.patch_make(dmp.diff_main(new, old)))
+        records.append(dict(QUERY, revision=revision, revert_patch=patch, rev_type="edit text", user=0, date=datetime.now()))
+    db.history.insert_many(records)
+
+
+@pytest.fixture
+def revisions(monkeypatch):
+    db.history.delete_many({"version": VERSION})
+    db.history_checkpoints.delete_many({"version": VERSION})
+    texts = ["In the beginning"]
+    add_revisions(texts, 1, 300)
+    monkeypatch.setattr(history, "TextChunk", lambda oref, lang, vtitle: Current(texts[-1]))
+    yield texts
+    db.history.delete_many({"version": VERSION})
+    db.history_checkpoints.delete_many({"version": VERSION})
+
+
+def count_patches(monkeypatch):
+    applied = []
+    original = dmp.patch_apply
+    def counted(*args):
+        applied.append(1)
+        return original(*args)
+    monkeypatch.setattr(dmp, "patch_apply", counted)
+    return applied
+
+
+class TestRevisionCheckpoints(object):
+
+    def test_same_text_as_replaying_every_patch(self, revisions):
+        expected = {revision: text_at_revision(TREF, VERSION, "en", revision) for revision in (1, 49, 50, 51, 120, 299, 300)}
+        assert expected == {revision: revisions[revision] for revision in expected}
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=50) == 6
+        for revision, text in expected.items():
+            assert text_at_revision(TREF, VERSION, "en", revision) == text
+
+    def test_patches_applied(self, revisions, monkeypatch):
+        save_revision_checkpoints(TREF, VERSION, "en", every=50)
+        applied = count_patches(monkeypatch)
+        assert text_at_revision(TREF, VERSION, "en", 2) == revisions[2]
+        assert len(applied) == 48
+
+    def test_incremental(self, revisions):
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=50) == 6
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=50) == 0
+        add_revisions(revisions, 301, 60)
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=50) == 1
+        assert [c["revision"] for c in db.history_checkpoints.find(QUERY).sort("revision", 1)] == [50, 100, 150, 200, 250, 300, 350]
+        assert text_at_revision(TREF, VERSION, "en", 340) == revisions[340]
+
+    def test_revision_logged_while_reading(self, revisions, monkeypatch):
+        def edited_while_reading(oref, lang, vtitle):
+            # an edit saves its text, and then logs its revision
+            add_revisions(revisions, 301, 1)
+            return Current(revisions[-1])
+        monkeypatch.setattr(history, "TextChunk", edited_while_reading)
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=50) == 0
+        assert db.history_checkpoints.find_one(QUERY) is None
+        monkeypatch.setattr(history, "TextChunk", lambda oref, lang, vtitle: Current(revisions[-1]))
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=50) == 6
+        assert text_at_revision(TREF, VERSION, "en", 120) == revisions[120]
+
+    def test_patch_bytes(self, revisions):
+        assert save_revision_checkpoints(TREF, VERSION, "en", every=1000, patch_bytes=1) == 300
+
+    def test_unknown_revision(self, revisions):
+        save_revision_checkpoints(TREF, VERSION, "en", every=50)
+        assert text_at_revision(TREF, VERSION, "en", 1000) == revisions[0]
+
+    def test_candidates(self, revisions):
+        regex = r"^Genesis 1:1$"
+        assert (TREF, VERSION, "en") in revision_checkpoint_candidates(300, regex=regex)
+        assert (TREF, VERSION, "en") not in revision_checkpoint_candidates(301, regex=regex)
+        assert (TREF, VERSION, "en") in revision_checkpoint_candidates(301, min_patch_bytes=1, regex=regex)
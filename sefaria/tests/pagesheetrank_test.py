@@ -0,0 +1,65 @@
+import random
+import numpy
+from sefaria.pagesheetrank import pagerank, legacy_pagerank, random_web, web_to_graph, PagerankGraphWriter, \
+    load_pagerank_graph, sparse_power_iteration
+
+
+def assert_same_ranks(expected, actual, tolerance=1e-9):
+    assert expected.keys() == actual.keys()
+    for node, pr in expected.items():
+        assert abs(pr - actual[node]) < tolerance
+
+
+class TestSparsePagerank:
+
+    def test_small_weighted_graph(self):
+        g = [
+            ("a", {"b": 0.7}),
+            ("b", {"c": 2.0, "a": 1.0}),
+            ("c", {}),
+        ]
+        assert_same_ranks(legacy_pagerank(g), pagerank(g))
+
+    def test_dangling_and_fractional_weights(self):
+        # "d" has no out links and "a"'s only out link rounds to zero
+        g = [
+            ("a", {}),
+            ("b", {"a": 0.4, "c": 1.0}),
+            ("c", {"d": 3.0}),
+            ("d", {}),
+        ]
+        assert_same_ranks(legacy_pagerank(g), pagerank(g))
+
+    def test_random_web(self):
+        random.seed(613)
+        numpy.random.seed(613)
+        g = web_to_graph(random_web(500))
+        g = [(node, {k: v * random.choice([0.5, 1.0, 2.3]) for k, v in links.items()}) for node, links in g]
+        assert_same_ranks(legacy_pagerank(g, tolerance=1e-7), pagerank(g, tolerance=1e-7))
+        assert_same_ranks(legacy_pagerank(g, normalize=True), pagerank(g, normalize=True), tolerance=1e-6)
+
+    def test_empty_graph(self):
+        assert pagerank([]) == {}
+
+
+class TestPagerankGraphFile:
+
+    def test_round_trip(self, tmp_path):
+        g = [
+            ("Genesis 1:1", {"Rashi on Genesis 1:1:1": 1.0, "Ramban on Genesis 1:1:1": 1.0}),
+            ("Rashi on Genesis 1:1:1", {"Ramban on Genesis 1:1:1": 1.0}),
+            ("Ramban on Genesis 1:1:1", {}),
+        ]
+        writer = PagerankGraphWriter(str(tmp_path), chunk_size=2)
+        for node, links in g:
+            writer.node_id(node)
+        for node, links in g:
+            for in_link, weight in links.items():
+                writer.add_edge(writer.node_id(node), writer.node_id(in_link), weight)
+        writer.close()
+
+        trefs, sw = load_pagerank_graph(str(tmp_path))
+        assert trefs == [node for node, _ in g]
+        assert len(sw.src) == 3
+        streamed = dict(zip(trefs, sparse_power_iteration(sw).tolist()))
+        assert_same_ranks(pagerank(g), streamed, tolerance=1e-7)
@@ -0,0 +1,112 @@
+import pytest
+
+import sefaria.recommendation_engine as recommendation_engine
+import sefaria.recommendation_index as recommendation_index
+from sefaria.model import *
+from sefaria.recommendation_engine import RecommendationEngine
+from sefaria.recommendation_index import enqueue_sheet_change, index_recommendation_segments, update_recommendation_index
+from sefaria.system.database import db
+# sefaria.model.dependencies makes sure that model listeners are loaded.
+# noinspection PyUnresolvedReferences
+import sefaria.model.dependencies
+
+TREF = "Genesis 1:1"
+
+
+@pytest.fixture
+def indexed_segment():
+    saved = db.recommendation_candidates.find_one({"ref": TREF})
+    index_recommendation_segments([Ref(TREF)])
+    yield
+    db.recommendation_candidates.delete_one({"ref": TREF})
+    if saved:
+        db.recommendation_candidates.insert_one(saved)
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    refs = []
+    monkeypatch.setattr(recommendation_index, "enqueue_recommendation_refs", lambda trefs: refs.extend(trefs))
+    return refs
+
+
+def recommendations(tref):
+    return [rec.to_dict() for rec in RecommendationEngine(tref, top=20).recommendations]
+
+
+class TestRecommendationIndex:
+
+    def test_same_recommendations(self, indexed_segment, monkeypatch):
+        assert db.recommendation_candidates.find_one({"ref": TREF}) is not None
+        live = recommendations(TREF)
+        monkeypatch.setattr(recommendation_engine, "USE_RECOMMENDATION_INDEX", True)
+        assert recommendations(TREF) == live
+
+    def test_lookup_only(self, indexed_segment, monkeypatch):
+        monkeypatch.setattr(recommendation_engine, "USE_RECOMMENDATION_INDEX", True)
+        def fail(*args, **kwargs):
+            raise AssertionError("computed the candidates")
+        monkeypatch.setattr(recommendation_engine, "get_links", fail)
+        monkeypatch.setattr(RecommendationEngine, "get_sheets", staticmethod(fail))
+        RecommendationEngine(TREF)
+
+    def test_sheet_changes(self, queued):
+        private = {"status": "unlisted", "title": "Creation", "includedRefs": ["Genesis 1:1", "Rashi on Genesis 1:1:1"]}
+        public = dict(private, status="public")
+        enqueue_sheet_change(None, private)
+        enqueue_sheet_change(private, dict(private, includedRefs=["Genesis 1:2"]))
+        enqueue_sheet_change(public, dict(public))
+        assert queued == []
+        enqueue_sheet_change(private, public)
+        assert queued == ["Genesis 1:1", "Rashi on Genesis 1:1:1"]
+        del queued[:]
+        enqueue_sheet_change(public, dict(public, includedRefs=["Genesis 1:2"]))
+        assert sorted(queued) == ["Genesis 1:1", "Genesis 1:2", "Rashi on Genesis 1:1:1"]
+        del queued[:]
+        enqueue_sheet_change(public, None)
+        assert queued == ["Genesis 1:1", "Rashi on Genesis 1:1:1"]
+
+    def test_link_ref_change(self, queued):
+        old_refs, new_refs = ["Ecclesiastes 12:14", "Job 42:17"], ["Ecclesiastes 12:13", "Job 42:17"]
+        LinkSet({"refs": {"$in": [old_refs, new_refs]}}).delete()
+        link = Link({"refs": old_refs, "type": "reference"}).save()
+        try:
+            link = Link().load_by_id(link._id)
+            del queued[:]
+            link.refs = new_refs
+            link.save()
+            assert set(queued) == set(old_refs) | set(new_refs)
+        finally:
+            link.delete()
+
+    def test_untracked_link_ref_change(self, queued):
+        old_refs, new_refs = ["Ecclesiastes 12:14", "Job 42:16"], ["Ecclesiastes 12:13", "Job 42:16"]
+        LinkSet({"refs": {"$in": [old_refs, new_refs]}}).delete()
+        link = Link({"refs": old_refs, "type": "reference"}).save()
+        try:
+            link = Link().load_from_dict(dict(link.contents(), _id=link._id))
+            del queued[:]
+            link.refs = new_refs
+            link.save()
+            assert set(queued) == set(old_refs) | set(new_refs)
+        finally:
+            link.delete()
+
+    def test_update(self, monkeypatch):
+        monkeypatch.setattr(recommendation_index, "USE_RECOMMENDATION_INDEX", True)
+        # a queue of its own, so that the refs queued by the site aren't processed and removed
+        monkeypatch.setattr(recommendation_index, "QUEUE_COLLECTION", "recommendation_index_queue_test")
+        db.drop_collection("recommendation_index_queue_test")
+        indexed = []
+        def index(orefs):
+            indexed.extend(oref.normal() for oref in orefs)
+            return {"saved": len(orefs), "deleted": 0}
+        monkeypatch.setattr(recommendation_index, "index_recommendation_segments", index)
+        try:
+            recommendation_index.enqueue_recommendation_refs(["Genesis 50:26"])
+            assert update_recommendation_index()["refs"] == 1
+            assert "Genesis 50:26" in indexed
+            assert any(tref.startswith("Rashi on Genesis 50:26") for tref in indexed)
+            assert db.recommendation_index_queue_test.find_one({"ref": "Genesis 50:26"}) is None
+        finally:
+            db.drop_collection("recommendation_index_queue_test")
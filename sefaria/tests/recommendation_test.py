@@ -1,5 +1,7 @@
+import pytest
+
 from sefaria.model import *
-from sefaria.recommendation_engine import RecommendationEngine
+from sefaria.recommendation_engine import RecommendationEngine, SegmentOrdinals
 
 class TestClustering:
 
@@ -25,3 +27,75 @@ class TestClustering:
         assert clusters[0][0]['ref'].normal() == 'Genesis 1:1'
         assert clusters[1][0]['ref'].normal() == 'Genesis 1:5'
         assert clusters[2][0]['ref'].normal() == 'Exodus 1:1'
+
+
+@pytest.fixture
+def ref_methods_only(monkeypatch):
+    """
+    Turns off the SegmentOrdinals fast paths, so that RecommendationEngine works as it did with Ref methods alone
+    """
+    def by_ref(func, *args, **kwargs):
+        with monkeypatch.context() as m:
+            m.setattr(SegmentOrdinals, "order_key", lambda self, oref: None)
+            m.setattr(SegmentOrdinals, "offset", lambda self, oref, sections=None: None)
+            m.setattr(SegmentOrdinals, "covers_section", lambda self, oref: None)
+            return func(*args, **kwargs)
+    return by_ref
+
+
+class TestOrdinalParity:
+    trefs = ['Genesis 1:5', 'Genesis 1:1', 'Exodus 1:1', 'Genesis 1:2', 'Genesis 1:31', 'Genesis 2:1', 'Genesis 2:3',
+             'Exodus 1:3', 'Berakhot 2a:1', 'Berakhot 2a:5', 'Berakhot 2b:1', 'Rashi on Genesis 1:1:1', 'Rashi on Genesis 1:1:2',
+             'Rashi on Genesis 1:2:1', 'Genesis 1:2', 'Mishnah Berakhot 1:1']
+    related = ['Genesis 1:1-3', 'Genesis 1:2', 'Genesis 1:30-2:2', 'Genesis 1', 'Genesis 1:1-31', 'Genesis 2:4-5', 'Exodus 1:1-2',
+               'Berakhot 2a:1-4', 'Berakhot 2a-2b', 'Steinsaltz on Berakhot 2a:1', 'Rashi on Genesis 1:1:1-2', 'Mishnah Berakhot 1:1-2:1']
+
+    @staticmethod
+    def clusters(trefs, threshold):
+        refs = [Ref(tref) for tref in trefs]
+        clusters = RecommendationEngine.cluster_close_refs(refs, list(range(len(refs))), dist_threshold=threshold)
+        return [[(item['ref'].normal(), item['data']) for item in cluster] for cluster in clusters]
+
+    @staticmethod
+    def normalized(*args, **kwargs):
+        final_refs, factor, other_data, subref = RecommendationEngine.normalize_related_refs(*args, **kwargs)
+        return sorted(zip(final_refs, other_data or [None] * len(final_refs)), key=str), factor, subref and subref.normal()
+
+    def test_clusters(self, ref_methods_only):
+        for threshold in (0, 1, 2, 5, 30):
+            assert self.clusters(self.trefs, threshold) == ref_methods_only(self.clusters, self.trefs, threshold)
+
+    def test_includes_section(self, ref_methods_only):
+        for tref in self.related + self.trefs + ['Genesis 1:1-2:31', 'Berakhot 2a:1-100']:
+            oref = Ref(tref)
+            assert RecommendationEngine.includes_section(oref) == ref_methods_only(RecommendationEngine.includes_section, oref)
+
+    def test_normalize_related_refs(self, ref_methods_only):
+        for focus in ({'Genesis 1:1'}, {'Genesis 1:2', 'Genesis 1:3'}, {'Genesis 1:31', 'Genesis 2:1'}, {'Berakhot 2a:3'}, None):
+            for kwargs in ({"check_has_ref": True, "count_steinsaltz": True}, {}, {"other_data": list(range(len(self.related)))}):
+                assert self.normalized(self.related, focus, 1.0, **kwargs) == \
+                    ref_methods_only(self.normalized, self.related, focus, 1.0, **kwargs)
+
+    def test_recommendations(self, ref_methods_only):
+        def recommendations(tref):
+            return sorted((rec.to_dict() for rec in RecommendationEngine(tref).recommendations), key=lambda rec: rec["ref"])
+        for tref in ("Genesis 1:1", "Berakhot 2a:1"):
+            assert recommendations(tref) == ref_methods_only(recommendations, tref)
+
+
+class TestSegmentOffsetCache:
+
+    def test_offsets_are_cached_until_the_vstate_is_saved(self, monkeypatch):
+        oref = Ref("Genesis 1:5")
+        SegmentOrdinals().offset(oref)
+        def fail(*args):
+            raise AssertionError("flattened the version state again")
+        with monkeypatch.context() as m:
+            m.setattr(SegmentOrdinals, "_flatten", staticmethod(fail))
+            assert SegmentOrdinals().offset(oref) == 4
+        flattened = []
+        flatten = SegmentOrdinals._flatten
+        monkeypatch.setattr(SegmentOrdinals, "_flatten", staticmethod(lambda *args: flattened.append(args) or flatten(*args)))
+        VersionState("Genesis").save()
+        assert SegmentOrdinals().offset(oref) == 4
+        assert len(flattened) == 1
@@ -44,3 +44,15 @@ def test_make_text_index_document():
     }
 
 
+
+
+def test_iter_versions():
+    TI.create_version_priority_map()
+    versions = list(TI.iter_versions(titles=["Genesis", "Exodus"]))
+    assert [v.title for v in versions] == sorted(v.title for v in versions)
+    expected = {key for key in TI.version_priority_map if key[0] in ("Genesis", "Exodus")}
+    assert {(v.title, v.versionTitle, v.language) for v in versions} == expected
+    for title in ("Genesis", "Exodus"):
+        for lang in ("en", "he"):
+            priorities = [TI.version_priority_map[(v.title, v.versionTitle, v.language)][0] for v in versions if v.title == title and v.language == lang]
+            assert priorities == list(range(len(priorities)))
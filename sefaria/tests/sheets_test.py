@@ -0,0 +1,103 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from sefaria.model import *
+from sefaria.model.ref_ordinal import expanded_ordinals
+from sefaria.sheets import get_sheets_for_ref
+from sefaria.system.database import db
+from sefaria.utils.testing_utils import record_mongo_calls
+
+TEST_SHEET_ID = 1999900000
+TEST_UID = 1999900000
+TEST_COLLECTION = "test-sheets-for-ref-{}"
+
+
+def make_sheets(n):
+    refs = ["Genesis 1:1-3"]
+    expanded = Ref.expand_refs(refs)
+    sheets = [{
+        "id": TEST_SHEET_ID + i,
+        "title": "Test Sheet {}".format(i),
+        "owner": TEST_UID + i,
+        "assigner_id": TEST_UID + n + i,
+        "viaOwner": TEST_UID + 2 * n + i,
+        "via": TEST_SHEET_ID,
+        "displayedCollection": TEST_COLLECTION.format(i % 3),
+        "status": "public",
+        "dateCreated": "2020-01-01T00:00:00",
+        "includedRefs": refs,
+        "expandedRefs": expanded,
+        "expandedOrdinals": expanded_ordinals(refs),
+        "views": n - i,
+        "options": {},
+    } for i in range(n)]
+    collections = [{
+        "slug": TEST_COLLECTION.format(i),
+        "name": TEST_COLLECTION.format(i),
+        "sheets": [s["id"] for s in sheets],
+        "toc": {"title": "Collection {}".format(i)},
+    } for i in range(3)]
+    db.sheets.insert_many(sheets)
+    db.collections.insert_many(collections)
+    return sheets
+
+
+def delete_sheets():
+    db.sheets.delete_many({"id": {"$gte": TEST_SHEET_ID, "$lt": TEST_SHEET_ID + 1000}})
+    db.collections.delete_many({"slug": {"$regex": "^" + TEST_COLLECTION.format("")}})
+
+
+def count_queries(monkeypatch, func):
+    """
+    Returns the number of Mongo find queries and Django queries that `func` makes
+    """
+    mongo_queries = record_mongo_calls(monkeypatch)
+    with CaptureQueriesContext(connection) as django_queries:
+        result = func()
+    monkeypatch.undo()
+    return result, len(mongo_queries), len(django_queries)
+
+
+@pytest.fixture
+def unblocked_db(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        delete_sheets()
+        yield
+        delete_sheets()
+
+
+class TestSheetsForRef(object):
+
+    def sheets_for_ref(self):
+        return get_sheets_for_ref("Genesis 1:2", in_collection=[TEST_COLLECTION.format(0)])
+
+    def test_hydration(self, unblocked_db):
+        sheets = make_sheets(3)
+        results = self.sheets_for_ref()
+        assert [r["id"] for r in results] == [str(s["id"]) for s in sheets]
+        for i, (result, sheet) in enumerate(zip(results, sheets)):
+            assert result["assignerName"] == "User {}".format(sheet["assigner_id"])
+            assert result["viaOwnerName"] == "User {}".format(sheet["viaOwner"])
+            assert result["collectionTOC"] == {"title": "Collection {}".format(i % 3)}
+
+    def test_owner_without_profile(self, unblocked_db):
+        user = User.objects.create_user(username="sheets-for-ref@sefaria.org", email="sheets-for-ref@sefaria.org", password="!!!", first_name="Sheet", last_name="Owner")
+        try:
+            make_sheets(1)
+            db.sheets.update_one({"id": TEST_SHEET_ID}, {"$set": {"owner": user.id}})
+            assert self.sheets_for_ref()[0]["ownerProfileUrl"] == "/profile/sheet-owner"
+        finally:
+            db.profiles.delete_many({"id": user.id})
+            user.delete()
+
+    def test_query_count(self, unblocked_db, monkeypatch):
+        make_sheets(5)
+        few, few_mongo, few_django = count_queries(monkeypatch, self.sheets_for_ref)
+        delete_sheets()
+        make_sheets(100)
+        many, many_mongo, many_django = count_queries(monkeypatch, self.sheets_for_ref)
+        assert (len(few), len(many)) == (5, 100)
+        assert many_mongo == few_mongo
+        assert many_django == few_django == 1
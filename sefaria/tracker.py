@@ -160,15 +160,18 @@ def post_modify_text(user, action, oref, lang, vtitle, old_text, curr_text, vers
         if USE_VARNISH:
             invalidate_linked(oref)
     # rabbis_move(oref, vtitle)
-    count_and_index(oref, lang, vtitle, to_count=kwargs.get("count_after", 1))
+    count_and_index(oref, lang, vtitle, to_count=kwargs.get("count_after", 1), old_text=old_text, curr_text=curr_text)
 
 
-def count_and_index(oref, lang, vtitle, to_count=1):
+def count_and_index(oref, lang, vtitle, to_count=1, old_text=None, curr_text=None):
     from sefaria.settings import SEARCH_INDEX_ON_SAVE
 
     # count available segments of text
     if to_count:
-        count_segments(oref.index)
+        if old_text is not None and curr_text is not None:
+            count_segments_in_ref(oref, lang, old_text, curr_text)
+        else:
+            count_segments(oref.index)
     
     if SEARCH_INDEX_ON_SAVE:
         model.IndexQueue({
@@ -188,6 +191,20 @@ def count_segments(index):
         server_coordinator.publish_event("library", "recount_index_in_toc", [index.title])
 
 
+def count_segments_in_ref(oref, lang, old_text, new_text):
+    """
+    Updates counts after an edit of one version's text at `oref`, by patching the counts of the edited section.
+    """
+    from sefaria.settings import MULTISERVER_ENABLED
+    from sefaria.system.multiserver.coordinator import server_coordinator
+
+    model.VersionState(oref.index).refresh_ref(oref, lang, old_text, new_text)
+    # The VersionState is saved, so the TOC only needs to reload it
+    model.library.recount_index_in_toc(oref.index, refresh=False)
+    if MULTISERVER_ENABLED:
+        server_coordinator.publish_event("library", "recount_index_in_toc", [oref.index.title, False])
+
+
 def add(user, klass, attrs, **kwargs):
     """
     Creates a new instance, saves it, and records the history
@@ -2,13 +2,14 @@
 """
 ar.py - functions for looking up information relating texts to dates.
 
-Uses MongoDB collections: dafyomi, parshiot
+Uses MongoDB collections: dafyomi, parshiot, calendar_items
 """
 import datetime
 import p929
 import re
 import urllib
 from django.utils import timezone
+from pymongo.errors import PyMongoError
 
 import sefaria.model as model
 from sefaria.system.database import db
@@ -424,28 +425,97 @@ def yerushalmi_yomi(datetime_obj):
     return yerushalmi_items
 
 
+# Customs that calendar items are precomputed for.  None lists the haftarot of every custom.
+CALENDAR_CUSTOMS = [None, "ashkenazi", "sephardi", "edot hamizrach"]
+
+
+def _calendar_items_key(datetime_obj, diaspora, custom):
+    return {"date": datetime_obj.strftime("%Y-%m-%d"), "diaspora": diaspora, "custom": custom}
+
+
 def get_all_calendar_items(datetime_obj, diaspora=True, custom="sephardi"):
+    """
+    Returns the calendar items for the date of `datetime_obj`, from the calendar_items collection if they have been
+    precomputed with `precompute_calendar_items`, otherwise computed now.
+    """
     if not SITE_SETTINGS["TORAH_SPECIFIC"]:
         return []
+    if custom in CALENDAR_CUSTOMS:
+        precomputed = db.calendar_items.find_one(_calendar_items_key(datetime_obj, diaspora, custom), {"items": 1})
+        if precomputed is not None:
+            return precomputed["items"]
+    return compute_calendar_items(datetime_obj, diaspora=diaspora, custom=custom)
+
+
+def compute_calendar_items(datetime_obj, diaspora=True, custom="sephardi", raise_db_errors=False):
+    """
+    :param raise_db_errors: raise database errors of any of the calendars, which otherwise leave out that calendar's
+    items like any other error.  Used when the items are saved, so that a calendar that failed for the moment isn't
+    saved without its items.
+    """
+    def items(calendar, **kwargs):
+        if not raise_db_errors:
+            return calendar(datetime_obj, **kwargs)
+        try:
+            return calendar.__wrapped__(datetime_obj, **kwargs)  # without graceful_exception
+        except PyMongoError:
+            raise
+        except Exception as e:
+            logger.exception(str(e))
+            return []
+
     cal_items  = []
-    cal_items += parashat_hashavua_and_haftara(datetime_obj, diaspora=diaspora, custom=custom)
-    cal_items += daf_yomi(datetime_obj)
-    cal_items += daily_929(datetime_obj)
-    cal_items += daily_mishnayot(datetime_obj)
-    cal_items += daily_rambam(datetime_obj)
-    cal_items += daily_rambam_three(datetime_obj)
-    cal_items += daf_weekly(datetime_obj)
-    cal_items += halakhah_yomit(datetime_obj)
-    cal_items += arukh_hashulchan(datetime_obj)
-    cal_items += tanakh_yomi(datetime_obj)
-    cal_items += tikkunei_yomi(datetime_obj)
-    cal_items += hok_leyisrael(datetime_obj, diaspora=diaspora)
-    cal_items += tanya_yomi(datetime_obj)
-    cal_items += yerushalmi_yomi(datetime_obj)
+    cal_items += items(parashat_hashavua_and_haftara, diaspora=diaspora, custom=custom)
+    cal_items += items(daf_yomi)
+    cal_items += items(daily_929)
+    cal_items += items(daily_mishnayot)
+    cal_items += items(daily_rambam)
+    cal_items += items(daily_rambam_three)
+    cal_items += items(daf_weekly)
+    cal_items += items(halakhah_yomit)
+    cal_items += items(arukh_hashulchan)
+    cal_items += items(tanakh_yomi)
+    cal_items += items(tikkunei_yomi)
+    cal_items += items(hok_leyisrael, diaspora=diaspora)
+    cal_items += items(tanya_yomi)
+    cal_items += items(yerushalmi_yomi)
     cal_items = [item for item in cal_items if item]
     return cal_items
 
 
+def precompute_calendar_items(start_date, days=365, customs=None):
+    """
+    Computes the calendar items of `days` days from `start_date`, in and out of the diaspora and for each custom,
+    and saves them to the calendar_items collection, replacing whatever was saved for those days before.
+    Items have to be precomputed again after the calendar collections (dafyomi, parshiot...) change.
+    Days whose items fail on a database error are skipped, and keep whatever was saved for them before, or are
+    computed when requested.
+    :return: number of documents saved
+    """
+    customs = CALENDAR_CUSTOMS if customs is None else customs
+    saved = 0
+    for day in range(days):
+        date = datetime.datetime(start_date.year, start_date.month, start_date.day) + datetime.timedelta(days=day)
+        for diaspora in (True, False):
+            for custom in customs:
+                key = _calendar_items_key(date, diaspora, custom)
+                try:
+                    items = compute_calendar_items(date, diaspora=diaspora, custom=custom, raise_db_errors=True)
+                except PyMongoError as e:
+                    logger.warning("Skipping calendar items of {}: {}".format(key, e))
+                    continue
+                db.calendar_items.replace_one(key, dict(key, items=items, computed=datetime.datetime.now()), upsert=True)
+                saved += 1
+    return saved
+
+
+def delete_calendar_items_before(date):
+    """
+    Deletes precomputed calendar items of days before `date`
+    """
+    return db.calendar_items.delete_many({"date": {"$lt": date.strftime("%Y-%m-%d")}}).deleted_count
+
+
 def get_keyed_calendar_items(diaspora=True, custom=None):
     cal_items = get_todays_calendar_items(diaspora=diaspora, custom=custom)
     cal_dict = {}
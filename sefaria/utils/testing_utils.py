@@ -1,3 +1,4 @@
+import pymongo.collection
 import sefaria.model as model
 
 
@@ -50,3 +51,19 @@ def verify_title_existence_in_toc(title, expected_toc_location=None, toc=None):
 
 def verify_existence_across_tocs(title, expected_toc_location=None):
     verify_title_existence_in_toc(title, expected_toc_location, toc=model.library.get_toc())
+
+
+def record_mongo_calls(monkeypatch, methods=("find", "find_one")):
+    """
+    Records calls of pymongo Collection methods, until `monkeypatch` is undone
+    :param methods: names of the Collection methods to record
+    :return: list, to which (collection name, method name) is appended on each call
+    """
+    calls = []
+    for method in methods:
+        original = getattr(pymongo.collection.Collection, method)
+        def recorded(self, *args, _original=original, _method=method, **kwargs):
+            calls.append((self.name, _method))
+            return _original(self, *args, **kwargs)
+        monkeypatch.setattr(pymongo.collection.Collection, method, recorded)
+    return calls
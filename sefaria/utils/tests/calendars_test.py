@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import sefaria.utils.calendars as c
-from datetime import date
+from datetime import date, datetime
+from pymongo.errors import AutoReconnect
 from sefaria.system.database import db
+from sefaria.utils.util import graceful_exception
 
 
 def setup_module(module): 
@@ -25,6 +27,7 @@ def setup_module(module):
 def teardown_module():
 	db.dafyomi.delete_one({'date': '1/1/1100'})
 	db.dafyomi.delete_one({'date': '1/2/1100'})
+	db.calendar_items.delete_many({'date': {'$regex': '^1100-'}})
 
 
 class Test_daf_yomi():
@@ -49,6 +52,35 @@ class Test_daf_yomi():
 		assert df['displayValue']['he'] == 'משהו מצחיק'
 		assert df['url'] == 'Berakhot.3'
 
+class Test_precomputed_calendar_items():
+
+	def test_matches_live(self):
+		start = datetime(1100, 1, 1)
+		assert c.precompute_calendar_items(start, days=2) == 2 * 2 * len(c.CALENDAR_CUSTOMS)
+		for day in (datetime(1100, 1, 1), datetime(1100, 1, 2)):
+			for diaspora in (True, False):
+				for custom in c.CALENDAR_CUSTOMS:
+					key = {'date': day.strftime('%Y-%m-%d'), 'diaspora': diaspora, 'custom': custom}
+					assert db.calendar_items.find_one(key)['items'] == c.compute_calendar_items(day, diaspora=diaspora, custom=custom)
+		assert c.get_all_calendar_items(start, custom='ashkenazi') == db.calendar_items.find_one({'date': '1100-01-01', 'diaspora': True, 'custom': 'ashkenazi'})['items']
+
+	def test_delete_before(self):
+		db.calendar_items.delete_many({'date': {'$regex': '^1100-'}})
+		c.precompute_calendar_items(datetime(1100, 1, 1), days=2, customs=[None])
+		assert c.delete_calendar_items_before(datetime(1100, 1, 2)) == 2
+		assert db.calendar_items.count_documents({'date': {'$regex': '^1100-'}}) == 2
+
+	def test_database_error_not_saved(self, monkeypatch):
+		@graceful_exception(return_value=[])
+		def unreachable(datetime_obj):
+			raise AutoReconnect('no primary')
+		db.calendar_items.delete_many({'date': {'$regex': '^1100-'}})
+		monkeypatch.setattr(c, 'daf_yomi', unreachable)
+		assert c.precompute_calendar_items(datetime(1100, 1, 1), days=1, customs=[None]) == 0
+		assert db.calendar_items.find_one({'date': '1100-01-01'}) is None
+		assert c.get_all_calendar_items(datetime(1100, 1, 1), custom=None) == c.compute_calendar_items(datetime(1100, 1, 1), custom=None)
+
+
 class Test_this_weeks_parasha():
 	pass
 	#c.this_weeks_parasha()
\ No newline at end of file
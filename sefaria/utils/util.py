@@ -7,6 +7,7 @@ from html.parser import HTMLParser
 import re
 from functools import wraps
 from itertools import zip_longest
+from diff_match_patch import diff_match_patch
 from sefaria.constants.model import ALLOWED_TAGS_IN_ABSTRACT_TEXT_RECORD
 
 """
@@ -611,3 +612,21 @@ def graceful_exception(logger=None, logLevel="exception", return_value=[], excep
             return return_value
         return decorated_function
     return argumented_decorator
+
+
+def text_diffs(texts):
+    """
+    Kept out of the models, so that the processes that log_text() computes diffs in don't have to import them.
+    :param texts: the old and new text of a segment
+    :return: a patch that turns the new text back into the old, and html displaying the edits
+    """
+    dmp = diff_match_patch()
+    old_text, new_text = texts
+    # create a patch that turns the new version back into the old
+    backwards_diff = dmp.diff_main(new_text, old_text)
+    patch = dmp.patch_toText(dmp.patch_make(backwards_diff))
+    # get html displaying edits in this change.
+    forwards_diff = dmp.diff_main(old_text, new_text)
+    dmp.diff_cleanupSemantic(forwards_diff)
+    diff_html = dmp.diff_prettyHtml(forwards_diff)
+    return patch, diff_html
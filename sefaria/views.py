@@ -62,6 +62,7 @@ from sefaria.model.webpage import *
 from sefaria.system.multiserver.coordinator import server_coordinator
 from sefaria.google_storage_manager import GoogleStorageManager
 from sefaria.sheets import get_sheet_categorization_info
+from sefaria.recommendation_index import enqueue_sheet_change
 from reader.views import base_props, render_template
 from sefaria.helper.link import add_links_from_csv, delete_links_from_text, get_csv_links_by_refs, remove_links_from_csv
 
@@ -778,13 +779,13 @@ def delete_citation_links(request, title):
 def cache_stats(request):
     import resource
     from sefaria.utils.util import get_size
-    from sefaria.model.user_profile import public_user_data_cache
+    from sefaria.model.user_profile import public_user_data_cache_stats
     # from sefaria.sheets import last_updated
     resp = {
         'ref_cache_size': f'{model.Ref.cache_size():,}',
+        'ref_cache_stats': model.Ref.cache_size(stats=True),
         # 'ref_cache_bytes': model.Ref.cache_size_bytes(), # This pretty expensive, not sure if it should run on prod.
-        'public_user_data_size': f'{len(public_user_data_cache):,}',
-        'public_user_data_bytes': f'{get_size(public_user_data_cache):,}',
+        'public_user_data': public_user_data_cache_stats(),
         # 'sheets_last_updated_size': len(last_updated),
         # 'sheets_last_updated_bytes': get_size(last_updated),
         'memory usage': f'{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:,}'
@@ -1062,6 +1063,7 @@ def delete_sheet_by_id(request):
                 return jsonResponse({"error": "Sheet %d not found." % id})
 
             db.sheets.remove({"id": id})
+            enqueue_sheet_change(sheet, None)
             process_sheet_deletion_in_collections(id)
             process_sheet_deletion_in_notifications(id)
 
@@ -1129,7 +1131,10 @@ def spam_dashboard(request):
             reviewed_sheet_ids = list(map(int, request.POST.getlist("reviewed_sheets[]", [])))
             db.sheets.update_many({"id": {"$in": reviewed_sheet_ids}}, {"$set": {"reviewed": True}})
             spammers = db.sheets.find({"id": {"$in": spam_sheet_ids}}, {"owner": 1}).distinct("owner")
+            public_spam = list(db.sheets.find({"id": {"$in": spam_sheet_ids}, "status": "public"}, {"status": 1, "title": 1, "includedRefs": 1}))
             db.sheets.delete_many({"id": {"$in": spam_sheet_ids}})
+            for sheet in public_spam:
+                enqueue_sheet_change(sheet, None)
 
             for spammer in spammers:
                 try:
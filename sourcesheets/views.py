@@ -32,6 +32,7 @@ from sefaria.sheets import *
 from sefaria.model.user_profile import *
 from sefaria.model.notification import process_sheet_deletion_in_notifications
 from sefaria.model.collection import Collection, CollectionSet, process_sheet_deletion_in_collections
+from sefaria.recommendation_index import enqueue_sheet_change
 from sefaria.system.decorators import catch_error_as_json
 from sefaria.utils.util import strip_tags
 
@@ -369,6 +370,7 @@ def delete_sheet_api(request, sheet_id):
         return jsonResponse({"error": "Only the sheet owner may delete a sheet."})
 
     db.sheets.remove({"id": id})
+    enqueue_sheet_change(sheet, None)
     process_sheet_deletion_in_collections(id)
     process_sheet_deletion_in_notifications(id)
 